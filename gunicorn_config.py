@@ -8,7 +8,13 @@ bind = "0.0.0.0:8000"
 
 # Worker processes
 workers = 4
-worker_class = "sync"
+# gthread: een open statuspagina houdt één verbinding open voor de
+# voortgangsstream; met sync-workers zou elke pagina een hele worker bezetten.
+# Verzoeken lopen dus als threads in hetzelfde proces: gedeelde toestand in de
+# requestcode heeft een lock nodig (edf_api._LRUCache) en figuren worden
+# zonder pyplot gemaakt (app.EDFProcessor, generate_pdf_report._subplots).
+worker_class = "gthread"
+threads = 16
 worker_connections = 1000
 timeout = 300
 keepalive = 5
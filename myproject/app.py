@@ -14,6 +14,7 @@ Domeinen: sleepai.be / sleepai.eu
 # ── matplotlib config-map VOOR alle andere imports ──────────────
 import os
 import re
+import shutil
 import time
 from pathlib import Path
 
@@ -47,12 +48,15 @@ _MPLCONFIGDIR = _init_mplconfigdir()
 import logging
 
 logger = logging.getLogger('yasaflaskified')
+import hashlib
 import json
+import threading
 import traceback
 import uuid
 import warnings
 from datetime import datetime, timedelta
 from logging.handlers import RotatingFileHandler
+from types import SimpleNamespace
 
 import matplotlib
 import mne
@@ -61,9 +65,19 @@ import pandas as pd
 import yasa
 
 matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+import channel_map
+import content_hash
+import edf_api
+import job_estimate
+import job_events
+import job_scheduler
+import job_state
+import pipeline_results
+import signal_cache
+import stage_cache
 from flask import (
     Flask,
+    Response,
     abort,
     flash,
     jsonify,
@@ -73,6 +87,7 @@ from flask import (
     send_file,
     send_from_directory,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_limiter import Limiter
@@ -87,6 +102,7 @@ from flask_login import (
 )
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFError, CSRFProtect
+from matplotlib.figure import Figure
 
 # Pneumo-analyse (nieuw v7.1)
 from pneumo_analysis import detect_channels as pneumo_detect_channels
@@ -100,6 +116,8 @@ from version import __version__ as APP_VERSION
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
+from window_cache import DEFAULT_BUDGET_MB, WindowCache
+from window_cache import connect as connect_window_cache
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 
@@ -154,6 +172,8 @@ app.config["SECRET_KEY"]         = _cfg("SECRET_KEY", "supersecretkey")
 if app.config["SECRET_KEY"] == "supersecretkey":
     logger.warning("⚠️  SECURITY: Using default SECRET_KEY! Set YASAFLASKIFIED_SECRET_KEY in .env")
 app.config["MAX_CONTENT_LENGTH"] = int(_cfg("MAX_CONTENT_LENGTH", 500 * 1024 * 1024))
+# Bovengrens voor de `chunk_size` die een client opgeeft (upload.html: 2 MB).
+app.config["MAX_CHUNK_SIZE"]     = int(_cfg("MAX_CHUNK_SIZE", 16 * 1024 * 1024))
 app.config["MPLCONFIGDIR"]       = _cfg("MPLCONFIGDIR", os.environ.get("MPLCONFIGDIR", _MPLCONFIGDIR))
 
 # Database
@@ -206,6 +226,15 @@ except Exception as _e:
     redis_conn = Redis(host=_redis_host, port=_redis_port, decode_responses=False)
 
 queue = Queue(connection=redis_conn)
+# Voorwerk tijdens de kanaalkeuze (tasks.prepare_analysis). De workers nemen
+# deze wachtrij als laatste: hij gebruikt alleen wat anders stil zou staan.
+prepare_queue = Queue("prepare", connection=redis_conn)
+
+# Gedeelde venstercache voor de signaalviewer: over alle workers, in bytes
+# begrensd (window_cache.py).
+edf_api.set_window_cache(WindowCache(
+    connect_window_cache(_redis_host, _redis_port),
+    int(_cfg("EDF_VIEWER_CACHE_MB", DEFAULT_BUDGET_MB)) * 1024 * 1024))
 
 # Rate limiting
 if _cfg("ENABLE_RATE_LIMITING", True):
@@ -336,12 +365,16 @@ class Job(db.Model):
     status         = db.Column(db.String(30), default="submitted")
     archived       = db.Column(db.Boolean, default=False, nullable=False)
     created_at     = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    # Inhoudshash van de EDF (content_hash.py) — om een opnieuw opgeladen
+    # opname te herkennen, zie _find_duplicate_edf.
+    content_hash   = db.Column(db.String(64), nullable=True, index=True)
 
     def __repr__(self):
         return f"<Job {self.job_id} owner={self.owner_username} site={self.site_id}>"
 
 
-def _register_job(job_id, user, filename="", status="submitted", site_id=_UNSET):
+def _register_job(job_id, user, filename="", status="submitted", site_id=_UNSET,
+                  content_hash=None):
     """
     Maak of werk de Job-rij bij. Idempotent: bestaat de rij al, dan worden
     alleen lege velden aangevuld en de status bijgewerkt.
@@ -365,6 +398,8 @@ def _register_job(job_id, user, filename="", status="submitted", site_id=_UNSET)
             row.filename = filename[:300]
         if status:
             row.status = status
+        if content_hash:
+            row.content_hash = content_hash
         db.session.commit()
         return row
     except Exception as e:
@@ -418,6 +453,9 @@ class FileUploadHandler:
     def __init__(self, upload_dir, redis_connection):
         self.upload_dir = upload_dir
         self.redis_conn = redis_connection
+        # Gezet door assemble_file: de inhoudshash (content_hash.py) van het
+        # samengevoegde bestand, berekend terwijl de data toch voorbijkwam.
+        self.content_hash = None
         os.makedirs(upload_dir, exist_ok=True)
 
     def _safe_path(self, name):
@@ -452,7 +490,16 @@ class FileUploadHandler:
             raise UploadError("Invalid filename")
         return filename
 
-    def save_chunk(self, file_id, chunk_index, chunk_file):
+    def save_chunk(self, file_id, chunk_index, chunk_file,
+                   total_chunks=None, chunk_size=None):
+        """
+        Met `chunk_size` (huidige upload.html): rechtstreeks op de eigen
+        offset in één voorgealloceerd bestand, zie write_chunk_in_place.
+        Zonder: een los chunkbestand, zoals oudere clients het verwachten.
+        """
+        if chunk_size:
+            return self.write_chunk_in_place(file_id, chunk_index, chunk_file,
+                                             total_chunks, chunk_size)
         chunk_path = self._safe_path(f"{file_id}_chunk_{chunk_index}")
         try:
             chunk_file.save(chunk_path)
@@ -462,15 +509,22 @@ class FileUploadHandler:
             logger.error(f"Failed to save chunk {chunk_index}: {e}")
             raise UploadError(f"Failed to save chunk: {str(e)}")
 
-    def assemble_file(self, file_id, total_chunks, final_filename):
-        assembled_path = self._safe_path(f"{file_id}_assembled.edf")
-        final_path     = self._safe_path(final_filename)
+    def _final_path(self, final_filename):
+        final_path = self._safe_path(final_filename)
         if os.path.exists(final_path):
             timestamp  = int(time.time())
             final_path = self._safe_path(
                 f"{os.path.splitext(final_filename)[0]}_{timestamp}.edf",
             )
             logger.warning(f"File exists, using new name: {final_path}")
+        return final_path
+
+    def assemble_file(self, file_id, total_chunks, final_filename):
+        assembled_path = self._safe_path(f"{file_id}_assembled.edf")
+        if os.path.exists(self._safe_path(f"{file_id}_partial.edf")):
+            return self.finish_in_place(file_id, final_filename)
+        final_path     = self._final_path(final_filename)
+        hasher         = content_hash.BlockHasher()
         try:
             with open(assembled_path, "wb") as af:
                 for i in range(total_chunks):
@@ -478,9 +532,12 @@ class FileUploadHandler:
                     if not os.path.exists(chunk_path):
                         raise FileNotFoundError(f"Missing chunk {i}")
                     with open(chunk_path, "rb") as cf:
-                        af.write(cf.read())
+                        data = cf.read()
+                    hasher.update(data)
+                    af.write(data)
                     os.remove(chunk_path)
             os.rename(assembled_path, final_path)
+            self.content_hash = hasher.hexdigest()
             logger.info(f"File assembled successfully: {final_path}")
             return final_path
         except Exception as e:
@@ -496,32 +553,382 @@ class FileUploadHandler:
             logger.error(f"Assembly failed: {e}")
             raise UploadError(f"Failed to assemble file: {str(e)}")
 
+    # ── Chunks op hun plaats ──────────────────────────────────────────
+    #
+    # Het samenvoegen hierboven las elk chunkbestand volledig in, schreef het
+    # opnieuw weg en hernoemde daarna: twee keer de hele PSG over de schijf,
+    # binnen het verzoek van de laatste chunk. Met een bekende chunkgrootte
+    # ligt de plaats van elke chunk vast (index × chunk_size), dus gaat hij
+    # meteen daarheen in `{file_id}_partial.edf`. Volgorde doet er dan niet
+    # toe en chunks mogen parallel binnenkomen, ook bij verschillende
+    # workers. Afronden is een truncate tot de echte lengte en een rename.
+    #
+    # Welke chunks er zijn, staat in `{file_id}_partial.chunks`: per chunk
+    # een uint32 met zijn lengte (0 = ontbreekt). Dat is meteen de
+    # hervatting: een onderbroken upload vraagt chunk_status() en stuurt
+    # alleen wat ontbreekt. Alles staat op schijf naast de data, niet in
+    # Redis — het overleeft een herstart en hoort bij hetzelfde bestand.
+    #
+    # Is de chunkgrootte een veelvoud van het hashblok, dan schrijft elke
+    # chunk ook zijn blokdigests op hun plaats in `{file_id}_partial.hashes`;
+    # de inhoudshash is bij het afronden dan één SHA-256 over die lijst.
+
+    _COPY_BLOCK = 1024 * 1024
+
+    def _partial(self, file_id):
+        return (self._safe_path(f"{file_id}_partial.edf"),
+                self._safe_path(f"{file_id}_partial.json"),
+                self._safe_path(f"{file_id}_partial.chunks"))
+
+    def _hashes_path(self, file_id):
+        return self._safe_path(f"{file_id}_partial.hashes")
+
+    def _init_partial(self, file_id, total_chunks, chunk_size):
+        """Maak (of controleer) de parameters, het doelbestand en de chunkmap.
+
+        Het manifest wordt via een hardlink op zijn plaats gezet: een tweede
+        worker ziet het volledig of niet. Doelbestand en map worden tot hun
+        vaste maximale lengte verlengd; verlengen wist nooit geschreven data,
+        dus het maakt niet uit welke worker dat als eerste of laatste doet.
+        """
+        data_p, meta_p, map_p = self._partial(file_id)
+        meta = {"total_chunks": total_chunks, "chunk_size": chunk_size}
+        if not os.path.exists(meta_p):
+            tmp = f"{meta_p}.{os.getpid()}"
+            with open(tmp, "w") as f:
+                json.dump(meta, f)
+            try:
+                os.link(tmp, meta_p)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+        with open(meta_p) as f:
+            if json.load(f) != meta:
+                raise UploadError("Chunk parameters changed during upload")
+        for path, size in ((data_p, total_chunks * chunk_size),
+                           (map_p, total_chunks * 4)):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+        return data_p, map_p
+
+    def _copy_into(self, stream, fd, offset):
+        """Kopieer de chunk naar `offset`; in de kernel als het kan.
+
+        Werkzeug spoolt een chunk van 2 MB naar een tijdelijk bestand; dan
+        gaat copy_file_range van bestand naar bestand zonder Python-buffer.
+        Anders (in-memory stream, ander bestandssysteem) blokken van 1 MB.
+        """
+        try:
+            src = stream.fileno()
+            size = os.fstat(src).st_size
+            done = 0
+            while done < size:
+                n = os.copy_file_range(src, fd, size - done, done, offset + done)
+                if n == 0:
+                    break
+                done += n
+            return done
+        except (AttributeError, OSError, ValueError):
+            pass
+        stream.seek(0)
+        done = 0
+        while True:
+            block = stream.read(self._COPY_BLOCK)
+            if not block:
+                return done
+            os.pwrite(fd, block, offset + done)
+            done += len(block)
+
+    def write_chunk_in_place(self, file_id, chunk_index, chunk_file,
+                             total_chunks, chunk_size):
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            raise UploadError("Invalid chunk_size")
+        # Het doelbestand wordt meteen tot total_chunks * chunk_size verlengd:
+        # beide komen van de client, dus eerst begrenzen. Alleen de laatste
+        # chunk mag kort zijn, vandaar total_chunks - 1.
+        if chunk_size > app.config["MAX_CHUNK_SIZE"]:
+            raise UploadError("chunk_size too large")
+        if (total_chunks - 1) * chunk_size >= app.config["MAX_CONTENT_LENGTH"]:
+            raise UploadError("File too large")
+        try:
+            data_p, map_p = self._init_partial(file_id, total_chunks, chunk_size)
+            fd = os.open(data_p, os.O_WRONLY)
+            try:
+                n = self._copy_into(chunk_file.stream, fd, chunk_index * chunk_size)
+            finally:
+                os.close(fd)
+        except UploadError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to write chunk {chunk_index}: {e}")
+            raise UploadError(f"Failed to save chunk: {str(e)}")
+        last = chunk_index == total_chunks - 1
+        if n == 0 or n > chunk_size or (not last and n != chunk_size):
+            raise UploadError(f"Chunk {chunk_index} has wrong size {n}")
+        if chunk_size % content_hash.BLOCK == 0:
+            chunk_file.stream.seek(0)
+            digests = content_hash.block_digests(chunk_file.stream)
+            per_chunk = chunk_size // content_hash.BLOCK * content_hash.DIGEST
+            fd = os.open(self._hashes_path(file_id), os.O_WRONLY | os.O_CREAT, 0o600)
+            try:
+                os.pwrite(fd, digests, chunk_index * per_chunk)
+            finally:
+                os.close(fd)
+        # Pas na de data: een chunk telt pas als hij er volledig staat.
+        fd = os.open(map_p, os.O_WRONLY)
+        try:
+            os.pwrite(fd, n.to_bytes(4, "little"), chunk_index * 4)
+        finally:
+            os.close(fd)
+        logger.info(f"Wrote chunk {chunk_index} in place for file_id {file_id}")
+        return data_p
+
+    def chunk_status(self, file_id):
+        """Welke chunks staan er al? None als er geen upload loopt."""
+        _, meta_p, map_p = self._partial(file_id)
+        if not os.path.exists(meta_p) or not os.path.exists(map_p):
+            return None
+        with open(meta_p) as f:
+            meta = json.load(f)
+        with open(map_p, "rb") as f:
+            sizes = np.frombuffer(f.read(meta["total_chunks"] * 4), dtype="<u4")
+        present = [int(i) for i in np.flatnonzero(sizes)]
+        return {**meta, "present": present,
+                "complete": len(present) == meta["total_chunks"]}
+
+    def finish_in_place(self, file_id, final_filename):
+        """Afronden: exacte lengte, rename. Eén worker wint via O_EXCL.
+
+        None: een ander verzoek rondt af of rondde al af. Bij parallelle
+        chunks zien twee laatste verzoeken allebei `complete`; wie de lock
+        mist, of pas komt als de winnaar de partial al heeft opgeruimd, heeft
+        niets fout gedaan.
+        """
+        data_p, meta_p, map_p = self._partial(file_id)
+        status = self.chunk_status(file_id)
+        if status is None:
+            return None
+        if not status["complete"]:
+            raise UploadError("Upload incomplete")
+        lock_p = self._safe_path(f"{file_id}_partial.lock")
+        try:
+            os.close(os.open(lock_p, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+        except FileExistsError:
+            return None                       # een andere worker rondt af
+        try:
+            with open(map_p, "rb") as f:
+                last = int.from_bytes(f.read()[-4:], "little")
+            size = (status["total_chunks"] - 1) * status["chunk_size"] + last
+            os.truncate(data_p, size)
+            final_path = self._final_path(final_filename)
+            os.rename(data_p, final_path)
+        except Exception as e:
+            os.remove(lock_p)
+            logger.error(f"Assembly failed: {e}")
+            raise UploadError(f"Failed to assemble file: {str(e)}")
+        hashes_p = self._hashes_path(file_id)
+        n_blocks = -(-size // content_hash.BLOCK)
+        try:
+            with open(hashes_p, "rb") as f:
+                digests = f.read(n_blocks * content_hash.DIGEST)
+            if len(digests) != n_blocks * content_hash.DIGEST:
+                raise ValueError("incomplete block digests")
+            self.content_hash = content_hash.combine(digests)
+        except (OSError, ValueError):
+            # Chunkgrootte geen veelvoud van het blok: dan toch één keer lezen.
+            self.content_hash = content_hash.file_hash(final_path)
+        for p in (meta_p, map_p, lock_p, hashes_p):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        logger.info(f"File assembled in place: {final_path} ({size} bytes)")
+        return final_path
+
     def update_progress(self, file_id, progress):
         try:
             self.redis_conn.set(f"{file_id}_progress", progress, ex=3600)
         except Exception as e:
             logger.warning(f"Failed to update progress: {e}")
 
-    def mark_completed(self, file_id, filepath):
+    def mark_completed(self, file_id, filepath, content_hash=None):
         try:
             self.redis_conn.set(f"{file_id}_filepath", filepath, ex=3600)
+            if content_hash:
+                self.redis_conn.set(f"{file_id}_content_hash", content_hash, ex=3600)
             self.redis_conn.set(f"{file_id}_completed", 1, ex=3600)
             self.redis_conn.set(f"{file_id}_progress", 100, ex=3600)
         except Exception as e:
             logger.warning(f"Failed to mark completed: {e}")
 
 
+def _edf_header(filepath):
+    """
+    Kanaalnamen, sfreq, duur en startdatum uit de EDF-header (edf_reader).
+
+    parse_file en de kanaalkeuze openden hiervoor elk een MNE-object, de
+    kanaalkeuze zelfs twee keer (rechtstreeks en via parse_channels). In
+    Redis met grootte en mtime als controle: een herladen pagina leest het
+    bestand niet opnieuw, een geanonimiseerd bestand wel. Zelfde TTL als
+    een geparste job in job_state (PARSED_TTL_S).
+    """
+    from edf_reader import read_summary
+    st  = os.stat(filepath)
+    key = "edf_header:" + hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()
+    try:
+        cached = redis_conn.get(key)
+        if cached:
+            entry = json.loads(cached)
+            if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+                return entry["header"]
+    except Exception:
+        pass
+    header = read_summary(filepath)
+    try:
+        redis_conn.set(key, json.dumps({"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                        "header": header}), ex=7200)
+    except Exception:
+        pass
+    return header
+
+
+def _file_content_hash(filepath, known=None):
+    """
+    Inhoudshash van een EDF op schijf, in Redis met grootte en mtime als
+    controle (zelfde patroon als _edf_header).
+
+    `known` is de hash die de upload al berekende; die wordt dan enkel
+    vastgelegd. Een latere wijziging ter plekke (anonimisatie herschrijft de
+    header) verandert de mtime, en dan wordt er opnieuw gerekend in plaats
+    van een verouderde hash te vertrouwen.
+    """
+    st  = os.stat(filepath)
+    key = "edf_hash:" + hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()
+    if known is None:
+        try:
+            cached = redis_conn.get(key)
+            if cached:
+                entry = json.loads(cached)
+                if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+                    return entry["hash"]
+        except Exception:
+            pass
+    digest = known or content_hash.file_hash(filepath)
+    try:
+        redis_conn.set(key, json.dumps({"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                        "hash": digest}), ex=7 * 86400)
+    except Exception:
+        pass
+    return digest
+
+
+def _jobs_with_content(digest, user, exclude_job_id=None):
+    """
+    Eerdere jobs met dezelfde opname die `user` mag delen, nieuwste eerst.
+
+    Bewust smaller dan job-toegang: alleen dezelfde site, of zonder site
+    dezelfde eigenaar. Een gedeeld bestand wordt ook samen geanonimiseerd,
+    en dat beslist een site niet voor een andere.
+    """
+    if not digest or user is None or not getattr(user, "is_authenticated", False):
+        return []
+    q = Job.query.filter(Job.content_hash == digest)
+    if exclude_job_id:
+        q = q.filter(Job.job_id != exclude_job_id)
+    if user.site_id is not None:
+        q = q.filter(Job.site_id == user.site_id)
+    else:
+        q = q.filter(Job.site_id.is_(None), Job.owner_id == user.id)
+    return q.order_by(Job.created_at.desc()).all()
+
+
+def _find_duplicate_edf(digest, user, exclude_job_id=None, exclude_path=None):
+    """
+    Pad van een al opgeladen EDF met exact deze inhoud, of None.
+
+    De hash op de Job-rij zegt wat er toen binnenkwam; of het bestand nog
+    zo op schijf staat, wordt hier nagekeken voor het hergebruikt wordt.
+    """
+    try:
+        rows = _jobs_with_content(digest, user, exclude_job_id)
+    except Exception as e:
+        logger.warning("Duplicaatcontrole mislukt: %s", e)
+        return None
+    upload_folder = os.path.realpath(app.config["UPLOAD_FOLDER"])
+    for row in rows:
+        if not row.filename:
+            continue
+        path = os.path.join(upload_folder, row.filename)
+        if path == exclude_path or not os.path.isfile(path):
+            continue
+        try:
+            if _file_content_hash(path) == digest:
+                return path
+        except OSError:
+            continue
+    return None
+
+
+def _share_edf(existing, filepath):
+    """Vervang `filepath` door een hardlink naar `existing` (zelfde inhoud).
+
+    Twee namen, één keer de data. Een job die zijn bestand verwijdert, laat
+    het andere staan; wie ter plekke schrijft (anonimisatie), maakt eerst een
+    eigen kopie (_unshare_edf). De kolomcache wordt op dezelfde manier
+    gedeeld, bestand per bestand. False als linken hier niet kan; dan blijft
+    de verse upload gewoon staan.
+    """
+    tmp = f"{filepath}.link-{os.getpid()}"
+    try:
+        os.link(existing, tmp)
+        os.replace(tmp, filepath)
+    except OSError as e:
+        logger.info("Geen hardlink naar %s: %s — eigen kopie blijft", existing, e)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    src, dst = signal_cache.cache_dir_for(existing), signal_cache.cache_dir_for(filepath)
+    if os.path.isdir(src) and not os.path.exists(dst):
+        try:
+            shutil.copytree(src, dst, copy_function=os.link)
+        except OSError:
+            shutil.rmtree(dst, ignore_errors=True)
+    return True
+
+
+def _unshare_edf(filepath):
+    """Eigen kopie van een gedeelde EDF (_share_edf), vóór er ter plekke geschreven wordt."""
+    if os.stat(filepath).st_nlink < 2:
+        return
+    tmp = f"{filepath}.copy-{os.getpid()}"
+    try:
+        shutil.copy2(filepath, tmp)
+        os.replace(tmp, filepath)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+_PLOT_LOCK = threading.Lock()
+"""yasa.plot_hypnogram zet tijdelijk de globale rcParams["font.size"]; twee
+threads tegelijk lieten die op de verkeerde waarde staan."""
+
+
 class EDFProcessor:
     """Originele EDF-verwerking — volledig bewaard voor achterwaartse compatibiliteit."""
 
     def __init__(self, mpl_config_dir=None):
         if mpl_config_dir:
-            plt.rcParams["savefig.directory"] = mpl_config_dir
+            matplotlib.rcParams["savefig.directory"] = mpl_config_dir
 
     def parse_channels(self, filepath):
         try:
-            edf      = mne.io.read_raw_edf(filepath, preload=False, verbose=False)
-            channels = edf.info["ch_names"]
+            channels = _edf_header(filepath)["ch_names"]
             eeg_ch   = self._identify_eeg_channels(channels)
             eog_ch   = self._identify_eog_channels(channels)
             emg_ch   = self._identify_emg_channels(channels)
@@ -608,8 +1015,11 @@ class EDFProcessor:
     def _generate_hypnogram(self, hypno_int, filepath, metadata, output_dir):
         filename    = Path(filepath).stem
         output_path = Path(output_dir) / f"{filename}_hypnogram.pdf"
-        plt.figure(figsize=(11.69, 8.27))
-        yasa.plot_hypnogram(hypno_int)
+        # Een eigen Figure, geen pyplot: de webworkers draaien met threads
+        # (gunicorn_config.py) en pyplot deelt één "huidige figuur" per proces.
+        fig = Figure(figsize=(11.69, 8.27))
+        with _PLOT_LOCK:
+            yasa.plot_hypnogram(hypno_int, ax=fig.add_subplot())
         title_text = (
             f"Sleep Hypnogram: {filename}\n"
             f"Recording Date: {metadata['recording_date']} | "
@@ -617,10 +1027,9 @@ class EDFProcessor:
             f"Channels: {metadata['channels_used']}\n"
             f"Patient ID: {metadata['patient_id']}"
         )
-        plt.suptitle(title_text, fontsize=9, ha="center", va="top", y=0.98)
-        plt.tight_layout(rect=[0, 0, 1, 0.92])
-        plt.savefig(output_path, format="pdf", orientation="landscape", dpi=300)
-        plt.close()
+        fig.suptitle(title_text, fontsize=9, ha="center", va="top", y=0.98)
+        fig.tight_layout(rect=[0, 0, 1, 0.92])
+        fig.savefig(output_path, format="pdf", orientation="landscape", dpi=300)
         logger.info(f"Generated hypnogram: {output_path}")
         return str(output_path)
 
@@ -1086,6 +1495,26 @@ def _can_modify_job(job_id: str) -> bool:
     return False
 
 
+def _job_content_hashes(job_id: str) -> set:
+    """De inhoudshashes waaronder deze job in de stapcache kan staan: die
+    van de Job-rij (na anonimisatie herberekend) en die uit de jobconfig."""
+    found = set()
+    try:
+        row = Job.query.filter_by(job_id=job_id).first()
+        if row is not None and row.content_hash:
+            found.add(row.content_hash)
+    except Exception:
+        pass
+    try:
+        with open(os.path.join(app.config["UPLOAD_FOLDER"], f"{job_id}_config.json")) as f:
+            digest = json.load(f).get("content_hash")
+        if digest:
+            found.add(digest)
+    except (OSError, ValueError, AttributeError):
+        pass
+    return found
+
+
 def _delete_job_files(job_id: str) -> tuple[int, list[str]]:
     """
     Verwijder alle bestanden van een job uit upload- + processed-map,
@@ -1096,6 +1525,7 @@ def _delete_job_files(job_id: str) -> tuple[int, list[str]]:
     import glob as _glob
     upload_folder    = app.config["UPLOAD_FOLDER"]
     processed_folder = app.config.get("PROCESSED_FOLDER", upload_folder)
+    recordings = _job_content_hashes(job_id)
 
     files = []
     for folder in set([upload_folder, processed_folder]):
@@ -1107,22 +1537,31 @@ def _delete_job_files(job_id: str) -> tuple[int, list[str]]:
     deleted, errors_list = 0, []
     for f in set(files):
         try:
-            os.remove(f)
+            # `{job_id}_checkpoints` en `{job_id}_study` zijn mappen.
+            if os.path.isdir(f) and not os.path.islink(f):
+                shutil.rmtree(f)
+            else:
+                os.remove(f)
             deleted += 1
         except Exception as e:
             logger.error("Kan %s niet verwijderen: %s", f, e)
             errors_list.append(str(e))
 
+    # Tussenresultaten in de stapcache (stage_cache.py). Een andere job op
+    # dezelfde opname rekent die stappen dan gewoon opnieuw.
+    cache_root = stage_cache.cache_root(os.path.join(upload_folder, "stage_cache"))
+    for digest in recordings:
+        stage_cache.forget(cache_root, digest)
+
     # EDF-viewer cache vrijgeven
     try:
         from edf_api import clear_cache
         clear_cache(job_id)
     except Exception:
         pass
-    # Redis-sleutels opschonen
+    # Toestand in Redis opschonen
     try:
-        for key_suffix in ["_filepath", "_config", "_progress", "_orig_file_id"]:
-            redis_conn.delete(f"{job_id}{key_suffix}")
+        job_state.delete(redis_conn, job_id)
     except Exception:
         pass
 
@@ -1490,6 +1929,17 @@ def admin_set_study_profile_set(site_id):
 
 # ── Sitebeheer ──────────────────────────────────────────────────
 
+@app.route("/admin/viewer-cache")
+@login_required
+@requires_role("admin")
+def admin_viewer_cache():
+    """Hits, misses en evictions van de gedeelde viewercache, alle workers samen."""
+    cache = edf_api._window_cache
+    if cache is None:
+        return jsonify({"available": False}), 503
+    return jsonify(cache.stats())
+
+
 @app.route("/admin/sites")
 @login_required
 @requires_role("admin")
@@ -1603,6 +2053,7 @@ def upload_chunks():
         try:
             chunk_index  = int(request.form.get("chunk_index", 0))
             total_chunks = int(request.form.get("total_chunks", 1))
+            chunk_size   = int(request.form.get("chunk_size") or 0) or None
         except (ValueError, TypeError):
             return jsonify({"success": False, "error": "Invalid chunk parameters"}), 400
 
@@ -1626,17 +2077,52 @@ def upload_chunks():
             return jsonify({"success": False, "error": str(e)}), 400
 
         try:
-            handler.save_chunk(file_id, chunk_index, chunk_file)
+            handler.save_chunk(file_id, chunk_index, chunk_file,
+                               total_chunks=total_chunks, chunk_size=chunk_size)
         except UploadError as e:
             return jsonify({"success": False, "error": str(e)}), 500
 
-        progress = int(((chunk_index + 1) / total_chunks) * 50)
+        # In place mogen chunks in willekeurige volgorde en parallel komen:
+        # klaar is klaar als ze er allemaal staan, niet bij de hoogste index.
+        if chunk_size:
+            status   = handler.chunk_status(file_id) or {"present": []}
+            n_done   = len(status["present"])
+            complete = n_done == total_chunks
+        else:
+            n_done   = chunk_index + 1
+            complete = chunk_index + 1 == total_chunks
+        progress = int((n_done / total_chunks) * 50)
         handler.update_progress(file_id, progress)
 
-        if chunk_index + 1 == total_chunks:
+        if complete:
             try:
-                filepath = handler.assemble_file(file_id, total_chunks, final_filename)
-                handler.mark_completed(file_id, filepath)
+                # In place rechtstreeks: assemble_file kiest de weg aan de
+                # partial, en die kan een parallel verzoek al weggerenamed hebben.
+                if chunk_size:
+                    filepath = handler.finish_in_place(file_id, final_filename)
+                else:
+                    filepath = handler.assemble_file(file_id, total_chunks, final_filename)
+                if filepath is None:
+                    # Een parallel verzoek rondt dezelfde upload af.
+                    return jsonify({"success": True, "progress": progress,
+                                    "message": "Upload being finalised"})
+                handler.mark_completed(file_id, filepath, handler.content_hash)
+                try:
+                    _file_content_hash(filepath, known=handler.content_hash)
+                except OSError:
+                    pass
+                # Kolomcache op de achtergrond (signal_cache.py): tegen dat
+                # de kanaalkeuze gemaakt is, lezen analyse en viewer per
+                # kanaal in plaats van door de hele EDF. Niet-kritiek. Een
+                # opname die er al staat, heeft zijn cache al; parse_file
+                # schakelt dan over op dat bestand.
+                if not _find_duplicate_edf(handler.content_hash, current_user,
+                                           exclude_path=filepath):
+                    try:
+                        queue.enqueue("signal_cache.build_signal_cache", filepath,
+                                      job_timeout=1800, result_ttl=600)
+                    except Exception as e:
+                        logger.warning(f"Signaalcache niet ingepland: {e}")
                 return jsonify({
                     "success":  True,
                     "filepath": filepath,
@@ -1656,6 +2142,35 @@ def upload_chunks():
         return jsonify({"success": False, "error": "Internal server error"}), 500
 
 
+@app.route("/upload_chunks/<file_id>/status")
+@login_required
+def upload_chunks_status(file_id):
+    """Welke chunks staan er al — om een onderbroken upload te hervatten."""
+    if not _FILE_ID_RE.match(file_id):
+        return jsonify({"success": False, "error": "Invalid file_id"}), 400
+    handler = FileUploadHandler(app.config["UPLOAD_FOLDER"], redis_conn)
+    status  = handler.chunk_status(file_id)
+    if status is None:
+        return jsonify({"success": True, "present": [], "complete": False})
+    return jsonify({"success": True, **status})
+
+
+def _finished_upload(file_id, wait_s=30.0):
+    """Het pad van een afgeronde upload, of None.
+
+    Met parallelle chunks kan de browser hier al zijn terwijl een ander
+    verzoek het bestand nog afrondt ("Upload being finalised"). Zolang de
+    upload nog loopt (er is voortgang, nog geen pad), wordt er even gewacht.
+    """
+    deadline = time.monotonic() + wait_s
+    while True:
+        filepath = redis_conn.get(f"{file_id}_filepath")
+        if (filepath or time.monotonic() >= deadline
+                or not redis_conn.exists(f"{file_id}_progress")):
+            return filepath
+        time.sleep(0.25)
+
+
 @app.route("/parse_file", methods=["POST"])
 @login_required
 @csrf.exempt
@@ -1670,7 +2185,7 @@ def parse_file():
         if not file_id:
             return jsonify({"success": False, "error": "Missing file_id"}), 400
 
-        filepath_bytes = redis_conn.get(f"{file_id}_filepath")
+        filepath_bytes = _finished_upload(file_id)
         if not filepath_bytes:
             return jsonify({"success": False, "error": "File not found. Please upload again."}), 400
 
@@ -1678,19 +2193,40 @@ def parse_file():
         if not os.path.exists(filepath):
             return jsonify({"success": False, "error": "File no longer exists on server"}), 400
 
+        # Dezelfde opname opnieuw opgeladen (browsercrash, heranalyse met
+        # andere kanalen)? Dan wordt de nieuwe kopie een hardlink naar het
+        # bestand dat er al staat (_share_edf): geen tweede EDF van een paar
+        # GB, en de kolomcache van de eerste upload geldt meteen. Elke job
+        # houdt zijn eigen pad. Of ook de resultaten herbruikbaar zijn,
+        # beslist /analyze.
+        duplicate_of = None
+        try:
+            digest = redis_conn.get(f"{file_id}_content_hash")
+            digest = digest.decode("utf-8") if digest else _file_content_hash(filepath)
+            existing = _find_duplicate_edf(digest, current_user,
+                                           exclude_path=os.path.realpath(filepath))
+            if existing and _share_edf(existing, filepath):
+                logger.info(f"Upload {file_id} is identiek aan {existing} — gedeeld")
+                duplicate_of = os.path.basename(existing)
+        except Exception as e:
+            digest = None
+            logger.warning(f"Duplicaatcontrole voor {file_id} mislukt: {e}")
+
         try:
             processor = EDFProcessor(app.config["MPLCONFIGDIR"])
             channels  = processor.parse_channels(filepath)
 
             # ── NIEUW: UUID job_id voor uitgebreide analyse ──
             job_id = str(uuid.uuid4())
-            redis_conn.set(f"{job_id}_filepath", filepath, ex=7200)       # 2 uur
-            redis_conn.set(f"{job_id}_orig_file_id", file_id, ex=7200)
+            job_state.update(redis_conn, job_id, status="parsed",      # 2 uur
+                             filepath=filepath, orig_file_id=file_id)
             # Job-registry: hier al vastleggen, niet pas bij /analyze.
             # /channel-select/<job_id> komt hiertussen en heeft de rij nodig.
             _register_job(job_id, current_user,
-                          filename=os.path.basename(filepath), status="parsed")
+                          filename=os.path.basename(filepath), status="parsed",
+                          content_hash=digest)
             logger.info(f"job_id {job_id} gekoppeld aan {filepath}")
+            _enqueue_prepare(job_id, filepath, digest, channels)
 
             return jsonify({
                 "success":  True,
@@ -1702,6 +2238,7 @@ def parse_file():
                 "others":   channels["others"],
                 "all":      channels["all"],
                 "filepath": filepath,
+                "duplicate_of": duplicate_of,
                 "message":  "File parsed successfully.",
             })
         except EDFProcessingError as e:
@@ -1907,6 +2444,36 @@ def serve_logo(filename):
 # NIEUW: KANAALKEUZE UI
 # ═══════════════════════════════════════════════════════════════
 
+def _best_eeg(ch_names, parsed):
+    """De EEG-voorselectie van het kanaalkeuzescherm."""
+    # v0.8.11: Intelligente EEG-kanaalkeuze — YASA presteert best op C3/C4
+    # (volgorde in channel_map.EEG_PRIORITY)
+    best_eeg = channel_map.preferred_eeg(ch_names)
+    # Fallback: eerste kanaal uit parsed EEG-lijst
+    if not best_eeg and parsed.get("eeg"):
+        best_eeg = parsed["eeg"][0]
+    return best_eeg
+
+
+def _enqueue_prepare(job_id, filepath, digest, parsed):
+    """Zet het voorwerk voor deze job klaar (tasks.prepare_analysis).
+
+    Op de kanalen die channel_select zo meteen voorselecteert; dient de
+    gebruiker die ongewijzigd in, dan staat de staging al in de stapcache.
+    Niet-kritiek: zonder voorwerk rekent de analyse alles zelf.
+    """
+    if str(_cfg("PREPARE_ON_PARSE", True)).lower() in ("0", "off", "false", "no"):
+        return
+    try:
+        ch_names = _edf_header(filepath)["ch_names"]
+        cfg = {"job_id": job_id, "edf_path": filepath, "content_hash": digest,
+               **channel_map.preselect(ch_names, _best_eeg(ch_names, parsed))}
+        prepare_queue.enqueue("tasks.prepare_analysis", cfg,
+                              job_timeout=1800, result_ttl=600)
+    except Exception as e:
+        logger.warning(f"Voorwerk voor {job_id} niet ingepland: {e}")
+
+
 @app.route("/channel-select/<job_id>")
 @login_required
 @job_access_required
@@ -1949,28 +2516,27 @@ def channel_select(job_id):
             ("aasm_v3_rec", "AASM v3 — Recommended", "v3", "clinical"),
         ]
 
-    filepath_bytes = redis_conn.get(f"{job_id}_filepath")
-    if not filepath_bytes:
+    filepath = job_state.get(redis_conn, job_id).get("filepath")
+    if not filepath:
         flash(get_translation("session_expired", session.get("lang","en")), "danger")
         return redirect(url_for("upload_file"))
 
-    filepath = filepath_bytes.decode("utf-8")
     if not os.path.exists(filepath):
         flash(get_translation("file_not_available", session.get("lang","en")), "danger")
         return redirect(url_for("upload_file"))
 
     try:
-        raw          = mne.io.read_raw_edf(filepath, preload=False, verbose=False)
-        channels     = raw.ch_names
-        sfreq        = raw.info["sfreq"]
-        duration_min = round(raw.times[-1] / 60, 1)
+        header       = _edf_header(filepath)
+        channels     = header["ch_names"]
+        sfreq        = header["sfreq"]
+        duration_min = round(header["duration_s"] / 60, 1)
         filename     = os.path.basename(filepath)
 
         recording_start = None
         try:
-            meas_date = raw.info.get("meas_date")
-            if meas_date:
-                recording_start = meas_date.strftime("%Y-%m-%dT%H:%M")
+            if header["meas_date"]:
+                recording_start = datetime.fromisoformat(
+                    header["meas_date"]).strftime("%Y-%m-%dT%H:%M")
         except Exception:
             pass
 
@@ -1981,33 +2547,7 @@ def channel_select(job_id):
         # Respiratoire kanaaldetectie (nieuw v7.1)
         pneumo_auto = pneumo_detect_channels(channels)
 
-        # v0.8.11: Intelligente EEG-kanaalkeuze — YASA presteert best op C3/C4
-        # Prioriteit: C4-M1 > C3-M2 > C4 > C3 > F4 > F3 > Cz > any EEG > first
-        EEG_PRIORITY = [
-            # Exacte referentieel (AASM standaard)
-            "C4-M1", "C3-M2", "C4-A1", "C3-A2",
-            # Met streepje-varianten
-            "EEG C4-M1", "EEG C3-M2", "EEG C4-A1", "EEG C3-A2",
-            # Monopolair centraal
-            "C4", "C3", "EEG C4", "EEG C3",
-            # Frontaal (goed voor slow waves)
-            "F4-M1", "F3-M2", "F4", "F3", "EEG F4", "EEG F3",
-            # Centraal z-lijn
-            "Cz", "EEG Cz", "CZ", "EEG CZ",
-            # Pariëtaal
-            "P4", "P3", "EEG P4", "EEG P3",
-            # Occipitaal (alpha-detectie)
-            "O2", "O1", "EEG O2", "EEG O1",
-        ]
-        best_eeg = None
-        ch_upper_map = {ch.upper().strip(): ch for ch in channels}
-        for candidate in EEG_PRIORITY:
-            if candidate.upper() in ch_upper_map:
-                best_eeg = ch_upper_map[candidate.upper()]
-                break
-        # Fallback: eerste kanaal uit parsed EEG-lijst
-        if not best_eeg and parsed.get("eeg"):
-            best_eeg = parsed["eeg"][0]
+        best_eeg = _best_eeg(channels, parsed)
         # GEEN blinde terugval meer op het eerste kanaal.
         #
         # Hier stond `best_eeg = channels[0]`. Op een polygrafie is dat
@@ -2031,7 +2571,8 @@ def channel_select(job_id):
         # MNE's subject_info is onbetrouwbaar: his_id bevat vaak patient_code
         # i.p.v. naam. Onze parser leest de raw 80-byte velden correct.
         from psgscoring.pipeline import _parse_edf_patient_info
-        edf_pat = _parse_edf_patient_info(raw)
+        # Leest zelf de 160 bytes patiëntvelden; heeft alleen het pad nodig.
+        edf_pat = _parse_edf_patient_info(SimpleNamespace(filenames=[filepath]))
 
         edf_lastname = ""
         edf_firstname = ""
@@ -2140,18 +2681,21 @@ def anonymize_job_edf(job_id):
     Schrijft 256 bytes op offset 0 en raakt de signaaldata niet aan. Er wordt
     bewust geen kopie gemaakt: een half geslaagde kopieeractie op een bestand
     van enkele GB is een groter risico dan deze ene write, en het origineel
-    hoort hier juist NIET te blijven staan.
+    hoort hier juist NIET te blijven staan. Alleen een opname die met een
+    andere job gedeeld wordt (_share_edf) krijgt eerst een eigen kopie.
     """
-    filepath_bytes = redis_conn.get(f"{job_id}_filepath")
-    if not filepath_bytes:
+    filepath = job_state.get(redis_conn, job_id).get("filepath")
+    if not filepath:
         flash(get_translation("session_expired", session.get("lang", "en")), "danger")
         return redirect(url_for("upload_file"))
 
-    filepath = filepath_bytes.decode("utf-8")
     study_code = request.form.get("study_code", "")
     try:
         from edf_anonymize import anonymize_file_in_place
+        # Een gedeelde opname (dezelfde EDF in een andere job) niet mee wijzigen.
+        _unshare_edf(filepath)
         after = anonymize_file_in_place(filepath, study_code=study_code)
+        _content_changed(job_id, filepath)
         # Nooit de oude waarden loggen — dat is precies de PHI die weg moet.
         logger.info("EDF-header geanonimiseerd voor job %s (code=%s)",
                     job_id, after.patient.split(" ")[0] if after.patient else "?")
@@ -2163,10 +2707,71 @@ def anonymize_job_edf(job_id):
     return redirect(url_for("channel_select", job_id=job_id))
 
 
+def _content_changed(job_id, filepath):
+    """De EDF van `job_id` werd ter plekke herschreven: zijn inhoudshash opnieuw.
+
+    De hash op de Job-rij kiest hergebruik (_reusable_analysis) en de
+    stapcache; met de hash van vóór de anonimisatie kreeg deze job het
+    resultaat — en de headervelden — van de niet-geanonimiseerde opname.
+    Lukt het rekenen niet, dan geen hash: liever geen hergebruik.
+    """
+    try:
+        digest = _file_content_hash(filepath)
+    except OSError as e:
+        logger.warning("Inhoudshash van %s niet herberekend: %s", job_id, e)
+        digest = None
+    try:
+        row = Job.query.filter_by(job_id=job_id).first()
+        if row is not None:
+            row.content_hash = digest
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("Inhoudshash van %s niet bijgewerkt: %s", job_id, e)
+
+
 # ═══════════════════════════════════════════════════════════════
 # NIEUW: UITGEBREIDE ANALYSE STARTEN
 # ═══════════════════════════════════════════════════════════════
 
+# Config-sleutels die de uitkomst van de pipeline bepalen. Patiëntgegevens,
+# taal en scorer staan er niet bij: die gaan alleen naar de rapporten, en
+# die worden bij hergebruik toch opnieuw gemaakt.
+_ANALYSIS_KEYS = ("eeg_ch", "eog_ch", "emg_ch", "extra_eeg_ch", "recording_start",
+                  "pneumo_channels", "scoring_profile", "study_type", "arousal_lgbm")
+
+
+def _reusable_analysis(job_id, cfg):
+    """
+    job_id van een eerdere analyse van dezelfde opname met dezelfde keuzes,
+    of None.
+
+    Alleen binnen de site (_jobs_with_content), alleen als die analyse haar
+    onbewerkte pipelineresultaat nog heeft, en niet als er een
+    studievergelijking gevraagd is — die moet de worker hoe dan ook draaien.
+    """
+    if (cfg.get("study_profile_set") or {}).get("comparison_profiles"):
+        return None
+    upload_folder = app.config["UPLOAD_FOLDER"]
+    wanted = {k: cfg.get(k) for k in _ANALYSIS_KEYS}
+    try:
+        rows = _jobs_with_content(cfg.get("content_hash"), current_user, job_id)
+    except Exception as e:
+        logger.warning("Hergebruikcontrole mislukt voor %s: %s", job_id, e)
+        return None
+    for row in rows:
+        if not pipeline_results.source(upload_folder, row.job_id):
+            continue
+        try:
+            with open(os.path.join(upload_folder, f"{row.job_id}_config.json")) as f:
+                old = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if {k: old.get(k) for k in _ANALYSIS_KEYS} == wanted:
+            return row.job_id
+    return None
+
+
 @app.route("/analyze", methods=["POST"])
 @login_required
 def start_analysis():
@@ -2245,11 +2850,10 @@ def start_analysis():
         flash(get_translation("job_eeg_required", session.get("lang","en")), "danger")
         return redirect(url_for("upload_file"))
 
-    filepath_bytes = redis_conn.get(f"{job_id}_filepath")
-    if not filepath_bytes:
+    filepath = job_state.get(redis_conn, job_id).get("filepath")
+    if not filepath:
         flash(get_translation("session_expired", session.get("lang","en")), "danger")
         return redirect(url_for("upload_file"))
-    filepath = filepath_bytes.decode("utf-8")
 
     if not os.path.exists(filepath):
         flash(get_translation("file_not_available", session.get("lang","en")), "danger")
@@ -2288,7 +2892,22 @@ def start_analysis():
         # v0.9.8: optional ML arousal re-classifier (preview).
         # Checkbox value is "on" if checked, absent otherwise.
         "arousal_lgbm":     bool(request.form.get("arousal_lgbm")),
+        # Volgorde in de wachtrij (job_scheduler.py): urgent/routine/research.
+        "priority":         job_scheduler.normalise_priority(
+                                request.form.get("priority")),
     }
+    _row = Job.query.filter_by(job_id=job_id).first()
+    cfg["content_hash"] = _row.content_hash if _row else None
+    # Rekentijd en geheugen vooraf, uit de header (job_estimate.py): bepaalt
+    # de wachtrij en de ETA op de statuspagina. Zonder schatting gewoon
+    # `default` en geen ETA.
+    try:
+        cfg["estimate"] = job_estimate.estimate(
+            app.config["UPLOAD_FOLDER"], "analysis",
+            job_estimate.features(_edf_header(filepath), cfg["study_type"]))
+    except Exception as e:
+        logger.warning(f"Geen kostschatting voor {job_id}: {e}")
+        cfg["estimate"] = None
     cfg_path = os.path.join(app.config["UPLOAD_FOLDER"], f"{job_id}_config.json")
     with open(cfg_path, "w") as f:
         json.dump(cfg, f)
@@ -2298,17 +2917,42 @@ def start_analysis():
                   filename=os.path.basename(filepath), status="submitted",
                   site_id=current_user.site_id)
 
-    # RQ-job starten
+    # RQ-job starten — of, bij een al geanalyseerde opname met dezelfde
+    # keuzes, enkel de rapporten opnieuw (de worker valt zelf terug op de
+    # volledige analyse als zijn bibliotheekversies verschillen).
+    source_job_id = _reusable_analysis(job_id, cfg)
+    # Niet rechtstreeks in RQ: de scheduler geeft de job vrij naar prioriteit
+    # en eerlijk verdeeld over sites (job_scheduler.py). Bij het vrijgeven
+    # koppelt hij app job_id aan RQ job_id, zodat de status-API het vindt.
     try:
-        rq_job = queue.enqueue(
-            "tasks.run_analysis_job",
-            args=(job_id,),
-            job_timeout=int(_cfg("JOB_TIMEOUT_SECONDS", 900)),
-            result_ttl=86400,
-        )
-        # Koppel app job_id aan RQ job_id zodat de status-API het kan vinden
-        redis_conn.set(f"{job_id}_rq_id", rq_job.id, ex=86400)
-        logger.info(f"Analyse gestart: job_id={job_id}, rq={rq_job.id}")
+        estimate = cfg["estimate"]
+        if source_job_id:
+            logger.info(f"Analyse {job_id}: resultaat van {source_job_id} herbruikbaar")
+            func, args, on_failure = ("tasks.reuse_analysis_results",
+                                      (job_id, source_job_id), None)
+            # Alleen rapporten; de zeldzame terugval op een volledige analyse
+            # (andere versies) draait dan op de snelle wachtrij.
+            estimate = dict(estimate or {}, runtime_s=job_estimate.MIN_RUNTIME_S)
+        else:
+            # Een timeout of OOM-kill zet de job opnieuw klaar met meer tijd;
+            # hij hervat dan vanaf zijn checkpoints (job_checkpoint.py).
+            func, args, on_failure = ("tasks.run_analysis_job", (job_id,),
+                                      "tasks.on_analysis_failure")
+        runtime_s = (estimate or {}).get("runtime_s")
+        # De timeout volgt de volledige analyse, ook bij hergebruik: dat
+        # valt bij andere versies op de volledige analyse terug.
+        job_timeout = job_estimate.timeout_s(
+            cfg["estimate"], int(_cfg("JOB_TIMEOUT_SECONDS", 900)))
+        job_state.update(redis_conn, job_id, status="scheduled", estimate=estimate,
+                         rq_id=None, error=None, step=None, total=None, label=None,
+                         started_at=None, ended_at=None)
+        rq_id = job_scheduler.submit(
+            redis_conn, job_estimate.route(runtime_s), job_id, func, args,
+            site=current_user.site_id, priority=cfg["priority"],
+            job_timeout=job_timeout, result_ttl=86400,
+            on_failure=on_failure, track_state=True,
+            estimate_s=runtime_s, ram_mb=(estimate or {}).get("ram_mb"))
+        logger.info(f"Analyse ingediend: job_id={job_id}, rq={rq_id or 'wacht'}")
     except Exception as e:
         logger.error(f"Fout bij starten analyse-job: {e}", exc_info=True)
         flash(get_translation("worker_unavailable", session.get("lang","en")), "danger")
@@ -2329,73 +2973,221 @@ def job_status(job_id):
     return render_template("job_status.html", job_id=job_id)
 
 
+_ARTIFACT_FILES = {"pdf": "_rapport.pdf", "xlsx": "_rapport.xlsx",
+                   "edfplus": "_scored.edf"}
+
+
+def _artifact_states(job_ids):
+    """
+    Per job de toestand van elk rapportartefact (tasks.generate_report_artifact):
+    ready, pending, running, failed, skipped (mail niet ingesteld) — of absent
+    als er niets bekend is.
+
+    Een bestand op schijf is altijd ready, ook zonder Redis-toestand (oudere
+    jobs, of een download die het on-the-fly maakte). Eén pipeline voor alle
+    jobs: het dashboard vraagt er tientallen tegelijk op.
+    """
+    upload_folder = app.config["UPLOAD_FOLDER"]
+    raw = [{} for _ in job_ids]
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for jid in job_ids:
+            pipe.hgetall(f"job:{jid}:artifacts")
+        raw = pipe.execute()
+    except Exception:
+        pass
+    states = {}
+    for jid, entry in zip(job_ids, raw):
+        entry = {(k.decode() if isinstance(k, bytes) else k):
+                 (v.decode() if isinstance(v, bytes) else v)
+                 for k, v in (entry or {}).items()}
+        per_job = {}
+        for kind in ("pdf", "xlsx", "edfplus", "email"):
+            suffix = _ARTIFACT_FILES.get(kind)
+            if suffix and os.path.exists(os.path.join(upload_folder, f"{jid}{suffix}")):
+                per_job[kind] = "ready"
+            else:
+                per_job[kind] = entry.get(kind, "absent")
+        states[jid] = per_job
+    return states
+
+
+def _eta_s(status, started, estimate):
+    """Resterende seconden volgens de schatting; None zonder schatting of als klaar.
+
+    `started`: epoch-seconden waarop de job begon, of None als hij nog wacht.
+    """
+    if not estimate or status not in ("queued", "started", "deferred"):
+        return None
+    if started is None:
+        return estimate["runtime_s"]
+    return max(0, round(estimate["runtime_s"] - (time.time() - started)))
+
+
+def _finished_files(job_id):
+    """Wat er van een klare job al op schijf staat, voor de knoppen op de statuspagina."""
+    upload_folder = app.config["UPLOAD_FOLDER"]
+
+    def exists(suffix):
+        return os.path.exists(os.path.join(upload_folder, f"{job_id}{suffix}"))
+
+    has_pdf = exists("_rapport.pdf")
+    return {"has_pdf": has_pdf, "has_excel": exists("_rapport.xlsx"),
+            "has_psg": has_pdf, "has_edfplus": exists("_scored.edf"),
+            # De job is klaar zodra results.json er staat; de rapporten
+            # volgen als eigen jobs. Dit zegt welke er al zijn.
+            "artifacts": _artifact_states([job_id])[job_id]}
+
+
+def _mirror_job_state(job_id, status):
+    """Eindtoestand uit job_state naar de Job-rij. De workers raken de DB niet aan."""
+    if status not in job_state.FINAL:
+        return
+    try:
+        row = Job.query.filter_by(job_id=job_id).first()
+        if row is not None and row.status != status:
+            row.status = status
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Job-status van {job_id} niet bijgewerkt: {e}")
+
+
+def _sync_job_states(limit=200):
+    """Zet eindtoestanden over voor jobs die in de DB nog als ingediend staan.
+
+    Ook voor wie de statuspagina nooit opende; één round-trip naar Redis.
+    """
+    try:
+        rows = (Job.query.filter_by(status="submitted")
+                .order_by(Job.created_at.desc()).limit(limit).all())
+        if not rows:
+            return
+        current = job_state.statuses(redis_conn, [r.job_id for r in rows])
+        changed = False
+        for row in rows:
+            status = current.get(row.job_id)
+            if status in job_state.FINAL:
+                row.status, changed = status, True
+        if changed:
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Job-statussen niet gesynchroniseerd: {e}")
+
+
+def _job_status_payload(job_id):
+    """(payload, HTTP-status) zoals `/api/status` en de stream ze geven.
+
+    Eén lookup: de toestand in job_state. Alleen een job die nog op de
+    scheduler wacht, vraagt daarnaast zijn plaats in de rij op.
+    """
+    try:
+        # Geen dispatch hier: vrijgeven volgt de workers (job_scheduler.py),
+        # niet het aantal open statuspagina's.
+        state = job_state.get(redis_conn, job_id)
+        estimate = state.get("estimate")
+        if state.get("status") == "scheduled":
+            pending = job_scheduler.pending_status(redis_conn, job_id)
+            if pending:
+                return {"status": "scheduled", "done": False, "failed": False,
+                        "progress": {}, "scheduled": pending,
+                        "estimate": estimate,
+                        "eta_s": (pending["ahead_s"] + estimate["runtime_s"]
+                                  if estimate else None)}, 200
+            # Net vrijgegeven: de scheduler zette de toestand intussen op queued.
+            state = job_state.get(redis_conn, job_id)
+
+        status = state.get("status")
+        if status in ("queued", "started") + job_state.FINAL:
+            response = {
+                "status":   status,
+                "done":     status == "finished",
+                "failed":   status == "failed",
+                "progress": {k: state[k] for k in ("step", "total", "label") if k in state},
+                "estimate": estimate,
+                "eta_s":    _eta_s(status, state.get("started_at"), estimate),
+            }
+            if status == "failed":
+                response["error"] = state.get("error") or "Onbekende fout"
+            if status == "finished":
+                response.update(_finished_files(job_id))
+            _mirror_job_state(job_id, status)
+            return response, 200
+
+        # Geen (of geen lopende) toestand meer: vervallen na ACTIVE_TTL_S, of
+        # een job van vóór job_state. Dan beslist results.json.
+        result_file = os.path.join(app.config["UPLOAD_FOLDER"], f"{job_id}_results.json")
+        if os.path.exists(result_file):
+            return {"status": "finished", "done": True, "failed": False,
+                    **_finished_files(job_id)}, 200
+        return {"status": "not_found", "done": False, "failed": False}, 404
+
+    except Exception as e:
+        logger.error(f"Fout bij ophalen job-status {job_id}: {e}")
+        return {"status": "error", "error": str(e)}, 500
+
+
 @app.route("/api/status/<job_id>")
 @login_required
 @job_access_required
 @csrf.exempt
 def api_job_status(job_id):
     """AJAX JSON-endpoint voor job-statuspolling."""
-    try:
-        # Haal echte RQ job_id op (app job_id ≠ RQ job_id)
-        rq_id = redis_conn.get(f"{job_id}_rq_id")
-        if rq_id:
-            rq_id = rq_id.decode("utf-8") if isinstance(rq_id, bytes) else rq_id
-            job    = RQJob.fetch(rq_id, connection=redis_conn)
-        else:
-            job    = RQJob.fetch(job_id, connection=redis_conn)  # fallback
-        status = job.get_status()
+    payload, code = _job_status_payload(job_id)
+    return jsonify(payload), code
 
-        # Lees echte voortgang uit Redis (geschreven door worker)
-        progress = {}
-        try:
-            raw = redis_conn.hgetall(f"job:{job_id}:progress")
-            if raw:
-                progress = {
-                    k.decode("utf-8") if isinstance(k, bytes) else k:
-                    v.decode("utf-8") if isinstance(v, bytes) else v
-                    for k, v in raw.items()
-                }
-        except Exception:
-            pass
 
-        response = {
-            "status":   str(status),
-            "done":     status == "finished",
-            "failed":   status == "failed",
-            "progress": progress,
-        }
-        if status == "failed":
-            response["error"] = str(job.exc_info) if job.exc_info else "Onbekende fout"
-        if status == "finished":
-            upload_folder = app.config["UPLOAD_FOLDER"]
-            response["has_pdf"]   = os.path.exists(
-                os.path.join(upload_folder, f"{job_id}_rapport.pdf"))
-            response["has_excel"] = os.path.exists(
-                os.path.join(upload_folder, f"{job_id}_rapport.xlsx"))
-            response["has_psg"]   = os.path.exists(
-                os.path.join(upload_folder, f"{job_id}_rapport.pdf"))
-            response["has_edfplus"] = os.path.exists(
-                os.path.join(upload_folder, f"{job_id}_scored.edf"))
-        return jsonify(response)
+STATUS_STREAM_QUIET_S = 15
+"""Zo lang stil op het kanaal: status zelf herbekijken (ook een keepalive)."""
+STATUS_STREAM_MAX_S = 600
+"""Daarna sluit de stream; EventSource maakt zelf een nieuwe verbinding."""
 
-    except NoSuchJobError:
-        result_file = os.path.join(app.config["UPLOAD_FOLDER"], f"{job_id}_results.json")
-        if os.path.exists(result_file):
-            upload_folder = app.config["UPLOAD_FOLDER"]
-            return jsonify({
-                "status":    "finished",
-                "done":      True,
-                "failed":    False,
-                "has_pdf":   os.path.exists(os.path.join(upload_folder, f"{job_id}_rapport.pdf")),
-                "has_excel": os.path.exists(os.path.join(upload_folder, f"{job_id}_rapport.xlsx")),
-                "has_psg":   os.path.exists(os.path.join(upload_folder, f"{job_id}_rapport.pdf")),
-                "has_edfplus": os.path.exists(os.path.join(upload_folder, f"{job_id}_scored.edf")),
-            })
-        return jsonify({"status": "not_found", "done": False, "failed": False}), 404
 
-    except Exception as e:
-        logger.error(f"Fout bij ophalen job-status {job_id}: {e}")
-        return jsonify({"status": "error", "error": str(e)}), 500
+@app.route("/api/status/<job_id>/stream")
+@login_required
+@job_access_required
+@csrf.exempt
+def api_job_status_stream(job_id):
+    """Dezelfde status als Server-Sent Events, gevoed door de worker (job_events.py).
+
+    Eerst de volledige status, daarna elke `progress` van de worker zoals hij
+    binnenkomt; bij een `state`-melding of na `STATUS_STREAM_QUIET_S` stilte
+    opnieuw de volledige status. Klaar of mislukt sluit de stream.
+    """
+    def _terminal(payload):
+        return payload.get("done") or payload.get("failed") or \
+            payload.get("status") in ("not_found", "error")
+
+    def generate():
+        pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+        # Eerst inschrijven, dan lezen: wat tussenin gebeurt, gaat niet verloren.
+        pubsub.subscribe(job_events.channel(job_id))
+        try:
+            yield "retry: 5000\n\n"
+            payload, _ = _job_status_payload(job_id)
+            yield job_events.format_sse("status", payload)
+            deadline = time.monotonic() + STATUS_STREAM_MAX_S
+            heard = time.monotonic()
+            while not _terminal(payload) and time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=STATUS_STREAM_QUIET_S)
+                if message is None and time.monotonic() - heard < STATUS_STREAM_QUIET_S:
+                    continue            # de inschrijvingsbevestiging, geen stilte
+                heard = time.monotonic()
+                event = json.loads(message["data"]) if message else {"type": "state"}
+                if event["type"] == "progress":
+                    yield job_events.format_sse("progress", {
+                        k: event[k] for k in ("step", "total", "label")})
+                    continue
+                payload, _ = _job_status_payload(job_id)
+                yield job_events.format_sse("status", payload)
+        finally:
+            pubsub.close()
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache",
+                             # nginx mag de stream niet bufferen
+                             "X-Accel-Buffering": "no"})
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -2633,16 +3425,21 @@ def request_profile_comparison(job_id):
 
     try:
         from redis import Redis as _Redis
-        from rq import Queue as _Queue
-        q = _Queue("study", connection=_Redis(
-            host=os.environ.get("YASAFLASKIFIED_REDIS_HOST", "redis"),
-            port=int(os.environ.get("YASAFLASKIFIED_REDIS_PORT", 6379))))
-        q.enqueue("tasks.run_study_comparison",
-                  job_id, edf_path, app.config["UPLOAD_FOLDER"],
-                  study["comparison_profiles"], study.get("primary_profile"),
-                  None, None, None,
-                  results.get("pneumo_channels") or {}, hypno,
-                  job_timeout="6h")
+        estimate = job_estimate.estimate(
+            app.config["UPLOAD_FOLDER"], "study",
+            job_estimate.features(_edf_header(edf_path), None,
+                                  len(study["comparison_profiles"])))
+        job_scheduler.submit(
+            _Redis(host=os.environ.get("YASAFLASKIFIED_REDIS_HOST", "redis"),
+                   port=int(os.environ.get("YASAFLASKIFIED_REDIS_PORT", 6379))),
+            "study", job_id, "tasks.run_study_comparison",
+            (job_id, edf_path, app.config["UPLOAD_FOLDER"],
+             study["comparison_profiles"], study.get("primary_profile"),
+             None, None, None,
+             results.get("pneumo_channels") or {}, hypno),
+            site=current_user.site_id, priority="research",
+            job_timeout=job_estimate.timeout_s(estimate, job_estimate.STUDY_TIMEOUT_S),
+            estimate_s=estimate["runtime_s"], ram_mb=estimate["ram_mb"])
     except Exception as e:  # noqa: BLE001
         logger.error("[study] handmatig inschakelen mislukt voor %s: %s",
                      job_id, e)
@@ -2877,8 +3674,8 @@ def reanalyze_study(job_id):
         flash(get_translation("edf_not_found", lang), "danger")
         return redirect(request.referrer or url_for("dashboard"))
 
-    # ── Zet filepath in Redis (zodat channel_select het vindt) ──
-    redis_conn.set(f"{job_id}_filepath", edf_path, ex=7200)
+    # ── Zet filepath in job_state (zodat channel_select het vindt) ──
+    job_state.update(redis_conn, job_id, status="parsed", filepath=edf_path)
 
     logger.info("Her-analyse gestart: %s → %s door %s",
                 job_id, os.path.basename(edf_path), current_user.username)
@@ -3118,6 +3915,7 @@ def api_save_conclusion(job_id):
         if "patient_info" not in data:
             data["patient_info"] = {}
         data["patient_info"]["diagnosis"] = conclusion_text
+        pipeline_results.before_edit(result_path)
         with open(result_path, "w") as f:
             json.dump(data, f, indent=2, default=str)
 
@@ -3239,6 +4037,7 @@ def api_save_report(job_id):
             }, f, indent=2)
 
         # Sla results JSON op
+        pipeline_results.before_edit(result_path)
         with open(result_path, "w") as f:
             json.dump(data, f, indent=2, default=str)
 
@@ -3420,6 +4219,7 @@ def _severity_class_plmi(value):
 def dashboard():
     """Patiëntenoverzicht — gefilterd op rol."""
     import glob
+    _sync_job_states()
     upload_folder = app.config["UPLOAD_FOLDER"]
     # v0.12.0: archief-weergave via ?archived=1
     show_archived = request.args.get("archived") == "1"
@@ -3526,6 +4326,11 @@ def dashboard():
         except Exception as e:
             logger.warning(f"Dashboard: {jf}: {e}")
 
+    # Rapporten die nog in de wachtrij staan (tasks._fan_out_reports).
+    states = _artifact_states([s["job_id"] for s in studies])
+    for study in studies:
+        study["artifacts"] = states[study["job_id"]]
+
     sites = Site.query.order_by(Site.name).all() if current_user.is_admin else []
     return render_template("dashboard.html", studies=studies, total=len(studies),
                            sites=sites,
@@ -3663,7 +4468,7 @@ def api_save_scoring(job_id):
         try:
             rq_job = queue.enqueue("tasks.regenerate_with_corrections",
                 args=(job_id,), job_timeout=600, result_ttl=86400)
-            redis_conn.set(f"{job_id}_regen_rq", rq_job.id, ex=86400)
+            job_state.update(redis_conn, job_id, regen_rq=rq_job.id)
         except Exception as e:
             return jsonify({"success": True,
                             "warning": f"Opgeslagen maar herberekening mislukt: {e}",
@@ -3680,10 +4485,9 @@ def api_save_scoring(job_id):
 @csrf.exempt
 def api_scoring_status(job_id):
     try:
-        rq_id_b = redis_conn.get(f"{job_id}_regen_rq")
-        if not rq_id_b:
+        rq_id = job_state.get(redis_conn, job_id).get("regen_rq")
+        if not rq_id:
             return jsonify({"status": "none", "done": False})
-        rq_id  = rq_id_b.decode() if isinstance(rq_id_b, bytes) else rq_id_b
         job    = RQJob.fetch(rq_id, connection=redis_conn)
         status = str(job.get_status())
         return jsonify({"status": status, "done": status=="finished", "failed": status=="failed"})
@@ -3720,15 +4524,23 @@ def api_edf_info(job_id):
 def api_edf_epoch(job_id, epoch_idx):
     _require_job_access(job_id)
     try:
-        from edf_api import edf_epoch
+        from edf_api import BINARY_MIMETYPE, edf_epoch, edf_epoch_binary
         channels_param = request.args.get("channels")
         channels = channels_param.split(",") if channels_param else None
+        fmt = request.args.get("format")
+        if fmt:
+            return Response(edf_epoch_binary(job_id, epoch_idx,
+                                             app.config["UPLOAD_FOLDER"],
+                                             channels, fmt),
+                            mimetype=BINARY_MIMETYPE)
         return jsonify(edf_epoch(job_id, epoch_idx,
                                  app.config["UPLOAD_FOLDER"], channels))
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 404
     except IndexError as e:
         return jsonify({"error": str(e)}), 416
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"api_edf_epoch {job_id}/{epoch_idx}: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
@@ -3741,18 +4553,84 @@ def api_edf_epoch(job_id, epoch_idx):
 def api_edf_epochs(job_id, start, end):
     _require_job_access(job_id)
     try:
-        from edf_api import edf_multi_epoch
+        from edf_api import BINARY_MIMETYPE, edf_multi_epoch, edf_multi_epoch_binary
         channels_param = request.args.get("channels")
         channels = channels_param.split(",") if channels_param else None
+        fmt = request.args.get("format")
+        if fmt:
+            return Response(edf_multi_epoch_binary(job_id, start, end,
+                                                   app.config["UPLOAD_FOLDER"],
+                                                   channels, fmt),
+                            mimetype=BINARY_MIMETYPE)
         return jsonify(edf_multi_epoch(job_id, start, end,
                                        app.config["UPLOAD_FOLDER"], channels))
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"api_edf_epochs {job_id}: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/edf/<job_id>/range")
+@login_required
+@job_access_required
+@csrf.exempt
+def api_edf_range(job_id):
+    """Willekeurig venster, één lezing en één decimatie (multi-epoch, review)."""
+    _require_job_access(job_id)
+    try:
+        from edf_api import BINARY_MIMETYPE, edf_range, edf_range_binary
+        t0 = request.args.get("t0", 0.0, type=float)
+        t1 = request.args.get("t1", 30.0, type=float)
+        n = request.args.get("n", 512, type=int)
+        channels_param = request.args.get("channels")
+        channels = channels_param.split(",") if channels_param else None
+        fmt = request.args.get("format")
+        if fmt:
+            return Response(edf_range_binary(job_id, t0, t1, n,
+                                             app.config["UPLOAD_FOLDER"],
+                                             channels, fmt),
+                            mimetype=BINARY_MIMETYPE)
+        return jsonify(edf_range(job_id, t0, t1, n,
+                                 app.config["UPLOAD_FOLDER"], channels))
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except IndexError as e:
+        return jsonify({"error": str(e)}), 416
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"api_edf_range {job_id}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/edf/<job_id>/envelope")
+@login_required
+@job_access_required
+@csrf.exempt
+def api_edf_envelope(job_id):
+    """Min/max per pixelkolom over een willekeurig venster (uitzoomen)."""
+    _require_job_access(job_id)
+    try:
+        from edf_api import edf_envelope
+        t0 = request.args.get("t0", 0.0, type=float)
+        t1 = request.args.get("t1", None, type=float)
+        width = request.args.get("width", 1000, type=int)
+        channels_param = request.args.get("channels")
+        channels = channels_param.split(",") if channels_param else None
+        return jsonify(edf_envelope(job_id, t0, t1, width,
+                                    app.config["UPLOAD_FOLDER"], channels))
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except IndexError as e:
+        return jsonify({"error": str(e)}), 416
+    except Exception as e:
+        logger.error(f"api_edf_envelope {job_id}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 # ═══════════════════════════════════════════════════════════════
 # EVENT API  (v12)
 # ═══════════════════════════════════════════════════════════════
@@ -3937,6 +4815,20 @@ def initialize_database():
                 except Exception as e:
                     logger.warning("Migratie 'study_profile_set' mislukt: %s", e)
 
+            # ── Inhoudshash op de job, voor duplicaatherkenning ───
+            job_cols = _sqlite_columns("job")
+            if job_cols and "content_hash" not in job_cols:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(text(
+                            "ALTER TABLE job ADD COLUMN content_hash VARCHAR(64)"))
+                        conn.execute(text(
+                            "CREATE INDEX IF NOT EXISTS ix_job_content_hash "
+                            "ON job (content_hash)"))
+                    logger.info("Kolom 'content_hash' toegevoegd aan job")
+                except Exception as e:
+                    logger.warning("Migratie 'content_hash' mislukt: %s", e)
+
             # Legacy wachtwoordveld kopiëren indien nodig
             cols2 = _sqlite_columns("user")
             legacy_sources = ["password_hash", "hashed_password", "password_digest"]
@@ -9,11 +9,29 @@ with AHI, OAHI, ODI, staging stats, and per-fix counters for each study.
 Designed for the AZORG-YASA-2026-001 validation study: feed 50+ EDFs
 and get a structured dataset suitable for Bland-Altman / κ analysis.
 
+Elke opname loopt door dezelfde pipeline als een job in de app
+(`tasks.run_pipeline`): één lezing van enkel de kanalen die de stappen
+nodig hebben, staging met EEG/EOG/EMG, de stappen als graaf. De kanalen
+kiest channel_map.py uit de header, zoals het kanaalkeuzescherm ze zou
+voorstellen.
+
+Hervatten: elke afgewerkte opname (per profiel) komt als één regel in
+`batch_manifest.jsonl` in de uitvoermap. Een onderbroken cohortrun die
+opnieuw gestart wordt, slaat over wat daar al staat — ook mislukte
+opnames, tenzij `--retry-failed`. Een EDF die sindsdien veranderde
+(grootte of wijzigingstijd), draait opnieuw.
+
+Geheugen: elk proces van de pool krijgt een plafond (`--mem-per-worker-mb`,
+standaard het RAM-budget van memory_budget.py gedeeld door `--workers`).
+Een opname die erboven gaat, faalt met MemoryError en wordt als fout
+genoteerd, in plaats van dat de OOM-killer de hele run stopt.
+
 Usage
 -----
     python batch_analyse.py /path/to/edfs/ -o /path/to/output/
     python batch_analyse.py /path/to/edfs/ --profile standard --workers 4
     python batch_analyse.py /path/to/edfs/ --profile strict standard sensitive
+    python batch_analyse.py /path/to/edfs/ --workers 8 --mem-per-worker-mb 6000
 
 Author:  Bart Rombaut, MD — Slaapkliniek AZORG
 Version: 0.8.37
@@ -30,114 +48,183 @@ import sys
 import time
 import traceback
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 logging.basicConfig(level=logging.INFO,
                     format="[%(asctime)s] %(levelname)s %(message)s")
 logger = logging.getLogger("batch")
 
+MANIFEST = "batch_manifest.jsonl"
+
+
+# ─────────────────────────────────────────────
+# MANIFEST
+# ─────────────────────────────────────────────
+
+def _identity(edf_path: str, profile: str) -> dict:
+    st = os.stat(edf_path)
+    return {"file": os.path.basename(edf_path), "profile": profile,
+            "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _key(entry: dict) -> tuple:
+    return (entry["file"], entry["profile"], entry["size"], entry["mtime_ns"])
+
+
+def read_manifest(path: Path) -> dict[tuple, dict]:
+    """{(file, profile, size, mtime_ns): rij}; de laatste rij per sleutel wint.
+
+    Een afgebroken laatste regel (de run stopte midden in een schrijf) wordt
+    overgeslagen: die opname draait gewoon opnieuw.
+    """
+    done: dict[tuple, dict] = {}
+    if not path.exists():
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                done[_key(entry)] = entry
+            except (ValueError, KeyError):
+                logger.warning("Manifest: onleesbare regel overgeslagen")
+    return done
+
+
+def _drop_partial_line(path: Path) -> None:
+    """Knip een afgebroken laatste regel weg, anders plakt de volgende erachter."""
+    if not path.exists():
+        return
+    data = path.read_bytes()
+    if data and not data.endswith(b"\n"):
+        with open(path, "r+b") as f:
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def _append(path: Path, entry: dict) -> None:
+    # Alleen het hoofdproces schrijft; fsync zodat een harde stop niets
+    # halfs achterlaat dat als "klaar" zou tellen.
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ─────────────────────────────────────────────
+# ÉÉN OPNAME
+# ─────────────────────────────────────────────
+
+def summarise(combined: dict) -> dict:
+    """Eén CSV-rij uit de resultaten van `tasks.run_pipeline`."""
+    pneumo = combined.get("pneumo") or {}
+    resp = pneumo.get("respiratory") or {}
+    rsum = resp.get("summary") or {}
+    spo2 = (pneumo.get("spo2") or {}).get("summary") or {}
+    arousal = (pneumo.get("arousal") or {}).get("summary") or {}
+    stats = (combined.get("sleep_statistics") or {}).get("stats") or {}
+    hypno = (combined.get("staging") or {}).get("hypnogram") or []
+    counts = {s: hypno.count(s) for s in ("W", "N1", "N2", "N3", "R")}
+    return {
+        "n_epochs": len(hypno),
+        "is_polygraphy": combined.get("is_polygraphy", False),
+        "tst_min": stats.get("TST"),
+        "sleep_efficiency_pct": stats.get("SE"),
+        "n_W": counts["W"],
+        "n_N1": counts["N1"],
+        "n_N2": counts["N2"],
+        "n_N3": counts["N3"],
+        "n_REM": counts["R"],
+        # Respiratory
+        "ahi_total": rsum.get("ahi_total"),
+        "oahi": rsum.get("oahi"),
+        # `cahi` bestaat niet in de summary; `central_index` is de
+        # centrale apneu-index. Zie de toelichting in tasks.py.
+        "central_index": rsum.get("central_index"),
+        "ahi_rem": rsum.get("ahi_rem"),
+        "ahi_nrem": rsum.get("ahi_nrem"),
+        "ahi_supine": rsum.get("ahi_supine"),
+        "ahi_nonsupine": rsum.get("ahi_nonsupine"),
+        # Kolomnamen zoals voorheen; de sleutels zoals `_compute_summary`
+        # ze levert (`n_apneas`/`n_hypopneas` bestaan daar niet).
+        "n_apneas": rsum.get("n_apnea_total"),
+        "n_hypopneas": rsum.get("n_hypopnea"),
+        "n_obstructive": rsum.get("n_obstructive"),
+        "n_central": rsum.get("n_central"),
+        "n_mixed": rsum.get("n_mixed"),
+        "rera_index": rsum.get("rera_index"),
+        "rdi": rsum.get("rdi"),
+        # Fix counters
+        "n_spo2_cross_contaminated": rsum.get("n_spo2_cross_contaminated", 0),
+        "n_csr_flagged": rsum.get("n_csr_flagged", 0),
+        "n_low_conf_noise": rsum.get("n_low_conf_noise", 0),
+        "n_low_conf_borderline": rsum.get("n_low_conf_borderline", 0),
+        "n_gap_excluded": rsum.get("n_gap_excluded", 0),
+        "n_local_baseline_rejected": resp.get("n_local_baseline_rejected", 0),
+        "n_ecg_reclassified_central": rsum.get("n_ecg_reclassified_central", 0),
+        "ahi_csr_corrected": rsum.get("ahi_csr_corrected"),
+        "ahi_excl_noise": rsum.get("ahi_excl_noise"),
+        # SpO2
+        "baseline_spo2": spo2.get("baseline_spo2"),
+        "min_spo2": spo2.get("min_spo2"),
+        "mean_spo2": spo2.get("mean_spo2"),
+        "odi_3pct": spo2.get("odi_3pct"),
+        "odi_4pct": spo2.get("odi_4pct"),
+        "pct_below_90": spo2.get("pct_below_90"),
+        "low_baseline_warning": spo2.get("low_baseline_warning", False),
+        # Arousal
+        "arousal_index": arousal.get("arousal_index"),
+        # PLM
+        "plmi": (pneumo.get("plm") or {}).get("summary", {}).get("plmi"),
+    }
+
+
+def job_config(edf_path: str, profile: str) -> dict:
+    """De jobconfig die het kanaalkeuzescherm zou opleveren, zonder scherm."""
+    import channel_map
+    from edf_reader import read_summary
+
+    header = read_summary(edf_path)
+    recording_start = None
+    if header.get("meas_date"):
+        recording_start = header["meas_date"][:16]
+    return {
+        "edf_path": edf_path,
+        **channel_map.auto_config(header["ch_names"]),
+        "recording_start": recording_start,
+        "scoring_profile": profile,
+        "study_type": None,
+    }
+
 
 def _analyse_single(edf_path: str, output_dir: str, profile: str) -> dict:
     """Analyse a single EDF file. Runs in a subprocess."""
-    import mne
-    mne.set_log_level("ERROR")
-
-    from pneumo_analysis import detect_channels, run_pneumo_analysis
-    from yasa_analysis import run_sleep_staging
+    import tasks
 
     result = {
-        "file": os.path.basename(edf_path),
-        "profile": profile,
+        **_identity(edf_path, profile),
         "status": "error",
         "error": None,
     }
 
     try:
         t0 = time.time()
-        raw = mne.io.read_raw_edf(edf_path, preload=True, verbose=False)
-
-        # Sleep staging
-        staging = run_sleep_staging(raw)
-        hypno = staging.get("hypnogram", [])
-        if not hypno:
-            result["error"] = "Staging failed: no hypnogram"
-            return result
-
-        # Channel detection
-        channels = detect_channels(raw)
-
-        # Respiratory analysis
-        pneumo = run_pneumo_analysis(raw, hypno, scoring_profile=profile)
-        resp = pneumo.get("respiratory", {})
-        rsum = resp.get("summary", {})
-        spo2 = pneumo.get("spo2", {}).get("summary", {})
-        arousal = pneumo.get("arousal", {}).get("summary", {})
-
-        # Sleep statistics
-        from collections import Counter
-        stage_counts = Counter(hypno)
-        tst_min = sum(1 for s in hypno if s in ("N1","N2","N3","R")) * 0.5
-        se = tst_min / (len(hypno) * 0.5) * 100 if hypno else 0
-
-        elapsed = time.time() - t0
-
-        result.update({
-            "status": "ok",
-            "duration_s": round(elapsed, 1),
-            "n_epochs": len(hypno),
-            "tst_min": round(tst_min, 1),
-            "sleep_efficiency_pct": round(se, 1),
-            "n_W": stage_counts.get("W", 0),
-            "n_N1": stage_counts.get("N1", 0),
-            "n_N2": stage_counts.get("N2", 0),
-            "n_N3": stage_counts.get("N3", 0),
-            "n_REM": stage_counts.get("R", 0),
-            # Respiratory
-            "ahi_total": rsum.get("ahi_total"),
-            "oahi": rsum.get("oahi"),
-            # `cahi` bestaat niet in de summary; `central_index` is de
-            # centrale apneu-index. Zie de toelichting in tasks.py.
-            "central_index": rsum.get("central_index"),
-            "ahi_rem": rsum.get("ahi_rem"),
-            "ahi_nrem": rsum.get("ahi_nrem"),
-            "ahi_supine": rsum.get("ahi_supine"),
-            "ahi_nonsupine": rsum.get("ahi_nonsupine"),
-            "n_apneas": rsum.get("n_apneas"),
-            "n_hypopneas": rsum.get("n_hypopneas"),
-            "n_obstructive": rsum.get("n_obstructive"),
-            "n_central": rsum.get("n_central"),
-            "n_mixed": rsum.get("n_mixed"),
-            "rera_index": rsum.get("rera_index"),
-            "rdi": rsum.get("rdi"),
-            # Fix counters
-            "n_spo2_cross_contaminated": rsum.get("n_spo2_cross_contaminated", 0),
-            "n_csr_flagged": rsum.get("n_csr_flagged", 0),
-            "n_low_conf_noise": rsum.get("n_low_conf_noise", 0),
-            "n_low_conf_borderline": rsum.get("n_low_conf_borderline", 0),
-            "n_gap_excluded": rsum.get("n_gap_excluded", 0),
-            "n_local_baseline_rejected": resp.get("n_local_baseline_rejected", 0),
-            "n_ecg_reclassified_central": rsum.get("n_ecg_reclassified_central", 0),
-            "ahi_csr_corrected": rsum.get("ahi_csr_corrected"),
-            "ahi_excl_noise": rsum.get("ahi_excl_noise"),
-            # SpO2
-            "baseline_spo2": spo2.get("baseline_spo2"),
-            "min_spo2": spo2.get("min_spo2"),
-            "mean_spo2": spo2.get("mean_spo2"),
-            "odi_3pct": spo2.get("odi_3pct"),
-            "odi_4pct": spo2.get("odi_4pct"),
-            "pct_below_90": spo2.get("pct_below_90"),
-            "low_baseline_warning": spo2.get("low_baseline_warning", False),
-            # Arousal
-            "arousal_index": arousal.get("arousal_index"),
-            # PLM
-            "plmi": pneumo.get("plm", {}).get("summary", {}).get("plmi"),
-        })
+        cfg = job_config(edf_path, profile)
+        # Stapcache (stage_cache.py): een tweede profiel of een herhaalde run
+        # op dezelfde EDF staget niet opnieuw.
+        cache = tasks._stage_cache(edf_path, root=os.path.join(output_dir, "stage_cache"))
+        combined = tasks.run_pipeline(cfg, cache=cache)
 
         # Save full JSON result
         json_path = os.path.join(output_dir, Path(edf_path).stem + f"_{profile}.json")
-        with open(json_path, "w") as f:
-            json.dump(pneumo, f, indent=2, default=str)
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(combined, f, indent=2, default=tasks._json_serializer)
+
+        result.update({"status": "ok", "duration_s": round(time.time() - t0, 1),
+                       "eeg_ch": cfg["eeg_ch"], **summarise(combined)})
 
+    except MemoryError:
+        result["error"] = "MemoryError: boven --mem-per-worker-mb"
+        logger.error("Failed %s: geheugenplafond bereikt", edf_path)
     except Exception as e:
         result["error"] = f"{type(e).__name__}: {e}"
         logger.error("Failed %s: %s", edf_path, traceback.format_exc())
@@ -145,7 +232,39 @@ def _analyse_single(edf_path: str, output_dir: str, profile: str) -> dict:
     return result
 
 
-def main():
+# ─────────────────────────────────────────────
+# POOL
+# ─────────────────────────────────────────────
+
+def default_mem_per_worker_mb(workers: int) -> float | None:
+    """Het RAM-budget van de node (memory_budget.py) gedeeld door de workers."""
+    import memory_budget
+
+    ram = memory_budget.node_ram_mb()
+    if not ram:
+        return None
+    return ram * memory_budget.BUDGET_FRACTION / max(workers, 1)
+
+
+def _init_worker(mem_mb: float | None, stage_workers: int) -> None:
+    """Initializer van elk poolproces: geheugenplafond en eigen threadpool.
+
+    RLIMIT_DATA en niet RLIMIT_AS: die laatste telt ook de gereserveerde
+    maar ongebruikte adresruimte (malloc-arena's per thread, BLAS), en zou
+    een opname doen falen die het geheugen nooit werkelijk gebruikt.
+    """
+    import resource
+
+    if mem_mb:
+        limit = int(mem_mb * 2**20)
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    # Elke opname draait zijn stappen als graaf op een threadpool
+    # (stage_graph.py); N processen × het standaardaantal threads zou de
+    # kernen overboeken.
+    os.environ.setdefault("YASAFLASKIFIED_STAGE_WORKERS", str(stage_workers))
+
+
+def main() -> int:
     parser = argparse.ArgumentParser(
         description="Batch PSG analysis for validation study")
     parser.add_argument("input_dir", help="Directory with EDF files")
@@ -158,6 +277,11 @@ def main():
                         help="Parallel workers (default: 1)")
     parser.add_argument("--limit", type=int, default=None,
                         help="Max number of EDFs to process")
+    parser.add_argument("--mem-per-worker-mb", type=float, default=None,
+                        help="Memory cap per worker process in MB "
+                             "(default: node RAM budget / workers; 0 = no cap)")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Run recordings again that failed in an earlier run")
 
     args = parser.parse_args()
 
@@ -173,43 +297,66 @@ def main():
         logger.error("No EDF files found in %s", input_dir)
         return 1
 
-    logger.info("Found %d EDF files, profiles: %s, workers: %d",
-                len(edfs), args.profile, args.workers)
-
-    all_results = []
-
     # Add myproject to path for imports
     sys.path.insert(0, str(Path(__file__).parent))
-
+    # Eén keer laden in het hoofdproces: de poolprocessen forken daarvan en
+    # erven mne, yasa en psgscoring in plaats van ze elk opnieuw te importeren.
+    import tasks  # noqa: F401
+
+    manifest_path = output_dir / MANIFEST
+    _drop_partial_line(manifest_path)
+    done = read_manifest(manifest_path)
+    todo: list[tuple[Path, str]] = []
     for profile in args.profile:
-        logger.info("=== Profile: %s ===", profile)
-
-        if args.workers <= 1:
-            for edf in edfs:
-                logger.info("Processing %s [%s]...", edf.name, profile)
-                r = _analyse_single(str(edf), str(output_dir), profile)
-                all_results.append(r)
-                status = r["status"]
-                ahi = r.get("ahi_total", "?")
-                logger.info("  → %s  AHI=%s  (%.1fs)",
-                            status, ahi, r.get("duration_s", 0))
-        else:
-            with ProcessPoolExecutor(max_workers=args.workers) as executor:
-                futures = {
-                    executor.submit(_analyse_single, str(edf), str(output_dir), profile): edf
-                    for edf in edfs
-                }
-                for future in as_completed(futures):
-                    edf = futures[future]
-                    r = future.result()
-                    all_results.append(r)
-                    logger.info("  %s → %s  AHI=%s",
-                                edf.name, r["status"], r.get("ahi_total", "?"))
-
-    # Write summary CSV
+        for edf in edfs:
+            entry = done.get(_key(_identity(str(edf), profile)))
+            if entry and (entry["status"] == "ok" or not args.retry_failed):
+                continue
+            todo.append((edf, profile))
+
+    mem_mb = (args.mem_per_worker_mb if args.mem_per_worker_mb is not None
+              else default_mem_per_worker_mb(args.workers))
+    workers = max(1, args.workers)
+    stage_workers = max(1, (os.cpu_count() or 1) // workers)
+    logger.info("Found %d EDF files, profiles: %s, workers: %d — %d to do, "
+                "%d already in %s; memory cap per worker: %s",
+                len(edfs), args.profile, workers, len(todo),
+                len(edfs) * len(args.profile) - len(todo), MANIFEST,
+                f"{mem_mb:.0f} MB" if mem_mb else "none")
+
+    interrupted = False
+    # Ook met één worker in een apart proces: het geheugenplafond geldt dan
+    # voor de analyse en niet voor deze lus, en een crash kost één opname.
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(mem_mb, stage_workers)) as executor:
+        futures = {
+            executor.submit(_analyse_single, str(edf), str(output_dir), profile): (edf, profile)
+            for edf, profile in todo
+        }
+        for n, future in enumerate(as_completed(futures), 1):
+            edf, profile = futures[future]
+            try:
+                r = future.result()
+            except BrokenProcessPool:
+                # Een proces werd van buitenaf gestopt (OOM-killer, kill).
+                # Wat nog liep staat niet in het manifest en draait bij de
+                # volgende start opnieuw.
+                interrupted = True
+                logger.error("%s [%s] not finished: a worker process died; "
+                             "rerun to resume", edf.name, profile)
+                continue
+            _append(manifest_path, r)
+            logger.info("  [%d/%d] %s [%s] → %s  AHI=%s  (%.1fs)",
+                        n, len(todo), edf.name, profile, r["status"],
+                        r.get("ahi_total", "?"), r.get("duration_s", 0))
+
+    # Summary CSV over the whole manifest: this run and the runs before it.
+    done = read_manifest(manifest_path)
+    all_results = [row for profile in args.profile for edf in edfs
+                   if (row := done.get(_key(_identity(str(edf), profile))))]
     csv_path = output_dir / "batch_summary.csv"
     if all_results:
-        keys = all_results[0].keys()
+        keys = list(dict.fromkeys(k for r in all_results for k in r))
         with open(csv_path, "w", newline="") as f:
             writer = csv.DictWriter(f, fieldnames=keys)
             writer.writeheader()
@@ -220,7 +367,7 @@ def main():
     n_err = sum(1 for r in all_results if r["status"] == "error")
     logger.info("Done: %d OK, %d errors out of %d total", n_ok, n_err, len(all_results))
 
-    return 0 if n_err == 0 else 1
+    return 0 if n_err == 0 and not interrupted else 1
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+"""Kanaalrollen uit de kanaalnamen, voor wie geen kanaalkeuzescherm heeft.
+
+Het kanaalkeuzescherm (app.py, `channel_select`) stelt een EEG voor en laat
+de gebruiker de rest kiezen. batch_analyse.py heeft geen gebruiker: voor een
+cohort van honderden MESA- of SHHS-nachten moet dezelfde keuze uit de namen
+alleen komen, en één keer per opname, op de header.
+
+Een EEG wordt nooit "dan maar het eerste kanaal": zonder herkend EEG is het
+een polygrafie (zie de toelichting in `channel_select` en run_pipeline).
+
+`preselect` is iets anders: wat het kanaalkeuzescherm zelf voorselecteert
+(channel_select.html). tasks.prepare_analysis stageert daar al op terwijl
+de gebruiker het formulier invult, dus moet het dezelfde keuze zijn.
+"""
+
+from __future__ import annotations
+
+# v0.8.11: YASA presteert best op C3/C4.
+# Prioriteit: C4-M1 > C3-M2 > C4 > C3 > F4 > F3 > Cz > P > O
+EEG_PRIORITY = [
+    # Exacte referentieel (AASM standaard)
+    "C4-M1", "C3-M2", "C4-A1", "C3-A2",
+    # Met streepje-varianten
+    "EEG C4-M1", "EEG C3-M2", "EEG C4-A1", "EEG C3-A2",
+    # Monopolair centraal
+    "C4", "C3", "EEG C4", "EEG C3",
+    # Frontaal (goed voor slow waves)
+    "F4-M1", "F3-M2", "F4", "F3", "EEG F4", "EEG F3",
+    # Centraal z-lijn
+    "Cz", "EEG Cz", "CZ", "EEG CZ",
+    # Pariëtaal
+    "P4", "P3", "EEG P4", "EEG P3",
+    # Occipitaal (alpha-detectie)
+    "O2", "O1", "EEG O2", "EEG O1",
+]
+
+EOG_KEYWORDS = ("EOG", "E1", "E2", "LOC", "ROC")
+CHIN_EMG_KEYWORDS = ("EMG", "CHIN")
+LEG_KEYWORDS = ("LEG", "TIBIAL")
+"""Een been-EMG is geen kin-EMG: die telt niet voor de staging."""
+
+# De regels van het kanaalkeuzescherm (channel_select.html). Ruimer dan die
+# hierboven, en een test houdt ze gelijk met het template.
+PAGE_EOG_KEYWORDS = ("EOG", "LOC", "ROC")
+PAGE_CHIN_KEYWORDS = ("CHIN", "SUBMENT", "MENTON", "KINN")
+PAGE_EMG_KEYWORDS = ("EMG", "CHIN")
+PAGE_LEG_KEYWORDS = ("PLM", "LEG", "TIB", "BEIN", "JAMBE")
+PAGE_EXTRA_EEG = ("C3", "C4", "F3", "F4", "O1", "O2", "C3-M2", "C4-M1")
+
+
+def preferred_eeg(ch_names: list[str]) -> str | None:
+    """Het eerste kanaal uit `EEG_PRIORITY` dat in de opname zit."""
+    by_upper = {ch.upper().strip(): ch for ch in ch_names}
+    for candidate in EEG_PRIORITY:
+        if candidate.upper() in by_upper:
+            return by_upper[candidate.upper()]
+    return None
+
+
+def _first(ch_names: list[str], keywords: tuple[str, ...],
+           exclude: tuple[str, ...] = ()) -> str | None:
+    for ch in ch_names:
+        upper = ch.upper()
+        if any(k in upper for k in keywords) and not any(k in upper for k in exclude):
+            return ch
+    return None
+
+
+def auto_config(ch_names: list[str]) -> dict:
+    """De kanaalvelden van een jobconfig (zie tasks.run_pipeline), uit de namen.
+
+    EEG: eerst `EEG_PRIORITY`, dan de eeg-rol van psgscoring, die geen flow-
+    of effortkanaal als EEG aanneemt. Eén EEG-kanaal voor de analyse, zoals
+    de pipeline zonder `extra_eeg_ch` doet: er wordt niets geladen dat niet
+    nodig is. De respiratoire kanalen detecteert de pipeline zelf.
+    """
+    from pneumo_analysis import detect_channels
+
+    eeg = preferred_eeg(ch_names)
+    if eeg is None:
+        eeg = detect_channels(ch_names).get("eeg")
+    eog = emg = None
+    if eeg:
+        eog = _first(ch_names, EOG_KEYWORDS)
+        emg = _first(ch_names, CHIN_EMG_KEYWORDS, exclude=LEG_KEYWORDS)
+    return {
+        "eeg_ch": eeg,
+        "eog_ch": eog,
+        "emg_ch": emg,
+        "extra_eeg_ch": [eeg] if eeg else [],
+        "pneumo_channels": {},
+    }
+
+
+def preselect(ch_names: list[str], eeg: str | None) -> dict:
+    """Wat het kanaalkeuzescherm voorselecteert, als kanaalvelden van een jobconfig.
+
+    `eeg` is de EEG-voorselectie van `channel_select` (die ook de EDF-parser
+    raadpleegt). Dient de gebruiker het formulier ongewijzigd in, dan geeft
+    /analyze precies deze velden door; zo niet, dan is het voorwerk gewoon
+    een andere cachesleutel.
+    """
+    eog = _first(ch_names, PAGE_EOG_KEYWORDS)
+    emg = (_first(ch_names, PAGE_CHIN_KEYWORDS)
+           or _first(ch_names, PAGE_EMG_KEYWORDS, exclude=PAGE_LEG_KEYWORDS))
+    extra = [ch for ch in ch_names
+             if "EEG" in ch.upper() or ch in PAGE_EXTRA_EEG]
+    return {
+        "eeg_ch": eeg,
+        "eog_ch": eog,
+        "emg_ch": emg,
+        "extra_eeg_ch": extra or [eeg],
+    }
@@ -0,0 +1,60 @@
+"""Inhoudshash van een opname — dezelfde EDF herkennen, hoe hij ook binnenkwam.
+
+Technici laden dezelfde nacht geregeld opnieuw op: na een browsercrash, voor
+een heranalyse met andere kanalen, of op een tweede site. Op bestandsnaam
+valt dat niet te zien (de upload krijgt bij een botsing een tijdstempel), op
+inhoud wel.
+
+De hash is een lijst van SHA-256-digests over vaste blokken van 1 MiB,
+waarvan de SHA-256 de uiteindelijke waarde is. Zo kan elke uploadchunk
+(2 MiB, een veelvoud van het blok) zijn eigen digests berekenen op het
+moment dat hij binnenkomt, in willekeurige volgorde, en hoeft het
+samengevoegde bestand niet nog eens gelezen te worden. Wie het bestand in
+één stroom leest (`BlockHasher`, `file_hash`) komt op dezelfde waarde uit.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from typing import BinaryIO
+
+BLOCK = 1 << 20
+DIGEST = hashlib.sha256().digest_size
+
+
+def block_digests(stream: BinaryIO) -> bytes:
+    """Digests van opeenvolgende blokken uit `stream`, vanaf de huidige positie."""
+    out = bytearray()
+    while True:
+        block = stream.read(BLOCK)
+        if not block:
+            return bytes(out)
+        out += hashlib.sha256(block).digest()
+
+
+def combine(digests: bytes) -> str:
+    """De inhoudshash (hex) uit de aaneengesloten blokdigests."""
+    return hashlib.sha256(digests).hexdigest()
+
+
+class BlockHasher:
+    """Incrementeel, voor data die in willekeurig grote stukken voorbijkomt."""
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._digests = bytearray()
+
+    def update(self, data: bytes) -> None:
+        self._buf += data
+        while len(self._buf) >= BLOCK:
+            self._digests += hashlib.sha256(self._buf[:BLOCK]).digest()
+            del self._buf[:BLOCK]
+
+    def hexdigest(self) -> str:
+        tail = hashlib.sha256(self._buf).digest() if self._buf else b""
+        return combine(bytes(self._digests) + tail)
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return combine(block_digests(f))
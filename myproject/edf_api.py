@@ -14,11 +14,22 @@ Routes (geregistreerd in app.py via register_edf_api(app)):
 
   GET /api/edf/<job_id>/epochs/<int:start>/<int:end>
       → meerdere epochs in één request (max 10)
+
+  GET /api/edf/<job_id>/range?t0=&t1=&n=&channels=
+      → { t0_s, t1_s, sfreq, n_samples, channels: { <name>: [floats] } }
+      willekeurig venster (max 10 min), één lezing en één decimatie
+
+  ?format=f32|i16 op de epoch- en range-routes → binair i.p.v. JSON
+      (zie "Binaire overdracht" hieronder)
+
+  GET /api/edf/<job_id>/envelope?t0=&t1=&width=&channels=
+      → { t0_s, t1_s, width, channels: { <name>: {min: [...], max: [...]} } }
 """
 
 import json
 import logging
 import os
+import threading
 
 import numpy as np
 
@@ -95,42 +106,100 @@ def _edf_path_for_job(job_id: str, upload_folder: str) -> str | None:
 # ── Cache (LRU, max 3 EDF-bestanden per worker) ──────────────────────────────
 from collections import OrderedDict
 
-_MAX_CACHE = 3   # max RAM ~1.5 GB bij 3 × 500 MB PSG
+_MAX_CACHE = 3   # enkel voor de MNE-fallback echt RAM; een memmap kost niets
 
 class _LRUCache:
-    """Eenvoudige LRU-cache met vaste grootte voor mne.io.BaseRaw objecten."""
+    """Eenvoudige LRU-cache met vaste grootte voor geopende EDF-bronnen.
+
+    Met een lock: de webworkers draaien met threads (gunicorn_config.py), en
+    een eviction tussen `in` en het opzoeken liet `get` een KeyError geven.
+    """
     def __init__(self, maxsize: int = 3):
         self._cache: OrderedDict = OrderedDict()
         self._maxsize = maxsize
+        self._lock = threading.Lock()
 
     def get(self, key: str):
-        if key not in self._cache:
-            return None
-        self._cache.move_to_end(key)
-        return self._cache[key]
+        with self._lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
 
     def set(self, key: str, value) -> None:
-        if key in self._cache:
-            self._cache.move_to_end(key)
-        else:
-            if len(self._cache) >= self._maxsize:
-                evicted = next(iter(self._cache))
-                logger.info("EDF cache: evict job %s (RAM vrijgeven)", evicted)
-                del self._cache[evicted]
-        self._cache[key] = value
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            else:
+                if len(self._cache) >= self._maxsize:
+                    evicted = next(iter(self._cache))
+                    logger.info("EDF cache: evict job %s (RAM vrijgeven)", evicted)
+                    del self._cache[evicted]
+            self._cache[key] = value
+
+    def pop(self, key: str):
+        with self._lock:
+            return self._cache.pop(key, None)
 
     def __contains__(self, key: str) -> bool:
-        return key in self._cache
+        with self._lock:
+            return key in self._cache
 
     def clear(self) -> None:
-        self._cache.clear()
+        with self._lock:
+            self._cache.clear()
 
 _raw_cache = _LRUCache(maxsize=_MAX_CACHE)
 
+# Gedeelde venstercache (window_cache.py), door app.py ingesteld. Zonder
+# (tests, scripts) rekent elk verzoek zelf.
+_window_cache = None
+
+
+def set_window_cache(cache) -> None:
+    global _window_cache
+    _window_cache = cache
+
+
+class _MneSource:
+    """Zelfde interface als `EdfMemmapReader`, via MNE.
+
+    Voor wat de memmap-lezer niet aankan (BDF, rare headers). Gedrag zoals
+    vóór de memmap-lezer: alles op de hoogste frequentie, daarna decimeren.
+    """
+
+    def __init__(self, path: str):
+        import mne
+        # preload=False: open the file header + index only. Per-epoch reads
+        # pull just the requested 30s slice from disk (~1 MB).
+        self.raw = mne.io.read_raw_edf(path, preload=False, verbose=False)
+        self.ch_names = list(self.raw.ch_names)
+        self.sfreq = float(self.raw.info["sfreq"])
+        self.duration_s = float(self.raw.times[-1])
+
+    def read(self, ch: str, t0: float, t1: float) -> tuple[np.ndarray, float]:
+        data, _ = self.raw[[ch], int(t0 * self.sfreq):int(t1 * self.sfreq)]
+        return data[0], self.sfreq
+
+    def window(self, channels: list[str], t0: float, t1: float,
+               n_out: int) -> tuple[np.ndarray, float]:
+        start_s = int(t0 * self.sfreq)
+        stop_s  = int(t1 * self.sfreq)
+        data, _ = self.raw[channels, start_s:stop_s]
+        n_in = data.shape[1]
+        if n_in > n_out:
+            step = n_in // n_out
+            return data[:, ::step], self.sfreq / step
+        return data, self.sfreq
+
 
 def _get_raw(job_id: str, upload_folder: str):
     """
-    Laad (en cache) mne.io.BaseRaw voor job_id.
+    Open (en cache) de EDF-bron voor job_id.
+
+    Eerst de kolomcache (`signal_cache.py`), anders de memmap-lezer
+    (`edf_reader.py`): geen MNE-object per worker, de data komt uit de
+    gedeelde page cache. Lukt geen van beide, dan MNE lazy.
     LRU-cache max 3 bestanden — oudste wordt automatisch verwijderd.
     """
     cached = _raw_cache.get(job_id)
@@ -141,18 +210,23 @@ def _get_raw(job_id: str, upload_folder: str):
     if not edf_path:
         raise FileNotFoundError(f"EDF niet gevonden voor job {job_id}")
 
-    import mne
-    logger.info("EDF openen voor viewer (lazy): %s", edf_path)
-    # preload=False: open the file header + index only. Per-epoch reads
-    # pull just the requested 30s slice from disk (~1 MB). With preload=True
-    # an 8h 32-ch PSG would block the first /info request for 20-60s while
-    # ~1-2 GB is loaded into RAM. Viewer access is sparse and sequential,
-    # so lazy reads give much better time-to-first-signal.
-    raw = mne.io.read_raw_edf(edf_path, preload=False, verbose=False)
-    _raw_cache.set(job_id, raw)
+    from edf_reader import EdfMemmapReader, EdfReaderError
+    from signal_cache import SignalCacheReader, open_cache
+    src: SignalCacheReader | EdfMemmapReader | _MneSource | None
+    src = open_cache(edf_path)
+    if src is not None:
+        logger.info("EDF geopend voor viewer (kolomcache): %s", edf_path)
+    else:
+        try:
+            src = EdfMemmapReader(edf_path)
+            logger.info("EDF geopend voor viewer (memmap): %s", edf_path)
+        except (EdfReaderError, OSError, ValueError) as e:
+            logger.info("memmap niet mogelijk (%s) — MNE lazy: %s", e, edf_path)
+            src = _MneSource(edf_path)
+    _raw_cache.set(job_id, src)
     logger.info("EDF geopend: %d kanalen, %.0f Hz, %.0f s",
-                len(raw.ch_names), raw.info["sfreq"], raw.times[-1])
-    return raw
+                len(src.ch_names), src.sfreq, src.duration_s)
+    return src
 
 
 def _sort_channels(names: list[str]) -> list[str]:
@@ -172,8 +246,8 @@ def edf_info(job_id: str, upload_folder: str) -> dict:
     Retourneert dict klaar voor jsonify().
     """
     raw       = _get_raw(job_id, upload_folder)
-    sfreq     = raw.info["sfreq"]
-    duration  = raw.times[-1]
+    sfreq     = raw.sfreq
+    duration  = raw.duration_s
     epoch_len = 30.0
     n_epochs  = int(duration // epoch_len)
     names     = _sort_channels(raw.ch_names)
@@ -193,24 +267,25 @@ def edf_info(job_id: str, upload_folder: str) -> dict:
     }
 
 
-def edf_epoch(job_id: str, epoch_idx: int,
-              upload_folder: str,
-              channels: list[str] | None = None) -> dict:
-    """
-    Geeft signaaldata voor één 30s-epoch terug.
-    channels=None → alle kanalen.
-    Data wordt gedecimeerd naar max 512 samples/kanaal voor snelle overdracht.
-    """
-    raw       = _get_raw(job_id, upload_folder)
-    sfreq     = raw.info["sfreq"]
-    epoch_len = 30.0
-    t0        = epoch_idx * epoch_len
-    t1        = t0 + epoch_len
+MAX_RANGE_S = 600.0
+"""Langer dan tien minuten is uitzoomen: daarvoor is de envelope er."""
+
+MAX_RANGE_SAMPLES = 8000
+
 
-    if t0 >= raw.times[-1]:
-        raise IndexError(f"Epoch {epoch_idx} buiten bereik")
+def _range_window(job_id: str, t0: float, t1: float, n_out: int,
+                  upload_folder: str,
+                  channels: list[str] | None) -> tuple[dict, list[str], np.ndarray]:
+    """Metadata, kanaalvolgorde en gedecimeerde data over [t0, t1).
 
-    t1 = min(t1, raw.times[-1])
+    Eén lezing per kanaal over het hele venster en één decimatie, in plaats
+    van per 30 s opnieuw te lezen en te decimeren.
+    """
+    raw = _get_raw(job_id, upload_folder)
+    t0  = max(0.0, float(t0))
+    if t0 >= raw.duration_s or t1 <= t0:
+        raise IndexError(f"Venster {t0}–{t1} s buiten bereik")
+    t1 = min(float(t1), raw.duration_s)
 
     # Selecteer kanalen
     req_chs = channels if channels else raw.ch_names
@@ -218,38 +293,61 @@ def edf_epoch(job_id: str, epoch_idx: int,
     if not req_chs:
         req_chs = raw.ch_names
 
-    # Data ophalen (time-slice)
-    start_s = int(t0 * sfreq)
-    stop_s  = int(t1 * sfreq)
-    data, _  = raw[req_chs, start_s:stop_s]   # shape: (n_ch, n_samples)
-
-    # Decimeer naar max 512 samples per kanaal (snelheid)
-    n_out = 512
-    n_in  = data.shape[1]
-    if n_in > n_out:
-        step  = n_in // n_out
-        data  = data[:, ::step]
-        eff_sfreq = sfreq / step
-    else:
-        eff_sfreq = sfreq
+    n_out = max(1, int(n_out))
+    key = f"{job_id}|{t0:.4f}|{t1:.4f}|{n_out}|{','.join(req_chs)}"
+    if _window_cache is not None:
+        blob = _window_cache.get(key)
+        if blob is not None:
+            meta, chs, (data,) = _unpack(blob)
+            return meta, chs, data
+
+    data, eff_sfreq = raw.window(req_chs, t0, t1, n_out=n_out)
+    # Vervang NaN/Inf door 0
+    data = np.nan_to_num(np.asarray(data, dtype=float),
+                         nan=0.0, posinf=0.0, neginf=0.0)
+
+    meta = {
+        "t0_s":      t0,
+        "t1_s":      t1,
+        "sfreq":     float(eff_sfreq),
+        "n_samples": data.shape[1],
+    }
+    if _window_cache is not None:
+        # float64 zoals berekend: een hit geeft exact dezelfde JSON als een miss.
+        _window_cache.put(key, job_id, _pack(
+            {**meta, "dtype": "f64", "channel_order": req_chs},
+            [data.astype("<f8").tobytes()]))
+    return meta, req_chs, data
 
-    # Bouw response
-    ch_data = {}
-    for i, ch in enumerate(req_chs):
-        sig = data[i].astype(float)
-        # Vervang NaN/Inf door 0
-        sig = np.nan_to_num(sig, nan=0.0, posinf=0.0, neginf=0.0)
-        ch_data[ch] = sig.tolist()
 
-    return {
-        "epoch":      epoch_idx,
-        "t0_s":       float(t0),
-        "t1_s":       float(t1),
-        "epoch_len_s":epoch_len,
-        "sfreq":      float(eff_sfreq),
-        "n_samples":  data.shape[1],
-        "channels":   ch_data,
-    }
+def _epoch_window(job_id: str, epoch_idx: int, upload_folder: str,
+                  channels: list[str] | None) -> tuple[dict, list[str], np.ndarray]:
+    """Metadata, kanaalvolgorde en gedecimeerde data van één epoch."""
+    epoch_len = 30.0
+    t0        = epoch_idx * epoch_len
+    try:
+        # Data gedecimeerd naar max 512 samples per kanaal (snelheid)
+        meta, req_chs, data = _range_window(job_id, t0, t0 + epoch_len, 512,
+                                            upload_folder, channels)
+    except IndexError:
+        raise IndexError(f"Epoch {epoch_idx} buiten bereik") from None
+    meta = {"epoch": epoch_idx, "t0_s": meta["t0_s"], "t1_s": meta["t1_s"],
+            "epoch_len_s": epoch_len, "sfreq": meta["sfreq"],
+            "n_samples": meta["n_samples"]}
+    return meta, req_chs, data
+
+
+def edf_epoch(job_id: str, epoch_idx: int,
+              upload_folder: str,
+              channels: list[str] | None = None) -> dict:
+    """
+    Geeft signaaldata voor één 30s-epoch terug.
+    channels=None → alle kanalen.
+    Data wordt gedecimeerd naar max 512 samples/kanaal voor snelle overdracht.
+    """
+    meta, req_chs, data = _epoch_window(job_id, epoch_idx, upload_folder, channels)
+    meta["channels"] = {ch: data[i].tolist() for i, ch in enumerate(req_chs)}
+    return meta
 
 
 def edf_multi_epoch(job_id: str, start: int, end: int,
@@ -261,7 +359,7 @@ def edf_multi_epoch(job_id: str, start: int, end: int,
     """
     end   = min(end, start + 10)
     raw   = _get_raw(job_id, upload_folder)
-    n_max = int(raw.times[-1] // 30)
+    n_max = int(raw.duration_s // 30)
     end   = min(end, n_max)
 
     epochs = []
@@ -274,11 +372,180 @@ def edf_multi_epoch(job_id: str, start: int, end: int,
     return {"start": start, "end": end, "epochs": epochs}
 
 
+def _check_range(t0: float, t1: float, n_samples: int) -> None:
+    if t1 - t0 > MAX_RANGE_S:
+        raise ValueError(f"Venster langer dan {MAX_RANGE_S:.0f} s — "
+                         "gebruik /envelope")
+    if not 0 < n_samples <= MAX_RANGE_SAMPLES:
+        raise ValueError(f"n_samples moet tussen 1 en {MAX_RANGE_SAMPLES} liggen")
+
+
+def edf_range(job_id: str, t0: float, t1: float, n_samples: int,
+              upload_folder: str,
+              channels: list[str] | None = None) -> dict:
+    """
+    Signaaldata over een willekeurig venster, gedecimeerd tot ~n_samples.
+
+    Voor wat niet op een epochgrens valt (events nakijken) en voor spans van
+    meerdere epochs: één lezing, één decimatie.
+    """
+    _check_range(t0, t1, n_samples)
+    meta, req_chs, data = _range_window(job_id, t0, t1, n_samples,
+                                        upload_folder, channels)
+    meta["channels"] = {ch: data[i].tolist() for i, ch in enumerate(req_chs)}
+    return meta
+
+
+# ── Binaire overdracht ────────────────────────────────────────────────────
+#
+# Als JSON is een sample een decimale tekst van ~20 bytes; als float32 vier.
+# Voor 30 kanalen × 512 samples scheelt dat een factor 40 op de lijn, en het
+# `tolist()` + `jsonify` dat de sync-workers bezighield valt weg. Een scorer
+# die snel door de nacht bladert, vraagt tientallen epochs per minuut.
+#
+# Formaat (little-endian):
+#   uint32 N | N bytes JSON-header (opgevuld met spaties tot een viervoud) |
+#   per blok, per kanaal in `channel_order`: n_samples waarden
+# De header is de JSON-respons zonder de signaalarrays, plus `dtype` en
+# `channel_order`. Bij "i16" draagt elk blok `scales`: waarde = int16 × scale.
+# Decoder: edf_viewer_v12.js (`edfDecodeSignals`).
+
+BINARY_MIMETYPE = "application/octet-stream"
+BINARY_FORMATS = ("f32", "i16")
+
+
+def _encode_block(meta: dict, data: np.ndarray, fmt: str) -> bytes:
+    if fmt == "f32":
+        return data.astype("<f4").tobytes()
+    # Per kanaal geschaald op de grootste uitslag in het blok: 15 bits
+    # resolutie per epoch, ruim genoeg voor een spoor van enkele tientallen
+    # pixels hoog.
+    peak = np.abs(data).max(axis=1) if data.size else np.zeros(len(data))
+    scales = np.where(peak > 0, peak / 32767.0, 1.0)
+    meta["scales"] = scales.tolist()
+    return np.round(data / scales[:, None]).astype("<i2").tobytes()
+
+
+def _pack(header: dict, payload: list[bytes]) -> bytes:
+    head = json.dumps(header, separators=(",", ":")).encode()
+    head += b" " * (-len(head) % 4)       # typed-array views willen uitlijning
+    return len(head).to_bytes(4, "little") + head + b"".join(payload)
+
+
+def _unpack(blob: bytes) -> tuple[dict, list[str], list[np.ndarray]]:
+    """Omgekeerde van `_pack`: header, kanaalvolgorde en één array per blok."""
+    n = int.from_bytes(blob[:4], "little")
+    head = json.loads(blob[4:4 + n])
+    dtype = {"f64": "<f8", "f32": "<f4", "i16": "<i2"}[head.pop("dtype")]
+    chs = head.pop("channel_order")
+    off, blocks = 4 + n, []
+    for blk in head.get("epochs", [head]):
+        count = len(chs) * blk["n_samples"]
+        arr = np.frombuffer(blob, dtype=dtype, count=count, offset=off)
+        off += arr.nbytes
+        blocks.append(arr.reshape(len(chs), blk["n_samples"]).astype(float))
+    return head, chs, blocks
+
+
+def edf_epoch_binary(job_id: str, epoch_idx: int, upload_folder: str,
+                     channels: list[str] | None = None,
+                     fmt: str = "f32") -> bytes:
+    """edf_epoch als binaire respons (zie formaat hierboven)."""
+    if fmt not in BINARY_FORMATS:
+        raise ValueError(f"Onbekend formaat {fmt!r}")
+    meta, req_chs, data = _epoch_window(job_id, epoch_idx, upload_folder, channels)
+    body = _encode_block(meta, data, fmt)
+    return _pack({**meta, "dtype": fmt, "channel_order": req_chs}, [body])
+
+
+def edf_multi_epoch_binary(job_id: str, start: int, end: int,
+                           upload_folder: str,
+                           channels: list[str] | None = None,
+                           fmt: str = "f32") -> bytes:
+    """edf_multi_epoch als binaire respons: één blok per epoch."""
+    if fmt not in BINARY_FORMATS:
+        raise ValueError(f"Onbekend formaat {fmt!r}")
+    end   = min(end, start + 10)
+    raw   = _get_raw(job_id, upload_folder)
+    end   = min(end, int(raw.duration_s // 30))
+
+    epochs, payload = [], []
+    req_chs: list[str] = []
+    for idx in range(start, end):
+        try:
+            meta, req_chs, data = _epoch_window(job_id, idx, upload_folder,
+                                                channels)
+        except IndexError:
+            break
+        payload.append(_encode_block(meta, data, fmt))
+        epochs.append(meta)
+    return _pack({"start": start, "end": end, "dtype": fmt,
+                  "channel_order": req_chs, "epochs": epochs}, payload)
+
+
+def edf_range_binary(job_id: str, t0: float, t1: float, n_samples: int,
+                     upload_folder: str,
+                     channels: list[str] | None = None,
+                     fmt: str = "f32") -> bytes:
+    """edf_range als binaire respons."""
+    if fmt not in BINARY_FORMATS:
+        raise ValueError(f"Onbekend formaat {fmt!r}")
+    _check_range(t0, t1, n_samples)
+    meta, req_chs, data = _range_window(job_id, t0, t1, n_samples,
+                                        upload_folder, channels)
+    body = _encode_block(meta, data, fmt)
+    return _pack({**meta, "dtype": fmt, "channel_order": req_chs}, [body])
+
+
+MAX_ENVELOPE_WIDTH = 4000
+"""Breder dan een scherm heeft geen zin; begrenst ook de responsgrootte."""
+
+
+def edf_envelope(job_id: str, t0: float, t1: float | None, width: int,
+                 upload_folder: str,
+                 channels: list[str] | None = None) -> dict:
+    """
+    Min/max-envelope over een willekeurig tijdvenster, op pixelbreedte.
+
+    Voor uitzoomen: een piek of desaturatiebodem blijft zichtbaar, waar de
+    vaste decimatie van edf_epoch hem tussen twee samples liet vallen. De
+    kost volgt `width`, niet de lengte van het venster (signal_pyramid.py).
+    """
+    from signal_pyramid import envelope
+
+    src   = _get_raw(job_id, upload_folder)
+    t1    = src.duration_s if t1 is None else min(t1, src.duration_s)
+    t0    = max(0.0, t0)
+    width = max(1, min(int(width), MAX_ENVELOPE_WIDTH))
+    if t0 >= t1:
+        raise IndexError(f"Leeg venster {t0}–{t1} s")
+
+    req_chs = [c for c in (channels or src.ch_names) if c in src.ch_names]
+    if not req_chs:
+        req_chs = src.ch_names
+
+    ch_data = {}
+    for ch in req_chs:
+        lo, hi = envelope(src, ch, t0, t1, width)
+        ch_data[ch] = {
+            "min": np.nan_to_num(lo, nan=0.0, posinf=0.0, neginf=0.0).tolist(),
+            "max": np.nan_to_num(hi, nan=0.0, posinf=0.0, neginf=0.0).tolist(),
+        }
+    return {
+        "t0_s":     float(t0),
+        "t1_s":     float(t1),
+        "width":    width,
+        "channels": ch_data,
+    }
+
+
 def clear_cache(job_id: str | None = None) -> None:
     """Verwijder EDF uit cache (bijv. na delete job). None = alles wissen."""
     if job_id is None:
         _raw_cache.clear()
         logger.info("EDF cache volledig gewist")
-    elif job_id in _raw_cache:
-        del _raw_cache._cache[job_id]
+        return
+    if _raw_cache.pop(job_id) is not None:
         logger.info("EDF cache gewist voor job %s", job_id)
+    if _window_cache is not None:
+        _window_cache.drop_job(job_id)
@@ -0,0 +1,364 @@
+"""EDF lezen via een geheugenmap — de signaalviewer zonder MNE.
+
+De viewer (`edf_api.py`) vraagt telkens één epoch van 30 s op. Via MNE kostte
+dat per gunicorn-worker een eigen `read_raw_edf`-object (header parsen,
+`info` opbouwen, annotaties lezen), en elke epoch-lezing liep door MNE's
+generieke lezer, die alle kanalen naar de hoogste frequentie hersamplet.
+Vier workers betekenden vier keer dezelfde opname half in RAM.
+
+Het EDF-formaat maakt dat overbodig. Na de header volgen `n_records` records
+van vaste lengte, elk met per kanaal `n_samps[i]` int16-waarden achter
+elkaar:
+
+    offset = header_bytes + record * record_bytes + ch_offset[i] * 2
+
+Die structuur is precies een 2D-array `(n_records, samples_per_record)`,
+dus volstaat `np.memmap`. Er wordt niets ingelezen tot een epoch erom
+vraagt, en dan alleen de records die het venster raken. De omzetting naar
+fysische eenheden (`cal`, `offset`, µV→V zoals MNE) gebeurt enkel op die
+samples. De pagina's komen uit de page cache van het besturingssysteem,
+die alle workers delen — een tweede worker die dezelfde epoch opvraagt,
+leest niet opnieuw van schijf.
+
+Alleen EDF/EDF+ (16-bit). BDF (24-bit) en kapotte headers geven een
+`EdfReaderError`; de aanroeper valt dan terug op MNE.
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import numpy as np
+
+HEADER_LEN = 256
+"""Vaste header; daarna 256 bytes per signaal."""
+
+TAL_LABELS = ("EDF Annotations", "BDF Annotations")
+"""EDF+-annotatiekanalen: geen signaal, MNE sluit ze ook uit."""
+
+_MICROVOLT = ("μV", "µV", "\x83\xcaV", "uV")
+
+
+class EdfReaderError(Exception):
+    pass
+
+
+def _field(raw: bytes, n: int, width: int) -> list[str]:
+    return [raw[i * width:(i + 1) * width].decode("latin-1").strip()
+            for i in range(n)]
+
+
+def _num(s: str) -> float:
+    # Sommige toestellen schrijven een komma als decimaalteken.
+    return float(s.replace(",", ".")) if s else 0.0
+
+
+def _meas_date(date: str, time: str) -> datetime | None:
+    """Startdatum dd.mm.yy + tijd hh.mm.ss, UTC zoals MNE; 1985-2084."""
+    try:
+        d, m, y = (int(x) for x in date.strip().split("."))
+        hh, mm, ss = (int(x) for x in time.strip().split("."))
+        year = 1900 + y if y >= 85 else 2000 + y
+        return datetime(year, m, d, hh, mm, ss, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def _unit_scale(unit: str) -> float:
+    """Zelfde regel als MNE: µV en mV naar volt, de rest ongemoeid."""
+    if unit in _MICROVOLT:
+        return 1e-6
+    if unit == "mV":
+        return 1e-3
+    return 1.0
+
+
+def _unique(names: list[str]) -> list[str]:
+    """Dubbele labels krijgen een volgnummer, zoals MNE ('-0', '-1', …)."""
+    seen = {n: names.count(n) for n in names}
+    counter: dict[str, int] = {}
+    out = []
+    for n in names:
+        if seen[n] > 1:
+            i = counter.get(n, 0)
+            counter[n] = i + 1
+            out.append(f"{n}-{i}")
+        else:
+            out.append(n)
+    return out
+
+
+@dataclass
+class EdfHeader:
+    """Wat uit de header komt; alleen signaalkanalen (geen TAL)."""
+
+    ch_names: list[str]
+    units: list[str]
+    n_samps: np.ndarray        # samples per record, per signaalkanaal
+    cal: np.ndarray            # fysisch = digitaal * cal + offset (in SI)
+    offset: np.ndarray
+    record_length: float
+    n_records: int
+    header_bytes: int
+    record_samples: int        # samples per record over ALLE kanalen
+    ch_offsets: np.ndarray     # startkolom in het record, per signaalkanaal
+    meas_date: datetime | None = None
+
+    @property
+    def native_sfreq(self) -> np.ndarray:
+        return self.n_samps / self.record_length
+
+    @property
+    def sfreq(self) -> float:
+        """Hoogste frequentie — wat MNE als `info['sfreq']` rapporteert."""
+        return float(self.native_sfreq.max()) if len(self.n_samps) else 0.0
+
+    @property
+    def n_times(self) -> int:
+        return int(round(self.n_records * self.record_length * self.sfreq))
+
+    @property
+    def duration_s(self) -> float:
+        """Tijdstip van de laatste sample, gelijk aan MNE's `raw.times[-1]`."""
+        return (self.n_times - 1) / self.sfreq if self.n_times else 0.0
+
+
+def read_header(path: str) -> EdfHeader:
+    """Parse de EDF-header (vaste 256 bytes + 256 per signaal)."""
+    with open(path, "rb") as f:
+        fixed = f.read(HEADER_LEN)
+        if len(fixed) < HEADER_LEN:
+            raise EdfReaderError("bestand korter dan een EDF-header")
+        if fixed[:1] != b"0":
+            # BDF begint met 0xFF "BIOSEMI"; 24-bit ondersteunen we hier niet.
+            raise EdfReaderError("geen EDF (BDF of onbekend formaat)")
+        try:
+            header_bytes = int(fixed[184:192].decode("latin-1").strip())
+            n_records = int(fixed[236:244].decode("latin-1").strip())
+            record_length = _num(fixed[244:252].decode("latin-1").strip())
+            ns = int(fixed[252:256].decode("latin-1").strip())
+        except ValueError as e:
+            raise EdfReaderError(f"onleesbare header: {e}") from e
+        sig = f.read(ns * 256)
+        if len(sig) < ns * 256:
+            raise EdfReaderError("signaalheader afgekapt")
+        size = os.fstat(f.fileno()).st_size
+    meas_date = _meas_date(fixed[168:176].decode("latin-1"),
+                           fixed[176:184].decode("latin-1"))
+
+    if record_length <= 0:
+        record_length = 1.0
+
+    pos = 0
+
+    def block(width: int) -> list[str]:
+        nonlocal pos
+        vals = _field(sig[pos:pos + ns * width], ns, width)
+        pos += ns * width
+        return vals
+
+    labels = block(16)
+    block(80)                                  # transducer
+    units = block(8)
+    try:
+        pmin = np.array([_num(v) for v in block(8)])
+        pmax = np.array([_num(v) for v in block(8)])
+        dmin = np.array([_num(v) for v in block(8)])
+        dmax = np.array([_num(v) for v in block(8)])
+        block(80)                              # prefiltering
+        n_samps_all = np.array([int(v) for v in block(8)], dtype=np.int64)
+    except ValueError as e:
+        raise EdfReaderError(f"onleesbare signaalheader: {e}") from e
+
+    record_samples = int(n_samps_all.sum())
+    if record_samples <= 0:
+        raise EdfReaderError("geen samples per record")
+    # Zoals MNE: bij een afwijkend aantal records (opname niet netjes
+    # gestopt, of -1) beslist de bestandsgrootte.
+    on_disk = (size - header_bytes) // (2 * record_samples)
+    if n_records != on_disk:
+        n_records = int(on_disk)
+    if n_records <= 0:
+        raise EdfReaderError("geen datarecords")
+
+    starts = np.concatenate([[0], np.cumsum(n_samps_all)[:-1]])
+    keep = [i for i, lab in enumerate(labels) if lab not in TAL_LABELS]
+    drange = np.where(dmax - dmin == 0, 1.0, dmax - dmin)
+    gain = (pmax - pmin) / drange
+    scale = np.array([_unit_scale(u) for u in units])
+    return EdfHeader(
+        ch_names=_unique([labels[i] for i in keep]),
+        units=[units[i] for i in keep],
+        n_samps=n_samps_all[keep],
+        cal=(gain * scale)[keep],
+        offset=((pmin - gain * dmin) * scale)[keep],
+        record_length=record_length,
+        n_records=n_records,
+        header_bytes=header_bytes,
+        record_samples=record_samples,
+        ch_offsets=starts[keep],
+        meas_date=meas_date,
+    )
+
+
+def read_summary(path: str) -> dict:
+    """Kanaalnamen, frequenties, duur en startdatum — alleen de header.
+
+    Voor alles wat enkel moet weten wát er in het bestand zit: de
+    kanaalkeuze, de auto-detectie van respiratoire kanalen, het laadplan van
+    de analyse. Die openden elk een `read_raw_edf`-object (annotaties lezen,
+    `info` opbouwen) voor een lijst namen. Een EDF-header is 256 bytes plus
+    256 per kanaal; die lezen kost niets.
+
+    JSON-serialiseerbaar, zodat de webapp het kan cachen. BDF en headers die
+    `read_header` weigert, gaan via MNE (preload=False) met hetzelfde
+    resultaat.
+    """
+    try:
+        h = read_header(path)
+        return {
+            "ch_names":     list(h.ch_names),
+            "sfreq":        h.sfreq,
+            "duration_s":   h.duration_s,
+            "native_sfreq": {ch: float(sf)
+                             for ch, sf in zip(h.ch_names, h.native_sfreq)},
+            "meas_date":    h.meas_date.isoformat() if h.meas_date else None,
+        }
+    except EdfReaderError:
+        pass
+
+    import mne
+    raw = mne.io.read_raw_edf(path, preload=False, verbose="ERROR")
+    native: dict[str, float] = {}
+    try:
+        # _raw_extras is intern aan MNE, maar de enige plek waar de NATIVE
+        # frequentie per kanaal staat; `info['sfreq']` is al het maximum.
+        extras = raw._raw_extras[0]
+        rec_len = float(extras["record_length"][0]) or 1.0
+        native = {ch: float(n) / rec_len
+                  for ch, n in zip(raw.ch_names, extras["n_samps"])}
+    except Exception:
+        pass
+    meas_date = raw.info.get("meas_date")
+    return {
+        "ch_names":     list(raw.ch_names),
+        "sfreq":        float(raw.info["sfreq"]),
+        "duration_s":   float(raw.times[-1]) if len(raw.times) else 0.0,
+        "native_sfreq": native,
+        "meas_date":    meas_date.isoformat() if meas_date else None,
+    }
+
+
+class SignalSource:
+    """Gemeenschappelijk deel van de lezers: kanalen op één tijdas zetten.
+
+    Subklassen leveren `ch_names`, `sfreq`, `duration_s` en `read()`.
+    """
+
+    ch_names: list[str]
+    sfreq: float
+    duration_s: float
+
+    def read(self, ch: str, t0: float, t1: float) -> tuple[np.ndarray, float]:
+        raise NotImplementedError
+
+    def window(self, channels: list[str], t0: float, t1: float,
+               n_out: int) -> tuple[np.ndarray, float]:
+        """`n_out` punten per kanaal op een gemeenschappelijke tijdas.
+
+        De viewer toont alle kanalen op één as. MNE bereikte dat door alles
+        naar de hoogste frequentie te hersamplen en daarna te decimeren; hier
+        wordt rechtstreeks per uitvoerpunt de native sample op of net vóór
+        dat tijdstip genomen. Voor traag bemonsterde kanalen (SpO2 op 1 Hz)
+        geeft dat trappen in plaats van FFT-rimpels — eerlijker voor wie
+        scoort.
+        """
+        n_in = int(t1 * self.sfreq) - int(t0 * self.sfreq)
+        step = max(1, n_in // n_out) if n_in > n_out else 1
+        eff = self.sfreq / step
+        n = (n_in + step - 1) // step
+        t = np.arange(n) / eff
+        return self._samples_at(channels, t0, t1, t), eff
+
+    def _samples_at(self, channels: list[str], t0: float, t1: float,
+                    t: np.ndarray) -> np.ndarray:
+        """Per kanaal de sample op of vóór `t0 + t`, binnen [t0, t1)."""
+        out = np.zeros((len(channels), len(t)))
+        for row, ch in enumerate(channels):
+            sig, sf = self.read(ch, t0, t1)
+            if not len(sig):
+                continue
+            idx = np.minimum((t * sf + 1e-9).astype(np.int64), len(sig) - 1)
+            out[row] = sig[idx]
+        return out
+
+
+class EdfMemmapReader(SignalSource):
+    """Leest samples rechtstreeks uit een geheugenmap van de datarecords."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header = read_header(path)
+        h = self.header
+        self._records = np.memmap(
+            path, dtype="<i2", mode="r", offset=h.header_bytes,
+            shape=(h.n_records, h.record_samples))
+        self._index = {ch: i for i, ch in enumerate(h.ch_names)}
+        self.ch_names = h.ch_names
+        self.sfreq = h.sfreq
+        self.duration_s = h.duration_s
+
+    def read(self, ch: str, t0: float, t1: float) -> tuple[np.ndarray, float]:
+        """Fysische samples van `ch` in [t0, t1), op de NATIVE frequentie.
+
+        Alleen de records die het venster raken worden aangeraakt; de
+        int16→float-omzetting gebeurt op die samples en niet meer.
+        """
+        h = self.header
+        i = self._index[ch]
+        n = int(h.n_samps[i])
+        sf = n / h.record_length
+        total = h.n_records * n
+        s0 = max(0, min(total, int(round(t0 * sf))))
+        s1 = max(s0, min(total, int(round(t1 * sf))))
+        if s1 == s0:
+            return np.zeros(0), sf
+        r0, r1 = s0 // n, (s1 - 1) // n + 1
+        c0 = int(h.ch_offsets[i])
+        block = self._records[r0:r1, c0:c0 + n].reshape(-1)
+        dig = block[s0 - r0 * n:s1 - r0 * n]
+        return dig * h.cal[i] + h.offset[i], sf
+
+    def _samples_at(self, channels: list[str], t0: float, t1: float,
+                    t: np.ndarray) -> np.ndarray:
+        """Eén recordblok voor alle kanalen; alleen de getoonde samples omzetten.
+
+        Zelfde selectie als de basisklasse, maar de records die het venster
+        raken worden één keer geadresseerd en er wordt niet eerst per kanaal
+        het hele venster naar float omgezet om het merendeel weg te gooien.
+        """
+        h = self.header
+        r0 = max(0, int(t0 // h.record_length))
+        r1 = min(h.n_records, int(np.ceil(t1 / h.record_length)) + 1)
+        block = self._records[r0:r1]
+        out = np.zeros((len(channels), len(t)))
+        for row, ch in enumerate(channels):
+            i = self._index[ch]
+            n = int(h.n_samps[i])
+            sf = n / h.record_length
+            total = h.n_records * n
+            s0 = max(0, min(total, int(round(t0 * sf))))
+            s1 = max(s0, min(total, int(round(t1 * sf))))
+            if s1 == s0:
+                continue
+            idx = s0 + np.minimum((t * sf + 1e-9).astype(np.int64), s1 - s0 - 1)
+            dig = block[idx // n - r0, int(h.ch_offsets[i]) + idx % n]
+            out[row] = dig * h.cal[i] + h.offset[i]
+        return out
+
+    def close(self) -> None:
+        mm = getattr(self._records, "_mmap", None)
+        if mm is not None:
+            mm.close()
@@ -28,6 +28,8 @@ import os
 import uuid
 from datetime import datetime, timezone
 
+import pipeline_results
+
 logger = logging.getLogger("yasaflaskified.event_api")
 
 # ── Event-types ────────────────────────────────────────────────────────────
@@ -261,6 +263,7 @@ def _sync_to_results(job_id: str, upload_folder: str, stats: dict):
             data["pneumo"]["respiratory"] = {}
         data["pneumo"]["respiratory"]["summary"] = stats
         data["pneumo"]["respiratory"]["manually_corrected"] = True
+        pipeline_results.before_edit(res_path)
         with open(res_path, "w") as f:
             json.dump(data, f, indent=2, default=str)
     except Exception as e:
@@ -14,7 +14,7 @@ from version import PSGSCORING_VERSION as _PSGSCORING_VERSION
 from version import __version__ as _APP_VERSION
 
 matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 logger = logging.getLogger(__name__)
 import numpy as np
@@ -587,13 +587,24 @@ def _kpi(items):
     return t
 
 # ── Figuren ────────────────────────────────────────────────────
+def _subplots(*args, figsize, dpi=None, **kwargs):
+    """Zoals plt.subplots, maar zonder pyplot.
+
+    Dit rapport wordt ook in de webapp gemaakt (downloads op aanvraag), en
+    die draait met threads (gunicorn_config.py). pyplot houdt één lijst
+    figuren en één "huidige figuur" per proces bij; een losse Figure niet.
+    """
+    fig = Figure(figsize=figsize, dpi=dpi)
+    return fig, fig.subplots(*args, **kwargs)
+
+
 def _hypno_img(timeline, wc=16.2, hc=3.0, lang="nl"):
     stages=[ep.get("stage","W") for ep in timeline]
     # AASM standaard: W bovenaan, REM onderaan
     order={"W":0,"N1":1,"N2":2,"N3":3,"R":4}
     y=[order.get(s,0) for s in stages]; n=len(stages); x=np.arange(n)
 
-    fig,ax=plt.subplots(figsize=(wc/2.54,hc/2.54),dpi=180)
+    fig,ax=_subplots(figsize=(wc/2.54,hc/2.54),dpi=180)
     fig.patch.set_facecolor("white"); ax.set_facecolor("white")
 
     # Stap-lijn (fijn)
@@ -629,13 +640,13 @@ def _hypno_img(timeline, wc=16.2, hc=3.0, lang="nl"):
     ax.spines["bottom"].set_linewidth(0.4); ax.spines["bottom"].set_color("#b0b8c4")
     ax.tick_params(axis="both",length=2,width=0.4,color="#b0b8c4")
 
-    plt.tight_layout(pad=0.3)
-    buf=io.BytesIO(); fig.savefig(buf,format="png",dpi=180,bbox_inches="tight"); plt.close(fig); buf.seek(0)
+    fig.tight_layout(pad=0.3)
+    buf=io.BytesIO(); fig.savefig(buf,format="png",dpi=180,bbox_inches="tight"); buf.seek(0)
     return Image(buf,width=wc*cm,height=hc*cm)
 
 def _spo2_img(ts,wc=16.2,hc=2.2):
     y=np.array(ts,dtype=float); x=np.arange(len(y))
-    fig,ax=plt.subplots(figsize=(wc/2.54,hc/2.54),dpi=150)
+    fig,ax=_subplots(figsize=(wc/2.54,hc/2.54),dpi=150)
     fig.patch.set_facecolor("white"); ax.set_facecolor("#fafbfd")
     ax.fill_between(x,y,90,where=(y<90),color="#e74c3c",alpha=0.3)
     ax.plot(x,y,color="#2980b9",linewidth=0.8)
@@ -644,8 +655,8 @@ def _spo2_img(ts,wc=16.2,hc=2.2):
     n=len(y); te=max(1,n//6); xt=np.arange(0,n+1,te)
     ax.set_xticks(xt); ax.set_xticklabels([f"{t/3600:.1f}h" for t in xt],fontsize=6)
     ax.spines[["top","right"]].set_visible(False); ax.grid(color="#e2e8f0",linewidth=0.3)
-    plt.tight_layout(pad=0.3)
-    buf=io.BytesIO(); fig.savefig(buf,format="png",dpi=150,bbox_inches="tight"); plt.close(fig); buf.seek(0)
+    fig.tight_layout(pad=0.3)
+    buf=io.BytesIO(); fig.savefig(buf,format="png",dpi=150,bbox_inches="tight"); buf.seek(0)
     return Image(buf,width=wc*cm,height=hc*cm)
 
 # ── v0.8.22: Overview plots — gedeelde x-as (uren) ────────────
@@ -658,7 +669,7 @@ _OV_RIGHT = 0.98
 
 def _ov_setup(hc, dur_h, show_xticklabels=True):
     """Maak figuur + ax met identieke marges voor alle overview-panelen."""
-    fig, ax = plt.subplots(figsize=(_OV_WC/2.54, hc/2.54), dpi=_OV_DPI)
+    fig, ax = _subplots(figsize=(_OV_WC/2.54, hc/2.54), dpi=_OV_DPI)
     fig.patch.set_facecolor("white"); ax.set_facecolor("white")
     bot = 0.22 if show_xticklabels else 0.08
     fig.subplots_adjust(left=_OV_LEFT, right=_OV_RIGHT, top=0.95, bottom=bot)
@@ -680,7 +691,7 @@ def _ov_finish(fig, hc):
     """Sla op als Image met vaste breedte — GEEN bbox_inches=tight."""
     buf = io.BytesIO()
     fig.savefig(buf, format="png", dpi=_OV_DPI)  # vaste marges, geen tight
-    plt.close(fig); buf.seek(0)
+    buf.seek(0)
     return Image(buf, width=_OV_WC*cm, height=hc*cm)
 
 POS_LABELS = {0:"BUK",1:"LNK",2:"RUG",3:"REC",4:"STA"}
@@ -974,7 +985,7 @@ def epoch_panel_png(edf_path, channel_map, event, hypno=None,
 
     n_ch = len(ch_to_plot)
     total_hc = max(n_ch * hc_per_ch, 3)
-    fig, axes = plt.subplots(n_ch, 1, figsize=(wc/2.54, total_hc/2.54),
+    fig, axes = _subplots(n_ch, 1, figsize=(wc/2.54, total_hc/2.54),
                               sharex=True, dpi=150)
     if n_ch == 1:
         axes = [axes]
@@ -1145,12 +1156,11 @@ def epoch_panel_png(edf_path, channel_map, event, hypno=None,
     title = f"{ev_type}{_det_label} — {ev_dur}{ev_desat}{ev_conf}{stage} — t={onset_hm}"
     fig.suptitle(title, fontsize=6.5, color="#1a3a5c", fontweight="bold", y=0.99)
 
-    plt.tight_layout(pad=0.3)
+    fig.tight_layout(pad=0.3)
     fig.subplots_adjust(top=0.94, hspace=0.15)
 
     buf = io.BytesIO()
     fig.savefig(buf, format="png", dpi=150, bbox_inches="tight")
-    plt.close(fig)
     buf.seek(0)
     return buf, total_hc
 
@@ -1192,6 +1202,19 @@ def load_panel_raw(edf_path, channel_map):
     try:
         import mne
         mne.set_log_level("ERROR")
+        # Kolomcache eerst (signal_cache.py). Een volledige MNE-lezing zet
+        # alles op de hoogste frequentie van het BESTAND; de cache is alleen
+        # bruikbaar als de gevraagde kanalen die al hebben.
+        import signal_cache
+        cache = signal_cache.open_cache(edf_path)
+        if cache is not None:
+            need = list(dict.fromkeys(
+                channel_map[t] for t, _, _ in _EPOCH_CH_ORDER
+                if channel_map.get(t) and channel_map.get(t) in cache.channels))
+            cached = signal_cache.cached_raw(edf_path, need, sfreq=cache.sfreq,
+                                             cache=cache)
+            if cached is not None:
+                return cached
         raw = mne.io.read_raw_edf(edf_path, preload=False, verbose=False)
         available = raw.ch_names
         # dict.fromkeys: ontdubbelen met behoud van volgorde. Meerdere rollen
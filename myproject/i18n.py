@@ -785,6 +785,12 @@ TRANSLATIONS = {
     "upload_parse_error":   {"nl": "Parse fout", "fr": "Erreur d'analyse", "en": "Parse error"},
     "upload_parse_fail":    {"nl": "Parse mislukt", "fr": "Analyse échouée", "en": "Parse failed"},
     "upload_channels_found":{"nl": "kanalen gevonden", "fr": "canaux trouvés", "en": "channels found"},
+    "artifact_pending":     {"nl": "Wordt aangemaakt…", "fr": "En cours de création…",
+                             "en": "Being generated…", "de": "Wird erstellt…"},
+    "upload_duplicate":     {"nl": "Deze opname staat al op de server — het bestaande bestand wordt gebruikt",
+                             "fr": "Cet enregistrement existe déjà sur le serveur — le fichier existant est utilisé",
+                             "en": "This recording is already on the server — using the existing file",
+                             "de": "Diese Aufzeichnung ist bereits auf dem Server — die vorhandene Datei wird verwendet"},
     "upload_analysis_start":{"nl": "Analyse gestart", "fr": "Analyse démarrée", "en": "Analysis started"},
     "upload_async":         {"nl": "Async verwerking", "fr": "Traitement asynchrone", "en": "Async processing"},
 
@@ -4066,3 +4072,32 @@ _RIP_GATE_V0270 = {
         "de": "Energieverhältnis Thorax/Abdomen"},
 }
 TRANSLATIONS.update(_RIP_GATE_V0270)
+
+
+# Wachtrijprioriteit en -positie (job_scheduler.py).
+_SCHEDULER = {
+    "priority_label": {
+        "nl": "Prioriteit", "fr": "Priorité", "en": "Priority", "de": "Priorität"},
+    "priority_urgent": {
+        "nl": "Dringend", "fr": "Urgent", "en": "Urgent", "de": "Dringend"},
+    "priority_routine": {
+        "nl": "Routine", "fr": "Routine", "en": "Routine", "de": "Routine"},
+    "priority_research": {
+        "nl": "Onderzoek", "fr": "Recherche", "en": "Research", "de": "Forschung"},
+    "priority_hint": {
+        "nl": "Dringende analyses gaan vóór alle andere in de wachtrij. "
+              "Gebruik dit alleen voor een studie die vandaag nodig is.",
+        "fr": "Les analyses urgentes passent avant toutes les autres dans la "
+              "file. À réserver aux études nécessaires aujourd'hui.",
+        "en": "Urgent analyses go ahead of all others in the queue. Use it only "
+              "for a study that is needed today.",
+        "de": "Dringende Analysen kommen in der Warteschlange vor allen anderen. "
+              "Nur für eine Studie verwenden, die heute benötigt wird."},
+    "queue_position": {
+        "nl": "In de wachtrij — plaats", "fr": "En file d'attente — position",
+        "en": "Queued — position", "de": "In der Warteschlange — Platz"},
+    "eta_remaining": {
+        "nl": "Nog ongeveer", "fr": "Encore environ",
+        "en": "Time left: about", "de": "Noch etwa"},
+}
+TRANSLATIONS.update(_SCHEDULER)
@@ -0,0 +1,92 @@
+"""Afgewerkte stappen van één analysejob bewaren, om na een onderbreking verder te gaan.
+
+Een RQ-worker die door de OOM-killer gestopt wordt of `JOB_TIMEOUT_SECONDS`
+haalt halverwege `run_analysis_job`, verloor alles: de studie moest opnieuw
+vanaf de kanaalkeuze, en op een opname van 10–14 h betekent dat staging en
+alle detectoren opnieuw. Hier wordt elke stap die klaar is meteen bewaard
+onder `{UPLOAD_FOLDER}/{job_id}_checkpoints/`; een volgende poging op
+dezelfde job zet die terug (`stage_graph.run_stages`) en begint bij wat
+ontbreekt.
+
+Anders dan de stapcache (`stage_cache.py`) hoort dit bij de JOB, niet bij de
+opname, en bewaart het ook de goedkope stappen: het doel is de draad weer
+oppakken, niet hergebruik over jobs heen. Een checkpoint geldt alleen voor
+exact dezelfde config en dezelfde bibliotheekversies (`fingerprint`); een
+heranalyse met andere keuzes begint dus schoon. Na een geslaagde job wordt
+de map verwijderd.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pickle
+import shutil
+from typing import Any
+
+from stage_cache import write_pickle
+
+logger = logging.getLogger("yasaflaskified.worker")
+
+MANIFEST = "manifest.json"
+
+
+def checkpoint_dir(upload_folder: str, job_id: str) -> str:
+    return os.path.join(upload_folder, f"{job_id}_checkpoints")
+
+
+class JobCheckpoints:
+    """De checkpoints van één job onder `directory`, geldig voor `fingerprint`."""
+
+    def __init__(self, directory: str, fingerprint: str) -> None:
+        self.directory = directory
+        self.fingerprint = fingerprint
+        stored = self._stored_fingerprint()
+        if stored is not None and stored != fingerprint:
+            logger.info("[CHECKPOINT] config of versies gewijzigd — oude "
+                        "checkpoints van %s vervallen", directory)
+            self.clear()
+
+    def _stored_fingerprint(self) -> str | None:
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                return json.load(f).get("fingerprint")
+        except (OSError, ValueError):
+            return None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.pkl")
+
+    def done(self) -> list[str]:
+        """De stappen waarvoor een checkpoint klaarstaat."""
+        if self._stored_fingerprint() != self.fingerprint:
+            return []
+        return sorted(p[:-4] for p in os.listdir(self.directory) if p.endswith(".pkl"))
+
+    def restore(self, name: str) -> tuple[bool, Any]:
+        if self._stored_fingerprint() != self.fingerprint:
+            return False, None
+        try:
+            with open(self._path(name), "rb") as f:
+                return True, pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:                                    # noqa: BLE001
+            logger.warning("[CHECKPOINT] %s onleesbaar, opnieuw: %s", name, e)
+            return False, None
+
+    def save(self, name: str, value: Any) -> None:
+        try:
+            if self._stored_fingerprint() != self.fingerprint:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(os.path.join(self.directory, MANIFEST), "w") as f:
+                    json.dump({"fingerprint": self.fingerprint}, f)
+            write_pickle(self._path(name), value)
+        except OSError as e:
+            # Zonder checkpoint loopt de job gewoon door; hij is dan alleen
+            # niet hervatbaar vanaf deze stap.
+            logger.warning("[CHECKPOINT] %s niet bewaard: %s", name, e)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
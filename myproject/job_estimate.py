@@ -0,0 +1,266 @@
+"""Hoe lang en hoeveel geheugen een job zal kosten, uit de EDF-header.
+
+Bij `parse_file` staat alles al vast wat de kost bepaalt: duur, aantal
+kanalen en hun frequenties (`edf_reader.read_summary`), en bij het indienen
+het studietype (polygrafie stageert niet) en, voor een studievergelijking,
+het aantal profielen. Daarmee wordt hier geschat, met twee doelen:
+
+* routeren: een job die naar schatting kort is, gaat naar de wachtrij
+  `fast` (zie `job_scheduler.QUEUES` en docker-compose.yml), zodat een
+  polygrafie van een paar minuten niet achter een nacht-PSG wacht;
+* een ETA voor de statuspagina (`/api/status/<job_id>`);
+* de timeout van de RQ-job (`timeout_s`) en de verwachte duur die de
+  worker naast de echte legt (`expected_s` in `job.meta`).
+
+De schatting is een lineair model per soort job (`analysis`, `study`,
+`report`), gefit met kleinste kwadraten op de laatste `HISTORY_WINDOW` echte
+runs uit `{UPLOAD_FOLDER}/job_timings.jsonl`. Elke geslaagde, volledig
+gerekende job schrijft daar één regel bij (`record`); een hervatte job of een met
+cachetreffers telt niet mee, want die zegt niets over wat de opname kost.
+Zolang er minder dan `MIN_HISTORY` runs zijn, gelden de `PRIORS`: ruwe
+schattingen, geen metingen.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+from study_type import is_polygraphy
+
+logger = logging.getLogger("yasaflaskified.estimate")
+
+HISTORY_FILE = "job_timings.jsonl"
+HISTORY_WINDOW = 500
+MIN_HISTORY = 10
+
+MIN_RUNTIME_S = 10.0
+MIN_RAM_MB = 200.0
+
+TERMS = {
+    # Laden en filteren schalen met het aantal samples, pneumo met de duur,
+    # staging en de EEG-detectoren met de duur als er gestageerd wordt.
+    "analysis": ("msamples", "hours", "staging_hours"),
+    # Elk profiel is een volledige `run_pneumo_analysis` over de nacht; met
+    # `workers` processen (profile_pool) lopen er zoveel tegelijk, dus telt
+    # de duur maal het aantal rondes.
+    "study": ("msamples", "profile_hours"),
+    # PDF en Excel tekenen de nacht (hypnogram, events), EDF+ schrijft de
+    # signalen opnieuw weg.
+    "report": ("msamples", "hours"),
+}
+
+PRIORS: dict[str, dict[str, tuple[float, ...]]] = {
+    # Intercept eerst, dan per term in de volgorde van TERMS. Afgeleid van
+    # "~4 minuten en ~2 GB per PSG" (docker-compose.yml) en "46 minuten voor
+    # zeven profielen" (tasks.run_study_comparison), niet gemeten. Een PSG
+    # van 8 uur met 20 kanalen op 256 Hz is ~150 Msamples: ~75 s laden en
+    # filteren, ~50 s pneumo, ~95 s staging en EEG. Zonder samplesterm zou
+    # een polygrafie met 40 kanalen op 512 Hz even snel lijken als een met 8.
+    "analysis": {"runtime_s": (30.0, 0.5, 6.0, 12.0),
+                 "ram_mb": (400.0, 12.0, 0.0, 0.0)},
+    "study": {"runtime_s": (60.0, 0.0, 50.0),
+              "ram_mb": (600.0, 24.0, 0.0)},
+    "report": {"runtime_s": (20.0, 0.2, 4.0),
+               "ram_mb": (300.0, 8.0, 0.0)},
+}
+
+
+def features(summary: dict, study_type: str | None = None,
+             n_profiles: int = 0, workers: int = 1) -> dict:
+    """De kostbepalende grootheden van één opname, uit `read_summary`.
+
+    `workers`: over hoeveel processen de profielen verdeeld worden. Bij het
+    schatten vooraf is dat onbekend (het vrije geheugen beslist), dus 1: de
+    trage kant, die de timeout moet dekken.
+    """
+    duration = float(summary.get("duration_s") or 0.0)
+    native = summary.get("native_sfreq") or {}
+    if native:
+        rate = float(sum(native.values()))
+    else:
+        rate = float(summary.get("sfreq") or 0.0) * len(summary.get("ch_names") or ())
+    return {
+        "hours": round(duration / 3600, 3),
+        "msamples": round(rate * duration / 1e6, 3),
+        "n_channels": len(summary.get("ch_names") or ()),
+        "staging": not is_polygraphy(study_type),
+        "n_profiles": int(n_profiles),
+        "workers": max(1, int(workers)),
+    }
+
+
+def _terms(kind: str, f: dict) -> list[float]:
+    derived = {**f,
+               "staging_hours": f["hours"] if f.get("staging") else 0.0,
+               "profile_hours": f["hours"] * math.ceil(
+                   f.get("n_profiles", 0) / max(1, f.get("workers", 1)))}
+    return [1.0] + [float(derived[t]) for t in TERMS[kind]]
+
+
+# ── Geschiedenis ───────────────────────────────────────────────────────
+
+def history_path(upload_folder: str) -> str:
+    return os.path.join(upload_folder, HISTORY_FILE)
+
+
+def peak_rss_mb(children: int = 1) -> float | None:
+    """Piekgeheugen van dit proces — in een RQ-work-horse: van deze job —
+    plus dat van zijn kindprocessen.
+
+    RUSAGE_CHILDREN geeft de piek van het grootste afgesloten kind, niet de
+    som; `children` is hoeveel er tegelijk liepen (de profielworkers van
+    profile_pool), zodat een parallelle vergelijking niet als één proces telt.
+    """
+    try:
+        import resource
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        child = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return (own + max(children, 1) * child) / 1024
+    except (ImportError, OSError):
+        return None
+
+
+def record(upload_folder: str, kind: str, job_id: str, feats: dict,
+           runtime_s: float, ram_mb: float | None = None) -> None:
+    """Eén gerealiseerde run toevoegen. Een mislukte schrijf kost alleen een datapunt."""
+    line = json.dumps({"kind": kind, "job_id": job_id, "features": feats,
+                       "runtime_s": round(runtime_s, 1),
+                       "ram_mb": round(ram_mb) if ram_mb else None,
+                       "finished": time.time()})
+    try:
+        # Eén write met O_APPEND: gelijktijdige workers schuiven niet door elkaar.
+        with open(history_path(upload_folder), "a") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        logger.warning("[ESTIMATE] timing van %s niet bewaard: %s", job_id, e)
+
+
+def load_history(upload_folder: str, kind: str) -> list[dict]:
+    rows = []
+    try:
+        with open(history_path(upload_folder)) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if row.get("kind") == kind:
+                    rows.append(row)
+    except OSError:
+        return []
+    return rows[-HISTORY_WINDOW:]
+
+
+# ── Model ──────────────────────────────────────────────────────────────
+
+@dataclass(frozen=True)
+class Model:
+    kind: str
+    runtime: tuple[float, ...]
+    ram: tuple[float, ...]
+    basis: str          # "fit" of "prior"
+    n: int
+
+    def predict(self, feats: dict) -> dict:
+        x = _terms(self.kind, feats)
+        runtime = max(MIN_RUNTIME_S, float(np.dot(self.runtime, x)))
+        ram = max(MIN_RAM_MB, float(np.dot(self.ram, x)))
+        return {"runtime_s": round(runtime), "ram_mb": round(ram),
+                "basis": self.basis, "n": self.n}
+
+
+def _lstsq(x: np.ndarray, y: np.ndarray) -> tuple[float, ...]:
+    coef, *_ = np.linalg.lstsq(x, y, rcond=None)
+    return tuple(float(c) for c in coef)
+
+
+def fit(history: list[dict], kind: str) -> Model:
+    prior = PRIORS[kind]
+    if kind == "study":
+        # Van vóór `workers` in de kenmerken: niet te zeggen hoeveel profielen
+        # tegelijk liepen, dus ook niet wat één ronde kostte.
+        history = [r for r in history if "workers" in r.get("features", {})]
+    if len(history) < MIN_HISTORY:
+        return Model(kind, prior["runtime_s"], prior["ram_mb"], "prior", len(history))
+    x = np.array([_terms(kind, r["features"]) for r in history])
+    runtime = _lstsq(x, np.array([r["runtime_s"] for r in history], dtype=float))
+    with_ram = [i for i, r in enumerate(history) if r.get("ram_mb")]
+    ram = (_lstsq(x[with_ram], np.array([history[i]["ram_mb"] for i in with_ram],
+                                        dtype=float))
+           if len(with_ram) >= MIN_HISTORY else prior["ram_mb"])
+    return Model(kind, runtime, ram, "fit", len(history))
+
+
+_FITTED: dict[tuple, Model] = {}
+
+
+def model(upload_folder: str, kind: str) -> Model:
+    """Het model voor `kind`, opnieuw gefit alleen als de geschiedenis veranderde."""
+    try:
+        st = os.stat(history_path(upload_folder))
+        stamp: Any = (st.st_size, st.st_mtime_ns)
+    except OSError:
+        stamp = None
+    key = (upload_folder, kind, stamp)
+    if key not in _FITTED:
+        if len(_FITTED) > 16:
+            _FITTED.clear()
+        _FITTED[key] = fit(load_history(upload_folder, kind), kind)
+    return _FITTED[key]
+
+
+def estimate(upload_folder: str, kind: str, feats: dict) -> dict:
+    """{"runtime_s", "ram_mb", "basis", "n"} voor een job met deze kenmerken."""
+    return model(upload_folder, kind).predict(feats)
+
+
+# ── Routering ──────────────────────────────────────────────────────────
+
+FAST_QUEUE = "fast"
+
+
+def fast_lane_max_s() -> float:
+    return float(os.environ.get("YASAFLASKIFIED_FAST_LANE_MAX_S", 180))
+
+
+def route(runtime_s: float | None) -> str:
+    """`fast` voor een job die naar schatting kort is, anders `default`."""
+    if runtime_s is not None and runtime_s <= fast_lane_max_s():
+        return FAST_QUEUE
+    return "default"
+
+
+# ── Timeout ────────────────────────────────────────────────────────────
+#
+# Eén vaste `JOB_TIMEOUT_SECONDS` (900) doodde een nacht van 14 uur met 20
+# EEG-kanalen na een kwartier, en een vaste `6h` liet een vastgelopen
+# vergelijking van een korte opname zes uur een worker bezet houden. De
+# timeout volgt nu de schatting: een veelvoud van de verwachte duur plus
+# een vaste marge, ruimer zolang die schatting nog een prior is.
+
+TIMEOUT_FACTOR = {"fit": 3.0, "prior": 5.0}
+TIMEOUT_MARGIN_S = 300
+MIN_TIMEOUT_S = 600
+MAX_TIMEOUT_S = 12 * 3600
+STUDY_TIMEOUT_S = 6 * 3600
+"""Studievergelijking zonder schatting: de vaste waarde van vroeger."""
+REPORT_TIMEOUT_S = 900
+"""Rapportartefact zonder schatting: idem."""
+
+
+def timeout_s(estimate: dict | None, fallback: int) -> int:
+    """`job_timeout` voor een job met deze schatting; `fallback` zonder schatting."""
+    estimate = estimate or {}
+    runtime = estimate.get("runtime_s")
+    if not runtime:
+        return int(fallback)
+    factor = TIMEOUT_FACTOR.get(estimate.get("basis", "prior"), TIMEOUT_FACTOR["prior"])
+    return int(min(MAX_TIMEOUT_S,
+                   max(MIN_TIMEOUT_S, runtime * factor + TIMEOUT_MARGIN_S)))
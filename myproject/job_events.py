@@ -0,0 +1,70 @@
+"""Voortgang van een job als gebeurtenissen, via Redis pub/sub.
+
+De statuspagina vroeg elke twee seconden `/api/status/<job_id>`: per poll een
+`RQJob.fetch`, een `hgetall` en vier `os.path.exists` op een gunicorn-worker.
+Met tien tabbladen open voor een nacht vol opnames is dat een poll-storm.
+
+Nu publiceert de worker op `job:{job_id}:events` en relayt
+`/api/status/<job_id>/stream` dat als Server-Sent Events naar de browser,
+over één verbinding per open pagina. Twee soorten berichten:
+
+* `progress` — stap, totaal en label, dezelfde velden als in de toestand
+  van de job (job_state.py; wie later inschakelt, leest daaruit);
+* `state` — er veranderde iets aan de job zelf (vrijgegeven door de
+  scheduler, klaar, mislukt, opnieuw in de wachtrij). Geen inhoud: de stream
+  rekent dan de volledige status opnieuw uit, zoals `/api/status` dat doet.
+
+Pub/sub bewaart niets: wie niet luistert, mist het bericht. Daarom leest de
+stream bij het openen eerst de huidige status, en herbekijkt ze die zelf als
+het een tijd stil blijft.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+
+import job_state
+
+logger = logging.getLogger("yasaflaskified.events")
+
+
+def channel(job_id: str) -> str:
+    return f"job:{job_id}:events"
+
+
+def publish_progress(conn, job_id: str, step: int, total: int, label: str) -> None:
+    """Bewaar de voortgang in de toestand van de job en meld ze, in één MULTI."""
+    progress = {"step": step, "total": total, "label": label}
+    pipe = conn.pipeline()
+    job_state.stage(pipe, job_id, None, progress)
+    pipe.publish(channel(job_id), json.dumps({"type": "progress", **progress}))
+    pipe.execute()
+
+
+def publish_state(conn, job_id: str | None) -> None:
+    """Meld dat de status van `job_id` veranderde. Niet-kritiek."""
+    if not job_id:
+        return
+    try:
+        conn.publish(channel(job_id), json.dumps({"type": "state"}))
+    except Exception as e:                                       # noqa: BLE001
+        logger.debug("[EVENTS] state voor %s niet gemeld: %s", job_id, e)
+
+
+def app_job_id(rq_job) -> str | None:
+    """De app-job_id achter een RQ-job: waar de statuspagina naar luistert.
+
+    Een job van de scheduler draagt hem in `sched_key` (`queue:job_id`, voor
+    een rapportartefact `queue:job_id:soort`); de taken zelf krijgen hem als
+    eerste argument.
+    """
+    key = rq_job.meta.get("sched_key")
+    if key:
+        return key.split(":")[1]
+    args = rq_job.args or ()
+    return args[0] if args and isinstance(args[0], str) else None
+
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
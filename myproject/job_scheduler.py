@@ -0,0 +1,489 @@
+"""Wachtende jobs eerlijk verdelen over sites, vóór ze in een RQ-wachtrij gaan.
+
+RQ werkt elke wachtrij FIFO af. Een site die om 07:00 dertig nachtopnames
+uploadt, zette zo elke dringende studie van een andere site uren achter zich.
+Daarom gaan analyses en studievergelijkingen niet meer rechtstreeks in
+`default` of `study`, maar eerst hierin; een job gaat pas naar RQ als er een
+worker vrij is voor die wachtrij, en dan in deze volgorde:
+
+1. Prioriteit, strikt: `urgent` vóór `routine` vóór `research`. Een dringende
+   studie wacht nooit achter routinewerk, van welke site ook.
+2. Binnen dezelfde prioriteit: eerlijk delen over sites (stride scheduling).
+   Elke site heeft een teller die per vrijgegeven job met 1/gewicht stijgt;
+   de site met de laagste teller is aan de beurt. Een site met gewicht 2
+   krijgt zo twee jobs voor elke job van een site met gewicht 1, hoe lang
+   de rij van de ene of de andere ook is. Een site die een tijd niets had,
+   begint op de huidige stand en niet op haar oude (lage) teller — anders
+   zou ze na een stille week de hele wachtrij voor zich opeisen.
+3. Binnen één site: in volgorde van indienen.
+
+Daarnaast heeft elke site een maximum aan jobs die tegelijk in RQ staan of
+draaien (`max_inflight`). Zijn die op, dan slaat de verdeling de site over
+tot er één klaar is.
+
+Alles staat in Redis, zodat web en workers dezelfde toestand zien:
+  sched:job:<wachtrij>:<job_id>         de aanvraag (hash)
+  sched:pending:<wachtrij>:<site>       wachtend, gesorteerd (zset)
+  sched:sites:<wachtrij>                sites met iets wachtends (set)
+  sched:pass:<wachtrij>                 teller per site (hash)
+  sched:vtime:<wachtrij>                stand van de laatst gekozen site
+  sched:inflight:<site>                 vrijgegeven jobs → RQ-id (hash)
+
+Vrijgeven gebeurt bij het indienen, wanneer een vrijgegeven job eindigt (de
+RQ-callbacks hieronder) en wanneer een worker vrij wordt of zijn
+onderhoudsronde doet (worker.PrewarmedWorker); niet bij statuspolls, die
+anders allemaal om dezelfde lock vragen. Die lock in Redis zorgt dat twee
+rondes tegelijk niet dezelfde job vrijgeven.
+
+Hoeveel er vrijkomt, volgt de vrije workers. Een worker luistert vaak op meer
+dan één wachtrij ("fast default prepare"); hij telt één keer, voor de eerste
+wachtrij in `QUEUES` die hem nodig heeft.
+
+Instellingen (omgeving, voor web en workers dezelfde):
+  YASAFLASKIFIED_SCHEDULER=off             rechtstreeks naar RQ, zoals vroeger
+  YASAFLASKIFIED_SCHED_SITE_WEIGHTS        JSON, bv. {"3": 2}; standaard 1
+  YASAFLASKIFIED_SCHED_MAX_INFLIGHT        per site, standaard 2
+  YASAFLASKIFIED_SCHED_SITE_MAX_INFLIGHT   JSON, uitzonderingen per site
+  YASAFLASKIFIED_SCHED_SLOTS               JSON, bv. {"default": 6}; vaste
+                                           plaatsen in plaats van de vrije workers
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any
+
+import job_events
+import job_state
+
+logger = logging.getLogger("yasaflaskified.scheduler")
+
+PRIORITIES = ("urgent", "routine", "research")
+DEFAULT_PRIORITY = "routine"
+QUEUES = ("fast", "default", "study")
+"""`fast`: jobs die naar schatting kort zijn (job_estimate.route)."""
+
+NO_SITE = "-"
+"""Sitesleutel voor gebruikers zonder site; die delen samen één aandeel."""
+
+SUCCESS_CALLBACK = "job_scheduler.on_job_success"
+FAILURE_CALLBACK = "job_scheduler.on_job_failure"
+
+_LIVE = ("queued", "started", "deferred", "scheduled")
+_RANK_SCALE = 10**12
+
+
+def enabled() -> bool:
+    return os.environ.get("YASAFLASKIFIED_SCHEDULER", "").lower() not in (
+        "0", "off", "false", "no")
+
+
+def site_key(site_id: Any) -> str:
+    return NO_SITE if site_id in (None, "") else str(site_id)
+
+
+def _env_json(name: str) -> dict:
+    try:
+        return {str(k): v for k, v in json.loads(os.environ.get(name) or "{}").items()}
+    except (ValueError, AttributeError):
+        logger.warning("[SCHED] %s is geen geldige JSON-map — genegeerd", name)
+        return {}
+
+
+def site_weight(site: str) -> float:
+    w = float(_env_json("YASAFLASKIFIED_SCHED_SITE_WEIGHTS").get(site, 1))
+    return w if w > 0 else 1.0
+
+
+def max_inflight(site: str) -> int:
+    default = int(os.environ.get("YASAFLASKIFIED_SCHED_MAX_INFLIGHT", 2))
+    return max(1, int(_env_json("YASAFLASKIFIED_SCHED_SITE_MAX_INFLIGHT").get(site, default)))
+
+
+def queue_slots(conn, queue: str) -> int:
+    """Hoeveel jobs deze wachtrij tegelijk kan draaien; voor de geschatte wachttijd."""
+    slots = _env_json("YASAFLASKIFIED_SCHED_SLOTS").get(queue)
+    if slots is not None:
+        return max(1, int(slots))
+    from rq import Queue, Worker
+    return max(1, Worker.count(queue=Queue(queue, connection=conn)))
+
+
+def normalise_priority(priority: str | None) -> str:
+    return priority if priority in PRIORITIES else DEFAULT_PRIORITY
+
+
+def _s(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _job_key(queue: str, job_id: str) -> str:
+    return f"sched:job:{queue}:{job_id}"
+
+
+def _pending_key(queue: str, site: str) -> str:
+    return f"sched:pending:{queue}:{site}"
+
+
+# ── Indienen ───────────────────────────────────────────────────────────
+
+def submit(conn, queue: str, job_id: str, func: str, args: tuple = (), *,
+           site: Any = None, priority: str | None = None,
+           job_timeout: Any = None, result_ttl: int | None = None,
+           on_failure: str | None = None, track_state: bool = False,
+           estimate_s: float | None = None,
+           ram_mb: float | None = None) -> str | None:
+    """Dien een job in. Geeft het RQ-id als hij meteen vrijkwam, anders None.
+
+    `on_failure` is de naam van een RQ-failure-callback van de job zelf; die
+    loopt nog steeds, vóór de plaats van de site vrijkomt. Met `track_state`
+    wordt de job bij het vrijgeven `queued` in job_state, met zijn RQ-id (de
+    status-API volgt dat). `estimate_s` (job_estimate) telt mee in de
+    wachttijd die `pending_status` opgeeft voor de jobs erachter en gaat als
+    `expected_s` mee in `job.meta`; `ram_mb` ook, voor de geheugentoelating
+    van de worker (memory_budget.py).
+    """
+    if not enabled():
+        from rq import Queue
+        from rq.job import Callback
+        job = Queue(queue, connection=conn).enqueue(
+            func, args=args, job_timeout=job_timeout, result_ttl=result_ttl,
+            on_failure=Callback(on_failure) if on_failure else None,
+            meta=_resource_meta(ram_mb, estimate_s) or None)
+        if track_state:
+            job_state.update(conn, job_id, status="queued", rq_id=job.id)
+        return job.id
+
+    site = site_key(site)
+    priority = normalise_priority(priority)
+    seq = int(conn.incr("sched:seq"))
+    spec = {"job_id": job_id, "queue": queue, "func": func, "args": json.dumps(list(args)),
+            "site": site, "priority": priority, "submitted": time.time(),
+            "job_timeout": json.dumps(job_timeout), "result_ttl": json.dumps(result_ttl),
+            "on_failure": on_failure or "", "track_state": "1" if track_state else "",
+            "estimate_s": json.dumps(estimate_s), "ram_mb": json.dumps(ram_mb)}
+    with _lock(conn):
+        pending = _pending_key(queue, site)
+        if not conn.zcard(pending):
+            # Wie een tijd niets had, begint op de huidige stand.
+            vtime = float(conn.get(f"sched:vtime:{queue}") or 0)
+            own = float(conn.hget(f"sched:pass:{queue}", site) or 0)
+            conn.hset(f"sched:pass:{queue}", site, max(own, vtime))
+        pipe = conn.pipeline()
+        pipe.hset(_job_key(queue, job_id), mapping=spec)
+        pipe.zadd(pending, {job_id: PRIORITIES.index(priority) * _RANK_SCALE + seq})
+        pipe.sadd(f"sched:sites:{queue}", site)
+        pipe.execute()
+    logger.info("[SCHED] %s ingediend op %s (site %s, %s)", job_id, queue, site, priority)
+    return dispatch(conn).get(f"{queue}:{job_id}")
+
+
+# ── Vrijgeven ──────────────────────────────────────────────────────────
+
+@contextmanager
+def _lock(conn, timeout: int = 30, wait: float = 10.0):
+    """Eén vrijgeefronde tegelijk, over web en workers heen.
+
+    SET NX met een vervaltijd, zodat een gestopt proces de lock niet voor
+    altijd vasthoudt. Geen Lua (`redis.lock`): zonder scripts blijft dit ook
+    werken tegen een Redis-vervanger in de tests.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not conn.set("sched:lock", token, nx=True, ex=timeout):
+        if time.monotonic() > deadline:
+            raise TimeoutError("scheduler-lock niet verkregen")
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        if _s(conn.get("sched:lock") or b"") == token:
+            conn.delete("sched:lock")
+
+
+def _live(conn, rq_id: str) -> bool:
+    from rq.exceptions import NoSuchJobError
+    from rq.job import Job
+    try:
+        status = Job.fetch(rq_id, connection=conn).get_status()
+    except NoSuchJobError:
+        return False
+    return getattr(status, "value", status) in _LIVE
+
+
+def _inflight(conn, site: str) -> int:
+    """Vrijgegeven jobs van deze site die nog leven; de rest wordt opgeruimd.
+
+    De RQ-callbacks ruimen normaal zelf op. Dit vangt wat ze missen: een
+    gestopte worker, een job die van buitenaf verwijderd werd.
+    """
+    key = f"sched:inflight:{site}"
+    stale = [f for f, rq_id in conn.hgetall(key).items() if not _live(conn, _s(rq_id))]
+    if stale:
+        conn.hdel(key, *stale)
+    return int(conn.hlen(key))
+
+
+def _order(pending: dict[str, list[tuple[str, float]]], passes: dict[str, float],
+           sites: list[str]) -> str | None:
+    """De site die nu aan de beurt is, uit de koppen van hun wachtrijen."""
+    best = None
+    for site in sites:
+        if not pending.get(site):
+            continue
+        job_id, score = pending[site][0]
+        key = (int(score) // _RANK_SCALE, passes.get(site, 0.0), score)
+        if best is None or key < best[0]:
+            best = (key, site)
+    return best[1] if best else None
+
+
+def _idle_workers(conn, ending: str | None) -> dict[str, frozenset[str]]:
+    """Workers die nu een job kunnen nemen, met de wachtrijen waarop ze luisteren.
+
+    De worker van `ending` is nog bezig met diens callback, maar is zo vrij.
+    """
+    from rq import Worker
+    idle: dict[str, frozenset[str]] = {}
+    for worker in Worker.all(connection=conn):
+        state = worker.get_state()
+        state = getattr(state, "value", state)
+        if state == "suspended" or (
+                state == "busy" and (ending is None or worker.get_current_job_id() != ending)):
+            continue
+        idle[worker.name] = frozenset(worker.queue_names())
+    return idle
+
+
+def _takers(idle: dict[str, frozenset[str]], queue: str) -> list[str]:
+    """De vrije workers van `queue`; wie op de minste wachtrijen luistert eerst."""
+    return sorted((name for name, queues in idle.items() if queue in queues),
+                  key=lambda name: (len(idle[name]), name))
+
+
+def _claim(idle: dict[str, frozenset[str]], queue: str, n: int) -> None:
+    """Elk van de `n` jobs in RQ op `queue` neemt een vrije worker."""
+    for name in _takers(idle, queue)[:max(0, n)]:
+        del idle[name]
+
+
+def _free_slots(conn, queue: str, ending: str | None,
+                idle: dict[str, frozenset[str]]) -> int:
+    from rq import Queue
+    q = Queue(queue, connection=conn)
+    slots = _env_json("YASAFLASKIFIED_SCHED_SLOTS").get(queue)
+    if slots is None:
+        # Wat al in RQ wacht, neemt eerst een worker.
+        return len(_takers(idle, queue)) - q.count
+    started = q.started_job_registry.get_job_ids()
+    # Een callback loopt terwijl zijn job nog als gestart geregistreerd staat.
+    busy = len(started) - (ending in started)
+    return max(1, int(slots)) - q.count - busy
+
+
+def dispatch(conn, ending: str | None = None) -> dict[str, str]:
+    """Geef vrij wat er past. Geeft {"<wachtrij>:<job_id>": RQ-id} van wat vrijkwam.
+
+    `ending` is het RQ-id van een job die op dit moment afloopt (vanuit zijn
+    callback); die telt niet meer als bezette worker.
+    """
+    from rq import Queue
+
+    released: dict[str, str] = {}
+    if not enabled():
+        return released
+    try:
+        with _lock(conn):
+            idle = _idle_workers(conn, ending)
+            for queue in QUEUES:
+                released.update(_dispatch_queue(conn, queue, ending, idle))
+                _claim(idle, queue, Queue(queue, connection=conn).count)
+    except Exception as e:                                       # noqa: BLE001
+        # Een mislukte ronde verliest niets: de jobs blijven wachten tot de
+        # volgende.
+        logger.warning("[SCHED] vrijgeven mislukt: %s", e)
+    return released
+
+
+def _dispatch_queue(conn, queue: str, ending: str | None,
+                    idle: dict[str, frozenset[str]]) -> dict[str, str]:
+    released: dict[str, str] = {}
+    sites = sorted(_s(s) for s in conn.smembers(f"sched:sites:{queue}"))
+    if not sites:
+        return released
+    free = _free_slots(conn, queue, ending, idle)
+    room = {s: max_inflight(s) - _inflight(conn, s) for s in sites}
+    while free > 0:
+        eligible = [s for s in sites if room[s] > 0]
+        heads = {s: [(_s(j), sc) for j, sc in
+                     conn.zrange(_pending_key(queue, s), 0, 0, withscores=True)]
+                 for s in eligible}
+        passes = {_s(k): float(v) for k, v in conn.hgetall(f"sched:pass:{queue}").items()}
+        site = _order(heads, passes, eligible)
+        if site is None:
+            break
+        job_id = heads[site][0][0]
+        rq_id = _release(conn, queue, site, job_id)
+        conn.zrem(_pending_key(queue, site), job_id)
+        conn.set(f"sched:vtime:{queue}", passes.get(site, 0.0))
+        conn.hset(f"sched:pass:{queue}", site, passes.get(site, 0.0) + 1 / site_weight(site))
+        if not conn.zcard(_pending_key(queue, site)):
+            conn.srem(f"sched:sites:{queue}", site)
+        if rq_id:
+            released[f"{queue}:{job_id}"] = rq_id
+            room[site] -= 1
+            free -= 1
+    return released
+
+
+def _release(conn, queue: str, site: str, job_id: str) -> str | None:
+    from rq import Queue
+
+    raw = conn.hgetall(_job_key(queue, job_id))
+    conn.delete(_job_key(queue, job_id))
+    if not raw:
+        return None
+    spec = {_s(k): _s(v) for k, v in raw.items()}
+    meta = {"sched_site": site, "sched_key": f"{queue}:{job_id}",
+            "sched_priority": spec["priority"],
+            "sched_on_failure": spec["on_failure"] or None}
+    meta.update(_resource_meta(json.loads(spec.get("ram_mb") or "null"),
+                               json.loads(spec.get("estimate_s") or "null")))
+    job = Queue(queue, connection=conn).enqueue(
+        spec["func"], args=tuple(json.loads(spec["args"])),
+        job_timeout=json.loads(spec["job_timeout"]),
+        result_ttl=json.loads(spec["result_ttl"]), meta=meta,
+        **completion_callbacks(meta))
+    conn.hset(f"sched:inflight:{site}", meta["sched_key"], job.id)
+    # `rq_id_key`: een spec van vóór job_state, nog in de rij bij een update.
+    if spec.get("track_state") or spec.get("rq_id_key"):
+        job_state.update(conn, job_id, status="queued", rq_id=job.id)
+    job_events.publish_state(conn, job_id)
+    waited = time.time() - float(spec["submitted"])
+    logger.info("[SCHED] %s vrijgegeven op %s als %s na %.0f s (site %s, %s)",
+                job_id, queue, job.id, waited, site, spec["priority"])
+    return job.id
+
+
+def _resource_meta(ram_mb: float | None, estimate_s: float | None) -> dict:
+    """Wat de worker van een job moet weten: geheugen en verwachte duur."""
+    meta: dict[str, float] = {}
+    if ram_mb:
+        meta["ram_mb"] = ram_mb
+    if estimate_s:
+        meta["expected_s"] = estimate_s
+    return meta
+
+
+def completion_callbacks(meta: dict) -> dict:
+    """De RQ-callbacks die een vrijgegeven job (of een nieuwe poging) meekrijgt."""
+    from rq.job import Callback
+    if "sched_key" not in meta:
+        return {}
+    return {"on_success": Callback(SUCCESS_CALLBACK),
+            "on_failure": Callback(FAILURE_CALLBACK)}
+
+
+# ── Einde van een vrijgegeven job ──────────────────────────────────────
+
+def job_ended(conn, job) -> None:
+    """Geef de plaats van de site vrij, tenzij de job opnieuw in de wachtrij ging.
+
+    Een analyse die na een timeout opnieuw klaargezet wordt
+    (`tasks.requeue_interrupted_job`), houdt haar plaats: die verhuist naar
+    de nieuwe poging, die `rq_id` in job_state volgt.
+    """
+    site, key = job.meta.get("sched_site"), job.meta.get("sched_key")
+    if site is None or not key:
+        return
+    inflight = f"sched:inflight:{site}"
+    if _s(conn.hget(inflight, key) or "") != job.id:
+        return
+    successor = conn.hget(job_state.key(key.split(":", 1)[1]), "rq_id")
+    if successor and _s(successor) != job.id and _live(conn, _s(successor)):
+        conn.hset(inflight, key, _s(successor))
+    else:
+        conn.hdel(inflight, key)
+
+
+def on_job_success(job, connection, result, *args, **kwargs) -> None:
+    job_ended(connection, job)
+    dispatch(connection, ending=job.id)
+
+
+def own_failure_callback(job, connection, exc_type, exc_value, tb) -> None:
+    """De failure-callback die bij `submit` werd opgegeven, als die er is.
+
+    Ook voor een work-horse die van buitenaf stopte: daar roept RQ geen
+    callback aan (worker._work_horse_killed).
+    """
+    own = job.meta.get("sched_on_failure") or getattr(job, "_failure_callback_name", None)
+    if own and own != FAILURE_CALLBACK:
+        from rq.utils import import_attribute
+        try:
+            import_attribute(own)(job, connection, exc_type, exc_value, tb)
+        except Exception:                                        # noqa: BLE001
+            logger.exception("[SCHED] failure-callback %s van %s mislukt", own, job.id)
+
+
+def on_job_failure(job, connection, exc_type, exc_value, tb) -> None:
+    own_failure_callback(job, connection, exc_type, exc_value, tb)
+    job_ended(connection, job)
+    dispatch(connection, ending=job.id)
+
+
+# ── Wachtrijpositie ────────────────────────────────────────────────────
+
+def queue_positions(conn, queue: str = "default") -> list[str]:
+    """De wachtende jobs in de volgorde waarin ze zouden vrijkomen.
+
+    Een schatting: de maxima per site tellen niet mee, want wanneer een
+    draaiende job klaar is, weet niemand.
+    """
+    sites = sorted(_s(s) for s in conn.smembers(f"sched:sites:{queue}"))
+    pending = {s: [(_s(j), sc) for j, sc in
+                   conn.zrange(_pending_key(queue, s), 0, -1, withscores=True)]
+               for s in sites}
+    passes = {_s(k): float(v) for k, v in conn.hgetall(f"sched:pass:{queue}").items()}
+    order: list[str] = []
+    while True:
+        site = _order(pending, passes, sites)
+        if site is None:
+            return order
+        order.append(pending[site].pop(0)[0])
+        passes[site] = passes.get(site, 0.0) + 1 / site_weight(site)
+
+
+def pending_status(conn, job_id: str,
+                   queues: tuple[str, ...] = ("fast", "default")) -> dict | None:
+    """Voor de statuspagina: plaats, prioriteit en geschatte wachttijd, of None.
+
+    `ahead_s` is de geschatte rekentijd van wie ervoor staat, verdeeld over
+    de worker-plaatsen van de wachtrij; jobs zonder schatting tellen niet.
+    """
+    for queue in queues:
+        raw = conn.hgetall(_job_key(queue, job_id))
+        if raw:
+            break
+    else:
+        return None
+    spec = {_s(k): _s(v) for k, v in raw.items()}
+    order = queue_positions(conn, queue)
+    position = order.index(job_id) + 1 if job_id in order else None
+    ahead = 0.0
+    for other in order[:(position or 1) - 1]:
+        est = conn.hget(_job_key(queue, other), "estimate_s")
+        ahead += float(json.loads(_s(est)) or 0) if est else 0.0
+    return {
+        "queue": queue,
+        "priority": spec["priority"],
+        "position": position,
+        "pending": len(order),
+        "waiting_s": round(time.time() - float(spec["submitted"])),
+        "ahead_s": round(ahead / queue_slots(conn, queue)),
+    }
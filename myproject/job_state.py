@@ -0,0 +1,130 @@
+"""De toestand van één job, in één Redis-hash: `job:{job_id}:state`.
+
+Vroeger lag die verspreid over `{job_id}_filepath`, `_orig_file_id`,
+`_rq_id`, `_estimate`, `_regen_rq` en `job:{job_id}:progress`, naast de
+JSON-bestanden op schijf en de `Job`-rij, waarvan de workers de status nooit
+bijwerkten. Elke statusvraag raakte er meerdere. Nu:
+
+    status        parsed → scheduled → queued → started → finished | failed
+    rq_id         de RQ-job die nu voor deze job loopt (ook na een nieuwe poging)
+    filepath      de EDF; orig_file_id de upload waar ze vandaan kwam
+    estimate      kostschatting (job_estimate), JSON
+    step, total, label   voortgang (job_events.publish_progress)
+    started_at, ended_at, error, regen_rq, updated_at
+
+Wie schrijft: de webapp bij parse en indienen, de scheduler bij het
+vrijgeven (`queued` + `rq_id`), de taken hun voortgang, en de worker het
+verloop (`started`, `finished`, `failed`) via `transition`. Elke schrijf is
+één MULTI/EXEC: velden, `updated_at` en de vervaltijd samen.
+
+De vervaltijd hangt aan de fase: `PARSED_TTL_S` zolang er alleen een upload
+is (zoals vroeger `{job_id}_filepath`), daarna `ACTIVE_TTL_S`, bij elke
+schrijf opnieuw. De eindtoestand zet de webapp over naar `Job.status`
+(app.py, `_mirror_job_state`): de DB blijft single writer.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from typing import Any
+
+PARSED_TTL_S = 7200
+ACTIVE_TTL_S = 86400
+
+FINAL = ("finished", "failed")
+
+_JSON_FIELDS = ("estimate",)
+_FLOAT_FIELDS = ("started_at", "ended_at", "updated_at")
+
+
+def key(job_id: str) -> str:
+    return f"job:{job_id}:state"
+
+
+def _ttl(status: str | None) -> int:
+    return PARSED_TTL_S if status == "parsed" else ACTIVE_TTL_S
+
+
+def _encode(fields: dict) -> tuple[dict, list[str]]:
+    mapping, removed = {}, []
+    for name, value in fields.items():
+        if value is None:
+            removed.append(name)
+        elif name in _JSON_FIELDS:
+            mapping[name] = json.dumps(value)
+        else:
+            mapping[name] = value
+    return mapping, removed
+
+
+def stage(pipe, job_id: str, status: str | None, fields: dict) -> None:
+    """Dezelfde schrijf als `update`, in een pipeline van de aanroeper."""
+    mapping, removed = _encode(fields)
+    if status:
+        mapping["status"] = status
+    mapping["updated_at"] = time.time()
+    pipe.hset(key(job_id), mapping=mapping)
+    if removed:
+        pipe.hdel(key(job_id), *removed)
+    pipe.expire(key(job_id), _ttl(status))
+
+
+def update(conn, job_id: str, status: str | None = None, **fields: Any) -> None:
+    """Zet `status` en `fields` in één keer; een veld op None wordt gewist."""
+    pipe = conn.pipeline()
+    stage(pipe, job_id, status, fields)
+    pipe.execute()
+
+
+def transition(conn, job_id: str, rq_id: str, status: str, **fields: Any) -> bool:
+    """Als `rq_id` nog de job is die hier loopt: zet `status` en `fields`.
+
+    Een onderbroken poging die al vervangen werd (tasks.requeue_interrupted_job)
+    mag de toestand van haar opvolger niet meer overschrijven.
+    """
+    from redis import WatchError
+
+    while True:
+        with conn.pipeline() as pipe:
+            try:
+                pipe.watch(key(job_id))
+                current = pipe.hget(key(job_id), "rq_id")
+                if current is None or _s(current) != rq_id:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                stage(pipe, job_id, status, fields)
+                pipe.execute()
+                return True
+            except WatchError:
+                continue
+
+
+def get(conn, job_id: str) -> dict:
+    """De toestand als dict met str-waarden; leeg als er niets (meer) is."""
+    state: dict[str, Any] = {_s(k): _s(v) for k, v in conn.hgetall(key(job_id)).items()}
+    for name in _JSON_FIELDS:
+        if name in state:
+            state[name] = json.loads(state[name])
+    for name in _FLOAT_FIELDS:
+        if name in state:
+            state[name] = float(state[name])
+    return state
+
+
+def statuses(conn, job_ids: list[str]) -> dict[str, str | None]:
+    """De status van veel jobs in één round-trip (dashboard)."""
+    pipe = conn.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.hget(key(job_id), "status")
+    return {job_id: _s(raw) if raw is not None else None
+            for job_id, raw in zip(job_ids, pipe.execute())}
+
+
+def delete(conn, job_id: str) -> None:
+    conn.delete(key(job_id))
+
+
+def _s(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
@@ -0,0 +1,199 @@
+"""EDF één keer lezen per analysejob — laadplan over alle stappen heen.
+
+`run_analysis_job` had drie afzonderlijke EDF-lezingen (staging, analyse,
+pneumo), elk met een eigen header-open ervoor, plus nog een header-open voor
+de pneumo-detectie en één voor de polygrafie-duur. Bij een nacht-PSG van
+1–2 GB betekende dat: dezelfde EEG-kanalen twee tot drie keer van schijf
+decoderen en opnieuw hersamplen, en vijf keer een header parsen.
+
+Dit module leest de header één keer, verzamelt welke kanalen elke stap nodig
+heeft, en decodeert de UNIE één keer. Elke stap krijgt daarna een `RawArray`
+die een *view* is op die ene buffer — geen kopie. Dat kan veilig omdat geen
+enkele stap de data ter plekke wijzigt: alles loopt via `raw.get_data()`,
+dat een kopie teruggeeft, en `run_sleep_staging` doet zelf `raw.copy()`.
+
+Waarom per samplefrequentie gegroepeerd wordt. MNE hersamplet bij een
+gedeeltelijke lezing alle kanalen naar het MAXIMUM van de ingelezen
+kanalen. De oude pneumo-lezing (ademkanalen + één EEG) kwam daardoor op de
+EEG-frequentie uit, de staging-lezing op die van EEG/EOG/EMG. Zou alles in
+één unie zitten, dan krijgt een stap ineens een hogere frequentie dan
+vroeger — psgscoring wordt trager en de uitkomsten verschuiven marginaal.
+Stappen worden daarom alleen samengevoegd als hun doelfrequentie gelijk is;
+in de praktijk (EMG op dezelfde frequentie als het EEG) is dat één lezing.
+Per stap is de data zo sample voor sample gelijk aan wat `_load_edf`
+vroeger opleverde.
+
+Staat er een kolomcache naast de EDF (`signal_cache.py`) en hoeft de groep
+niet hersampled te worden, dan komt de unie daaruit in plaats van uit MNE.
+
+Een stap zonder één beschikbaar kanaal krijgt — zoals `_load_edf` al deed —
+het volledige bestand, zodat de foutafhandeling verderop ongewijzigd blijft.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Any
+
+import mne
+import signal_cache
+from edf_reader import read_summary
+
+logger = logging.getLogger("yasaflaskified.worker")
+
+FULL = "__full__"
+"""Groepssleutel voor stappen die op het volledige bestand terugvallen."""
+
+
+@dataclass
+class LoadPlan:
+    """Wat er gelezen wordt, afgeleid uit één header-open."""
+
+    edf_path: str
+    ch_names: list[str]
+    duration_s: float
+    native_sfreq: dict[str, float]
+    stages: dict[str, list[str]] = field(default_factory=dict)
+    groups: dict[Any, list[str]] = field(default_factory=dict)
+    layouts: dict[Any, list[str]] = field(default_factory=dict)
+
+    @property
+    def n_epochs(self) -> int:
+        return int(self.duration_s // 30)
+
+
+def read_plan_header(edf_path: str) -> LoadPlan:
+    """Lees de header één keer; kanaalnamen, duur en native frequenties."""
+    hdr = read_summary(edf_path)
+    if not hdr["native_sfreq"]:
+        logger.info("[PLAN] native frequenties onbekend — één groep")
+    return LoadPlan(
+        edf_path=edf_path,
+        ch_names=hdr["ch_names"],
+        duration_s=hdr["duration_s"],
+        native_sfreq=hdr["native_sfreq"],
+    )
+
+
+def add_stage(plan: LoadPlan, name: str, channels: list) -> list[str]:
+    """Registreer de kanalen van een stap; geeft de beschikbare terug."""
+    available = set(plan.ch_names)
+    keep = list(dict.fromkeys(ch for ch in channels if ch and ch in available))
+    plan.stages[name] = keep
+    return keep
+
+
+def _contiguous(layout: list[str], chans: list[str]) -> bool:
+    idx = sorted(layout.index(ch) for ch in chans)
+    return idx == list(range(idx[0], idx[-1] + 1))
+
+
+def _layout(stage_names: list[str], stages: dict[str, list[str]],
+            file_order: list[str]) -> list[str]:
+    """Kanaalvolgorde waarin elke stap een aaneengesloten blok is.
+
+    Een view op een numpy-buffer kan alleen zonder kopie als de rijen van
+    een stap naast elkaar liggen. Past de bestandsvolgorde niet, dan worden
+    kanalen gesorteerd op de gemiddelde positie van de stappen die ze
+    gebruiken; welke stapvolgorde dat oplevert hangt af van hoe de stappen
+    overlappen, dus worden de volgordes afgelopen (hooguit drie stappen, dus
+    zes). Lukt geen enkele, dan kopieert `execute` de stap die uit de boot
+    valt.
+    """
+    rank = {ch: i for i, ch in enumerate(file_order)}
+    # Bestandsvolgorde eerst: past die al, dan ziet elke stap zijn kanalen in
+    # dezelfde volgorde als bij een aparte lezing (rapporten, kwaliteitslijst).
+    union = {ch for name in stage_names for ch in stages[name]}
+    natural = [ch for ch in file_order if ch in union]
+    if all(_contiguous(natural, stages[n]) for n in stage_names):
+        return natural
+    best: list[str] = []
+    for order in itertools.permutations(stage_names):
+        members: dict[str, list[int]] = {}
+        for i, name in enumerate(order):
+            for ch in stages[name]:
+                members.setdefault(ch, []).append(i)
+        layout = sorted(members, key=lambda ch: (
+            sum(members[ch]) / len(members[ch]), rank.get(ch, 0)))
+        if not best:
+            best = layout
+        if all(_contiguous(layout, stages[n]) for n in stage_names):
+            return layout
+    return best
+
+
+def finalize(plan: LoadPlan) -> LoadPlan:
+    """Groepeer stappen per doelfrequentie en bepaal de kanaalvolgorde."""
+    plan.groups = {}
+    for name, chans in plan.stages.items():
+        if not chans:
+            key: Any = FULL
+        elif plan.native_sfreq:
+            key = max(plan.native_sfreq.get(ch, 0.0) for ch in chans)
+        else:
+            key = 0.0
+        plan.groups.setdefault(key, []).append(name)
+    plan.layouts = {
+        key: (list(plan.ch_names) if key == FULL
+              else _layout(names, plan.stages, plan.ch_names))
+        for key, names in plan.groups.items()
+    }
+    for key, names in plan.groups.items():
+        logger.info("[PLAN] groep %s Hz: %s — %d kanalen", key,
+                    "+".join(names), len(plan.layouts[key]))
+    return plan
+
+
+def _decode(plan: LoadPlan, layout: list[str], label: str) -> mne.io.BaseRaw:
+    """Eén lezing van `layout`, in die volgorde, met fallback naar alles."""
+    raw = signal_cache.cached_raw(plan.edf_path, layout)
+    if raw is not None:
+        return raw
+    try:
+        wanted = set(layout)
+        exclude = [ch for ch in plan.ch_names if ch not in wanted]
+        raw = mne.io.read_raw_edf(plan.edf_path, exclude=exclude,
+                                  preload=False, verbose=False)
+        # Herordenen VÓÓR load_data: MNE leest dan meteen in deze volgorde
+        # en er is geen tweede buffer nodig om rijen te verplaatsen.
+        raw.reorder_channels(layout)
+        raw.load_data(verbose=False)
+        logger.info("[%s] geladen: %d kanalen, sfreq=%.0f Hz",
+                    label, len(layout), raw.info["sfreq"])
+        return raw
+    except Exception as e:
+        logger.warning("[%s] mislukt (%s) — fallback: alles laden", label, e)
+        return mne.io.read_raw_edf(plan.edf_path, preload=True, verbose=False)
+
+
+def _view(raw: mne.io.BaseRaw, channels: list[str]) -> mne.io.BaseRaw:
+    """RawArray op een aaneengesloten rijblok van `raw` — zonder kopie."""
+    idx = sorted(raw.ch_names.index(ch) for ch in channels)
+    lo, hi = idx[0], idx[-1] + 1
+    if idx != list(range(lo, hi)):
+        logger.info("[PLAN] %s niet aaneengesloten — kopie", channels)
+        return raw.copy().pick(channels)
+    view = mne.io.RawArray(raw._data[lo:hi], mne.pick_info(raw.info, idx),
+                           first_samp=raw.first_samp, copy="auto",
+                           verbose=False)
+    view.set_annotations(raw.annotations)
+    # psgscoring leest de patiëntvelden rechtstreeks uit het bestand via
+    # `raw.filenames`; een RawArray heeft er standaard geen.
+    view._filenames = list(raw._filenames)
+    return view
+
+
+def execute(plan: LoadPlan) -> dict[str, mne.io.BaseRaw]:
+    """Decodeer elke groep één keer en geef per stap een view terug."""
+    if not plan.layouts:
+        finalize(plan)
+    out: dict[str, mne.io.BaseRaw] = {}
+    for key, names in plan.groups.items():
+        raw = _decode(plan, plan.layouts[key], label="+".join(names).upper())
+        for name in names:
+            chans = plan.stages[name] or list(raw.ch_names)
+            chans = [ch for ch in chans if ch in raw.ch_names]
+            out[name] = raw if chans == list(raw.ch_names) else _view(raw, chans)
+    return out
@@ -0,0 +1,181 @@
+"""Geheugen toelaten vóór een job start: één RAM-budget per node, in Redis.
+
+docker-compose.yml rekent op ~2 GB per PSG, maar een nacht van 12 uur met
+40 kanalen op 512 Hz is ~885 miljoen samples; met de kopieën die laden,
+filteren en resamplen maken is dat een veelvoud. Pakken meerdere workers
+tegelijk zo'n opname op, dan grijpt de OOM-killer in — midden in een job.
+
+Daarom reserveert een worker (`worker.PrewarmedWorker`) vóór hij forkt de
+geschatte piek van de job tegen een budget dat alle workers delen:
+
+* de schatting komt uit de EDF-header (`job_estimate`, kanalen × frequentie
+  × duur, met de kopieën in de coëfficiënt) en reist mee in `job.meta["ram_mb"]`;
+* past ze niet meer naast wat al loopt, dan gaat de job terug naar RQ met
+  een oplopende wachttijd (`BACKOFF_S`) in plaats van te starten;
+* loopt er niets, dan start ze toch: een job groter dan het hele budget zou
+  anders nooit draaien. Alleen is hij dan alleen.
+
+Budget en reserveringen staan per node (`mem:{node}:budget_mb`,
+`mem:{node}:reserved`): het geheugen van de ene host zegt niets over dat van
+een andere die dezelfde Redis gebruikt. De node is `YASAFLASKIFIED_NODE_NAME`,
+anders de hostnaam; docker-compose.yml zet hem voor al zijn containers gelijk,
+want elke container heeft een eigen hostnaam.
+
+Reserveringen van een worker die niet meer bestaat (zijn `rq:worker:`-sleutel
+verliep) tellen niet mee en worden bij de volgende reservering opgeruimd.
+Een job zonder schatting (rapporten, samenvoegen) reserveert niets. Een job
+die zelf processen start (de profielvergelijking) reserveert die erbij onder
+`pool_key(job.id)`; de worker geeft ook die vrij als de job stopt.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+
+logger = logging.getLogger("yasaflaskified.worker")
+
+BUDGET_FRACTION = 0.8
+"""Zonder `YASAFLASKIFIED_RAM_BUDGET_MB`: dit deel van het geheugen van de node."""
+
+BACKOFF_S = (15, 30, 60, 120, 300)
+"""Wachttijd na de n-de keer uitstellen; daarna blijft het bij de laatste."""
+
+OOM_GROWTH = 1.5
+"""Een job die door SIGKILL stopte, reserveert bij de volgende poging zoveel meer."""
+
+
+def enabled() -> bool:
+    return os.environ.get("YASAFLASKIFIED_MEM_ADMISSION", "on").lower() not in (
+        "0", "off", "false", "no")
+
+
+def node_name() -> str:
+    return os.environ.get("YASAFLASKIFIED_NODE_NAME") or socket.gethostname()
+
+
+def budget_key(node: str | None = None) -> str:
+    return f"mem:{node or node_name()}:budget_mb"
+
+
+def reserved_key(node: str | None = None) -> str:
+    return f"mem:{node or node_name()}:reserved"
+
+
+def node_ram_mb() -> float | None:
+    """Het geheugen dat dit proces mag gebruiken: de cgroup-limiet of MemTotal."""
+    limits = []
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    limits.append(int(line.split()[1]) / 1024)
+                    break
+    except OSError:
+        pass
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            raw = f.read().strip()
+        if raw.isdigit():
+            limits.append(int(raw) / 2**20)
+    except OSError:
+        pass
+    return min(limits) if limits else None
+
+
+def configure(conn) -> float | None:
+    """Zet het budget van deze node bij het starten van een worker en geef het terug.
+
+    `YASAFLASKIFIED_RAM_BUDGET_MB` wint altijd; anders zet de eerste worker
+    van de node `BUDGET_FRACTION` van zijn geheugen en volgen de anderen.
+    """
+    explicit = os.environ.get("YASAFLASKIFIED_RAM_BUDGET_MB")
+    if explicit:
+        conn.set(budget_key(), float(explicit))
+    else:
+        ram = node_ram_mb()
+        if ram:
+            conn.set(budget_key(), round(ram * BUDGET_FRACTION), nx=True)
+    return budget_mb(conn)
+
+
+def budget_mb(conn, node: str | None = None) -> float | None:
+    raw = conn.get(budget_key(node))
+    return float(raw) if raw else None
+
+
+def job_ram_mb(job) -> float:
+    """De geschatte piek van een RQ-job in MB; 0 als er geen schatting meereist."""
+    try:
+        return float(job.meta.get("ram_mb") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _worker_alive(conn, name: str) -> bool:
+    from rq.worker import Worker
+    return bool(conn.exists(Worker.redis_worker_namespace_prefix + name))
+
+
+def _entries(conn, node: str | None = None) -> tuple[dict[str, dict], list[str]]:
+    live, stale = {}, []
+    for job_id, raw in conn.hgetall(reserved_key(node)).items():
+        key = job_id.decode() if isinstance(job_id, bytes) else job_id
+        entry = json.loads(raw)
+        if _worker_alive(conn, entry["worker"]):
+            live[key] = entry
+        else:
+            stale.append(key)
+    return live, stale
+
+
+def reserved(conn, node: str | None = None) -> dict[str, dict]:
+    """{job_id: {"mb", "worker"}} van de reserveringen op de node die nog gelden."""
+    return _entries(conn, node)[0]
+
+
+def reserve(conn, job_id: str, mb: float, worker: str) -> bool:
+    """Reserveer `mb` voor `job_id` als dat in het budget van deze node past.
+
+    WATCH/MULTI: twee workers die tegelijk de laatste ruimte willen, kunnen
+    niet allebei slagen. Zonder budget wordt alles toegelaten.
+    """
+    from redis import WatchError
+
+    node = node_name()
+    while True:
+        with conn.pipeline() as pipe:
+            try:
+                pipe.watch(reserved_key(node), budget_key(node))
+                budget = budget_mb(pipe, node)
+                live, stale = _entries(pipe, node)
+                used = sum(e["mb"] for e in live.values())
+                if budget and used and used + mb > budget:
+                    pipe.unwatch()
+                    logger.info("[MEM] %s wacht: %.0f MB nodig, %.0f van %.0f MB "
+                                "in gebruik", job_id, mb, used, budget)
+                    return False
+                pipe.multi()
+                if stale:
+                    pipe.hdel(reserved_key(node), *stale)
+                pipe.hset(reserved_key(node), job_id, json.dumps({"mb": mb, "worker": worker}))
+                pipe.execute()
+                return True
+            except WatchError:
+                continue
+
+
+def pool_key(job_id: str) -> str:
+    """De reservering voor de extra processen van een job (profile_pool)."""
+    return f"{job_id}:pool"
+
+
+def release(conn, job_id: str) -> None:
+    conn.hdel(reserved_key(), job_id)
+
+
+def backoff_s(deferrals: int) -> int:
+    """Wachttijd vóór de volgende poging, na `deferrals` keer uitstellen (≥ 1)."""
+    return BACKOFF_S[min(max(deferrals, 1), len(BACKOFF_S)) - 1]
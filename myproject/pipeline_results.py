@@ -0,0 +1,64 @@
+"""results.json zoals de pipeline het schreef, ook nadat het bewerkt is.
+
+results.json wordt achteraf bijgewerkt (PSG Editor, eventcorrecties,
+rapportbewerking). Hergebruik voor een andere job (tasks.reuse_analysis_results)
+mag alleen vertrekken van wat er berekend is, niet van wat een scorer voor
+déze job aanpaste.
+
+Een tweede kopie bij elke job verdubbelt de opslag voor de vele resultaten
+die nooit bewerkt worden. Daarom wordt het origineel pas bewaard bij de
+eerste bewerking (`before_edit`); tot dan IS results.json het
+pipelineresultaat.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+
+_SUFFIX = "_results.json"
+_SNAPSHOT_SUFFIX = "_results.pipeline.json"
+
+
+def results_path(upload_folder: str, job_id: str) -> str:
+    return os.path.join(upload_folder, f"{job_id}{_SUFFIX}")
+
+
+def snapshot_path(upload_folder: str, job_id: str) -> str:
+    return os.path.join(upload_folder, f"{job_id}{_SNAPSHOT_SUFFIX}")
+
+
+def _snapshot_of(result_path: str) -> str:
+    assert result_path.endswith(_SUFFIX), result_path
+    return result_path[:-len(_SUFFIX)] + _SNAPSHOT_SUFFIX
+
+
+def before_edit(result_path: str) -> None:
+    """Roep aan vóór results.json overschreven wordt met iets anders dan pipelinewerk.
+
+    De eerste keer wordt het pipelineresultaat apart gezet; daarna staat het
+    er al en is results.json niet meer het origineel.
+    """
+    snapshot = _snapshot_of(result_path)
+    if os.path.exists(snapshot) or not os.path.exists(result_path):
+        return
+    tmp = f"{snapshot}.{os.getpid()}"
+    shutil.copyfile(result_path, tmp)
+    os.replace(tmp, snapshot)
+
+
+def written(result_path: str) -> None:
+    """Na een nieuwe pipelinerun: results.json is weer het origineel."""
+    try:
+        os.remove(_snapshot_of(result_path))
+    except FileNotFoundError:
+        pass
+
+
+def source(upload_folder: str, job_id: str) -> str | None:
+    """Het bestand met het onbewerkte pipelineresultaat van `job_id`, of None."""
+    for path in (snapshot_path(upload_folder, job_id),
+                 results_path(upload_folder, job_id)):
+        if os.path.exists(path):
+            return path
+    return None
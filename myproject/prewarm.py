@@ -0,0 +1,178 @@
+"""Bibliotheken en modellen één keer laden, in de worker vóór hij forkt.
+
+RQ forkt per job een work-horse. Die begon koud: `tasks` importeren haalt
+mne, yasa, psgscoring, matplotlib, reportlab en openpyxl binnen, en
+`yasa.SleepStaging` leest bij elke `predict()` zijn classifier opnieuw van
+schijf (`joblib.load` in `SleepStaging._load_model`). Worden die in de
+ouder geladen, dan erft elke work-horse ze via copy-on-write en begint hij
+warm (`worker.PrewarmedWorker`).
+
+Twee dingen maken dat mogelijk:
+
+* `install_model_cache()` vervangt in `yasa.staging` alleen de verwijzing
+  naar joblib door een versie die per pad onthoudt wat er geladen werd. Het
+  pad kiest yasa zelf, zoals altijd; `_validate_predict` loopt nog steeds.
+* `preload()` importeert en laadt de nieuwste classifier per
+  kanaalcombinatie en de arousal-booster van psgscoring (die laatste cachet
+  psgscoring zelf in een moduleglobale).
+
+Niets hiervan draait een voorspelling in de ouder: LightGBM/OpenMP-threads
+die vóór een fork gestart zijn, kunnen een kind laten vastlopen. Laden start
+geen threadpool.
+
+Meten, koud tegen warm, op deze machine:
+
+    python prewarm.py --measure
+"""
+
+from __future__ import annotations
+
+import glob
+import logging
+import os
+import sys
+import time
+from typing import Any
+
+logger = logging.getLogger("yasaflaskified.worker")
+
+LIBRARIES = ("numpy", "mne", "yasa", "psgscoring", "matplotlib.pyplot",
+             "reportlab.platypus", "openpyxl", "lightgbm", "tasks")
+"""Wat een analysejob of rapportjob sowieso importeert; `tasks` als laatste."""
+
+_MODELS: dict[str, Any] = {}
+
+
+class _CachedJoblib:
+    """Wat `yasa.staging` als `joblib` ziet: `load` onthoudt per pad."""
+
+    def __init__(self, joblib_module) -> None:
+        self._joblib = joblib_module
+
+    def load(self, path, *args, **kwargs):
+        key = os.path.realpath(str(path))
+        if key not in _MODELS:
+            _MODELS[key] = self._joblib.load(path, *args, **kwargs)
+        return _MODELS[key]
+
+    def __getattr__(self, name):
+        return getattr(self._joblib, name)
+
+
+def install_model_cache() -> None:
+    import yasa.staging as staging
+    if not isinstance(staging.joblib, _CachedJoblib):
+        staging.joblib = _CachedJoblib(staging.joblib)
+
+
+def staging_classifiers() -> list[str]:
+    """De classifier die yasa per kanaalcombinatie kiest: de nieuwste versie."""
+    import yasa
+    clf_dir = os.path.join(os.path.dirname(yasa.__file__), "classifiers")
+    latest: dict[str, str] = {}
+    for path in sorted(glob.glob(os.path.join(clf_dir, "clf_*.joblib"))):
+        latest[os.path.basename(path).split("_lgb_")[0]] = path
+    return sorted(latest.values())
+
+
+def preload() -> dict[str, float]:
+    """Importeer en laad alles; geeft de tijd per onderdeel in seconden."""
+    import importlib
+
+    timings: dict[str, float] = {}
+    for name in LIBRARIES:
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("[PREWARM] %s niet geladen: %s", name, e)
+            continue
+        timings[name] = time.perf_counter() - t0
+
+    install_model_cache()
+    import yasa.staging as staging
+    t0 = time.perf_counter()
+    for path in staging_classifiers():
+        staging.joblib.load(path)
+    timings["yasa classifiers"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    try:
+        from psgscoring import arousal
+        arousal._load_arousal_lgbm_booster()
+        timings["arousal booster"] = time.perf_counter() - t0
+    except Exception as e:                                       # noqa: BLE001
+        logger.warning("[PREWARM] arousal-model niet geladen: %s", e)
+
+    logger.info("[PREWARM] geladen in %.1f s: %s", sum(timings.values()),
+                ", ".join(f"{k} {v:.2f}" for k, v in timings.items()))
+    return timings
+
+
+# ── Meten ──────────────────────────────────────────────────────────────
+
+def _job_startup() -> float:
+    """Wat één PSG-job laadt vóór hij aan de opname begint.
+
+    Koud laadt dat echt; in een kind van een voorverwarmde ouder zijn het
+    treffers in `sys.modules`, `_MODELS` en de cache van psgscoring.
+    """
+    import importlib
+
+    t0 = time.perf_counter()
+    for name in LIBRARIES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    import yasa.staging as staging
+    for path in staging_classifiers():
+        if os.path.basename(path).startswith("clf_eeg+eog+emg_"):
+            staging.joblib.load(path)
+    try:
+        from psgscoring import arousal
+        arousal._load_arousal_lgbm_booster()
+    except Exception:                                            # noqa: BLE001
+        pass
+    return time.perf_counter() - t0
+
+
+def _forked_startup() -> float:
+    """`_job_startup` in een geforkt kind, zoals RQ een work-horse maakt."""
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:                                                  # pragma: no cover
+        os.close(read)
+        os.write(write, repr(_job_startup()).encode())
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        seconds = float(f.read())
+    os.waitpid(pid, 0)
+    return seconds
+
+
+def measure(repeat: int = 3) -> dict[str, list[float]]:
+    """Opstarttijd van een work-horse, koud (verse ouder) en warm (geladen ouder)."""
+    import subprocess
+
+    cold = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, __file__, "--startup-child"],
+                             capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        cold.append(float(out.stdout.strip().splitlines()[-1]))
+    preload()
+    warm = [_forked_startup() for _ in range(repeat)]
+    return {"cold_s": cold, "warm_s": warm}
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    logging.basicConfig(level=logging.WARNING)
+    if "--startup-child" in sys.argv:
+        print(_job_startup())
+    elif "--measure" in sys.argv:
+        result = measure()
+        for mode, values in result.items():
+            print(f"{mode:7s} " + "  ".join(f"{v:6.2f}" for v in values))
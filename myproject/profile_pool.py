@@ -0,0 +1,203 @@
+"""Profielen van één vergelijking tegelijk scoren, in aparte processen.
+
+`run_profile_comparison` deed elk profiel na elkaar: zeven profielen kostten
+gemeten 45:59, en 97 % daarvan is `run_pneumo_analysis` per profiel. Die
+runs delen alles — dezelfde raw, hetzelfde hypnogram, dezelfde kanaalmap —
+en verschillen alleen in de drempels. Ze zijn dus onafhankelijk.
+
+Processen en geen threads zoals in `stage_graph.py`: psgscoring is voor een
+groot deel Python-lussen over events, en die houden de GIL vast. De raw
+gaat niet gepickeld mee (honderden MB per worker, elke keer opnieuw), maar
+één keer naar gedeeld geheugen; elke worker koppelt er bij het opstarten
+een `RawArray` op zonder kopie. De buffer is read-only in de workers. Dat is
+dezelfde voorwaarde waarop de sequentiële lus al steunde (één raw voor alle
+profielen), alleen nu afgedwongen.
+
+`spawn` en geen `fork`: dit draait in een RQ-work-horse met BLAS- en
+LightGBM-threads, en forken uit een proces met threads kan vastlopen. Een
+gespawnd proces importeert alles opnieuw (enkele seconden), wat tegenover
+minuten per profiel niet telt.
+
+Hoeveel workers: `YASAFLASKIFIED_PROFILE_WORKERS` als die gezet is, anders
+het aantal kernen — en in beide gevallen nooit meer dan er in het vrije
+geheugen passen (`profile_workers`). Vrij is het kleinste van MemAvailable
+en wat de cgroup van de container nog toelaat: in een container ziet
+/proc/meminfo de hele host. In een RQ-job reserveert de aanroeper de workers
+bovendien tegen het RAM-budget van de node (`tasks._reserve_pool`), want de
+reservering van de job zelf rekent op één proces.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+import numpy as np
+
+logger = logging.getLogger("yasaflaskified.worker")
+
+WORKER_BASE_MB = 600
+"""Wat een worker kost vóór hij iets rekent: Python, MNE, psgscoring, LightGBM."""
+
+WORKER_DATA_FACTOR = 3
+"""Werkgeheugen van één `run_pneumo_analysis` als veelvoud van de raw.
+
+Filters en envelopes maken per kanaal kopieën. Een ruime schatting, geen
+meting; `YASAFLASKIFIED_PROFILE_WORKER_MB` vervangt de hele som.
+"""
+
+
+@dataclass(frozen=True)
+class SharedRaw:
+    """Alles wat een worker nodig heeft om de raw terug op te bouwen."""
+
+    shm_name: str
+    shape: tuple[int, int]
+    dtype: str
+    info: Any
+    first_samp: int
+    annotations: Any
+    filenames: tuple
+
+
+def share_raw(raw) -> tuple[SharedRaw, SharedMemory]:
+    """Kopieer de data van `raw` één keer naar gedeeld geheugen.
+
+    De aanroeper sluit en verwijdert het segment (`close()` + `unlink()`).
+    """
+    data = raw._data
+    shm = SharedMemory(create=True, size=max(1, data.nbytes))
+    np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+    handle = SharedRaw(shm.name, tuple(data.shape), data.dtype.str, raw.info,
+                       int(raw.first_samp), raw.annotations,
+                       tuple(getattr(raw, "_filenames", ()) or ()))
+    return handle, shm
+
+
+def attach_raw(handle: SharedRaw):
+    """Een `RawArray` op het gedeelde segment, zonder kopie."""
+    import mne
+
+    # Gespawnde workers delen de resource tracker van de ouder; het segment
+    # blijft dus van de ouder, die het na afloop verwijdert.
+    shm = SharedMemory(name=handle.shm_name)
+    data: np.ndarray = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype),
+                                  buffer=shm.buf)
+    data.flags.writeable = False
+    raw = mne.io.RawArray(data, handle.info, first_samp=handle.first_samp,
+                          copy="auto", verbose=False)
+    raw.set_annotations(handle.annotations)
+    # psgscoring leest de patiëntvelden via `raw.filenames` (zie load_plan._view).
+    raw._filenames = list(handle.filenames)
+    return raw, shm
+
+
+_CGROUP_FILES = (
+    ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),                  # v2
+    ("/sys/fs/cgroup/memory/memory.limit_in_bytes",
+     "/sys/fs/cgroup/memory/memory.usage_in_bytes"),                                   # v1
+)
+
+
+def _cgroup_headroom_bytes() -> int | None:
+    """Limiet min gebruik van de cgroup van dit proces; None zonder limiet."""
+    for limit_path, usage_path in _CGROUP_FILES:
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+            with open(usage_path) as f:
+                usage = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        # v2 schrijft "max", v1 een getal in de buurt van 2**63.
+        if not limit.isdigit() or int(limit) >= 2**60:
+            return None
+        return max(0, int(limit) - usage)
+    return None
+
+
+def available_memory_bytes() -> int | None:
+    """Vrij geheugen voor nieuwe processen: MemAvailable, of minder als de
+    cgroup-limiet eerder bereikt is."""
+    found = []
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    found.append(int(line.split()[1]) * 1024)
+                    break
+    except OSError:
+        pass
+    headroom = _cgroup_headroom_bytes()
+    if headroom is not None:
+        found.append(headroom)
+    return min(found) if found else None
+
+
+def worker_bytes(data_bytes: int) -> int:
+    """Geschat geheugen van één worker voor een raw van `data_bytes`."""
+    if os.environ.get("YASAFLASKIFIED_PROFILE_WORKER_MB"):
+        return int(os.environ["YASAFLASKIFIED_PROFILE_WORKER_MB"]) * 2**20
+    return WORKER_BASE_MB * 2**20 + WORKER_DATA_FACTOR * data_bytes
+
+
+def profile_workers(n_profiles: int, data_bytes: int,
+                    requested: int | None = None) -> int:
+    """Aantal workers: gevraagd of het aantal kernen, begrensd door het vrije RAM."""
+    env = os.environ.get("YASAFLASKIFIED_PROFILE_WORKERS")
+    want = requested or (int(env) if env else (os.cpu_count() or 1))
+    n = max(1, min(want, n_profiles))
+    free = available_memory_bytes()
+    if free is not None:
+        per_worker = worker_bytes(data_bytes)
+        # 80 %: de rest is voor de ouder, de andere RQ-workers en de page cache.
+        fits = max(1, int(0.8 * free) // per_worker)
+        if fits < n:
+            logger.info("[cmp] %d workers gevraagd, %d passen in %.1f GiB vrij",
+                        n, fits, free / 2**30)
+            n = fits
+    return n
+
+
+_RAW = None
+
+
+def _init_worker(handle: SharedRaw) -> None:
+    global _RAW
+    import mne
+    mne.set_log_level("ERROR")
+    _RAW = attach_raw(handle)
+
+
+def _score(hypno: list, channel_map: dict, profile: str) -> tuple[dict, float]:
+    from pneumo_analysis import run_pneumo_analysis
+
+    assert _RAW is not None
+    t0 = time.monotonic()
+    pneumo = run_pneumo_analysis(raw=_RAW[0], hypno=hypno, channel_map=channel_map,
+                                 scoring_profile=profile)
+    return pneumo, round(time.monotonic() - t0, 1)
+
+
+def score_profiles(raw, hypno: list, channel_map: dict, profiles: list[str],
+                   workers: int) -> dict[str, tuple[dict, float]]:
+    """`run_pneumo_analysis` per profiel over `workers` processen.
+
+    Geeft per profiel (resultaat, wandkloktijd in s). Een fout in één profiel
+    gaat omhoog, zoals in de sequentiële lus.
+    """
+    handle, shm = share_raw(raw)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                 initializer=_init_worker, initargs=(handle,)) as pool:
+            futures = {p: pool.submit(_score, hypno, channel_map, p) for p in profiles}
+            return {p: fut.result() for p, fut in futures.items()}
+    finally:
+        shm.close()
+        shm.unlink()
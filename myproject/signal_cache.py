@@ -0,0 +1,236 @@
+"""Kolomgewijze signaalcache — de EDF één keer ontvlechten, bij het opladen.
+
+Een EDF bewaart de data per record: 1 s van kanaal 1, dan 1 s van kanaal 2,
+…, dan de volgende seconde. Wie één kanaal over de hele nacht wil, moet dus
+door het hele bestand. Dat deed elke lezer opnieuw: de analysejob, de
+profielvergelijking, de signaalpanelen van het PDF-rapport en de review, de
+viewer. Op een PSG van 1–2 GB telkens enkele seconden, per lezer.
+
+Na het opladen schrijft een achtergrondjob daarom per kanaal één aaneen-
+gesloten bestand met de ruwe int16-waarden (little-endian, zoals in de EDF),
+plus een klein manifest met samplefrequentie, eenheid en de schaal naar
+fysische waarden. Eén kanaal over de hele nacht is dan één sequentiële
+lezing — of een `np.memmap` zonder lezing. Dezelfde job schrijft er de
+min/max-piramide voor de viewer bij (`signal_pyramid.py`).
+
+De cache hoort bij het BESTAND, niet bij de job: hij staat naast de EDF als
+`<edf>.signals/`, zodat een heranalyse of een tweede job op dezelfde upload
+hem hergebruikt. Het manifest onthoudt de bestandsgrootte en een vingerafdruk
+van de header vanaf byte 184 (recordindeling en signaaldefinities). De
+patiënt- en opnamevelden vallen daar bewust buiten: server-side
+anonimiseren herschrijft die en raakt de data niet.
+
+Waar een lezer MNE-gedrag verwacht (`cached_raw`) wordt de cache alleen
+gebruikt als er niets te hersamplen valt: alle gevraagde kanalen hebben al
+de doelfrequentie. MNE hersamplet gemengde frequenties per blok records; dat
+hier nabootsen zou de analyse-uitkomsten marginaal verschuiven. In die
+gevallen blijft MNE de lezer, en de aanroeper merkt niets.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import signal_pyramid
+from edf_reader import EdfMemmapReader, EdfReaderError, SignalSource, read_header
+
+logger = logging.getLogger("yasaflaskified.signal_cache")
+
+CACHE_SUFFIX = ".signals"
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+_BLOCK_RECORDS = 600
+"""Records per schrijfblok: 10 min bij records van 1 s, enkele MB RAM."""
+
+
+def cache_dir_for(edf_path: str) -> str:
+    return edf_path + CACHE_SUFFIX
+
+
+def _fingerprint(edf_path: str, header_bytes: int) -> dict:
+    with open(edf_path, "rb") as f:
+        f.seek(184)
+        layout = f.read(max(0, header_bytes - 184))
+    return {
+        "size": os.path.getsize(edf_path),
+        "layout_sha1": hashlib.sha1(layout).hexdigest(),
+    }
+
+
+def build_signal_cache(edf_path: str) -> str | None:
+    """Schrijf de kolomcache voor `edf_path`; geeft de map terug.
+
+    Bedoeld als RQ-job direct na het samenvoegen van de upload. Bestaat er
+    al een geldige cache, dan gebeurt er niets. Een EDF die de memmap-lezer
+    niet aankan (BDF) krijgt geen cache — de lezers vallen terug op MNE.
+    """
+    existing = open_cache(edf_path)
+    if existing is not None:
+        if existing.pyramid is None:
+            signal_pyramid.build_pyramid(existing)
+        return existing.cache_dir
+    try:
+        src = EdfMemmapReader(edf_path)
+    except (EdfReaderError, OSError, ValueError) as e:
+        logger.info("Geen signaalcache voor %s: %s", edf_path, e)
+        return None
+
+    h = src.header
+    final = cache_dir_for(edf_path)
+    tmp = f"{final}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    files = [f"{i:03d}.i16" for i in range(len(h.ch_names))]
+    try:
+        handles = [open(os.path.join(tmp, name), "wb") for name in files]
+        try:
+            for r0 in range(0, h.n_records, _BLOCK_RECORDS):
+                block = src._records[r0:r0 + _BLOCK_RECORDS]
+                for i, fh in enumerate(handles):
+                    c0, n = int(h.ch_offsets[i]), int(h.n_samps[i])
+                    np.ascontiguousarray(block[:, c0:c0 + n]).tofile(fh)
+        finally:
+            for fh in handles:
+                fh.close()
+        manifest = {
+            "version":       FORMAT_VERSION,
+            "edf":           os.path.basename(edf_path),
+            **_fingerprint(edf_path, h.header_bytes),
+            "record_length": h.record_length,
+            "n_records":     h.n_records,
+            "meas_date":     h.meas_date.isoformat() if h.meas_date else None,
+            "channels": [
+                {
+                    "name":      ch,
+                    "file":      files[i],
+                    "dtype":     "<i2",
+                    "sfreq":     float(h.native_sfreq[i]),
+                    "n_samples": int(h.n_samps[i]) * h.n_records,
+                    "unit":      h.units[i],
+                    "cal":       float(h.cal[i]),
+                    "offset":    float(h.offset[i]),
+                }
+                for i, ch in enumerate(h.ch_names)
+            ],
+        }
+        with open(os.path.join(tmp, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=1)
+        # Pas na het manifest op zijn plaats zetten: een lezer ziet een
+        # volledige cache of geen.
+        shutil.rmtree(final, ignore_errors=True)
+        os.rename(tmp, final)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    finally:
+        src.close()
+    logger.info("Signaalcache geschreven: %s (%d kanalen)",
+                final, len(h.ch_names))
+    cache = open_cache(edf_path)
+    if cache is not None:
+        signal_pyramid.build_pyramid(cache)
+    return final
+
+
+class SignalCacheReader(SignalSource):
+    """Leest uit de kolomcache; zelfde interface als `EdfMemmapReader`."""
+
+    def __init__(self, cache_dir: str, manifest: dict):
+        self.cache_dir = cache_dir
+        self.manifest = manifest
+        self.channels = {c["name"]: c for c in manifest["channels"]}
+        self.ch_names = [c["name"] for c in manifest["channels"]]
+        rates = [c["sfreq"] for c in manifest["channels"]]
+        self.sfreq = float(max(rates)) if rates else 0.0
+        n_times = int(round(manifest["n_records"] * manifest["record_length"]
+                            * self.sfreq))
+        self.duration_s = (n_times - 1) / self.sfreq if n_times else 0.0
+        self._maps: dict[str, np.memmap] = {}
+        self.pyramid = signal_pyramid.load_pyramid(self)
+
+    def digital(self, ch: str) -> np.memmap:
+        """De int16-kolom van `ch` als geheugenmap (niets ingelezen)."""
+        if ch not in self._maps:
+            c = self.channels[ch]
+            self._maps[ch] = np.memmap(
+                os.path.join(self.cache_dir, c["file"]), dtype=c["dtype"],
+                mode="r", shape=(c["n_samples"],))
+        return self._maps[ch]
+
+    def read(self, ch: str, t0: float, t1: float) -> tuple[np.ndarray, float]:
+        c = self.channels[ch]
+        sf = c["sfreq"]
+        total = c["n_samples"]
+        s0 = max(0, min(total, int(round(t0 * sf))))
+        s1 = max(s0, min(total, int(round(t1 * sf))))
+        return self.digital(ch)[s0:s1] * c["cal"] + c["offset"], sf
+
+    def physical(self, ch: str) -> np.ndarray:
+        """Het hele kanaal in fysische eenheden (volt voor µV/mV, zoals MNE)."""
+        c = self.channels[ch]
+        return self.digital(ch) * c["cal"] + c["offset"]
+
+
+def open_cache(edf_path: str) -> SignalCacheReader | None:
+    """Geldige cache voor `edf_path`, of None (ontbreekt, verouderd, kapot)."""
+    cache_dir = cache_dir_for(edf_path)
+    path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != FORMAT_VERSION:
+            return None
+        h = read_header(edf_path)
+        fp = _fingerprint(edf_path, h.header_bytes)
+        if (fp["size"] != manifest.get("size")
+                or fp["layout_sha1"] != manifest.get("layout_sha1")):
+            logger.info("Signaalcache verouderd voor %s — genegeerd", edf_path)
+            return None
+        return SignalCacheReader(cache_dir, manifest)
+    except (OSError, ValueError, KeyError, EdfReaderError) as e:
+        logger.info("Signaalcache onleesbaar voor %s: %s", edf_path, e)
+        return None
+
+
+def cached_raw(edf_path: str, channels: list[str], sfreq: float | None = None,
+               cache: SignalCacheReader | None = None):
+    """MNE `RawArray` uit de cache, als dat zonder hersampling kan.
+
+    `sfreq` is de frequentie die MNE zou opleveren; standaard het maximum van
+    de gevraagde kanalen (wat een lezing met `exclude=` geeft). Wijkt één
+    kanaal daarvan af, of ontbreekt er één, dan None en leest de aanroeper
+    via MNE zoals voorheen.
+    """
+    cache = cache or open_cache(edf_path)
+    if cache is None or not channels:
+        return None
+    if any(ch not in cache.channels for ch in channels):
+        return None
+    rates = {cache.channels[ch]["sfreq"] for ch in channels}
+    target = sfreq if sfreq is not None else max(rates)
+    if rates != {target}:
+        return None
+
+    import mne
+    data = np.empty((len(channels), cache.channels[channels[0]]["n_samples"]))
+    for i, ch in enumerate(channels):
+        data[i] = cache.physical(ch)
+    info = mne.create_info(channels, target, ch_types="eeg")
+    raw = mne.io.RawArray(data, info, copy=None, verbose=False)
+    meas_date = cache.manifest.get("meas_date")
+    if meas_date:
+        from datetime import datetime
+        raw.set_meas_date(datetime.fromisoformat(meas_date))
+    # Zoals bij de views van load_plan: psgscoring leest de patiëntvelden
+    # rechtstreeks uit het bestand via `raw.filenames`.
+    raw._filenames = [edf_path]
+    logger.info("Uit signaalcache: %d kanalen, %.0f Hz", len(channels), target)
+    return raw
@@ -0,0 +1,136 @@
+"""Min/max-piramide per kanaal — uitzoomen zonder elke sample te versturen.
+
+De viewer decimeerde met een vaste stap (`data[:, ::step]`). Bij 30 s merk je
+dat niet, bij vijf minuten wel: de stap wordt zo groot dat een korte
+EMG-burst of de bodem van een desaturatie gewoon tussen twee genomen samples
+valt en van het scherm verdwijnt. Wie uitzoomt om een patroon te zoeken,
+ziet dan precies de uitschieters niet.
+
+Een min/max-envelope lost beide op. Per pixelkolom gaan het minimum en het
+maximum mee; een piek blijft een piek, hoe ver er ook uitgezoomd wordt. De
+envelope wordt vooraf berekend op de kolomcache (`signal_cache.py`), in
+niveaus die telkens een factor 4 grover zijn, tot ongeveer één bin per
+epoch van 30 s. Een verzoek kiest het grofste niveau dat nog minstens één
+bin per pixel heeft en voegt die bins samen tot exact de gevraagde breedte.
+De kost hangt dan af van het aantal pixels, niet van het aantal samples —
+een volledige nacht op 1200 pixels leest een paar duizend bins.
+
+Opgeslagen als int16 (digitale min, max) naast de kanaalbestanden, met de
+schaal uit het cachemanifest. Zonder piramide (BDF, oude cache) wordt de
+envelope op de ruwe samples berekend: trager, maar hetzelfde resultaat.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger("yasaflaskified.signal_cache")
+
+FACTOR = 4
+"""Samples per bin op het fijnste niveau, en de stap tussen niveaus."""
+
+TOP_BIN_S = 30.0
+"""Het grofste niveau heeft bins van minstens één epoch."""
+
+PYRAMID_DIR = "pyramid"
+PYRAMID_MANIFEST = "pyramid.json"
+
+
+def _minmax(x: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Min en max per groep van `k`; de laatste groep mag korter zijn."""
+    n = len(x)
+    edges = np.arange(0, n, k)
+    return np.minimum.reduceat(x, edges), np.maximum.reduceat(x, edges)
+
+
+def build_pyramid(cache) -> dict:
+    """Schrijf de piramide voor een `SignalCacheReader`; geeft het manifest.
+
+    Elk niveau wordt uit het vorige afgeleid, dus de ruwe data wordt één
+    keer gelezen.
+    """
+    out_dir = os.path.join(cache.cache_dir, PYRAMID_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    levels: dict[str, list[dict]] = {}
+    for ch in cache.ch_names:
+        c = cache.channels[ch]
+        sf = c["sfreq"]
+        stem = os.path.splitext(c["file"])[0]
+        lo, hi = _minmax(np.asarray(cache.digital(ch)), FACTOR)
+        bin_n = FACTOR
+        ch_levels: list[dict] = []
+        while True:
+            name = f"{stem}.L{len(ch_levels)}.i16"
+            np.stack([lo, hi], axis=1).astype("<i2").tofile(
+                os.path.join(out_dir, name))
+            ch_levels.append({"file": name, "bin": bin_n, "n_bins": len(lo)})
+            if bin_n / sf >= TOP_BIN_S or len(lo) <= 1:
+                break
+            lo = _minmax(lo, FACTOR)[0]
+            hi = _minmax(hi, FACTOR)[1]
+            bin_n *= FACTOR
+        levels[ch] = ch_levels
+    manifest = {"factor": FACTOR, "levels": levels}
+    with open(os.path.join(cache.cache_dir, PYRAMID_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    logger.info("Envelope-piramide geschreven: %s", cache.cache_dir)
+    return manifest
+
+
+def load_pyramid(cache) -> dict | None:
+    path = os.path.join(cache.cache_dir, PYRAMID_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _columns(lo: np.ndarray, hi: np.ndarray, u0: float, u1: float,
+             width: int) -> tuple[np.ndarray, np.ndarray]:
+    """Eenheden [u0, u1) (samples of bins) samenvoegen tot `width` kolommen."""
+    a = max(0, int(np.floor(u0)))
+    b = min(len(lo), int(np.ceil(u1)))
+    if b <= a:
+        return np.zeros(0), np.zeros(0)
+    n = b - a
+    width = min(width, n)
+    edges = a + (np.arange(width) * n) // width
+    return np.minimum.reduceat(lo, edges)[:width], np.maximum.reduceat(hi, edges)[:width]
+
+
+def envelope(source, ch: str, t0: float, t1: float,
+             width: int) -> tuple[np.ndarray, np.ndarray]:
+    """Fysische (min, max) van `ch` over [t0, t1) in hooguit `width` kolommen.
+
+    `source` is een lezer uit `edf_reader`/`signal_cache`. Heeft hij een
+    piramide, dan komt het resultaat daaruit; anders uit de ruwe samples.
+    """
+    pyramid = getattr(source, "pyramid", None)
+    if pyramid and ch in pyramid.get("levels", {}):
+        c = source.channels[ch]
+        sf, cal, off = c["sfreq"], c["cal"], c["offset"]
+        spp = (t1 - t0) * sf / max(1, width)          # samples per pixel
+        usable = [lv for lv in pyramid["levels"][ch] if lv["bin"] <= spp]
+        if usable:
+            lv = usable[-1]
+            bins = np.memmap(
+                os.path.join(source.cache_dir, PYRAMID_DIR, lv["file"]),
+                dtype="<i2", mode="r", shape=(lv["n_bins"], 2))
+            lo_d, hi_d = _columns(bins[:, 0], bins[:, 1],
+                                  t0 * sf / lv["bin"], t1 * sf / lv["bin"], width)
+        else:
+            raw = source.digital(ch)
+            lo_d, hi_d = _columns(raw, raw, t0 * sf, t1 * sf, width)
+        lo, hi = lo_d * cal + off, hi_d * cal + off
+        # Een negatieve schaal (omgekeerde fysische grenzen) draait min/max om.
+        return (lo, hi) if cal >= 0 else (hi, lo)
+
+    sig, sf = source.read(ch, t0, t1)
+    return _columns(sig, sig, 0, len(sig), width)
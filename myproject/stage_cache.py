@@ -0,0 +1,231 @@
+"""Uitkomsten per analysestap bewaren, op inhoud geadresseerd.
+
+Een heranalyse (`reanalyze_study`), een profielvergelijking zonder
+meegegeven hypnogram, of dezelfde EDF nog eens door `batch_analyse`: elk
+deed staging en alle EEG-detectoren opnieuw, ook als er niets aan veranderd
+was dat die stappen raakt. Wie alleen het scoringsprofiel wijzigt, wachtte
+zo vier minuten op wat een halve minuut pneumo had moeten zijn.
+
+Een stap is hier een zuivere functie van (opname, stap, parameters,
+bibliotheekversies). De sleutel is de SHA-256 over precies dat: de
+inhoudshash van de EDF (`content_hash.py`, dus dezelfde opname onder een
+andere naam of op een tweede upload telt mee), de stapnaam, wat de aanroeper
+als parameters opgeeft (kanaalkeuze, hypnogram, profiel, …) en de versies
+van de app en de rekenbibliotheken. Een nieuwe yasa of psgscoring maakt dus
+alles ongeldig; dat is de bedoeling.
+
+Opslag: één pickle per sleutel onder `<root>/<opname>/<sleutel>.pkl`. Pickle en
+geen JSON omdat een treffer EXACT moet teruggeven wat de stap zou berekenen
+— numpy-types, tuples en niet-string sleutels overleven een JSON-rondreis
+niet, en de stappen daarna (en results.json) zouden dan anders uitvallen
+dan zonder cache. De map hoort bij de server (onder UPLOAD_FOLDER); er komt
+niets in wat niet door een eigen worker geschreven is.
+
+Schrijven gebeurt via een tijdelijk bestand en `os.replace`, zodat twee
+workers op dezelfde opname elkaar geen half bestand laten lezen. Een
+onleesbaar of verdwenen item is gewoon een misser. De map mag op elk moment
+leeggemaakt worden.
+
+Eén map per opname, zodat het verwijderen van een job ook zijn tussenresultaten
+kan meenemen (`forget`). Wat `retention_days()` lang niet gebruikt werd,
+ruimt `prune` op; een treffer zet de mtime opnieuw, dus het is de laatste
+lezing die telt en niet de eerste berekening.
+
+`YASAFLASKIFIED_STAGE_CACHE` zet de cache uit (`0`/`off`) of verlegt hem
+naar een andere map; `YASAFLASKIFIED_STAGE_CACHE_DAYS` is de bewaartermijn.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger("yasaflaskified.worker")
+
+FORMAT_VERSION = 1
+
+RETENTION_DAYS = 30.0
+
+MISS: Any = object()
+"""Wat `StageCache.load` teruggeeft als er niets bruikbaars is."""
+
+
+def cache_root(default: str | None) -> str | None:
+    """De cachemap, of None als de cache uit staat."""
+    env = os.environ.get("YASAFLASKIFIED_STAGE_CACHE", "").strip()
+    if env.lower() in ("0", "off", "false", "no"):
+        return None
+    return env or default
+
+
+def retention_days() -> float:
+    try:
+        return float(os.environ.get("YASAFLASKIFIED_STAGE_CACHE_DAYS", RETENTION_DAYS))
+    except ValueError:
+        return RETENTION_DAYS
+
+
+def forget(root: str | None, recording: str | None) -> bool:
+    """Alles wat voor `recording` bewaard werd weg; True als er iets was."""
+    if not root or not recording or os.sep in recording or recording.startswith("."):
+        return False
+    path = os.path.join(root, recording)
+    if not os.path.isdir(path):
+        return False
+    shutil.rmtree(path, ignore_errors=True)
+    return True
+
+
+def prune(root: str | None, max_age_s: float | None = None) -> int:
+    """Items die `max_age_s` (standaard `retention_days()`) niet gelezen of
+    geschreven werden weg, met de mappen die daardoor leeg raken.
+
+    Ook achtergebleven `.tmp`-bestanden van een afgebroken schrijfactie.
+    Geeft het aantal verwijderde bestanden terug.
+    """
+    if not root or not os.path.isdir(root):
+        return 0
+    if max_age_s is None:
+        max_age_s = retention_days() * 86400
+    cutoff = time.time() - max_age_s
+    removed = 0
+    for dirpath, _dirs, files in os.walk(root, topdown=False):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                pass                    # tegelijk door een andere worker opgeruimd
+        if dirpath != root:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass                    # niet leeg
+    return removed
+
+
+def digest(value: Any) -> str:
+    """Korte vingerafdruk van een parameter die te groot is voor de sleutel zelf."""
+    blob = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest()
+
+
+def stage_key(recording: str, stage: str, params: dict, versions: dict) -> str:
+    blob = json.dumps({"format": FORMAT_VERSION, "recording": recording,
+                       "stage": stage, "params": params, "versions": versions},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def write_pickle(path: str, value: Any) -> None:
+    """Atomair: wie tegelijk leest, ziet het oude bestand of het nieuwe."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _succeeded(value: Any) -> bool:
+    # Een detector die faalt geeft {"success": False, "error": ...} terug in
+    # plaats van te raisen. Dat bewaren zou een tijdelijke fout (geheugen,
+    # een weggevallen schijf) permanent maken.
+    return not (isinstance(value, dict) and value.get("success") is False)
+
+
+class StageCache:
+    """De cache voor één opname; zonder map of opname doet hij niets.
+
+    Treffers worden in het geheugen onthouden, zodat een stap die vooraf
+    al bevraagd werd (om te beslissen wat er geladen moet worden) daarna
+    hetzelfde antwoord krijgt, ook als de map intussen opgeruimd is.
+    """
+
+    def __init__(self, root: str | None, recording: str | None,
+                 versions: dict) -> None:
+        self.root = root
+        self.recording = recording
+        self.versions = versions
+        self.outcome: dict[str, str] = {}
+        self._memo: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root and self.recording)
+
+    def _path(self, key: str) -> str:
+        assert self.root is not None
+        assert self.recording is not None
+        return os.path.join(self.root, self.recording, f"{key}.pkl")
+
+    def key(self, stage: str, params: dict) -> str:
+        assert self.recording is not None
+        return stage_key(self.recording, stage, params, self.versions)
+
+    def load(self, stage: str, **params: Any) -> Any:
+        if not self.enabled:
+            return MISS
+        key = self.key(stage, params)
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return MISS
+        except Exception as e:                                    # noqa: BLE001
+            logger.warning("[CACHE] %s onleesbaar, opnieuw berekenen: %s", stage, e)
+            return MISS
+        try:
+            os.utime(path)                          # gebruikt: telt voor `prune`
+        except OSError:
+            pass
+        with self._lock:
+            self._memo[key] = value
+        return value
+
+    def store(self, stage: str, value: Any, **params: Any) -> None:
+        if not self.enabled:
+            return
+        key = self.key(stage, params)
+        path = self._path(key)
+        try:
+            write_pickle(path, value)
+        except OSError as e:
+            # Een volle schijf mag de analyse niet laten falen.
+            logger.warning("[CACHE] %s niet bewaard: %s", stage, e)
+            return
+        with self._lock:
+            self._memo[key] = value
+
+    def run(self, stage: str, compute: Callable[[], Any],
+            keep: Callable[[Any], bool] = _succeeded, **params: Any) -> Any:
+        """De bewaarde uitkomst van `stage`, of `compute()` en die bewaren."""
+        value = self.load(stage, **params)
+        if value is not MISS:
+            self.outcome[stage] = "hit"
+            logger.info("[CACHE] %s uit de cache", stage)
+            return value
+        value = compute()
+        if self.enabled:
+            self.outcome[stage] = "miss"
+            if keep(value):
+                self.store(stage, value, **params)
+        return value
@@ -0,0 +1,199 @@
+"""Analysestappen als afhankelijkheidsgraaf — wat kan, loopt tegelijk.
+
+`run_analysis_job` deed alles na elkaar: staging, spindles, trage golven,
+REM, bandvermogen, artefacten, pneumo, kwaliteitscontrole. De meeste van
+die stappen hebben alleen het hypnogram en hun eigen kanalen nodig; de
+artefactdetectie zelfs niet eens het hypnogram. Op een lege machine met
+16 kernen draaide één dringende studie zo vier minuten op één kern.
+
+Hier declareert elke stap wat hij nodig heeft (`needs`), en start hij zodra
+dat er is, op een begrensde threadpool. Pneumo begint dus zodra staging en
+het artefactmasker klaar zijn, terwijl de EEG-detectoren nog lopen.
+
+Threads en geen processen: de stappen delen de MNE-raws uit `load_plan`
+(views op één buffer, zie daar), en die over processen verdelen zou
+betekenen: elke raw pickelen en kopiëren. Het zware werk zit in numpy,
+scipy en LightGBM, die de GIL loslaten. Geen enkele stap wijzigt een raw
+ter plekke; dat is dezelfde voorwaarde waarop `load_plan` al steunt.
+
+Per stap worden begin, einde en duur bijgehouden, relatief t.o.v. de start
+van de graaf; die gaan mee in de resultaten (`stage_timings`).
+
+Met `checkpoints` wordt elke afgewerkte stap bewaard en bij een volgende
+poging teruggezet in plaats van opnieuw gedraaid. Er draait dan alleen wat
+nog ontbreekt, plus wat die stappen nodig hebben: staat alles wat het laden
+nodig had al klaar, dan wordt er ook niet meer geladen.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Protocol
+
+logger = logging.getLogger("yasaflaskified.worker")
+
+
+@dataclass
+class Stage:
+    """Eén stap: `fn` krijgt de resultaten van `needs` als keyword-argumenten."""
+
+    name: str
+    fn: Callable[..., Any]
+    needs: tuple[str, ...] = ()
+    label: str = ""
+    checkpoint: bool = True
+    """False voor wat niet bewaard kan of mag worden (de geladen raws)."""
+
+
+class Checkpoints(Protocol):
+    def restore(self, name: str) -> tuple[bool, Any]: ...
+
+    def save(self, name: str, value: Any) -> None: ...
+
+
+class StageGraphError(ValueError):
+    """De graaf zelf klopt niet: onbekende afhankelijkheid of een cyclus."""
+
+
+def default_workers() -> int:
+    """`YASAFLASKIFIED_STAGE_WORKERS`, anders het aantal kernen tot 4.
+
+    Meer dan vier helpt niet: zoveel onafhankelijke EEG-stappen zijn er, en
+    elke worker van de machine draait zijn eigen graaf.
+    """
+    env = os.environ.get("YASAFLASKIFIED_STAGE_WORKERS")
+    if env:
+        return max(1, int(env))
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+def _check(stages: list[Stage]) -> None:
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise StageGraphError(f"dubbele stapnaam in {names}")
+    known = set(names)
+    for s in stages:
+        missing = [n for n in s.needs if n not in known]
+        if missing:
+            raise StageGraphError(f"{s.name} heeft onbekende stappen nodig: {missing}")
+    done: set[str] = set()
+    todo = list(stages)
+    while todo:
+        ready = [s for s in todo if set(s.needs) <= done]
+        if not ready:
+            raise StageGraphError(f"cyclus tussen {[s.name for s in todo]}")
+        done.update(s.name for s in ready)
+        todo = [s for s in todo if s.name not in done]
+
+
+def _still_needed(stages: list[Stage], restored: set[str]) -> set[str]:
+    """Wat niet teruggezet is, plus alles wat daarvoor moet draaien.
+
+    Een stap zonder checkpoint (het laden) draait bij een hervatting alleen
+    als een andere stap hem nog nodig heeft.
+    """
+    by_name = {s.name: s for s in stages}
+    todo = [s.name for s in stages
+            if s.name not in restored and (s.checkpoint or not restored)]
+    needed: set[str] = set()
+    while todo:
+        name = todo.pop()
+        if name in needed:
+            continue
+        needed.add(name)
+        todo += [n for n in by_name[name].needs if n not in restored]
+    return needed
+
+
+def run_stages(stages: list[Stage], max_workers: int | None = None,
+               on_done: Callable[[Stage, int, int], None] | None = None,
+               checkpoints: Checkpoints | None = None,
+               ) -> tuple[dict[str, Any], dict[str, dict]]:
+    """Voer de graaf uit; geeft (resultaat per stap, timing per stap).
+
+    Faalt een stap, dan wordt er niets nieuws meer gestart, lopen de stappen
+    die al bezig zijn uit, en gaat de eerste fout omhoog — net zoals de
+    sequentiële pipeline bij die stap zou stoppen. Wat tot dan klaar was,
+    staat in `checkpoints`.
+
+    Een stap die niet meer nodig was (zie `_still_needed`) ontbreekt in
+    het resultaat.
+    """
+    _check(stages)
+    workers = max_workers or default_workers()
+    results: dict[str, Any] = {}
+    timings: dict[str, dict] = {}
+    if checkpoints is not None:
+        for s in stages:
+            if not s.checkpoint:
+                continue
+            found, value = checkpoints.restore(s.name)
+            if found:
+                results[s.name] = value
+                timings[s.name] = {"restored": True}
+                if on_done is not None:
+                    on_done(s, len(results), len(stages))
+        if results:
+            logger.info("[STAGE] hervat: %s al klaar", sorted(results))
+    needed = _still_needed(stages, set(results))
+    t_zero = time.monotonic()
+    pending = [s for s in stages if s.name in needed]
+    running: dict[Future, Stage] = {}
+    error: BaseException | None = None
+
+    def call(stage: Stage) -> Any:
+        start = time.monotonic()
+        try:
+            return stage.fn(**{n: results[n] for n in stage.needs})
+        finally:
+            end = time.monotonic()
+            timings[stage.name] = {
+                "start_s":    round(start - t_zero, 3),
+                "end_s":      round(end - t_zero, 3),
+                "duration_s": round(end - start, 3),
+                "thread":     threading.current_thread().name,
+            }
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage")
+    try:
+        while pending or running:
+            if error is None:
+                ready = [s for s in pending if all(n in results for n in s.needs)]
+                for s in ready:
+                    pending.remove(s)
+                    running[pool.submit(call, s)] = s
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                stage = running.pop(fut)
+                exc = fut.exception()
+                if exc is not None:
+                    logger.error("[STAGE] %s mislukt: %s", stage.name, exc)
+                    error = error or exc
+                    continue
+                results[stage.name] = fut.result()
+                if checkpoints is not None and stage.checkpoint:
+                    checkpoints.save(stage.name, results[stage.name])
+                if on_done is not None:
+                    on_done(stage, len(results), len(stages))
+    except BaseException:
+        # Iets in DEZE thread: RQ's JobTimeoutException komt binnen `wait()`.
+        # Een `with`-blok zou bij het verlaten nog op elke lopende stap
+        # wachten, en dan grijpt de harde timeout pas in als alles klaar is.
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
+    if error is not None:
+        raise error
+    wall = time.monotonic() - t_zero
+    busy = sum(t.get("duration_s", 0) for t in timings.values())
+    logger.info("[STAGE] %d stappen in %.1f s (%.1f s rekentijd, %d threads)",
+                len(needed), wall, busy, workers)
+    return results, timings
@@ -97,6 +97,34 @@ const VI18N = {
 };
 
 // ── Viewer klasse ───────────────────────────────────────────────────────────
+// ── Binaire signaaloverdracht (edf_api.py, "Binaire overdracht") ──────────
+// uint32 headerlengte | JSON-header | per blok, per kanaal de samples.
+// Geeft hetzelfde object terug als de JSON-route, met Float32Arrays.
+async function edfDecodeSignals(resp) {
+  if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+  const buf  = await resp.arrayBuffer();
+  const n    = new DataView(buf).getUint32(0, true);
+  const head = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 4, n)));
+  let off = 4 + n;
+  for (const blk of (head.epochs || [head])) {
+    blk.channels = {};
+    head.channel_order.forEach((ch, i) => {
+      const len = blk.n_samples;
+      if (head.dtype === "i16") {
+        const raw = new Int16Array(buf.slice(off, off + 2*len));
+        const out = new Float32Array(len), s = blk.scales[i];
+        for (let j = 0; j < len; j++) out[j] = raw[j] * s;
+        blk.channels[ch] = out;
+        off += 2*len;
+      } else {
+        blk.channels[ch] = new Float32Array(buf, off, len);
+        off += 4*len;
+      }
+    });
+  }
+  return head;
+}
+
 class EdfViewer {
   constructor(containerId, jobId, opts = {}) {
     this.container       = document.getElementById(containerId);
@@ -115,6 +143,8 @@ class EdfViewer {
     this.epochSpan   = 1;            // v13: hoeveel epochs tegelijk tonen (1,2,5,10)
     this.cache       = {};          // epoch_idx → signaaldata
     this.evCache     = {};          // epoch_idx → events[]
+    this.envCache    = {};          // "idx:span:width" → min/max-envelope
+    this.rangeCache  = {};          // "idx:span" → één venster over de span
     this.hiddenChs   = new Set();
     this.ampScale    = 1.0;
     this.chAmpScale  = {};          // per-kanaal amplitude multiplier {ch_name: float}
@@ -438,6 +468,54 @@ class EdfViewer {
     this.goTo(idx);
   }
 
+  // Vanaf 5 epochs: één min/max-envelope op schermbreedte in plaats van
+  // elke epoch apart. Kost volgt de pixels, en pieken vallen niet weg
+  // tussen gedecimeerde samples (zie signal_pyramid.py).
+  _useEnvelope() { return this.epochSpan >= 5; }
+
+  _envKey(idx) {
+    return `${idx}:${this.epochSpan}:${Math.max(this.canvas.width - this.LABEL_W, 100)}`;
+  }
+
+  _fetchEnvelope(idx) {
+    const key = this._envKey(idx);
+    if (this.envCache[key]) return null;
+    const len = this.info.epoch_len_s || 30;
+    const width = Math.max(this.canvas.width - this.LABEL_W, 100);
+    return fetch(`/api/edf/${this.jobId}/envelope?t0=${idx*len}` +
+                 `&t1=${(idx+this.epochSpan)*len}&width=${width}`)
+      .then(r=>r.json()).then(d=>{this.envCache[key]=d;});
+  }
+
+  // Signaal als int16 met schaal per kanaal: een tiende van de JSON-tekst
+  // per sample, en geen JSON-parse van duizenden getallen per epoch.
+  _fetchEpoch(i) {
+    return fetch(`/api/edf/${this.jobId}/epoch/${i}?format=i16`)
+      .then(edfDecodeSignals);
+  }
+
+  // Meerdere epochs zonder envelope: één /range-venster over de hele span,
+  // één lezing en één decimatie aan de serverkant in plaats van per epoch.
+  _useRange() { return this.epochSpan > 1 && !this._useEnvelope(); }
+
+  _fetchRange(idx) {
+    const key = `${idx}:${this.epochSpan}`;
+    if (this.rangeCache[key]) return null;
+    const len = this.info.epoch_len_s || 30;
+    return fetch(`/api/edf/${this.jobId}/range?t0=${idx*len}` +
+                 `&t1=${(idx+this.epochSpan)*len}&n=${512*this.epochSpan}&format=i16`)
+      .then(edfDecodeSignals)
+      .then(d=>{d.epoch_len_s=len; this.rangeCache[key]=d;});
+  }
+
+  // Begintijd + epochlengte van wat er nu op het scherm staat
+  _viewMeta() {
+    if (this._useRange()) return this.rangeCache[`${this.epochIdx}:${this.epochSpan}`];
+    if (!this._useEnvelope()) return this.cache[this.epochIdx];
+    const env = this.envCache[this._envKey(this.epochIdx)];
+    return env ? { t0_s: env.t0_s, epoch_len_s: this.info.epoch_len_s || 30 } : null;
+  }
+
   async goTo(idx) {
     if (!this.info) return;
     idx = Math.max(0, Math.min(idx, this.info.n_epochs - this.epochSpan));
@@ -446,10 +524,12 @@ class EdfViewer {
 
     // Laad alle epochs in de huidige span
     const loads = [];
+    const env = this._useEnvelope(), rng = this._useRange();
+    if (env) { const p = this._fetchEnvelope(idx); if (p) loads.push(p); }
+    if (rng) { const p = this._fetchRange(idx); if (p) loads.push(p); }
     for (let i = idx; i < idx + this.epochSpan && i < this.info.n_epochs; i++) {
-      if (!this.cache[i])
-        loads.push(fetch(`/api/edf/${this.jobId}/epoch/${i}`)
-          .then(r=>r.json()).then(d=>{this.cache[i]=d;}));
+      if (!env && !rng && !this.cache[i])
+        loads.push(this._fetchEpoch(i).then(d=>{this.cache[i]=d;}));
       if (!this.evCache[i])
         loads.push(fetch(`/api/edf/${this.jobId}/events/${i}`)
           .then(r=>r.json()).then(d=>{this.evCache[i]=d.events||[];}));
@@ -469,10 +549,20 @@ class EdfViewer {
 
   _prefetch(cur) {
     const nxt = cur+1;
+    if (this._useEnvelope() || this._useRange()) {
+      if (nxt + this.epochSpan <= this.info.n_epochs) {
+        const p = this._useRange() ? this._fetchRange(nxt) : this._fetchEnvelope(nxt);
+        if (p) p.catch(()=>{});
+      }
+      for (let i = nxt; i < nxt + this.epochSpan && i < this.info.n_epochs; i++)
+        if (!this.evCache[i])
+          fetch(`/api/edf/${this.jobId}/events/${i}`).then(r=>r.json())
+            .then(d=>{this.evCache[i]=d.events||[];}).catch(()=>{});
+      return;
+    }
     if (nxt<this.info.n_epochs) {
       if (!this.cache[nxt])
-        fetch(`/api/edf/${this.jobId}/epoch/${nxt}`).then(r=>r.json())
-          .then(d=>{this.cache[nxt]=d;}).catch(()=>{});
+        this._fetchEpoch(nxt).then(d=>{this.cache[nxt]=d;}).catch(()=>{});
       if (!this.evCache[nxt])
         fetch(`/api/edf/${this.jobId}/events/${nxt}`).then(r=>r.json())
           .then(d=>{this.evCache[nxt]=d.events||[];}).catch(()=>{});
@@ -498,14 +588,19 @@ class EdfViewer {
     if (!this.info) return;
 
     // Verzamel signalen en events over alle epochs in de span
-    const firstSig = this.cache[this.epochIdx];
+    const envData  = this._useEnvelope() ? this.envCache[this._envKey(this.epochIdx)] : null;
+    const rangeData = this._useRange() ? this._viewMeta() : null;
+    const firstSig = envData
+      ? { t0_s: envData.t0_s, epoch_len_s: this.info.epoch_len_s || 30,
+          channels: envData.channels }
+      : rangeData || this.cache[this.epochIdx];
     if (!firstSig) { this._drawLoading(); return; }
 
     const totalEpochLen = (firstSig.epoch_len_s||30) * this.epochSpan;
     const t0 = firstSig.t0_s || 0;
 
     // Combineer signalen van alle epochs
-    const combinedChannels = {};
+    const combinedChannels = rangeData ? { ...rangeData.channels } : {};
     const combinedEvents = [];
     const visChs = this.info.channels.filter(c=>!this.hiddenChs.has(c)&&firstSig.channels[c]);
 
@@ -513,6 +608,7 @@ class EdfViewer {
       const epIdx = this.epochIdx + ei;
       const sig = this.cache[epIdx];
       const evs = this.evCache[epIdx] || [];
+      if (envData || rangeData) { combinedEvents.push(...evs); continue; }
       if (!sig) break;
       for (const ch of visChs) {
         if (!combinedChannels[ch]) combinedChannels[ch] = [];
@@ -566,6 +662,25 @@ class EdfViewer {
       ctx.strokeStyle="#dde3ed"; ctx.lineWidth=0.5;
       ctx.beginPath(); ctx.moveTo(this.LABEL_W,midY); ctx.lineTo(W,midY); ctx.stroke();
 
+      // Envelope: per pixelkolom een verticale lijn van min naar max
+      if (envData) {
+        const e = envData.channels[ch];
+        if (!e || !e.min.length) return;
+        const n = e.min.length;
+        const k = (this.TRACK_H/2)*0.85 / scale;
+        ctx.strokeStyle=color; ctx.lineWidth=1;
+        ctx.beginPath();
+        for (let j=0;j<n;j++) {
+          const x = this.LABEL_W + ((j+0.5)/n)*usableW;
+          ctx.moveTo(x, midY - e.max[j]*k);
+          ctx.lineTo(x, midY - e.min[j]*k + 0.5);
+        }
+        ctx.stroke();
+        ctx.strokeStyle="#d8e3ef"; ctx.lineWidth=0.4;
+        ctx.beginPath(); ctx.moveTo(0,trackY+this.TRACK_H); ctx.lineTo(W,trackY+this.TRACK_H); ctx.stroke();
+        return;
+      }
+
       // Signaal (downsample als te veel punten)
       if (!sig||sig.length<2) return;
       ctx.strokeStyle=color; ctx.lineWidth=0.9;
@@ -756,8 +871,8 @@ class EdfViewer {
   // ── Klik-handler (toggle event) ────────────────────────────────────────────
   _bindCanvas() {
     this.canvas.addEventListener("mousemove", e => {
-      if (!this.info||!this.cache[this.epochIdx]) return;
-      const d   = this.cache[this.epochIdx];
+      const d   = this.info && this._viewMeta();
+      if (!d) return;
       const totalLen = (d.epoch_len_s||30) * this.epochSpan;
       const rect= this.canvas.getBoundingClientRect();
       const cx  = e.clientX-rect.left;
@@ -821,7 +936,7 @@ class EdfViewer {
 
     this.canvas.addEventListener("click", async e => {
       if (!this.eventsEnabled||!this.info) return;
-      const d   = this.cache[this.epochIdx];
+      const d   = this._viewMeta();
       if (!d) return;
       const rect= this.canvas.getBoundingClientRect();
       const cx  = e.clientX-rect.left;
@@ -899,5 +1014,5 @@ class EdfViewer {
   }
 
   get currentEpoch() { return this.epochIdx; }
-  clearCache() { this.cache={}; this.evCache={}; }
+  clearCache() { this.cache={}; this.evCache={}; this.envCache={}; this.rangeCache={}; }
 }
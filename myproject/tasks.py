@@ -22,18 +22,44 @@ import os
 import traceback
 from collections import Counter
 from datetime import datetime
-
+from typing import Callable
+
+import job_estimate
+import job_events
+import job_scheduler
+import job_state
+import load_plan
+import memory_budget
 import mne
 import numpy as np
 import pandas as pd
+import pipeline_results
+import signal_cache
+import stage_cache
 
 # from generate_psg_report import generate_psg_report  # PSG = PDF (portrait)
+from edf_reader import read_summary
 from generate_edfplus import generate_edfplus
 from generate_excel_report import generate_excel_report
 from generate_pdf_report import generate_pdf_report
+from job_checkpoint import JobCheckpoints, checkpoint_dir
 from pneumo_analysis import detect_channels as pneumo_detect_channels
 from pneumo_analysis import run_pneumo_analysis
-from yasa_analysis import run_full_analysis, run_sleep_staging
+from stage_cache import MISS, StageCache
+from stage_graph import Stage, run_stages
+from yasa_analysis import (
+    analysis_meta,
+    build_hypnogram_timeline,
+    resolve_eeg_channels,
+    run_artifact_detection,
+    run_bandpower,
+    run_rem_detection,
+    run_sleep_cycles,
+    run_sleep_staging,
+    run_sleep_statistics,
+    run_spindle_detection,
+    run_sw_detection,
+)
 
 logger = logging.getLogger("yasaflaskified.worker")
 logging.basicConfig(
@@ -62,13 +88,9 @@ def _get_progress_redis():
     return _progress_redis
 
 def _set_progress(job_id: str, step: int, total: int, label: str):
-    """Schrijf voortgang naar Redis zodat de frontend het kan tonen."""
+    """Schrijf voortgang naar Redis en meld ze aan de statuspagina (job_events.py)."""
     try:
-        r = _get_progress_redis()
-        r.hset(f"job:{job_id}:progress", mapping={
-            "step": step, "total": total, "label": label
-        })
-        r.expire(f"job:{job_id}:progress", 3600)
+        job_events.publish_progress(_get_progress_redis(), job_id, step, total, label)
     except Exception:
         pass  # niet-kritiek
 
@@ -82,11 +104,18 @@ def _load_edf(edf_path: str, needed_channels: list,
     """
     Laad EDF met enkel de benodigde kanalen via exclude-parameter.
     MNE leest uitgesloten kanalen nooit in en hersampled ze niet.
+    Eerst de kolomcache (signal_cache.py), als die zonder hersampling volstaat.
     """
     logger.info("[%s] laden: %s", label, needed_channels)
+    cache = signal_cache.open_cache(edf_path)
+    if cache is not None:
+        cached = signal_cache.cached_raw(edf_path, list(dict.fromkeys(
+            ch for ch in needed_channels if ch and ch in cache.channels
+        )), cache=cache)
+        if cached is not None:
+            return cached
     try:
-        raw_hdr   = mne.io.read_raw_edf(edf_path, preload=False, verbose=False)
-        all_ch    = raw_hdr.ch_names
+        all_ch    = read_summary(edf_path)["ch_names"]
         available = set(all_ch)
         to_keep   = list(dict.fromkeys(
             ch for ch in needed_channels if ch and ch in available
@@ -108,11 +137,20 @@ def _load_edf(edf_path: str, needed_channels: list,
 def _detect_pneumo_channels(edf_path: str, pneumo_channels: dict) -> list:
     """Detecteer respiratoire kanalen via header (geen data)."""
     try:
-        raw_hdr  = mne.io.read_raw_edf(edf_path, preload=False, verbose=False)
-        auto     = pneumo_detect_channels(raw_hdr.ch_names)
+        return _pneumo_channels_from_names(read_summary(edf_path)["ch_names"],
+                                           pneumo_channels)
+    except Exception as e:
+        logger.warning("Pneumo detectie mislukt: %s", e)
+        return []
+
+
+def _pneumo_channels_from_names(ch_names: list, pneumo_channels: dict) -> list:
+    """Auto-detectie + gebruikerskeuze, op een reeds gelezen kanaallijst."""
+    try:
+        auto     = pneumo_detect_channels(ch_names)
         merged   = {**auto, **{k: v for k, v in pneumo_channels.items() if v}}
         detected = list(dict.fromkeys(
-            ch for ch in merged.values() if ch and ch in raw_hdr.ch_names
+            ch for ch in merged.values() if ch and ch in ch_names
         ))
         logger.info("Pneumo kanalen: %s", detected)
         return detected
@@ -125,26 +163,33 @@ def _detect_pneumo_channels(edf_path: str, pneumo_channels: dict) -> list:
 # HOOFD ANALYSETAAK
 # ─────────────────────────────────────────────
 
-def run_analysis_job(job_id: str) -> dict:
+def run_pipeline(cfg: dict, checkpoints: JobCheckpoints | None = None,
+                 cache: StageCache | None = None,
+                 progress: Callable[[int, int, str], None] | None = None) -> dict:
     """
-    Volledige slaap + pneumo analyse pipeline.
+    De analyse zelf, los van de job eromheen: één opname volgens `cfg`.
 
-    3-staps EDF-laadstrategie:
+    3 stap-raws, samen in één lezing (zie load_plan.py):
       raw_staging : EEG + EOG + EMG (3 kanalen) → YASA staging (snel!)
       raw_analyse : alle extra EEG kanalen       → spindles, SW, bandpower
       raw_pneumo  : respiratoire kanalen          → AHI, SpO2, PLM, snurk
-    """
-    started = datetime.utcnow()
-    logger.info("▶ Job gestart: %s | UPLOAD_FOLDER: %s", job_id, UPLOAD_FOLDER)
-    _set_progress(job_id, 1, 10, "Config laden...")
+    Elke stap krijgt een view op dezelfde buffer; een kanaal dat meerdere
+    stappen delen wordt één keer gedecodeerd.
 
-    # ── Config laden ──────────────────────────────────────────
-    config_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_config.json")
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"Config niet gevonden: {config_path}")
+    De analyses zelf lopen als graaf (stage_graph.py): elke stap start
+    zodra zijn invoer er is, naast de andere.
 
-    with open(config_path) as f:
-        cfg = json.load(f)
+    `cfg` heeft de velden van `{job_id}_config.json` (edf_path, eeg_ch,
+    eog_ch, emg_ch, extra_eeg_ch, pneumo_channels, scoring_profile, ...).
+    Geeft de analysevelden van results.json terug; wat bij de job hoort
+    (patiënt, site, eigenaar) voegt `run_analysis_job` toe. Zonder
+    `checkpoints` wordt er niets bewaard, zonder `cache` geldt de stapcache
+    van UPLOAD_FOLDER. `progress(stap, totaal, label)` volgt de schaal van
+    de statuspagina (2 = laden, 8 = alle stappen klaar).
+
+    batch_analyse.py draait dezelfde functie.
+    """
+    report = progress or (lambda step, total, label: None)
 
     edf_path        = cfg["edf_path"]
     eeg_ch          = cfg["eeg_ch"]
@@ -153,7 +198,6 @@ def run_analysis_job(job_id: str) -> dict:
     extra_eeg       = cfg.get("extra_eeg_ch") or [eeg_ch]
     recording_start = cfg.get("recording_start")
     pneumo_channels = cfg.get("pneumo_channels", {})
-    patient_info    = cfg.get("patient_info", {})
 
     logger.info("EEG=%s EOG=%s EMG=%s extra_eeg=%s",
                 eeg_ch, eog_ch, emg_ch, extra_eeg)
@@ -184,314 +228,467 @@ def run_analysis_job(job_id: str) -> dict:
         logger.info("[task] Geen EEG-kanaal opgegeven — als polygrafie "
                     "behandeld ondanks studietype %r", cfg.get("study_type"))
 
-    if is_polygraphy:
-        _set_progress(job_id, 3, 10, "Polygrafie — geen slaapstaging...")
-        # De opnameduur komt uit de EDF-header; daar is geen kanaal voor nodig.
-        import mne as _mne
-        _hdr = _mne.io.read_raw_edf(edf_path, preload=False, verbose="ERROR")
-        n_epochs = int(_hdr.times[-1] // 30)
-        del _hdr
-        raw_staging = None
-        hypno = ["N2"] * n_epochs
-        staging_ok = False
-        staging_result = {
-            "success":   False,
-            "skipped":   True,
-            "hypnogram": hypno,
-            "n_epochs":  n_epochs,
-            "reason":    ("polygrafie — geen EEG, dus geen slaapstaging; "
-                          "indices per uur registratietijd (REI)"),
+    # ── Laadplan: header één keer, elke kanaal één keer decoderen ──
+    # Wat elke stap nodig heeft ligt vast vóór er iets gedecodeerd wordt:
+    # de kanaalkeuze staat in de config en de pneumo-detectie heeft enkel
+    # de kanaalnamen nodig. Daarna volgt één lezing van de unie.
+    report(2, 10, "EDF laden...")
+    plan = load_plan.read_plan_header(edf_path)
+    if not is_polygraphy:
+        extra_eeg = _extra_eeg(plan.ch_names, eeg_ch, extra_eeg)
+    staging_params, analyse_params = _stage_params(
+        eeg_ch, eog_ch, emg_ch, extra_eeg, polygraphy=is_polygraphy)
+    staging_needed = staging_params["channels"]
+    analyse_needed = analyse_params["channels"]
+    logger.info("Pneumo-kanalen detecteren...")
+    pneumo_ch_list = _pneumo_channels_from_names(plan.ch_names, pneumo_channels)
+
+    # ── Stapcache (stage_cache.py) ─────────────────────────────────────
+    # Wat een stap berekent hangt af van de opname, de kanalen die hij leest
+    # en zijn invoer; niet van het scoringsprofiel. Staan staging en alle
+    # EEG-stappen al in de cache, dan worden de EEG-kanalen niet eens
+    # gedecodeerd: een heranalyse met een ander profiel kost dan de pneumo.
+    if cache is None:
+        cache = _stage_cache(edf_path, cfg.get("content_hash"))
+
+    def eeg_params(hypno):
+        return {**analyse_params, "hypno": stage_cache.digest(hypno)}
+
+    eeg_ready = False
+    if not is_polygraphy and analyse_needed and pneumo_ch_list:
+        # Bij een hervatting kunnen dezelfde stappen al als checkpoint klaarstaan.
+        eeg_ready = {"staging", "spindles", "slow_waves", "rem", "bandpower",
+                     "artifacts", "signal_quality", "meta"} <= set(
+                         checkpoints.done() if checkpoints is not None else ())
+        staged = MISS if eeg_ready else cache.load("staging", **staging_params)
+        if staged is not MISS and _staging_usable(staged.get("hypnogram", [])):
+            by_hypno = eeg_params(staged["hypnogram"])
+            eeg_ready = all(
+                cache.load(name, **params) is not MISS for name, params in (
+                    ("spindles", by_hypno), ("slow_waves", by_hypno),
+                    ("rem", by_hypno), ("bandpower", by_hypno),
+                    ("artifacts", analyse_params),
+                    ("signal_quality", analyse_params),
+                    ("meta", {**analyse_params, "start": recording_start})))
+    if eeg_ready:
+        logger.info("staging en EEG-stappen al bekend — EEG-kanalen "
+                    "worden niet geladen")
+    elif not is_polygraphy:
+        load_plan.add_stage(plan, "staging", staging_needed)
+        if analyse_needed and set(analyse_needed) != set(staging_needed):
+            load_plan.add_stage(plan, "analyse", analyse_needed)
+    if pneumo_ch_list:
+        load_plan.add_stage(
+            plan, "pneumo", list(dict.fromkeys(pneumo_ch_list + [eeg_ch])))
+    plan = load_plan.finalize(plan)
+    eeg_analysis = not is_polygraphy and bool(analyse_needed)
+
+    # ── De stappen als graaf (stage_graph.py) ──────────────────────────
+    # Elke stap noemt wat hij nodig heeft en start zodra dat er is. De
+    # artefactdetectie wacht niet op de staging, pneumo niet op de
+    # EEG-detectoren, en die laatste lopen naast elkaar.
+
+    def st_load():
+        stage_raws = load_plan.execute(plan)
+        raws = {
+            "staging": stage_raws.get("staging"),
+            "analyse": None,
+            "pneumo":  None,
         }
-        logger.info("[task] Polygrafie: staging overgeslagen, %d epochs "
-                    "registratietijd als noemer", n_epochs)
-    else:
-        # ── Stap 1: Staging-raw laden (ENKEL primaire kanalen) ────
-        _set_progress(job_id, 2, 10, "EDF laden voor staging...")
-        staging_needed = list(dict.fromkeys(
-            ch for ch in [eeg_ch, eog_ch, emg_ch] if ch
-        ))
-        logger.info("STAGING EDF laden (%d kanalen)...", len(staging_needed))
-        raw_staging = _load_edf(edf_path, staging_needed, label="STAGING")
-
-        # ── Stap 2: Staging uitvoeren (snel: 3 kanalen) ───────────
-        _set_progress(job_id, 3, 10, "Slaapstaging (AI-model)...")
+        if eeg_analysis and not eeg_ready:
+            raws["analyse"] = stage_raws.get("analyse", raws["staging"])
+            _validate_channels(raws["analyse"], eeg_ch, eog_ch, emg_ch)
+        if pneumo_ch_list:
+            raws["pneumo"] = stage_raws["pneumo"]
+        else:
+            logger.info("Geen pneumo-kanalen — gebruik staging-raw")
+            raws["pneumo"] = raws["staging"]
+        return raws
+
+    def st_staging(load):
+        # Polygrafie: alle epochs "N2", zie hierboven.
+        if is_polygraphy:
+            hypno = ["N2"] * plan.n_epochs
+            logger.info("[task] Polygrafie: staging overgeslagen, %d epochs "
+                        "registratietijd als noemer", plan.n_epochs)
+            return {
+                "success":   False,
+                "skipped":   True,
+                "hypnogram": hypno,
+                "n_epochs":  plan.n_epochs,
+                "reason":    ("polygrafie — geen EEG, dus geen slaapstaging; "
+                              "indices per uur registratietijd (REI)"),
+            }
+        raw_staging = load["staging"]
         logger.info("YASA staging starten...")
-        staging_result = run_sleep_staging(raw_staging, eeg_ch, eog_ch, emg_ch)
-        hypno          = staging_result.get("hypnogram", [])
-        staging_ok     = bool(hypno) and any(s != "W" for s in hypno)
-
-        if staging_ok:
+        result = dict(cache.run(
+            "staging",
+            lambda: run_sleep_staging(raw_staging, eeg_ch, eog_ch, emg_ch),
+            **staging_params))
+        hypno  = result.get("hypnogram", [])
+        if _staging_usable(hypno):
             logger.info("Staging OK: %d epochs — %s",
                         len(hypno), dict(Counter(hypno)))
         else:
-            logger.warning("Staging mislukt: %s — fallback N2",
-                           staging_result.get("error"))
-            n_epochs = int(raw_staging.times[-1] / 30)
-            hypno    = ["N2"] * n_epochs
-            staging_result["hypnogram"] = hypno
-            staging_result["fallback"]  = True
-
-    # ── Stap 3: Analyse-raw laden (alle EEG kanalen) ──────────
-    _set_progress(job_id, 4, 10, "EEG-kanalen laden voor analyse...")
-    analyse_needed = list(dict.fromkeys(
-        ch for ch in [eeg_ch, eog_ch, emg_ch] + extra_eeg if ch
-    ))
-    if is_polygraphy or not analyse_needed:
-        # Geen EEG/EOG/EMG om te analyseren. Spindles, trage golven, REM en
-        # bandpower hebben geen invoer, en een leeg artefactmasker is hier het
-        # juiste antwoord: een EEG-artefactoordeel over een niet-EEG-kanaal
-        # veegde eerder de hele noemer weg. De respiratoire analyse hieronder
-        # draait op haar eigen kanalen en heeft hier niets van nodig.
-        logger.info("[task] Polygrafie: EEG-analyse overgeslagen")
-        raw_analyse  = None
-        yasa_results = {
-            "staging":          staging_result,
-            "sleep_statistics": {"success": False,
-                                 "error": "polygrafie — geen EEG, geen staging",
-                                 "stats": {}},
-            "artifacts":        {"success": False, "artifact_epochs": []},
-            "hypnogram_timeline": [],
-        }
-    else:
-        if set(analyse_needed) == set(staging_needed):
-            logger.info("Analyse-raw = staging-raw")
-            raw_analyse = raw_staging
-        else:
-            logger.info("ANALYSE EDF laden (%d kanalen)...", len(analyse_needed))
-            raw_analyse = _load_edf(edf_path, analyse_needed, label="ANALYSE")
-
-        _validate_channels(raw_analyse, eeg_ch, eog_ch, emg_ch, extra_eeg)
-
-        # ── Stap 4: Volledige YASA analyse (met prefetched hypno) ─
-        _set_progress(job_id, 5, 10, "Spindles, slow waves, bandpower...")
-        logger.info("YASA volledige analyse starten...")
-        yasa_results = run_full_analysis(
-            raw              = raw_analyse,
-            eeg_ch           = eeg_ch,
-            eog_ch           = eog_ch,
-            emg_ch           = emg_ch,
-            all_eeg_channels = extra_eeg,
-            recording_start  = recording_start,
-            prefetched_hypno = hypno,
-        )
-        # Gebruik het reeds berekende staging-resultaat
-        yasa_results["staging"] = staging_result
-
-    # ── Stap 5: Pneumo-kanalen detecteren en laden ────────────
-    _set_progress(job_id, 6, 10, "Pneumo-kanalen laden...")
-    logger.info("Pneumo-kanalen detecteren...")
-    pneumo_ch_list = _detect_pneumo_channels(edf_path, pneumo_channels)
+            logger.warning("Staging mislukt: %s — fallback N2", result.get("error"))
+            hypno = ["N2"] * int(raw_staging.times[-1] / 30)
+            result["hypnogram"] = hypno
+            result["fallback"]  = True
+        return result
+
+    def _eeg_channels(raw):
+        return resolve_eeg_channels(raw, eeg_ch, extra_eeg)
+
+    def st_hypnogram(staging):
+        hypno = staging["hypnogram"]
+        if not eeg_analysis:
+            return {"sleep_statistics": {"success": False,
+                                         "error": "polygrafie — geen EEG, geen staging",
+                                         "stats": {}},
+                    "hypnogram_timeline": []}
+        return {"sleep_statistics":   run_sleep_statistics(hypno),
+                "sleep_cycles":       run_sleep_cycles(hypno),
+                "hypnogram_timeline": build_hypnogram_timeline(hypno, recording_start)}
+
+    def st_spindles(load, staging):
+        raw = load["analyse"]
+        hypno = staging["hypnogram"]
+        return cache.run(
+            "spindles",
+            lambda: run_spindle_detection(raw, hypno, _eeg_channels(raw)),
+            **eeg_params(hypno))
+
+    def st_slow_waves(load, staging):
+        raw = load["analyse"]
+        hypno = staging["hypnogram"]
+        return cache.run(
+            "slow_waves",
+            lambda: run_sw_detection(raw, hypno, _eeg_channels(raw)),
+            **eeg_params(hypno))
+
+    def st_rem(load, staging):
+        raw = load["analyse"]
+        hypno = staging["hypnogram"]
+
+        def compute():
+            chans = _eeg_channels(raw)
+            eog_for_rem = eog_ch if eog_ch and eog_ch in raw.ch_names else chans[0]
+            return run_rem_detection(raw, hypno, eog_for_rem, eeg_ch)
+        return cache.run("rem", compute, **eeg_params(hypno))
+
+    def st_bandpower(load, staging):
+        raw = load["analyse"]
+        hypno = staging["hypnogram"]
+        return cache.run(
+            "bandpower",
+            lambda: run_bandpower(raw, hypno, _eeg_channels(raw)),
+            **eeg_params(hypno))
+
+    def st_meta(load):
+        raw = load["analyse"]
+        meta = cache.run(
+            "meta",
+            lambda: analysis_meta(raw, eeg_ch, eog_ch, emg_ch,
+                                  _eeg_channels(raw), recording_start),
+            **analyse_params, start=recording_start)
+        # Het tijdstip van DEZE analyse, niet dat van de eerste.
+        return {**meta, "analysis_timestamp": datetime.utcnow().isoformat()}
+
+    def st_artifacts(load):
+        # Een leeg artefactmasker is bij polygrafie het juiste antwoord: een
+        # EEG-artefactoordeel over een niet-EEG-kanaal veegde eerder de hele
+        # noemer weg.
+        if not eeg_analysis:
+            return {"success": False, "artifact_epochs": []}
+        raw = load["analyse"]
+        return cache.run(
+            "artifacts",
+            lambda: run_artifact_detection(raw, _eeg_channels(raw)),
+            **analyse_params)
+
+    def st_clipping(load):
+        # v0.8.11 FIX 4: Clipping-detectie → artefact-masker terugkoppeling
+        # Ref: Gemini review — "Epochs with saturated signals should be masked
+        # for AHI calculation so TST is not contaminated."
+        raw_pneumo = load["pneumo"]
+        clipping_epochs: list = []
+        try:
+            from signal_quality import check_channel_quality
+            eeg_ch_name = cfg.get("eeg_ch", "")
+            if raw_pneumo is not None and eeg_ch_name and eeg_ch_name in raw_pneumo.ch_names:
+                eeg_sq = check_channel_quality(
+                    raw_pneumo.get_data(picks=[eeg_ch_name])[0],
+                    raw_pneumo.info["sfreq"], "eeg")
+                if eeg_sq.get("clipping_pct", 0) > 2.0:
+                    # Hoge clipping: markeer epochs met extreme waarden als artefact
+                    eeg_data_sq = raw_pneumo.get_data(picks=[eeg_ch_name])[0]
+                    sf_sq = raw_pneumo.info["sfreq"]
+                    spe_sq = int(sf_sq * 30)
+                    clip_hi = np.percentile(eeg_data_sq, 99.5)
+                    clip_lo = np.percentile(eeg_data_sq, 0.5)
+                    n_epochs_sq = len(eeg_data_sq) // spe_sq
+                    for ep_i in range(n_epochs_sq):
+                        seg = eeg_data_sq[ep_i*spe_sq:(ep_i+1)*spe_sq]
+                        clip_frac = np.sum((seg >= clip_hi) | (seg <= clip_lo)) / len(seg)
+                        if clip_frac > 0.05:  # >5% van epoch is geclipped
+                            clipping_epochs.append(ep_i)
+        except Exception as e:
+            logger.debug("Clipping-check mislukt (niet-kritiek): %s", e)
+        return clipping_epochs
 
-    if pneumo_ch_list:
-        pneumo_needed = list(dict.fromkeys(pneumo_ch_list + [eeg_ch]))
-        logger.info("PNEUMO EDF laden (%d kanalen)...", len(pneumo_needed))
+    def st_pneumo(load, staging, artifacts, clipping):
+        hypno = staging["hypnogram"]
+        # Verzamel artefact-epoch nummers voor exclusie uit AHI/OAHI
+        art_epochs = []
+        if artifacts.get("success"):
+            art_epochs = [e["epoch"] for e in artifacts.get("artifact_epochs", [])]
+        if clipping:
+            art_epochs = sorted(set(art_epochs + clipping))
+            logger.info("v0.8.11: %d clipping-epochs toegevoegd aan artefactmasker "
+                        "(totaal: %d)", len(clipping), len(art_epochs))
+
+        # Blokkerende bevindingen die de gebruiker MOET zien, niet als voetnoot.
+        warnings_: list[dict] = []
+
+        # ── Twee bewakingen op het artefactmasker ────────────────────────
+        #
+        # (a) Bij polygrafie komt dit masker uit een EEG-artefactdetector die
+        #     naar een niet-EEG-kanaal keek. Dat oordeel zegt niets over de
+        #     ademhaling en mag de registratietijd niet wegvegen.
+        if is_polygraphy and art_epochs:
+            logger.info("[task] Polygrafie: %d EEG-artefact-epochs genegeerd — "
+                        "dat oordeel komt niet van een EEG", len(art_epochs))
+            art_epochs = []
+
+        # (b) Keurt de detector ALLES af, dan is dat geen resultaat maar een
+        #     mislukte analyse. Het masker blijft staan — psgscoring geeft dan
+        #     indices als None terug met de reden erbij, en dat is eerlijker
+        #     dan een getal uit een lege noemer. Maar het hoort wel zichtbaar
+        #     te zijn in plaats van als voetnoot: op de opname die dit aan het
+        #     licht bracht stond 100% artefact ergens onderaan het rapport
+        #     terwijl de kop "Ernstig SAS" meldde.
+        _n_ep = len(hypno) or 1
+        _art_frac = len(set(art_epochs)) / _n_ep
+        if _art_frac >= 1.0:
+            logger.error("[task] ALLE %d epochs als artefact gemarkeerd — de "
+                         "indices zijn niet berekenbaar. Kanaalkeuze controleren.",
+                         _n_ep)
+            warnings_.append({
+                "code": "all_epochs_artefact",
+                "severity": "blocking",
+                "message": (f"Alle {_n_ep} epochs zijn als artefact gemarkeerd. "
+                            "Er blijft geen slaaptijd over om indices op te "
+                            "baseren. Controleer of het opgegeven EEG-kanaal "
+                            "werkelijk een EEG is."),
+            })
+
+        logger.info("Artefact-epochs voor pneumo exclusie: %d", len(art_epochs))
+
+        # v0.9.8: per-job toggle for the ML arousal re-classifier. Via het
+        # profiel (_run_pneumo), niet via os.environ: de andere stappen lopen
+        # op threads in hetzelfde proces en zagen die tijdelijke wijziging.
+        _arousal_lgbm = bool(cfg.get("arousal_lgbm", False))
+        if _arousal_lgbm:
+            logger.info("[task] Arousal LGBM re-classifier ENABLED for this job")
+        # De headervelden (patiënt, technicus, datum) niet in de cache: de
+        # sleutel is de inhoudshash, en die deelt een andere job — of een
+        # latere, geanonimiseerde versie — niet noodzakelijk met deze header.
+        results = cache.run(
+            "pneumo",
+            lambda: _without_patient_info(_run_pneumo(
+                arousal_lgbm     = _arousal_lgbm,
+                raw              = load["pneumo"],
+                hypno            = hypno,
+                channel_map      = pneumo_channels,
+                artifact_epochs  = art_epochs,
+                scoring_profile  = cfg.get("scoring_profile", "standard"),
+            )),
+            channels=pneumo_ch_list, channel_map=pneumo_channels,
+            eeg=eeg_ch, hypno=stage_cache.digest(hypno),
+            artifact_epochs=art_epochs,
+            profile=cfg.get("scoring_profile", "standard"),
+            arousal_lgbm=_arousal_lgbm)
+        return {"results": _with_own_patient_info(results, edf_path),
+                "warnings": warnings_}
+
+    def st_confidence(staging):
         try:
-            raw_pneumo = _load_edf(edf_path, pneumo_needed, label="PNEUMO")
+            from validation_metrics import compute_confidence_review_stats
+            conf_review = compute_confidence_review_stats(
+                staging["hypnogram"], staging.get("confidence", {}), threshold=0.70)
+            logger.info("Confidence review: %d/%d low-confidence epochs (%.1f%%)",
+                        conf_review["n_low_confidence"], conf_review["n_epochs"],
+                        conf_review["pct_low_confidence"])
+            return conf_review
         except Exception as e:
-            logger.warning("Pneumo EDF mislukt (%s) — gebruik staging-raw", e)
-            raw_pneumo = raw_staging
-    else:
-        logger.info("Geen pneumo-kanalen — gebruik staging-raw")
-        raw_pneumo = raw_staging
-
-    # ── Stap 6: Pneumo-analyse ────────────────────────────────
-    _set_progress(job_id, 7, 10, "Respiratoire analyse (AHI, SpO2)...")
-    logger.info("Pneumo-analyse starten...")
-    # Verzamel artefact-epoch nummers voor exclusie uit AHI/OAHI
-    art_epochs = []
-    art_data = yasa_results.get("artifacts", {})
-    if art_data.get("success"):
-        art_epochs = [e["epoch"] for e in art_data.get("artifact_epochs", [])]
-
-    # v0.8.11 FIX 4: Clipping-detectie → artefact-masker terugkoppeling
-    # Ref: Gemini review — "Epochs with saturated signals should be masked
-    # for AHI calculation so TST is not contaminated."
-    try:
-        from signal_quality import check_channel_quality
-        eeg_ch_name = cfg.get("eeg_ch", "")
-        if eeg_ch_name and eeg_ch_name in raw_pneumo.ch_names:
-            eeg_sq = check_channel_quality(
-                raw_pneumo.get_data(picks=[eeg_ch_name])[0],
-                raw_pneumo.info["sfreq"], "eeg")
-            if eeg_sq.get("clipping_pct", 0) > 2.0:
-                # Hoge clipping: markeer epochs met extreme waarden als artefact
-                eeg_data_sq = raw_pneumo.get_data(picks=[eeg_ch_name])[0]
-                sf_sq = raw_pneumo.info["sfreq"]
-                spe_sq = int(sf_sq * 30)
-                clip_hi = np.percentile(eeg_data_sq, 99.5)
-                clip_lo = np.percentile(eeg_data_sq, 0.5)
-                n_epochs_sq = len(eeg_data_sq) // spe_sq
-                clipping_epochs = []
-                for ep_i in range(n_epochs_sq):
-                    seg = eeg_data_sq[ep_i*spe_sq:(ep_i+1)*spe_sq]
-                    clip_frac = np.sum((seg >= clip_hi) | (seg <= clip_lo)) / len(seg)
-                    if clip_frac > 0.05:  # >5% van epoch is geclipped
-                        clipping_epochs.append(ep_i)
-                if clipping_epochs:
-                    art_epochs = sorted(set(art_epochs + clipping_epochs))
-                    logger.info("v0.8.11: %d clipping-epochs toegevoegd aan artefactmasker "
-                               "(totaal: %d)", len(clipping_epochs), len(art_epochs))
-    except Exception as e:
-        logger.debug("Clipping-check mislukt (niet-kritiek): %s", e)
+            logger.warning("Confidence review mislukt: %s", e)
+            return {"n_low_confidence": 0, "pct_low_confidence": 0}
 
-    # Blokkerende bevindingen die de gebruiker MOET zien, niet als voetnoot.
-    analysis_warnings: list[dict] = []
+    def st_signal_quality(load):
+        try:
+            from signal_quality import check_signal_quality
+            sq = cache.run("signal_quality",
+                           lambda: check_signal_quality(load["analyse"]),
+                           **analyse_params)
+            if sq.get("issues"):
+                logger.warning("Signaal-kwaliteitsproblemen: %s", sq["issues"])
+            else:
+                logger.info("Signaal-kwaliteit: %s (%d goed, %d matig, %d slecht)",
+                            sq["overall"], sq["n_good"], sq["n_moderate"], sq["n_poor"])
+            return sq
+        except Exception as e:
+            logger.warning("Signaal-kwaliteitscheck mislukt: %s", e)
+            return {}
+
+    stages = [
+        Stage("load", st_load, label="EDF geladen", checkpoint=False),
+        Stage("staging", st_staging, ("load",), "Slaapstaging"),
+        Stage("hypnogram", st_hypnogram, ("staging",), "Slaapstatistieken"),
+        Stage("artifacts", st_artifacts, ("load",), "Artefacten"),
+        Stage("clipping", st_clipping, ("load",), "Clipping-controle"),
+        Stage("pneumo", st_pneumo, ("load", "staging", "artifacts", "clipping"),
+              "Respiratoire analyse"),
+        Stage("confidence", st_confidence, ("staging",), "Confidence review"),
+        Stage("signal_quality", st_signal_quality, ("load",), "Signaalkwaliteit"),
+    ]
+    if eeg_analysis:
+        stages += [
+            Stage("spindles", st_spindles, ("load", "staging"), "Spindles"),
+            Stage("slow_waves", st_slow_waves, ("load", "staging"), "Slow waves"),
+            Stage("rem", st_rem, ("load", "staging"), "REM"),
+            Stage("bandpower", st_bandpower, ("load", "staging"), "Bandvermogen"),
+            Stage("meta", st_meta, ("load",), "Opnamegegevens"),
+        ]
+
+    def _progress(stage, n_done, n_total):
+        # Stap 2 is het laden, 9 het opslaan: de graaf vult wat ertussen ligt.
+        report(2 + round(6 * n_done / n_total), 10,
+               f"{stage.label} klaar ({n_done}/{n_total})")
+
+    out, stage_timings = run_stages(stages, on_done=_progress,
+                                    checkpoints=checkpoints)
+
+    yasa_results: dict = {"staging": out["staging"], **out["hypnogram"],
+                          "artifacts": out["artifacts"]}
+    if eeg_analysis:
+        for name in ("meta", "spindles", "slow_waves", "rem", "bandpower"):
+            yasa_results[name] = out[name]
+    return {
+        **yasa_results,
+        "pneumo":           out["pneumo"]["results"],
+        "analysis_warnings": out["pneumo"]["warnings"],
+        # Wat er WERKELIJK gedraaid heeft, niet wat er aangevinkt stond. Het
+        # rapport moet "REI" boven een REI zetten, ook wanneer het studietype
+        # per ongeluk op PSG bleef staan.
+        "is_polygraphy":    is_polygraphy,
+        "edf_path":         edf_path,              # v0.8.22: voor epoch-plots in PDF
+        "pneumo_channels":  pneumo_channels,        # v0.8.22: kanaalmap voor epoch-plots
+        "confidence_review": out["confidence"],
+        "signal_quality":    out["signal_quality"],
+        # Waarmee er gerekend is; hergebruik (reuse_analysis_results) eist
+        # dezelfde versies.
+        "versions":         _library_versions(),
+        # Begin/einde/duur per stap (s sinds de start van de graaf), om te
+        # zien wat er overlapte en waar de tijd naartoe ging.
+        "stage_timings":    stage_timings,
+        # Welke stappen uit de stapcache kwamen ("hit") en welke berekend
+        # werden ("miss"); leeg als de cache uit staat.
+        "stage_cache":      cache.outcome,
+    }
 
-    # ── Twee bewakingen op het artefactmasker ────────────────────────────
-    #
-    # (a) Bij polygrafie komt dit masker uit een EEG-artefactdetector die
-    #     naar een niet-EEG-kanaal keek. Dat oordeel zegt niets over de
-    #     ademhaling en mag de registratietijd niet wegvegen.
-    if is_polygraphy and art_epochs:
-        logger.info("[task] Polygrafie: %d EEG-artefact-epochs genegeerd — "
-                    "dat oordeel komt niet van een EEG", len(art_epochs))
-        art_epochs = []
 
-    # (b) Keurt de detector ALLES af, dan is dat geen resultaat maar een
-    #     mislukte analyse. Het masker blijft staan — psgscoring geeft dan
-    #     indices als None terug met de reden erbij, en dat is eerlijker dan
-    #     een getal uit een lege noemer. Maar het hoort wel zichtbaar te zijn
-    #     in plaats van als voetnoot: op de opname die dit aan het licht
-    #     bracht stond 100% artefact ergens onderaan het rapport terwijl de
-    #     kop "Ernstig SAS" meldde.
-    _n_ep = len(hypno) or 1
-    _art_frac = len(set(art_epochs)) / _n_ep
-    if _art_frac >= 1.0:
-        logger.error("[task] ALLE %d epochs als artefact gemarkeerd — de "
-                     "indices zijn niet berekenbaar. Kanaalkeuze controleren.",
-                     _n_ep)
-        analysis_warnings.append({
-            "code": "all_epochs_artefact",
-            "severity": "blocking",
-            "message": (f"Alle {_n_ep} epochs zijn als artefact gemarkeerd. "
-                        "Er blijft geen slaaptijd over om indices op te "
-                        "baseren. Controleer of het opgegeven EEG-kanaal "
-                        "werkelijk een EEG is."),
-        })
-
-    logger.info("Artefact-epochs voor pneumo exclusie: %d", len(art_epochs))
-
-    # v0.9.8: per-job toggle for the ML arousal re-classifier. The
-    # YASAFlaskified arousal_analysis module reads the env var once at
-    # the top of detect_arousals(), so we set it right before the
-    # psgscoring pipeline call (which transitively invokes
-    # run_arousal_respiratory_analysis) and restore it afterwards so
-    # that subsequent jobs in the same RQ worker process are not
-    # affected.
-    _arousal_lgbm = bool(cfg.get("arousal_lgbm", False))
-    _saved_lgbm_env = os.environ.get("YASAFLASKIFIED_AROUSAL_LGBM")
-    if _arousal_lgbm:
-        os.environ["YASAFLASKIFIED_AROUSAL_LGBM"] = "1"
-        logger.info("[task] Arousal LGBM re-classifier ENABLED for this job")
-    try:
-        pneumo_results = run_pneumo_analysis(
-            raw              = raw_pneumo,
-            hypno            = hypno,
-            channel_map      = pneumo_channels,
-            artifact_epochs  = art_epochs,
-            scoring_profile  = cfg.get("scoring_profile", "standard"),
-        )
-    finally:
-        if _saved_lgbm_env is None:
-            os.environ.pop("YASAFLASKIFIED_AROUSAL_LGBM", None)
-        else:
-            os.environ["YASAFLASKIFIED_AROUSAL_LGBM"] = _saved_lgbm_env
+def _run_pneumo(arousal_lgbm: bool = False, **kwargs) -> dict:
+    """run_pneumo_analysis, met de LGBM-arousalclassifier als expliciete keuze.
 
-    # ── Stap 7: Confidence review + signaal kwaliteit ────────
-    _set_progress(job_id, 8, 10, "Kwaliteitscontrole...")
+    psgscoring leest die uit het profiel (AROUSAL_LGBM) of uit de omgeving.
+    Voor één job wordt het dus een variant van het gekozen profiel met de
+    vlag aan; de meta noemt gewoon het gekozen profiel. Een
+    omgevingsvariabele van de installatie blijft winnen, zoals in psgscoring.
+    """
+    if not arousal_lgbm:
+        return run_pneumo_analysis(**kwargs)
+    from psgscoring.constants import SCORING_PROFILES
+    from psgscoring.profiles import resolve_profile_name
+
+    asked = kwargs.get("scoring_profile", "aasm_v3_rec")
+    name = resolve_profile_name(asked)
+    variant = f"{name}+arousal_lgbm"
+    base = SCORING_PROFILES.get(name, SCORING_PROFILES["aasm_v3_rec"])
+    SCORING_PROFILES.setdefault(variant, {**base, "AROUSAL_LGBM": True})
+    out = run_pneumo_analysis(**{**kwargs, "scoring_profile": variant})
+    meta = out.setdefault("meta", {})
+    meta.update(scoring_profile=name, scoring_input_name=asked, arousal_lgbm=True)
+    if isinstance(out.get("ahi_interval"), dict):
+        out["ahi_interval"]["primary_profile"] = asked
+    return out
+
+
+def run_analysis_job(job_id: str, resume: bool = True) -> dict:
+    """
+    Volledige slaap + pneumo analyse als job: config lezen, `run_pipeline`,
+    results.json bewaren en de rapporten als eigen jobs inschakelen.
 
-    # Confidence-based review stats
-    try:
-        from validation_metrics import compute_confidence_review_stats
-        conf_review = compute_confidence_review_stats(
-            hypno, staging_result.get("confidence", {}), threshold=0.70)
-        logger.info("Confidence review: %d/%d low-confidence epochs (%.1f%%)",
-                    conf_review["n_low_confidence"], conf_review["n_epochs"],
-                    conf_review["pct_low_confidence"])
-    except Exception as e:
-        logger.warning("Confidence review mislukt: %s", e)
-        conf_review = {"n_low_confidence": 0, "pct_low_confidence": 0}
+    Elke afgewerkte stap wordt bewaard (job_checkpoint.py). Een nieuwe poging
+    op dezelfde job en config gaat verder waar de vorige stopte; `resume=False`
+    begint toch van nul.
+    """
+    started = datetime.utcnow()
+    logger.info("▶ Job gestart: %s | UPLOAD_FOLDER: %s", job_id, UPLOAD_FOLDER)
+    _set_progress(job_id, 1, 10, "Config laden...")
 
-    # Signaal kwaliteitscheck
-    signal_quality = {}
-    try:
-        from signal_quality import check_signal_quality
-        sq = check_signal_quality(raw_analyse)
-        signal_quality = sq
-        if sq.get("issues"):
-            logger.warning("Signaal-kwaliteitsproblemen: %s", sq["issues"])
-        else:
-            logger.info("Signaal-kwaliteit: %s (%d goed, %d matig, %d slecht)",
-                       sq["overall"], sq["n_good"], sq["n_moderate"], sq["n_poor"])
-    except Exception as e:
-        logger.warning("Signaal-kwaliteitscheck mislukt: %s", e)
+    # ── Config laden ──────────────────────────────────────────
+    config_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_config.json")
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"Config niet gevonden: {config_path}")
+
+    with open(config_path) as f:
+        cfg = json.load(f)
+
+    checkpoints = JobCheckpoints(
+        checkpoint_dir(UPLOAD_FOLDER, job_id),
+        stage_cache.digest({"config": cfg, "versions": _library_versions()}))
+    if not resume:
+        checkpoints.clear()
+
+    analysis = run_pipeline(
+        cfg, checkpoints=checkpoints,
+        progress=lambda step, total, label: _set_progress(job_id, step, total, label))
+    edf_path        = cfg["edf_path"]
+    eeg_ch          = cfg["eeg_ch"]
+    eog_ch          = cfg.get("eog_ch")
+    emg_ch          = cfg.get("emg_ch")
+    pneumo_channels = cfg.get("pneumo_channels", {})
+    hypno           = analysis["staging"]["hypnogram"]
+    stage_timings   = analysis["stage_timings"]
 
     # ── Stap 8: Combineer en sla op ───────────────────────────
     _set_progress(job_id, 9, 10, "Resultaten opslaan...")
     combined = {
-        **yasa_results,
-        "pneumo":           pneumo_results,
-        "analysis_warnings": analysis_warnings,
-        # Wat er WERKELIJK gedraaid heeft, niet wat er aangevinkt stond. Het
-        # rapport moet "REI" boven een REI zetten, ook wanneer het studietype
-        # per ongeluk op PSG bleef staan.
-        "is_polygraphy":    is_polygraphy,
-        "patient_info":     patient_info,
+        **analysis,
+        "patient_info":     cfg.get("patient_info", {}),
         "job_id":           job_id,
-        "edf_path":         edf_path,              # v0.8.22: voor epoch-plots in PDF
-        "pneumo_channels":  pneumo_channels,        # v0.8.22: kanaalmap voor epoch-plots
-        "confidence_review": conf_review,
-        "signal_quality":    signal_quality,
         # v0.8.11: multi-site toegangscontrole
         "site_id":          cfg.get("site_id"),
         "owner_username":   cfg.get("owner_username", ""),
         "study_type":       cfg.get("study_type", "diagnostic_psg"),
     }
-    result_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_results.json")
-    with open(result_path, "w", encoding="utf-8") as f:
-        json.dump(combined, f, indent=2, default=_json_serializer)
+    result_path = _save_results(job_id, combined)
     logger.info("JSON opgeslagen")
+    checkpoints.clear()
 
-    errors   = _collect_errors(combined)
-    pdf_path = xlsx_path = psg_path = None
-
-    _set_progress(job_id, 9, 10, "PDF & Excel rapporten genereren...")
-    try:
-        pdf_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_rapport.pdf")
-        _lang = cfg.get("language") or patient_info.get("lang") or "en"
-        generate_pdf_report(combined, pdf_path, lang=_lang)
-        logger.info("PDF opgeslagen (%s)", _lang)
-    except Exception as e:
-        logger.error("PDF mislukt: %s", e)
-        errors.append(f"pdf: {e}")
-
-    try:
-        xlsx_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_rapport.xlsx")
-        generate_excel_report(combined, xlsx_path)
-        logger.info("Excel opgeslagen")
-    except Exception as e:
-        logger.error("Excel mislukt: %s", e)
-        errors.append(f"xlsx: {e}")
-
-    # PSG-rapport: niet apart gegenereerd — /psg redirect naar /pdf (portrait AASM)
-    psg_path = pdf_path  # zelfde bestand
-
-    # EDF+ generatie: nu INLINE in pipeline (v14 — edfio, <10s)
-    edfplus_path = None
-    try:
-        if os.path.exists(edf_path):
-            edfplus_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_scored.edf")
-            generate_edfplus(edf_path, combined, edfplus_path)
-            logger.info("EDF+ opgeslagen: %s", edfplus_path)
-    except Exception as e:
-        logger.warning("EDF+ generatie mislukt (niet-blokkerend): %s", e)
-        errors.append(f"edfplus: {e}")
-        edfplus_path = None
-
+    # Het resultaat staat er: de job is klaar. PDF, Excel, EDF+ en de mail
+    # volgen als eigen jobs (_fan_out_reports).
+    errors = _collect_errors(combined)
+    artifacts = _fan_out_reports(job_id, cfg)
     _set_progress(job_id, 10, 10, "Voltooid!")
-    _send_email_notification(job_id, combined)
     elapsed = (datetime.utcnow() - started).total_seconds()
     logger.info("✅ Job voltooid: %s (%.1f sec)", job_id, elapsed)
+    # Voor de kostschatting (job_estimate.py) telt alleen een run die alles
+    # zelf rekende; een hervatte of gecachete run zegt niets over de opname.
+    if (not any(t.get("restored") for t in stage_timings.values())
+            and "hit" not in analysis["stage_cache"].values()):
+        _record_timing("analysis", job_id, edf_path, elapsed,
+                       study_type=cfg.get("study_type"))
 
     # ── Studievergelijking inschakelen, op een APARTE wachtrij ──────────
     #
@@ -513,20 +710,24 @@ def run_analysis_job(job_id: str) -> dict:
     if _study.get("comparison_profiles"):
         try:
             from redis import Redis as _Redis
-            from rq import Queue as _Queue
-            _q = _Queue("study", connection=_Redis(
-                host=os.environ.get("YASAFLASKIFIED_REDIS_HOST", "redis"),
-                port=int(os.environ.get("YASAFLASKIFIED_REDIS_PORT", 6379))))
-            _sj = _q.enqueue(
-                "tasks.run_study_comparison",
-                job_id, edf_path, UPLOAD_FOLDER,
-                _study.get("comparison_profiles"),
-                _study.get("primary_profile"),
-                eeg_ch, eog_ch, emg_ch, pneumo_channels, hypno,
-                job_timeout="6h")
-            _study_job_id = _sj.id
-            logger.info("[study] vergelijking ingeschakeld op wachtrij "
-                        "'study': %s (%d profielen)", _sj.id,
+            _study_estimate = job_estimate.estimate(
+                UPLOAD_FOLDER, "study",
+                job_estimate.features(read_summary(edf_path), None,
+                                      len(_study["comparison_profiles"])))
+            _study_job_id = job_scheduler.submit(
+                _Redis(host=os.environ.get("YASAFLASKIFIED_REDIS_HOST", "redis"),
+                       port=int(os.environ.get("YASAFLASKIFIED_REDIS_PORT", 6379))),
+                "study", job_id, "tasks.run_study_comparison",
+                (job_id, edf_path, UPLOAD_FOLDER,
+                 _study.get("comparison_profiles"),
+                 _study.get("primary_profile"),
+                 eeg_ch, eog_ch, emg_ch, pneumo_channels, hypno),
+                site=cfg.get("site_id"), priority="research",
+                job_timeout=job_estimate.timeout_s(_study_estimate, job_estimate.STUDY_TIMEOUT_S),
+                estimate_s=_study_estimate["runtime_s"],
+                ram_mb=_study_estimate["ram_mb"])
+            logger.info("[study] vergelijking ingediend voor wachtrij "
+                        "'study': %s (%d profielen)", _study_job_id or "wacht",
                         len(_study["comparison_profiles"]))
         except Exception as e:                                   # noqa: BLE001
             # Een mislukte inschakeling mag het klinische resultaat niet raken,
@@ -541,34 +742,486 @@ def run_analysis_job(job_id: str) -> dict:
         "elapsed_sec":  round(elapsed, 1),
         "study_job_id": _study_job_id,
         "result_json":  result_path,
-        "result_pdf":   pdf_path,
-        "result_excel": xlsx_path,
-        "result_psg":   psg_path,
-        "result_edfplus": edfplus_path,
+        "artifacts":    artifacts,
         "errors":       errors,
     }
 
 
+def prepare_analysis(cfg: dict) -> dict:
+    """
+    Voorwerk terwijl de gebruiker op het kanaalkeuzescherm zit.
+
+    Tussen /parse_file en /analyze vult de gebruiker een minuut of meer
+    patiëntgegevens in; een vrije worker zet intussen de kolomcache
+    (signal_cache.py) klaar en rekent staging en signaalkwaliteit op de
+    voorgeselecteerde kanalen (channel_map.preselect) in de stapcache. Dient
+    de gebruiker dezelfde kanalen in, dan vindt run_pipeline ze daar terug;
+    kiest de gebruiker andere, dan is het voorwerk een sleutel die niemand opvraagt.
+
+    `cfg` heeft de kanaalvelden van een jobconfig plus edf_path, job_id en
+    content_hash. Loopt de analyse van die job al, dan is er niets meer voor
+    te bereiden.
+    """
+    job_id   = cfg.get("job_id")
+    edf_path = cfg["edf_path"]
+    eeg_ch   = cfg.get("eeg_ch")
+    eog_ch   = cfg.get("eog_ch")
+    emg_ch   = cfg.get("emg_ch")
+    if job_id and job_state.get(_get_progress_redis(), job_id).get("status") != "parsed":
+        logger.info("[PREPARE] %s is al gestart — geen voorwerk", job_id)
+        return {"signal_cache": False, "stage_cache": {}}
+    built = bool(signal_cache.build_signal_cache(edf_path))
+    cache = _stage_cache(edf_path, cfg.get("content_hash"))
+    if not eeg_ch or not cache.enabled:
+        return {"signal_cache": built, "stage_cache": {}}
+
+    plan = load_plan.read_plan_header(edf_path)
+    staging_params, analyse_params = _stage_params(
+        eeg_ch, eog_ch, emg_ch,
+        _extra_eeg(plan.ch_names, eeg_ch, cfg.get("extra_eeg_ch") or [eeg_ch]))
+    raws: dict = {}
+
+    def load() -> dict:
+        # Zelfde laadplan als run_pipeline: dezelfde samples, dus dezelfde
+        # uitkomst. Pas laden als er iets te rekenen valt.
+        if not raws:
+            load_plan.add_stage(plan, "staging", staging_params["channels"])
+            if set(analyse_params["channels"]) != set(staging_params["channels"]):
+                load_plan.add_stage(plan, "analyse", analyse_params["channels"])
+            raws.update(load_plan.execute(load_plan.finalize(plan)))
+            raws.setdefault("analyse", raws["staging"])
+        return raws
+
+    from signal_quality import check_signal_quality
+    cache.run("staging", lambda: run_sleep_staging(load()["staging"], eeg_ch, eog_ch, emg_ch),
+              **staging_params)
+    cache.run("signal_quality", lambda: check_signal_quality(load()["analyse"]),
+              **analyse_params)
+    logger.info("[PREPARE] %s voorbereid: %s", job_id or edf_path, cache.outcome)
+    return {"signal_cache": built, "stage_cache": dict(cache.outcome)}
+
+
+def _library_versions() -> dict:
+    """Versies die de uitkomst van de pipeline bepalen."""
+    from importlib.metadata import PackageNotFoundError
+    from importlib.metadata import version as _dist_version
+
+    from version import __version__ as app_version
+    versions = {"yasaflaskified": app_version}
+    for dist in ("yasa", "mne", "psgscoring", "numpy", "scipy", "lightgbm"):
+        try:
+            versions[dist] = _dist_version(dist)
+        except PackageNotFoundError:
+            versions[dist] = None
+    return versions
+
+
+def _stage_cache(edf_path: str, known_hash: str | None = None,
+                 root: str | None = None) -> StageCache:
+    """De stapcache voor deze opname (zie stage_cache.py).
+
+    De inhoudshash uit de jobconfig scheelt een volledige lezing van de EDF;
+    ontbreekt die (oudere jobs, CLI), dan wordt hij hier berekend — alleen
+    als de cache aan staat.
+    """
+    root = stage_cache.cache_root(root or os.path.join(UPLOAD_FOLDER, "stage_cache"))
+    recording = None
+    if root:
+        import content_hash
+        recording = known_hash or content_hash.file_hash(edf_path)
+    return StageCache(root, recording, _library_versions())
+
+
+def prune_stage_cache(conn=None, root: str | None = None) -> int:
+    """De stapcache van UPLOAD_FOLDER opruimen (stage_cache.prune).
+
+    Vanuit het onderhoud van elke worker; met `conn` hooguit één keer per
+    uur over alle workers heen, want de map is gedeeld en het doorlopen
+    kost een `stat` per item.
+    """
+    root = stage_cache.cache_root(root or os.path.join(UPLOAD_FOLDER, "stage_cache"))
+    if not root:
+        return 0
+    if conn is not None and not conn.set("stage_cache:pruned", 1, nx=True, ex=3600):
+        return 0
+    removed = stage_cache.prune(root)
+    if removed:
+        logger.info("[CACHE] %d verlopen items opgeruimd", removed)
+    return removed
+
+
+def _stage_params(eeg_ch, eog_ch, emg_ch, extra_eeg: list,
+                  polygraphy: bool = False) -> tuple[dict, dict]:
+    """De cacheparameters van de staging- en de EEG-analysestappen.
+
+    `channels` is wat elke stap laadt. run_pipeline en prepare_analysis
+    moeten hier exact hetzelfde uitkomen, anders vindt de analyse het
+    voorwerk niet terug.
+    """
+    staging_needed: list = []
+    analyse_needed: list = []
+    if not polygraphy:
+        staging_needed = list(dict.fromkeys(
+            ch for ch in [eeg_ch, eog_ch, emg_ch] if ch
+        ))
+        analyse_needed = list(dict.fromkeys(
+            ch for ch in [eeg_ch, eog_ch, emg_ch] + extra_eeg if ch
+        ))
+    return ({"channels": staging_needed, "eeg": eeg_ch, "eog": eog_ch, "emg": emg_ch},
+            {"channels": analyse_needed, "eeg": eeg_ch, "eog": eog_ch, "emg": emg_ch,
+             "extra_eeg": list(extra_eeg)})
+
+
+def _record_timing(kind: str, job_id: str, edf_path: str, runtime_s: float,
+                   study_type: str | None = None, n_profiles: int = 0,
+                   workers: int = 1) -> None:
+    try:
+        feats = job_estimate.features(read_summary(edf_path), study_type, n_profiles,
+                                      workers)
+    except Exception as e:                                       # noqa: BLE001
+        logger.warning("[ESTIMATE] header van %s onleesbaar: %s", job_id, e)
+        return
+    # `workers`: zoveel kindprocessen liepen tegelijk (profile_pool); voor de
+    # duur een kenmerk, voor het geheugen een veelvoud van het grootste kind.
+    job_estimate.record(UPLOAD_FOLDER, kind, job_id, feats, runtime_s,
+                        job_estimate.peak_rss_mb(children=workers))
+
+
+def _staging_usable(hypno: list) -> bool:
+    """Een hypnogram waar de pipeline mee verder kan — niet leeg, niet enkel W."""
+    return bool(hypno) and any(s != "W" for s in hypno)
+
+
+# ── Onderbroken jobs opnieuw in de wachtrij ──────────────────────────
+#
+# Een timeout of een door de kernel gestopte work-horse (OOM) zegt niets over
+# de opname; een nieuwe poging met meer tijd hervat vanaf de checkpoints.
+# Een gewone exceptie (ontbrekend bestand, fout kanaal) komt bij een nieuwe
+# poging gewoon terug, dus die gaat niet opnieuw.
+JOB_RETRIES = int(os.environ.get("YASAFLASKIFIED_JOB_RETRIES", 1))
+RETRY_TIMEOUT_FACTOR = float(os.environ.get("YASAFLASKIFIED_RETRY_TIMEOUT_FACTOR", 2))
+ANALYSIS_FAILURE_CALLBACK = "tasks.on_analysis_failure"
+
+
+def requeue_interrupted_job(job, reason: str) -> str | None:
+    """Zet een onderbroken `run_analysis_job` opnieuw klaar, met meer tijd.
+
+    Geeft het nieuwe RQ-id, of None als er niet (meer) opnieuw geprobeerd
+    wordt. De status-API volgt `rq_id` in job_state, dus dat wijst daarna
+    naar de nieuwe poging.
+    """
+    from rq import Queue as _Queue
+    from rq.job import Callback
+
+    if job.func_name != "tasks.run_analysis_job" or not job.args:
+        return None
+    app_job_id = job.args[0]
+    attempt = int(job.meta.get("attempt", 1))
+    if attempt > JOB_RETRIES:
+        logger.error("[RETRY] %s: %s na %d poging(en) — niet opnieuw",
+                     app_job_id, reason, attempt)
+        return None
+    timeout = int((job.timeout or 900) * RETRY_TIMEOUT_FACTOR)
+    # De nieuwe poging houdt de plaats van de site in de scheduler
+    # (job_scheduler.job_ended) en krijgt dus ook diens callbacks mee.
+    meta = {**job.meta, "attempt": attempt + 1, "retry_of": job.id,
+            "retry_reason": reason}
+    callbacks = {"on_failure": Callback(ANALYSIS_FAILURE_CALLBACK),
+                 **job_scheduler.completion_callbacks(meta)}
+    new = _Queue(job.origin, connection=job.connection).enqueue(
+        "tasks.run_analysis_job", args=job.args, kwargs=job.kwargs,
+        job_timeout=timeout, result_ttl=job.result_ttl, meta=meta, **callbacks)
+    job_state.update(job.connection, app_job_id, status="queued", rq_id=new.id)
+    _set_progress(app_job_id, 1, 10,
+                  f"Onderbroken ({reason}) — poging {attempt + 1} in de wachtrij")
+    logger.warning("[RETRY] %s: %s — opnieuw als %s met timeout %d s",
+                   app_job_id, reason, new.id, timeout)
+    return new.id
+
+
+def on_analysis_failure(job, connection, exc_type, exc_value, tb) -> None:
+    """RQ-failure-callback van `run_analysis_job`: alleen een timeout of geheugentekort."""
+    from rq.timeouts import JobTimeoutException
+
+    if exc_type is not None and issubclass(exc_type, (JobTimeoutException, MemoryError)):
+        requeue_interrupted_job(job, exc_type.__name__)
+
+
+def _save_results(job_id: str, combined: dict) -> str:
+    """results.json van een nieuwe pipelinerun; zie pipeline_results.py."""
+    result_path = pipeline_results.results_path(UPLOAD_FOLDER, job_id)
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(combined, f, indent=2, default=_json_serializer)
+    pipeline_results.written(result_path)
+    return result_path
+
+
+# ─────────────────────────────────────────────
+# RAPPORTEN ALS AFZONDERLIJKE JOBS
+# ─────────────────────────────────────────────
+#
+# PDF, Excel, EDF+ en de mail werden na elkaar gemaakt vóór de analysejob
+# als klaar gold. De clinicus kijkt eerst naar de HTML-resultaten, en die
+# hebben alleen results.json nodig; hij wachtte dus op openpyxl en de
+# EDF+-schrijver voor niets. Nu is de job klaar zodra results.json er
+# staat, en maakt elk artefact zijn eigen kleine job — parallel als er
+# meerdere workers vrij zijn.
+#
+# De toestand per artefact staat in `job:{job_id}:artifacts` (pending,
+# running, ready, failed, skipped); status-API en dashboard tonen die. Wie
+# toch al op een downloadknop klikt, krijgt het bestand zoals voorheen: die
+# routes genereren zelf als het ontbreekt.
+#
+# De artefactjobs gaan door job_scheduler.submit, zoals analyses: met de
+# prioriteit en site van hun analyse, een timeout uit de kostschatting
+# (job_estimate, soort "report") en `ram_mb` voor de geheugentoelating van
+# de worker. Rechtstreeks op `default` sprongen ze voor de wachtende jobs van
+# andere sites.
+
+ARTIFACTS = ("pdf", "xlsx", "edfplus", "email")
+ARTIFACT_TTL_S = 7 * 86400
+REPORT_FAILURE_CALLBACK = "tasks.on_report_failure"
+
+
+def _set_artifact(job_id: str, kind: str, state: str, error: str = "") -> None:
+    try:
+        r = _get_progress_redis()
+        key = f"job:{job_id}:artifacts"
+        r.hset(key, mapping={kind: state, f"{kind}_error": error[:500]})
+        r.expire(key, ARTIFACT_TTL_S)
+    except Exception:
+        pass
+
+
+def generate_report_artifact(job_id: str, kind: str) -> dict:
+    """Eén artefact uit results.json: pdf, xlsx, edfplus of email."""
+    import time
+    with open(os.path.join(UPLOAD_FOLDER, f"{job_id}_results.json"),
+              encoding="utf-8") as f:
+        results = json.load(f)
+    cfg: dict = {}
+    try:
+        with open(os.path.join(UPLOAD_FOLDER, f"{job_id}_config.json")) as f:
+            cfg = json.load(f)
+    except (OSError, ValueError):
+        pass
+    patient_info = results.get("patient_info") or {}
+    _set_artifact(job_id, kind, "running")
+    started = time.monotonic()
+    path = None
+    try:
+        if kind == "pdf":
+            path = os.path.join(UPLOAD_FOLDER, f"{job_id}_rapport.pdf")
+            _lang = cfg.get("language") or patient_info.get("lang") or "en"
+            generate_pdf_report(results, path, lang=_lang)
+        elif kind == "xlsx":
+            path = os.path.join(UPLOAD_FOLDER, f"{job_id}_rapport.xlsx")
+            generate_excel_report(results, path)
+        elif kind == "edfplus":
+            # v14 — edfio, <10s; niet-blokkerend zoals voorheen
+            edf_path = results.get("edf_path", "")
+            if not os.path.exists(edf_path):
+                raise FileNotFoundError(f"EDF niet gevonden: {edf_path}")
+            path = os.path.join(UPLOAD_FOLDER, f"{job_id}_scored.edf")
+            generate_edfplus(edf_path, results, path)
+        elif kind == "email":
+            if not _send_email_notification(job_id, results):
+                _set_artifact(job_id, kind, "skipped")
+                return {"status": "skipped", "job_id": job_id, "kind": kind}
+        else:
+            raise ValueError(f"onbekend artefact: {kind}")
+    except Exception as e:
+        logger.error("%s mislukt voor %s: %s", kind, job_id, e)
+        _set_artifact(job_id, kind, "failed", str(e))
+        return {"status": "failed", "job_id": job_id, "kind": kind, "error": str(e)}
+    logger.info("%s klaar voor %s%s", kind, job_id, f": {path}" if path else "")
+    _set_artifact(job_id, kind, "ready")
+    if path and results.get("edf_path") and os.path.exists(results["edf_path"]):
+        _record_timing("report", job_id, results["edf_path"],
+                       time.monotonic() - started)
+    return {"status": "done", "job_id": job_id, "kind": kind, "path": path}
+
+
+def on_report_failure(job, connection, exc_type, exc_value, tb) -> None:
+    """RQ-failure-callback: een artefactjob die stierf (timeout, worker weg)."""
+    if len(job.args or ()) >= 2:
+        _set_artifact(job.args[0], job.args[1], "failed",
+                      f"{exc_type.__name__}: {exc_value}")
+
+
+def _report_estimate(edf_path: str | None) -> dict | None:
+    try:
+        return job_estimate.estimate(UPLOAD_FOLDER, "report",
+                                     job_estimate.features(read_summary(edf_path)))
+    except Exception as e:                                       # noqa: BLE001
+        logger.warning("[ESTIMATE] geen rapportschatting voor %s: %s", edf_path, e)
+        return None
+
+
+def _fan_out_reports(job_id: str, cfg: dict | None = None) -> list:
+    """Dien een job per artefact in; zonder wachtrij worden ze hier gemaakt.
+
+    `cfg` is de config van de analyse: site, prioriteit en de EDF voor de
+    schatting.
+    """
+    cfg = cfg or {}
+    estimate = _report_estimate(cfg.get("edf_path"))
+    queued: list = []
+    try:
+        conn = _get_progress_redis()
+        for kind in ARTIFACTS:
+            _set_artifact(job_id, kind, "pending")
+            # Eén aanvraag per artefact in de scheduler; de taak krijgt de
+            # app-job_id als eerste argument, zoals altijd.
+            job_scheduler.submit(
+                conn, job_estimate.route((estimate or {}).get("runtime_s")),
+                f"{job_id}:{kind}",
+                "tasks.generate_report_artifact", (job_id, kind),
+                site=cfg.get("site_id"), priority=cfg.get("priority"),
+                job_timeout=job_estimate.timeout_s(estimate, job_estimate.REPORT_TIMEOUT_S),
+                result_ttl=3600, on_failure=REPORT_FAILURE_CALLBACK,
+                estimate_s=(estimate or {}).get("runtime_s"),
+                ram_mb=(estimate or {}).get("ram_mb"))
+            queued.append(kind)
+    except Exception as e:                                       # noqa: BLE001
+        logger.warning("Rapportjobs niet ingepland (%s) — hier gemaakt", e)
+        for kind in ARTIFACTS:
+            if kind not in queued:
+                generate_report_artifact(job_id, kind)
+    return queued
+
+
+# ─────────────────────────────────────────────
+# HERGEBRUIK VAN EEN EERDERE ANALYSE (ZELFDE OPNAME)
+# ─────────────────────────────────────────────
+
+def _edf_patient_info(edf_path: str) -> dict:
+    """De patiëntvelden uit de header van deze EDF, zoals psgscoring ze leest.
+
+    Leeg als psgscoring ontbreekt: liever geen headervelden dan die van een
+    andere opname.
+    """
+    try:
+        from types import SimpleNamespace
+
+        from psgscoring.pipeline import _parse_edf_patient_info
+    except ImportError:
+        return {}
+    return _parse_edf_patient_info(SimpleNamespace(filenames=[edf_path]))
+
+
+def _without_patient_info(pneumo):
+    """`pneumo` zonder `meta.patient_info`, om te bewaren in de stapcache."""
+    if not isinstance(pneumo, dict) or "patient_info" not in (pneumo.get("meta") or {}):
+        return pneumo
+    meta = {k: v for k, v in pneumo["meta"].items() if k != "patient_info"}
+    return {**pneumo, "meta": meta}
+
+
+def _with_own_patient_info(pneumo, edf_path: str):
+    """`pneumo` met `meta.patient_info` uit `edf_path` in plaats van uit de
+    opname waarop het berekend werd."""
+    if not isinstance(pneumo, dict):
+        return pneumo
+    meta = {**(pneumo.get("meta") or {}), "patient_info": _edf_patient_info(edf_path)}
+    return {**pneumo, "meta": meta}
+
+
+def reuse_analysis_results(job_id: str, source_job_id: str) -> dict:
+    """
+    Dezelfde opname met dezelfde kanaalkeuze en instellingen is al eens
+    geanalyseerd (de weblaag vergeleek inhoudshash en config). Dan hoeft
+    de pipeline niet opnieuw: het berekende resultaat wordt overgenomen en
+    alleen de rapporten worden opnieuw gemaakt, met de patiëntgegevens van
+    deze job.
+
+    De versies kan alleen de worker controleren — hij weet welke
+    bibliotheken hij geladen heeft. Verschillen ze, of is het bronresultaat
+    weg, dan gewoon de volledige analyse.
+    """
+    _set_progress(job_id, 1, 3, "Eerdere analyse van deze opname laden...")
+    with open(os.path.join(UPLOAD_FOLDER, f"{job_id}_config.json")) as f:
+        cfg = json.load(f)
+    source_path = pipeline_results.source(UPLOAD_FOLDER, source_job_id)
+    try:
+        with open(source_path or "", encoding="utf-8") as f:
+            source = json.load(f)
+    except (OSError, ValueError):
+        source = None
+    if not source or source.get("versions") != _library_versions():
+        logger.info("Geen hergebruik van %s voor %s (%s) — volledige analyse",
+                    source_job_id, job_id,
+                    "versies verschillen" if source else "bron ontbreekt")
+        return run_analysis_job(job_id)
+
+    combined = {
+        **source,
+        "patient_info":   cfg.get("patient_info", {}),
+        "job_id":         job_id,
+        "edf_path":       cfg["edf_path"],
+        # De EDF-header van déze opname, niet die van de bron (anonimisatie).
+        "pneumo":         _with_own_patient_info(source.get("pneumo"), cfg["edf_path"]),
+        "site_id":        cfg.get("site_id"),
+        "owner_username": cfg.get("owner_username", ""),
+        "reused_from":    source_job_id,
+    }
+    result_path = _save_results(job_id, combined)
+    artifacts   = _fan_out_reports(job_id, cfg)
+
+    _set_progress(job_id, 3, 3, "Voltooid!")
+    logger.info("✅ Job %s: resultaat van %s hergebruikt", job_id, source_job_id)
+    return {
+        "status":       "done",
+        "job_id":       job_id,
+        "reused_from":  source_job_id,
+        "study_job_id": None,
+        "result_json":  result_path,
+        "artifacts":    artifacts,
+        "errors":       _collect_errors(combined),
+    }
+
+
 # ─────────────────────────────────────────────
 # STUDIEVERGELIJKING (WACHTRIJ `study`, LAGE PRIORITEIT)
 # ─────────────────────────────────────────────
 
+STUDY_FAN_OUT = os.environ.get("YASAFLASKIFIED_STUDY_FAN_OUT", "").lower() in (
+    "1", "true", "yes", "on")
+STUDY_PROFILE_TIMEOUT = os.environ.get("YASAFLASKIFIED_STUDY_PROFILE_TIMEOUT")
+"""Vaste timeout per profieljob; zonder deze variabele volgt hij de schatting."""
+STUDY_PART_RETRIES = 1
+"""Zoveel keer wordt een mislukte profieljob opnieuw ingediend."""
+STUDY_PART_FAILURE_CALLBACK = "tasks.on_study_part_failure"
+
+
 def run_study_comparison(job_id: str, edf_path: str, results_dir: str,
                          profiles: list, primary: str,
                          eeg_ch: str, eog_ch: str, emg_ch: str,
-                         pneumo_channels: dict, hypno: list) -> dict:
+                         pneumo_channels: dict, hypno: list,
+                         fan_out: bool | None = None) -> dict:
     """Draai de profielvergelijking en zet er een profielrapport naast.
 
     Draait op de wachtrij `study`, waar hoogstens twee van de acht workers naar
     luisteren en dan nog pas als `default` leeg is. Zo kan een vergelijking van
     drie kwartier geen klinische opname laten wachten.
 
+    Met `fan_out` (standaard `YASAFLASKIFIED_STUDY_FAN_OUT`) wordt dit één
+    job per profiel plus een samenvoegjob, ook op `study` en via
+    job_scheduler met de site en prioriteit van deze job; zie
+    `_dispatch_study_comparison`.
+
     Levert twee bestanden naast het klinische rapport:
       {job_id}_profielrapport.pdf   het onderzoeksdocument
       profile_comparison.json       de vergelijking, incl. overeenkomst
     """
     import time
 
+    if fan_out is None:
+        fan_out = STUDY_FAN_OUT
+    if fan_out and len(profiles or []) > 1 and hypno:
+        return _dispatch_study_comparison(job_id, edf_path, results_dir, profiles,
+                                          primary, pneumo_channels, hypno)
+
     started = time.monotonic()
     logger.info("[study %s] start, %d profielen, primair %s",
                 job_id, len(profiles or []), primary)
@@ -577,11 +1230,21 @@ def run_study_comparison(job_id: str, edf_path: str, results_dir: str,
             edf_path, results_dir,
             profiles=profiles, primary=primary,
             eeg_ch=eeg_ch, eog_ch=eog_ch, emg_ch=emg_ch,
-            pneumo_channels=pneumo_channels, hypno=hypno)
+            pneumo_channels=pneumo_channels, hypno=hypno,
+            # Over processen, zoveel als kernen en vrij geheugen toelaten.
+            workers=None)
     except Exception as e:                                       # noqa: BLE001
         logger.exception("[study %s] vergelijking mislukt", job_id)
         return {"status": "error", "job_id": job_id, "error": str(e)}
+    _record_timing("study", job_id, edf_path, time.monotonic() - started,
+                   n_profiles=len(profiles or []),
+                   workers=(comparison.get("_meta") or {}).get("profile_workers", 1))
+    return _write_profile_report(job_id, results_dir, comparison, profiles,
+                                 round(time.monotonic() - started, 1))
 
+
+def _write_profile_report(job_id: str, results_dir: str, comparison: dict,
+                          profiles: list, elapsed: float) -> dict:
     # Het klinische resultaat is de bron voor de kop en de primair-assert.
     pneumo = {}
     try:
@@ -602,7 +1265,6 @@ def run_study_comparison(job_id: str, edf_path: str, results_dir: str,
                 "result_json": os.path.join(results_dir,
                                             "profile_comparison.json")}
 
-    elapsed = round(time.monotonic() - started, 1)
     logger.info("[study %s] klaar in %.1f s (%.1f min)",
                 job_id, elapsed, elapsed / 60)
     return {
@@ -615,6 +1277,203 @@ def run_study_comparison(job_id: str, edf_path: str, results_dir: str,
     }
 
 
+# ── Verdeelde vergelijking: één job per profiel, dan samenvoegen ──────────
+#
+# Eén job van zes uur faalt alles-of-niets en houdt één worker bezet. Als
+# losse profieljobs pakt elke vrije `study`-worker, op welke machine ook, het
+# volgende profiel; een mislukt profiel wordt opnieuw geprobeerd zonder de
+# andere. Elke profieljob schrijft een gewone vergelijking van één profiel
+# (`run_profile_comparison`) in `{job_id}_study/<profiel>/`; de samenvoegjob
+# legt die rijen, eventlijsten en tijden naast elkaar en rekent pas dan de
+# overeenkomst met het primaire profiel uit.
+#
+# Profieljobs en samenvoegjob gaan door job_scheduler, met de site en de
+# prioriteit van de vergelijking: rechtstreeks in `study` zouden ze de
+# verdeling over sites omzeilen. De scheduler kent geen afhankelijkheden;
+# daarom houdt Redis bij welke profielen nog open staan
+# (`study:<job_id>:left`), en het laatste dat klaar is — of definitief
+# mislukt — dient de samenvoegjob in.
+
+def _study_parts_dir(results_dir: str, job_id: str) -> str:
+    return os.path.join(results_dir, f"{job_id}_study")
+
+
+def _study_key(job_id: str, part: str = "") -> str:
+    return f"study:{job_id}" + (f":{part}" if part else "")
+
+
+def _dispatch_study_comparison(job_id: str, edf_path: str, results_dir: str,
+                               profiles: list, primary: str,
+                               pneumo_channels: dict, hypno: list) -> dict:
+    import time
+
+    from rq import get_current_job
+
+    # Elk profiel leest de hele nacht in: het geheugen van de vergelijking
+    # (memory_budget.py) geldt per profieljob, niet gedeeld.
+    current = get_current_job()
+    meta = current.meta if current else {}
+    spec = {"edf_path": edf_path, "results_dir": results_dir,
+            "profiles": list(profiles), "primary": primary,
+            "pneumo_channels": pneumo_channels, "hypno": hypno,
+            "dispatched_at": time.time(),
+            "site": meta.get("sched_site"), "priority": meta.get("sched_priority"),
+            "ram_mb": meta.get("ram_mb"),
+            "timeout": STUDY_PROFILE_TIMEOUT or _study_profile_timeout(edf_path)}
+    conn = _get_progress_redis()
+    pipe = conn.pipeline()
+    pipe.set(_study_key(job_id), json.dumps(spec), ex=7 * 86400)
+    pipe.delete(_study_key(job_id, "left"), _study_key(job_id, "tries"))
+    pipe.sadd(_study_key(job_id, "left"), *profiles)
+    pipe.expire(_study_key(job_id, "left"), 7 * 86400)
+    pipe.execute()
+    for p in profiles:
+        _submit_study_part(conn, job_id, spec, p)
+    logger.info("[study %s] verdeeld over %d profieljobs", job_id, len(profiles))
+    return {"status": "dispatched", "job_id": job_id,
+            "profile_jobs": [f"{job_id}:{p}" for p in profiles],
+            "fan_in_job": f"{job_id}:merge", "profiles": list(profiles)}
+
+
+def _submit_study_part(conn, job_id: str, spec: dict, profile: str) -> None:
+    job_scheduler.submit(
+        conn, "study", f"{job_id}:{profile}", "tasks.run_study_profile",
+        (job_id, spec["edf_path"], spec["results_dir"], profile,
+         spec["pneumo_channels"], spec["hypno"]),
+        site=spec["site"], priority=spec["priority"], job_timeout=spec["timeout"],
+        result_ttl=86400, on_failure=STUDY_PART_FAILURE_CALLBACK, ram_mb=spec["ram_mb"])
+
+
+def _study_part_finished(conn, job_id: str, profile: str) -> None:
+    """Eén profiel is klaar of definitief mislukt; het laatste dient de
+    samenvoegjob in.
+
+    Ook na een mislukt profiel: dan zegt de samenvoegjob dat de vergelijking
+    onvolledig is, in plaats van dat er nooit iets komt.
+    """
+    pipe = conn.pipeline()
+    pipe.srem(_study_key(job_id, "left"), profile)
+    pipe.scard(_study_key(job_id, "left"))
+    removed, left = pipe.execute()
+    if not removed or left:
+        return
+    raw = conn.get(_study_key(job_id))
+    if not raw:
+        return
+    spec = json.loads(raw)
+    job_scheduler.submit(
+        conn, "study", f"{job_id}:merge", "tasks.finish_study_comparison",
+        (job_id, spec["results_dir"], spec["profiles"], spec["primary"],
+         spec["dispatched_at"]),
+        site=spec["site"], priority=spec["priority"], job_timeout="30m",
+        result_ttl=86400)
+    conn.delete(_study_key(job_id), _study_key(job_id, "tries"))
+    logger.info("[study %s] alle profielen af — samenvoegen ingediend", job_id)
+
+
+def on_study_part_failure(job, connection, exc_type, exc_value, tb) -> None:
+    """RQ-failure-callback van een profieljob: nog eens, of definitief mislukt."""
+    if len(job.args or ()) < 4:
+        return
+    job_id, profile = job.args[0], job.args[3]
+    tries = connection.hincrby(_study_key(job_id, "tries"), profile, 1)
+    raw = connection.get(_study_key(job_id))
+    if raw and tries <= STUDY_PART_RETRIES:
+        logger.warning("[study %s] %s mislukt (%s) — opnieuw ingediend",
+                       job_id, profile, exc_type.__name__)
+        _submit_study_part(connection, job_id, json.loads(raw), profile)
+        return
+    logger.error("[study %s] %s definitief mislukt: %s", job_id, profile, exc_value)
+    _study_part_finished(connection, job_id, profile)
+
+
+def _study_profile_timeout(edf_path: str) -> int:
+    """De timeout van één profieljob: één profiel over de hele nacht."""
+    try:
+        feats = job_estimate.features(read_summary(edf_path), None, 1)
+    except Exception as e:                                       # noqa: BLE001
+        logger.warning("[study] header van %s onleesbaar: %s", edf_path, e)
+        return 2 * 3600
+    return job_estimate.timeout_s(
+        job_estimate.estimate(UPLOAD_FOLDER, "study", feats), 2 * 3600)
+
+
+def run_study_profile(job_id: str, edf_path: str, results_dir: str, profile: str,
+                      pneumo_channels: dict, hypno: list) -> dict:
+    """Eén profiel van een verdeelde vergelijking.
+
+    Staat er al een deel voor exact dezelfde invoer (een eerdere poging die
+    verderop misliep), dan wordt dat hergebruikt. Het laatste profiel dient
+    de samenvoegjob in (`_study_part_finished`).
+    """
+    part = os.path.join(_study_parts_dir(results_dir, job_id), profile)
+    inputs = stage_cache.digest({
+        "edf": edf_path, "profile": profile, "channels": pneumo_channels,
+        "hypno": stage_cache.digest(hypno), "versions": _library_versions()})
+    marker = os.path.join(part, "inputs.json")
+    reused = False
+    try:
+        with open(marker) as f:
+            reused = json.load(f).get("inputs") == inputs and os.path.exists(
+                os.path.join(part, "profile_comparison.json"))
+    except (OSError, ValueError):
+        pass
+    if reused:
+        logger.info("[study %s] %s al klaar — hergebruikt", job_id, profile)
+    else:
+        os.makedirs(part, exist_ok=True)
+        run_profile_comparison(edf_path, part, profiles=[profile], primary=None,
+                               pneumo_channels=pneumo_channels, hypno=hypno)
+        with open(marker, "w") as f:
+            json.dump({"inputs": inputs}, f)
+    _study_part_finished(_get_progress_redis(), job_id, profile)
+    out = {"status": "done", "profile": profile}
+    return {**out, "reused": True} if reused else out
+
+
+def finish_study_comparison(job_id: str, results_dir: str, profiles: list,
+                            primary: str, dispatched_at: float) -> dict:
+    """Samenvoegen: `profile_comparison.json`, overeenkomst en profielrapport.
+
+    Ontbreekt er een profiel, dan komt er GEEN vergelijking — een vergelijking
+    met minder profielen dan de studie denkt is erger dan een fout. De delen
+    die er wel zijn blijven staan; een nieuwe aanvraag rekent alleen de rest.
+    """
+    import shutil
+    import time
+
+    parts_dir = _study_parts_dir(results_dir, job_id)
+    rows: dict = {}
+    events: dict = {}
+    flow: dict = {}
+    wall: dict = {}
+    missing = []
+    for p in profiles:
+        try:
+            with open(os.path.join(parts_dir, p, "profile_comparison.json")) as f:
+                part = json.load(f)
+            with open(os.path.join(parts_dir, p, "profile_events.json")) as f:
+                events[p] = json.load(f).get(p, [])
+        except (OSError, ValueError):
+            missing.append(p)
+            continue
+        rows[p] = part[p]
+        wall[p] = part["_meta"]["wall_clock_s"].get(p)
+        flow[p] = part["_meta"].get("flow_channels", {}).get(p, {})
+    if missing:
+        logger.error("[study %s] profielen ontbreken: %s — geen vergelijking",
+                     job_id, missing)
+        return {"status": "error", "job_id": job_id, "missing_profiles": missing,
+                "error": f"profielen niet gescoord: {', '.join(missing)}"}
+
+    elapsed = round(time.time() - dispatched_at, 1)
+    comparison = _finish_comparison(
+        rows, events, flow, wall, list(profiles), primary, results_dir,
+        {"wall_clock_total_s": elapsed, "profile_jobs": len(profiles)})
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    return _write_profile_report(job_id, results_dir, comparison, profiles, elapsed)
+
+
 # ─────────────────────────────────────────────
 # EDF+ GENERATIE (ON-DEMAND, ACHTERGRONDTAAK)
 # ─────────────────────────────────────────────
@@ -678,7 +1537,7 @@ def generate_edfplus_job(job_id: str) -> dict:
 # HULPFUNCTIES
 # ─────────────────────────────────────────────
 
-def _validate_channels(raw, eeg_ch, eog_ch, emg_ch, extra_eeg):
+def _validate_channels(raw, eeg_ch, eog_ch, emg_ch):
     available = set(raw.ch_names)
     if eeg_ch not in available:
         raise ValueError(f"EEG '{eeg_ch}' niet gevonden. Beschikbaar: {sorted(available)}")
@@ -686,12 +1545,24 @@ def _validate_channels(raw, eeg_ch, eog_ch, emg_ch, extra_eeg):
         logger.warning("EOG '%s' niet gevonden", eog_ch)
     if emg_ch and emg_ch not in available:
         logger.warning("EMG '%s' niet gevonden", emg_ch)
+
+
+def _extra_eeg(ch_names, eeg_ch, extra_eeg: list) -> list:
+    """De extra EEG-kanalen die in de opname staan, met het hoofdkanaal erbij.
+
+    Uit de header en vóór er een cachesleutel berekend wordt: run_pipeline
+    en prepare_analysis moeten dezelfde lijst in hun sleutels hebben, en
+    een lijst die pas na het laden nog verandert, geeft stappen met een
+    andere sleutel dan waarmee vooraf in de cache gekeken werd.
+    """
+    available = set(ch_names)
     missing = [ch for ch in extra_eeg if ch not in available]
     if missing:
         logger.warning("Extra EEG overgeslagen: %s", missing)
-        extra_eeg[:] = [ch for ch in extra_eeg if ch in available]
-    if eeg_ch not in extra_eeg:
-        extra_eeg.insert(0, eeg_ch)
+    kept = [ch for ch in extra_eeg if ch in available]
+    if eeg_ch not in kept:
+        kept.insert(0, eeg_ch)
+    return kept
 
 
 def _collect_errors(results: dict) -> list:
@@ -851,6 +1722,7 @@ def regenerate_with_corrections(job_id: str) -> dict:
     results["staging"]["is_manually_corrected"]  = True
 
     _set_progress(job_id, 3, 6, "Resultaten opslaan...")
+    pipeline_results.before_edit(result_path)
     with open(result_path, "w") as f:
         json.dump(results, f, indent=2, default=_json_serializer)
 
@@ -885,9 +1757,11 @@ def regenerate_with_corrections(job_id: str) -> dict:
 # v10: E-MAIL NOTIFICATIE BIJ KLAAR ANALYSE
 # ═══════════════════════════════════════════════════════════════
 
-def _send_email_notification(job_id: str, results: dict):
+def _send_email_notification(job_id: str, results: dict) -> bool:
     """
-    Stuur e-mail bij klaar analyse.
+    Stuur e-mail bij klaar analyse. False als er niets te sturen is (mail
+    uit of geen ontvangers); een mislukte verzending is een uitzondering,
+    zodat het artefact "failed" wordt in plaats van "ready".
     Configureer in config.json:
       "email": {
         "enabled": true,
@@ -899,57 +1773,58 @@ def _send_email_notification(job_id: str, results: dict):
         "notify_to": ["slaaplabo@uzgent.be"]
       }
     """
-    try:
-        import smtplib
-        from email.mime.multipart import MIMEMultipart
-        from email.mime.text import MIMEText
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
 
-        cfg_path = os.path.join(os.path.dirname(__file__), "..", "config.json")
-        if not os.path.exists(cfg_path):
-            cfg_path = "config.json"
+    cfg_path = os.path.join(os.path.dirname(__file__), "..", "config.json")
+    if not os.path.exists(cfg_path):
+        cfg_path = "config.json"
+    try:
         with open(cfg_path) as f:
             cfg = json.load(f)
-        ecfg = cfg.get("email", {})
-        if not ecfg.get("enabled"):
-            return
-
-        pat   = results.get("patient_info", {})
-        pname = " ".join(filter(None, [pat.get("patient_name", ""),
-                                        pat.get("patient_firstname", "")])) or "—"
-        to_list = list(set(ecfg.get("notify_to", [])))
-        if not to_list:
-            return
-
-        site_url   = cfg.get("site", {}).get("url", "https://sleepai.be")
-        report_url = f"{site_url}/results/{job_id}"
-
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = f"YASAFlaskified — Analyse klaar: {pname}"
-        msg["From"]    = ecfg.get("from", "SleepAI <noreply@sleepai.be>")
-        msg["To"]      = ", ".join(to_list)
-
-        html = f"""<html><body style="font-family:sans-serif">
-        <h3 style="color:#1a3a8f">✅ Analyse voltooid</h3>
-        <table><tr><td style="padding:4px 12px 4px 0;color:#666">Patiënt:</td>
-        <td><b>{pname}</b></td></tr>
-        <tr><td style="padding:4px 12px 4px 0;color:#666">Job:</td>
-        <td>{job_id[:8]}…</td></tr></table>
-        <p style="margin-top:16px">
-        <a href="{report_url}"
-           style="background:#1a3a8f;color:white;padding:8px 18px;
-                  border-radius:4px;text-decoration:none">Bekijk rapport</a></p>
-        <p style="color:#999;font-size:12px">YASAFlaskified v0.8.37 · {site_url}<br>
-        Screening-tool — geen medische diagnose.</p>
-        </body></html>"""
-
-        msg.attach(MIMEText(html, "html"))
-        with smtplib.SMTP(ecfg["smtp_host"], int(ecfg.get("smtp_port", 587))) as s:
-            s.ehlo(); s.starttls(); s.ehlo()
-            s.login(ecfg["smtp_user"], ecfg["smtp_pass"])
-            s.sendmail(msg["From"], to_list, msg.as_string())
-        logger.info("E-mail verstuurd naar: %s", to_list)
-    except Exception as e:
-        logger.warning("E-mail mislukt: %s", e)
+    except FileNotFoundError:
+        return False
+    ecfg = cfg.get("email", {})
+    if not ecfg.get("enabled"):
+        return False
+
+    pat   = results.get("patient_info", {})
+    pname = " ".join(filter(None, [pat.get("patient_name", ""),
+                                    pat.get("patient_firstname", "")])) or "—"
+    to_list = list(set(ecfg.get("notify_to", [])))
+    if not to_list:
+        return False
+
+    site_url   = cfg.get("site", {}).get("url", "https://sleepai.be")
+    report_url = f"{site_url}/results/{job_id}"
+
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = f"YASAFlaskified — Analyse klaar: {pname}"
+    msg["From"]    = ecfg.get("from", "SleepAI <noreply@sleepai.be>")
+    msg["To"]      = ", ".join(to_list)
+
+    html = f"""<html><body style="font-family:sans-serif">
+    <h3 style="color:#1a3a8f">✅ Analyse voltooid</h3>
+    <table><tr><td style="padding:4px 12px 4px 0;color:#666">Patiënt:</td>
+    <td><b>{pname}</b></td></tr>
+    <tr><td style="padding:4px 12px 4px 0;color:#666">Job:</td>
+    <td>{job_id[:8]}…</td></tr></table>
+    <p style="margin-top:16px">
+    <a href="{report_url}"
+       style="background:#1a3a8f;color:white;padding:8px 18px;
+              border-radius:4px;text-decoration:none">Bekijk rapport</a></p>
+    <p style="color:#999;font-size:12px">YASAFlaskified v0.8.37 · {site_url}<br>
+    Screening-tool — geen medische diagnose.</p>
+    </body></html>"""
+
+    msg.attach(MIMEText(html, "html"))
+    with smtplib.SMTP(ecfg["smtp_host"], int(ecfg.get("smtp_port", 587))) as s:
+        s.ehlo(); s.starttls(); s.ehlo()
+        s.login(ecfg["smtp_user"], ecfg["smtp_pass"])
+        s.sendmail(msg["From"], to_list, msg.as_string())
+    logger.info("E-mail verstuurd naar: %s", to_list)
+    return True
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -963,12 +1838,17 @@ def run_profile_comparison(edf_path: str, results_dir: str, *,
                            eog_ch: str | None = None,
                            emg_ch: str | None = None,
                            pneumo_channels: dict | None = None,
-                           hypno: list | None = None) -> dict:
+                           hypno: list | None = None,
+                           workers: int | None = 1) -> dict:
     """Score één opname onder meerdere profielen en schrijf de vergelijking weg.
 
     `profiles=None` houdt het oude gedrag (de hele registry) — backwards
     compatible. Geef een lijst om een studieprofiel-set te draaien.
 
+    `workers` > 1 verdeelt de profielen over processen op gedeeld geheugen
+    (profile_pool.py); `None` kiest zelf, begrensd door het vrije RAM. De
+    standaard blijft 1: na elkaar, in dit proces.
+
     LET OP DE KOSTEN, EN WAAROM DIE HIER STAAN
     ------------------------------------------
     Deze functie is sinds v0.9.0 **nooit aangeroepen**: ze kwam in de codebase
@@ -1013,10 +1893,17 @@ def run_profile_comparison(edf_path: str, results_dir: str, *,
                 "run_profile_comparison heeft eeg_ch nodig om te kunnen stagen, "
                 "of een kant-en-klaar hypno=. Zonder een van beide draaide deze "
                 "functie op een TypeError bij haar derde regel.")
-        _staging_needed = [c for c in (eeg_ch, eog_ch, emg_ch) if c]
-        raw_staging = _load_edf(edf_path, _staging_needed, label="STAGING/cmp")
-        hypno = run_sleep_staging(
-            raw_staging, eeg_ch, eog_ch, emg_ch).get("hypnogram", [])
+        # Dezelfde sleutel als de staging in run_analysis_job: een
+        # vergelijking op een opname die al geanalyseerd werd, staget niet
+        # opnieuw. `_load_edf` en het laadplan geven per stap dezelfde data.
+        _staging_needed = list(dict.fromkeys(c for c in (eeg_ch, eog_ch, emg_ch) if c))
+        _cache = _stage_cache(edf_path)
+
+        def _stage():
+            raw_staging = _load_edf(edf_path, _staging_needed, label="STAGING/cmp")
+            return run_sleep_staging(raw_staging, eeg_ch, eog_ch, emg_ch)
+        hypno = _cache.run("staging", _stage, channels=_staging_needed,
+                           eeg=eeg_ch, eog=eog_ch, emg=emg_ch).get("hypnogram", [])
 
     # Alleen de respiratoire kanalen laden. Een ongefilterde `preload=True` leest
     # elk kanaal en laat MNE alles naar de hoogste samplefrequentie brengen: op
@@ -1042,16 +1929,43 @@ def run_profile_comparison(edf_path: str, results_dir: str, *,
     else:
         _profile_names = _registry
 
+    # Parallel alleen over een echte, ingelezen raw: die gaat naar gedeeld
+    # geheugen. Elk profiel is onafhankelijk van de andere.
+    _n_workers, _pool = 1, None
+    if (workers is None or workers > 1) and len(_profile_names) > 1 \
+            and isinstance(raw, mne.io.BaseRaw) and raw.preload:
+        import profile_pool
+        _n_workers = profile_pool.profile_workers(
+            len(_profile_names), raw._data.nbytes, requested=workers)
+        _n_workers, _pool = _reserve_pool(
+            _n_workers, profile_pool.worker_bytes(raw._data.nbytes) / 2**20)
+
+    _t_all = time.monotonic()
+    if _n_workers > 1:
+        logger.info("[cmp] %d profielen over %d processen",
+                    len(_profile_names), _n_workers)
+        try:
+            _scored = profile_pool.score_profiles(
+                raw, hypno, pneumo_channels or {}, _profile_names, _n_workers)
+        finally:
+            if _pool is not None:
+                memory_budget.release(_pool[0], _pool[1])
+    else:
+        _scored = {}
+        for profile in _profile_names:
+            _t0 = time.monotonic()
+            _pn = run_pneumo_analysis(
+                raw=raw, hypno=hypno, channel_map=pneumo_channels or {},
+                scoring_profile=profile)
+            _scored[profile] = (_pn, round(time.monotonic() - _t0, 1))
+    _wall_total = round(time.monotonic() - _t_all, 1)
+
     comparison: dict = {}
     _wall: dict = {}
     _events: dict = {}
     _flow: dict = {}
     for profile in _profile_names:
-        _t0 = time.monotonic()
-        pneumo = run_pneumo_analysis(
-            raw=raw, hypno=hypno, channel_map=pneumo_channels or {},
-            scoring_profile=profile)
-        _wall[profile] = round(time.monotonic() - _t0, 1)
+        pneumo, _wall[profile] = _scored[profile]
         rsum = pneumo.get("respiratory", {}).get("summary", {})
         # De eventlijst zelf bewaren, niet alleen de samenvatting. Zonder deze
         # regel is elke vraag "zijn dit dezelfde events?" onbeantwoordbaar, en
@@ -1097,6 +2011,43 @@ def run_profile_comparison(edf_path: str, results_dir: str, *,
             "n_local_baseline_rejected": pneumo.get("respiratory", {}).get("n_local_baseline_rejected", 0),
         }
 
+    return _finish_comparison(
+        comparison, _events, _flow, _wall, _profile_names, primary, results_dir,
+        {"wall_clock_total_s": _wall_total, "profile_workers": _n_workers})
+
+
+def _reserve_pool(workers: int, per_worker_mb: float) -> tuple[int, tuple | None]:
+    """De profielworkers tegen het RAM-budget van de node (memory_budget.py).
+
+    De reservering van de RQ-job zelf rekent op één proces; elke worker is
+    een volledig extra Python met zijn kopieën. Past het gevraagde aantal
+    niet, dan minder, en in het slechtste geval sequentieel in dit proces.
+    Geeft (workers, (conn, sleutel)) terug — de sleutel om vrij te geven, of
+    None buiten RQ of zonder reservering.
+    """
+    from rq import get_current_job
+
+    job = get_current_job() if workers > 1 and memory_budget.enabled() else None
+    if job is None or not job.worker_name:
+        return workers, None
+    key = memory_budget.pool_key(job.id)
+    for n in range(workers, 1, -1):
+        if memory_budget.reserve(job.connection, key, round(n * per_worker_mb),
+                                 job.worker_name):
+            return n, (job.connection, key)
+    logger.info("[cmp] geen ruimte in het RAM-budget voor profielworkers — "
+                "sequentieel")
+    return 1, None
+
+
+def _finish_comparison(comparison: dict, events: dict, flow: dict, wall: dict,
+                       profile_names: list, primary: str | None,
+                       results_dir: str, extra_meta: dict) -> dict:
+    """Ernst, overeenkomst met het primaire profiel, `_meta`, en wegschrijven.
+
+    Gedeeld door `run_profile_comparison` en `finish_study_comparison`, die
+    de rijen uit aparte profieljobs samenlegt.
+    """
     # Severity classification per profile
     for profile, data in comparison.items():
         if profile == "_meta":
@@ -1124,14 +2075,14 @@ def run_profile_comparison(edf_path: str, results_dir: str, *,
     # dezelfde verzameling zijn. De matcher leeft in psgscoring omdat het een
     # scoringsvraag is en de validatieharness hem zal willen.
     _agree_err = None
-    if primary and primary in _events:
+    if primary and primary in events:
         try:
             from psgscoring.agreement import compare_event_sets
-            for _p, _evs in _events.items():
+            for _p, _evs in events.items():
                 if _p == primary:
                     continue
                 comparison[_p]["agreement_vs_primary"] = compare_event_sets(
-                    _events[primary], _evs, label_a=primary, label_b=_p)
+                    events[primary], _evs, label_a=primary, label_b=_p)
         except Exception as e:                                   # noqa: BLE001
             # Een mislukte vergelijking mag de vergelijking niet opeten; het
             # ontbreken ervan hoort wel zichtbaar te zijn in plaats van als
@@ -1141,13 +2092,16 @@ def run_profile_comparison(edf_path: str, results_dir: str, *,
 
     comparison["_meta"] = {
         "primary_profile":   primary,
-        "profiles_compared": list(_profile_names),
+        "profiles_compared": list(profile_names),
         "psgscoring_version": _psgver,
         "hypnogram_shared":  True,
-        "wall_clock_s":      _wall,
-        "n_events":          {k: len(v) for k, v in _events.items()},
-        "flow_channels":     _flow,
+        "wall_clock_s":      wall,
+        "n_events":          {k: len(v) for k, v in events.items()},
+        "flow_channels":     flow,
         "agreement_error":   _agree_err,
+        # Bij parallel of verdeeld scoren is de som van wall_clock_s niet
+        # wat het kostte; wall_clock_total_s wel.
+        **extra_meta,
     }
 
     # Save comparison JSON
@@ -1168,7 +2122,7 @@ def run_profile_comparison(edf_path: str, results_dir: str, *,
     # projectie, wel voor een eigen bestand.
     try:
         with open(os.path.join(results_dir, "profile_events.json"), "w") as _f:
-            json.dump(_events, _f, default=str)
+            json.dump(events, _f, default=str)
     except Exception as e:                                       # noqa: BLE001
         logger.warning("[cmp] eventlijsten niet weggeschreven: %s", e)
 
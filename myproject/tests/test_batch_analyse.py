@@ -0,0 +1,65 @@
+"""Bulk-CLI: kanalen uit de header, en een onderbroken cohortrun die hervat."""
+import json
+import sys
+
+import pytest
+
+pytest.importorskip("psgscoring")
+
+import batch_analyse  # noqa: E402
+import channel_map  # noqa: E402
+
+
+def test_channels_come_from_the_names_alone():
+    cfg = channel_map.auto_config(["Leg L", "E1-M2", "Chin1-Chin2", "C3-M2",
+                                   "C4-M1", "Nasal Pressure", "Thor", "SpO2"])
+    assert (cfg["eeg_ch"], cfg["eog_ch"], cfg["emg_ch"]) == ("C4-M1", "E1-M2",
+                                                             "Chin1-Chin2")
+    assert cfg["extra_eeg_ch"] == ["C4-M1"]
+
+    shhs = channel_map.auto_config(["SaO2", "EEG(sec)", "EMG", "EOG(L)", "EOG(R)",
+                                    "EEG", "THOR RES", "ABDO RES"])
+    assert shhs["eeg_ch"] in ("EEG", "EEG(sec)") and shhs["eog_ch"] == "EOG(L)"
+
+    polygraphy = channel_map.auto_config(["Pressure Flow", "Thorax", "Abdomen", "SpO2"])
+    assert polygraphy["eeg_ch"] is None and polygraphy["extra_eeg_ch"] == []
+
+
+def _fake_analyse(edf_path, output_dir, profile):
+    with open(f"{output_dir}/calls.log", "a") as f:
+        f.write(f"{profile}:{edf_path}\n")
+    status = "error" if edf_path.endswith("bad.edf") else "ok"
+    return {**batch_analyse._identity(edf_path, profile), "status": status,
+            "error": None, "ahi_total": 5.0}
+
+
+def _run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["batch_analyse.py", *argv,
+                                      "--workers", "2", "--mem-per-worker-mb", "0"])
+    return batch_analyse.main()
+
+
+def test_an_interrupted_run_resumes_where_it_stopped(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_analyse, "_analyse_single", _fake_analyse)
+    for name in ("a", "b", "bad"):
+        (tmp_path / f"{name}.edf").write_bytes(b"0" * 10)
+    out = tmp_path / "out"
+    out.mkdir()
+    manifest = out / batch_analyse.MANIFEST
+    # Een vorige run haalde a.edf, en stopte midden in de volgende regel.
+    a = {**batch_analyse._identity(str(tmp_path / "a.edf"), "standard"),
+         "status": "ok", "error": None}
+    manifest.write_text(json.dumps(a) + "\n" + '{"file": "b.e')
+
+    assert _run(monkeypatch, str(tmp_path), "-o", str(out)) == 1     # bad.edf faalt
+    calls = (out / "calls.log").read_text().splitlines()
+    assert sorted(c.rsplit("/", 1)[1] for c in calls) == ["b.edf", "bad.edf"]
+
+    (out / "calls.log").unlink()
+    assert _run(monkeypatch, str(tmp_path), "-o", str(out)) == 1
+    assert not (out / "calls.log").exists()                          # niets meer te doen
+    _run(monkeypatch, str(tmp_path), "-o", str(out), "--retry-failed")
+    assert (out / "calls.log").read_text().count("bad.edf") == 1
+
+    rows = (out / "batch_summary.csv").read_text().splitlines()
+    assert len(rows) == 4 and rows[0].startswith("file,profile")
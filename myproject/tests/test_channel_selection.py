@@ -126,3 +126,21 @@ def test_without_a_usable_emg_the_none_option_stays_selected():
 def test_without_an_eog_the_none_option_stays_selected():
     montage = ["C4:A1", "EMG Chin", "SpO2"]
     assert _checked_values(_render(montage), "eog_ch") == [""]
+
+
+@pytest.mark.parametrize("montage", [
+    SOMNO,
+    ["C4:A1", "EOG1:A2", "EMG Chin", "EMG Tib L", "EMG Tib R"],
+    ["C4:A1", "EMG1", "EMG2", "Chin1-Chin2", "PLMl"],
+    ["EEG C4-M1", "EEG F4-M1", "LOC", "ROC", "Kinn", "SpO2"],
+    ["C4:A1", "C3:A2", "SpO2", "Pulse", "PLMl", "PLMr"],
+])
+def test_the_prepare_job_stages_on_what_the_page_preselects(montage):
+    """tasks.prepare_analysis rekent op channel_map.preselect: dat moet het formulier zijn."""
+    import channel_map
+
+    html = _render(montage)
+    pre = channel_map.preselect(montage, "C4:A1")
+    assert _checked_values(html, "eog_ch") == [pre["eog_ch"] or ""]
+    assert _checked_values(html, "emg_ch") == [pre["emg_ch"] or ""]
+    assert (_checked_values(html, "extra_eeg_ch") or ["C4:A1"]) == pre["extra_eeg_ch"]
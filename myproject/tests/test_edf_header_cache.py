@@ -0,0 +1,68 @@
+"""De kanaalkeuze leest de header één keer — tot het bestand verandert.
+
+`_edf_header` in app.py vervangt de MNE-objecten van parse_file en de
+kanaalkeuze door de headerparser, en bewaart het resultaat in Redis. Een
+herladen pagina mag het bestand niet opnieuw openen; een bestand dat
+intussen geanonimiseerd werd (zelfde pad, nieuwe mtime) wel.
+"""
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+fakeredis = pytest.importorskip("fakeredis")
+edfio = pytest.importorskip("edfio")
+
+import app as app_module  # noqa: E402
+import edf_reader  # noqa: E402
+
+
+@pytest.fixture
+def edf(tmp_path):
+    p = tmp_path / "hdr.edf"
+    edfio.Edf([
+        edfio.EdfSignal(np.zeros(60 * 128), sampling_frequency=128, label="EEG C4-M1"),
+        edfio.EdfSignal(np.zeros(60 * 32), sampling_frequency=32, label="Flow"),
+    ]).write(p)
+    return str(p)
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    monkeypatch.setattr(app_module, "redis_conn", fakeredis.FakeRedis())
+    n = []
+    real = edf_reader.read_summary
+
+    def counting(path):
+        n.append(path)
+        return real(path)
+
+    monkeypatch.setattr(edf_reader, "read_summary", counting)
+    return n
+
+
+def test_a_reload_does_not_reopen_the_file(edf, calls):
+    first = app_module._edf_header(edf)
+    again = app_module._edf_header(edf)
+    assert first == again
+    assert first["ch_names"] == ["EEG C4-M1", "Flow"]
+    assert len(calls) == 1
+
+
+def test_a_rewritten_file_is_read_again(edf, calls):
+    app_module._edf_header(edf)
+    st = os.stat(edf)
+    os.utime(edf, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    app_module._edf_header(edf)
+    assert len(calls) == 2
+
+
+def test_parse_channels_uses_the_header(edf, calls):
+    parsed = app_module.EDFProcessor().parse_channels(edf)
+    assert parsed["all"] == ["EEG C4-M1", "Flow"]
+    assert "EEG C4-M1" in parsed["eeg"]
+    assert len(calls) == 1
@@ -0,0 +1,122 @@
+"""De memmap-lezer moet dezelfde getallen geven als MNE, zonder MNE.
+
+De signaalviewer leest sinds `edf_reader.py` rechtstreeks uit een
+geheugenmap van de datarecords. Dat is alleen verantwoord als de viewer
+daarna hetzelfde toont: dezelfde kanaalnamen (zonder het EDF+-
+annotatiekanaal), dezelfde duur en aantal epochs, en dezelfde fysische
+waarden in dezelfde eenheden (volt, zoals MNE). Een verschil in schaal of
+een verschoven record zou een scorer een andere amplitude tonen dan het
+rapport gebruikte.
+
+Mixed-rate, met annotaties, zodat de record-offsets en de TAL-uitsluiting
+echt meetellen.
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+edfio = pytest.importorskip("edfio")
+mne = pytest.importorskip("mne")
+
+import edf_api  # noqa: E402
+from edf_reader import EdfMemmapReader, EdfReaderError, read_header  # noqa: E402
+
+DUR_S = 95
+
+
+@pytest.fixture(scope="module")
+def edf(tmp_path_factory):
+    def sig(name, sf, f, dim="uV", rng=(-500.0, 500.0)):
+        t = np.arange(DUR_S * sf) / sf
+        return edfio.EdfSignal(f(t), sampling_frequency=sf, label=name,
+                               physical_dimension=dim, physical_range=rng)
+
+    p = tmp_path_factory.mktemp("edf") / "reader.edf"
+    edfio.Edf(
+        [
+            sig("EEG C4-M1", 256, lambda t: 80 * np.sin(2 * np.pi * 10 * t)),
+            sig("Flow", 32, lambda t: np.sin(2 * np.pi * 0.25 * t),
+                dim="", rng=(-2.0, 2.0)),
+            sig("SpO2", 1, lambda t: 90 + 5 * np.sin(t / 10),
+                dim="%", rng=(0.0, 100.0)),
+        ],
+        annotations=[edfio.EdfAnnotation(10.0, None, "Lights off")],
+    ).write(p)
+    return str(p)
+
+
+def test_the_header_matches_what_mne_reports(edf):
+    raw = mne.io.read_raw_edf(edf, preload=False, verbose=False)
+    h = read_header(edf)
+    assert h.ch_names == raw.ch_names
+    assert h.sfreq == raw.info["sfreq"]
+    assert h.duration_s == pytest.approx(raw.times[-1])
+
+
+@pytest.mark.parametrize("ch", ["EEG C4-M1", "Flow", "SpO2"])
+def test_samples_are_the_physical_values_mne_reads(edf, ch):
+    """Per kanaal, op de native frequentie — geen hersampling ertussen."""
+    ref = mne.io.read_raw_edf(edf, include=[ch], preload=True, verbose=False)
+    sig, sf = EdfMemmapReader(edf).read(ch, 31.0, 62.5)
+    assert sf == ref.info["sfreq"]
+    want = ref.get_data(start=round(31.0 * sf), stop=round(62.5 * sf))[0]
+    np.testing.assert_allclose(sig, want, rtol=0, atol=1e-12)
+
+
+def test_a_window_across_a_record_boundary_is_continuous(edf):
+    sig, sf = EdfMemmapReader(edf).read("EEG C4-M1", 0.9, 1.1)
+    t = (round(0.9 * sf) + np.arange(len(sig))) / sf
+    np.testing.assert_allclose(sig, 80e-6 * np.sin(2 * np.pi * 10 * t),
+                               atol=80e-6 * 0.01)
+
+
+def test_the_single_block_window_picks_the_same_samples(edf):
+    """De memmap-lezer slaat het per-kanaal-venster over; uitkomst gelijk."""
+    from edf_reader import SignalSource
+    reader = EdfMemmapReader(edf)
+    chs = ["SpO2", "EEG C4-M1", "Flow"]
+    for t0, t1, n in [(0.0, 30.0, 512), (47.3, 71.8, 400), (80.0, 95.0, 10_000)]:
+        fast, eff = reader.window(chs, t0, t1, n)
+        slow, eff_ref = SignalSource.window(reader, chs, t0, t1, n)
+        assert eff == eff_ref
+        np.testing.assert_array_equal(fast, slow)
+
+
+def test_the_summary_is_what_channel_select_read_from_mne(edf):
+    from edf_reader import read_summary
+    raw = mne.io.read_raw_edf(edf, preload=False, verbose=False)
+    s = read_summary(edf)
+    assert s["ch_names"] == raw.ch_names
+    assert s["sfreq"] == raw.info["sfreq"]
+    assert s["duration_s"] == pytest.approx(raw.times[-1])
+    assert s["native_sfreq"] == {"EEG C4-M1": 256.0, "Flow": 32.0, "SpO2": 1.0}
+    assert s["meas_date"] == raw.info["meas_date"].isoformat()
+    json.dumps(s)                          # moet in Redis kunnen
+
+
+def test_a_bdf_is_refused_so_the_api_can_fall_back(tmp_path):
+    p = tmp_path / "x.bdf"
+    p.write_bytes(b"\xffBIOSEMI" + b" " * 300)
+    with pytest.raises(EdfReaderError):
+        read_header(str(p))
+
+
+def test_the_viewer_api_serves_the_same_epoch_as_before(edf, tmp_path):
+    """Zelfde vorm en tijdas als de MNE-route; hoge-frequentiekanaal gelijk."""
+    (tmp_path / "j_config.json").write_text(json.dumps({"edf_path": edf}))
+    edf_api.clear_cache()
+    info = edf_api.edf_info("j", str(tmp_path))
+    got = edf_api.edf_epoch("j", 1, str(tmp_path))
+
+    mne_src = edf_api._MneSource(edf)
+    data, eff = mne_src.window(list(got["channels"]), 30.0, 60.0, n_out=512)
+    assert info["n_epochs"] == int(mne_src.duration_s // 30)
+    assert got["sfreq"] == eff
+    assert got["n_samples"] == data.shape[1]
+    np.testing.assert_allclose(got["channels"]["EEG C4-M1"], data[0],
+                               atol=1e-12)
@@ -0,0 +1,127 @@
+"""Binair of JSON: de viewer moet dezelfde epoch te zien krijgen.
+
+`?format=f32|i16` op de epoch-routes stuurt de signalen als getypeerde
+arrays in plaats van JSON-getallen. Dat mag alleen de lijn en de CPU
+sparen: kanaalvolgorde, tijdas en waarden moeten overeenkomen met de
+JSON-route, anders toont de scorer iets anders naargelang het formaat.
+De decoder hieronder volgt `edfDecodeSignals` in edf_viewer_v12.js.
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+edfio = pytest.importorskip("edfio")
+
+import edf_api  # noqa: E402
+
+DUR_S = 125
+
+
+def _decode(body: bytes) -> dict:
+    n = int.from_bytes(body[:4], "little")
+    head = json.loads(body[4:4 + n])
+    assert (4 + n) % 4 == 0
+    off = 4 + n
+    dtype = "<f4" if head["dtype"] == "f32" else "<i2"
+    for blk in head.get("epochs", [head]):
+        blk["channels"] = {}
+        for i, ch in enumerate(head["channel_order"]):
+            x = np.frombuffer(body, dtype=dtype, count=blk["n_samples"], offset=off)
+            off += x.nbytes
+            if head["dtype"] == "i16":
+                x = x * blk["scales"][i]
+            blk["channels"][ch] = x
+    assert off == len(body)
+    return head
+
+
+@pytest.fixture
+def job(tmp_path):
+    t = np.arange(DUR_S * 256) / 256
+    p = tmp_path / "transport.edf"
+    edfio.Edf([
+        edfio.EdfSignal(80 * np.sin(2 * np.pi * 10 * t), sampling_frequency=256,
+                        label="EEG C4-M1", physical_dimension="uV",
+                        physical_range=(-500.0, 500.0)),
+        edfio.EdfSignal(np.zeros(DUR_S * 32), sampling_frequency=32,
+                        label="Flow", physical_dimension="",
+                        physical_range=(-2.0, 2.0)),
+    ]).write(p)
+    (tmp_path / "j_config.json").write_text(json.dumps({"edf_path": str(p)}))
+    edf_api.clear_cache()
+    return str(tmp_path)
+
+
+def test_float32_carries_the_json_epoch(job):
+    ref = edf_api.edf_epoch("j", 2, job)
+    got = _decode(edf_api.edf_epoch_binary("j", 2, job, fmt="f32"))
+    assert got["channel_order"] == list(ref["channels"])
+    for key in ("epoch", "t0_s", "t1_s", "sfreq", "n_samples"):
+        assert got[key] == ref[key]
+    for ch, sig in ref["channels"].items():
+        np.testing.assert_allclose(got["channels"][ch], sig, rtol=1e-6, atol=0)
+
+
+def test_int16_is_within_half_a_step_and_a_flat_channel_stays_flat(job):
+    """Een vlak kanaal (EDF-kwantisatie: niet exact nul) mag niet gaan ruisen."""
+    ref = edf_api.edf_epoch("j", 1, job)
+    got = _decode(edf_api.edf_epoch_binary("j", 1, job, fmt="i16"))
+    eeg = np.asarray(ref["channels"]["EEG C4-M1"])
+    step = np.abs(eeg).max() / 32767
+    np.testing.assert_allclose(got["channels"]["EEG C4-M1"], eeg, atol=step / 2 + 1e-18)
+    flow = got["channels"]["Flow"]
+    assert np.ptp(flow) == 0
+    assert flow[0] == pytest.approx(ref["channels"]["Flow"][0], rel=1e-4)
+
+
+def test_multi_epoch_blocks_follow_each_other(job):
+    ref = edf_api.edf_multi_epoch("j", 1, 4, job, ["Flow", "EEG C4-M1"])
+    got = _decode(edf_api.edf_multi_epoch_binary("j", 1, 4, job,
+                                                 ["Flow", "EEG C4-M1"], fmt="f32"))
+    assert got["channel_order"] == ["Flow", "EEG C4-M1"]
+    assert [e["epoch"] for e in got["epochs"]] == [e["epoch"] for e in ref["epochs"]]
+    np.testing.assert_allclose(got["epochs"][-1]["channels"]["EEG C4-M1"],
+                               ref["epochs"][-1]["channels"]["EEG C4-M1"], rtol=1e-6)
+
+
+def test_the_binary_body_is_a_fraction_of_the_json(job):
+    as_json = json.dumps(edf_api.edf_epoch("j", 0, job)).encode()
+    assert len(edf_api.edf_epoch_binary("j", 0, job, fmt="f32")) * 3 < len(as_json)
+    assert len(edf_api.edf_epoch_binary("j", 0, job, fmt="i16")) * 6 < len(as_json)
+
+
+def test_an_unknown_format_is_refused(job):
+    with pytest.raises(ValueError):
+        edf_api.edf_epoch_binary("j", 0, job, fmt="f64")
+
+
+def test_a_range_on_an_epoch_boundary_is_that_epoch(job):
+    ref = edf_api.edf_epoch("j", 2, job)
+    got = edf_api.edf_range("j", 60.0, 90.0, 512, job)
+    assert got["sfreq"] == ref["sfreq"]
+    for ch, sig in ref["channels"].items():
+        np.testing.assert_allclose(got["channels"][ch], sig, atol=0)
+
+
+def test_a_range_off_the_epoch_grid_spans_two_epochs_in_one_answer(job):
+    """Een event van 47,3 tot 71,8 s: geen epochgrens, toch één verzoek."""
+    got = _decode(edf_api.edf_range_binary("j", 47.3, 71.8, 400, job,
+                                           ["EEG C4-M1"], fmt="f32"))
+    assert got["t0_s"] == 47.3 and got["t1_s"] == 71.8
+    assert got["channel_order"] == ["EEG C4-M1"]
+    assert 400 <= got["n_samples"] <= 2 * 400
+    assert got["n_samples"] / got["sfreq"] == pytest.approx(71.8 - 47.3, abs=0.1)
+
+
+def test_long_or_empty_ranges_are_refused(job):
+    with pytest.raises(ValueError):
+        edf_api.edf_range("j", 0.0, edf_api.MAX_RANGE_S + 1, 512, job)
+    with pytest.raises(ValueError):
+        edf_api.edf_range("j", 0.0, 30.0, 0, job)
+    with pytest.raises(IndexError):
+        edf_api.edf_range("j", DUR_S + 5, DUR_S + 30, 512, job)
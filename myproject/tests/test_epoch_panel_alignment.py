@@ -34,7 +34,6 @@ import matplotlib  # noqa: E402
 
 matplotlib.use("Agg")
 import generate_pdf_report as g  # noqa: E402
-import matplotlib.pyplot as plt  # noqa: E402
 
 DUR_S, DROP_START, DROP_END = 600, 300.0, 320.0
 AMP = 100.0
@@ -92,7 +91,7 @@ CH_MAP_GEDEELD = {"flow": "Flow", "flow_pressure": "Flow",
 def _panel(edf_path, onset=DROP_START, dur=DROP_END - DROP_START, ch_map=None):
     """Render en geef de assen terug, per kanaaltype."""
     grabbed = {}
-    real_subplots = plt.subplots
+    real_subplots = g._subplots
 
     def spy(*a, **kw):
         fig, axes = real_subplots(*a, **kw)
@@ -100,15 +99,14 @@ def _panel(edf_path, onset=DROP_START, dur=DROP_END - DROP_START, ch_map=None):
         return fig, axes
 
     cm = CH_MAP if ch_map is None else ch_map
-    real_close = plt.close
-    plt.subplots, plt.close = spy, lambda *a, **k: None
+    g._subplots = spy
     try:
         g._plot_epoch_example(edf_path, cm,
                               {"type": "obstructive", "onset_s": onset,
                                "duration_s": dur, "confidence": 0.9},
                               hypno=["N2"] * 20)
     finally:
-        plt.subplots, plt.close = real_subplots, real_close
+        g._subplots = real_subplots
 
     if "axes" not in grabbed:
         return {}, None
@@ -139,7 +137,6 @@ def test_the_window_is_centred_on_the_event(edf):
     x, _ = _line(axes["flow"])
     assert x[0] == pytest.approx(DROP_START - 15, abs=0.5), "venster begint verkeerd"
     assert x[-1] == pytest.approx(DROP_END + 30, abs=0.5), "venster eindigt verkeerd"
-    plt.close(fig)
 
 
 def test_the_silence_falls_inside_the_marked_band(edf):
@@ -151,7 +148,6 @@ def test_the_silence_falls_inside_the_marked_band(edf):
     buiten = ~binnen
     assert np.abs(y[binnen]).max() < 0.1 * AMP, "de band ligt niet op de stilte"
     assert np.abs(y[buiten]).max() > 0.5 * AMP, "buiten de band is het ook stil"
-    plt.close(fig)
 
 
 def test_a_deliberately_shifted_event_fails_the_same_check(edf):
@@ -161,7 +157,6 @@ def test_a_deliberately_shifted_event_fails_the_same_check(edf):
     x, y = _line(axes["flow"])
     binnen = (x >= DROP_START + 25) & (x < DROP_END + 25)
     assert np.abs(y[binnen]).max() > 0.5 * AMP
-    plt.close(fig)
 
 
 def test_mixed_sample_rates_do_not_shift_the_time_axis(edf):
@@ -173,7 +168,6 @@ def test_mixed_sample_rates_do_not_shift_the_time_axis(edf):
         xo, _ = _line(axes[ct])
         assert xo[0] == pytest.approx(xf[0], abs=0.05), f"{ct} loopt uit de pas"
         assert xo[-1] == pytest.approx(xf[-1], abs=0.05), f"{ct} loopt uit de pas"
-    plt.close(fig)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -190,7 +184,6 @@ def test_the_reference_breathing_is_not_clipped(edf):
         assert lo <= -amp and hi >= amp, (
             f"{ct}: referentie-ademhaling ±{amp:.0f} valt buiten de y-as "
             f"({lo:.0f}, {hi:.0f})")
-    plt.close(fig)
 
 
 def test_the_old_rule_would_have_clipped_this(edf):
@@ -208,7 +201,6 @@ def test_the_old_rule_would_have_clipped_this(edf):
     assert not (lo <= -AMP and hi >= AMP), (
         f"median±4·MAD klemt hier niet ({lo:.1f}, {hi:.1f}) — dit fixture "
         "reproduceert de fout niet meer en de schaaltoets meet niets")
-    plt.close(fig)
 
 
 def test_the_event_itself_stays_in_view(edf):
@@ -216,7 +208,6 @@ def test_the_event_itself_stays_in_view(edf):
     for ct in ("flow", "thorax", "abdomen"):
         lo, hi = axes[ct].get_ylim()
         assert lo < 0 < hi, f"{ct}: de nullijn van het event valt buiten beeld"
-    plt.close(fig)
 
 
 def test_a_flat_channel_does_not_collapse_the_axis(edf, tmp_path):
@@ -225,7 +216,6 @@ def test_a_flat_channel_does_not_collapse_the_axis(edf, tmp_path):
     for ct in ("flow", "thorax", "abdomen", "spo2"):
         lo, hi = axes[ct].get_ylim()
         assert hi > lo, f"{ct}: y-as heeft hoogte nul"
-    plt.close(fig)
 
 
 # ──────────────────────────────────────────────────────────────
@@ -242,7 +232,6 @@ def test_a_flat_channel_does_not_collapse_the_axis(edf, tmp_path):
 def test_two_roles_sharing_one_channel_still_render(edf):
     axes, fig = _panel(edf, ch_map=CH_MAP_GEDEELD)
     assert fig is not None, "geen enkel paneel getekend bij een gedeeld kanaal"
-    plt.close(fig)
 
 
 def test_a_shared_channel_is_drawn_once(edf):
@@ -251,7 +240,6 @@ def test_a_shared_channel_is_drawn_once(edf):
     axes, fig = _panel(edf, ch_map=CH_MAP_GEDEELD)
     assert len(fig.axes) == 4, (
         f"verwacht 4 rijen (Flow, Thorax, Abdomen, SpO2), kreeg {len(fig.axes)}")
-    plt.close(fig)
 
 
 def test_the_shared_channel_keeps_its_data(edf):
@@ -261,7 +249,6 @@ def test_the_shared_channel_keeps_its_data(edf):
     binnen = (x >= DROP_START) & (x < DROP_END)
     assert np.abs(y[binnen]).max() < 0.1 * AMP
     assert np.abs(y[~binnen]).max() > 0.5 * AMP
-    plt.close(fig)
 
 
 def test_load_panel_raw_survives_duplicate_roles(edf):
@@ -317,14 +304,14 @@ def _assert_event_span(ax):
 
 def _panel_met_buren(edf_path, buren):
     grabbed = {}
-    real_subplots, real_close = plt.subplots, plt.close
+    real_subplots = g._subplots
 
     def spy(*a, **kw):
         fig, axes = real_subplots(*a, **kw)
         grabbed["fig"], grabbed["axes"] = fig, np.atleast_1d(axes)
         return fig, axes
 
-    plt.subplots, plt.close = spy, lambda *a, **k: None
+    g._subplots = spy
     try:
         g._plot_epoch_example(
             edf_path, CH_MAP,
@@ -332,7 +319,7 @@ def _panel_met_buren(edf_path, buren):
              "duration_s": DROP_END - DROP_START, "confidence": 0.9},
             hypno=["N2"] * 20, all_events=buren)
     finally:
-        plt.subplots, plt.close = real_subplots, real_close
+        g._subplots = real_subplots
     return grabbed["axes"][0], grabbed["fig"]
 
 
@@ -344,7 +331,6 @@ def test_a_neighbour_crossing_the_window_edge_is_still_marked(edf):
     _assert_event_span(ax)
     randen = [s for s in _spans(ax) if s[0] > DROP_END + 20]
     assert randen, "buurevent over de vensterrand wordt niet gemarkeerd"
-    plt.close(fig)
 
 
 def test_a_neighbour_starting_before_the_window_is_still_marked(edf):
@@ -354,7 +340,6 @@ def test_a_neighbour_starting_before_the_window_is_still_marked(edf):
     _assert_event_span(ax)
     vroeg = [s for s in _spans(ax) if s[0] < DROP_START - 10]
     assert vroeg, "buurevent dat vóór het venster begint wordt niet gemarkeerd"
-    plt.close(fig)
 
 
 def test_the_marking_is_clipped_to_the_window(edf):
@@ -368,7 +353,6 @@ def test_the_marking_is_clipped_to_the_window(edf):
     # t_end = 350; matplotlib zet daar zijn gebruikelijke marge omheen (~353).
     # Een niet-afgeknipte markering zou tot 545 lopen.
     assert hi <= DROP_END + 40, f"x-as opgerekt tot {hi:.0f}"
-    plt.close(fig)
 
 
 def test_a_neighbour_outside_the_window_is_not_marked(edf):
@@ -378,7 +362,6 @@ def test_a_neighbour_outside_the_window_is_not_marked(edf):
     ax, fig = _panel_met_buren(edf, buren)
     _assert_event_span(ax)
     assert not [s for s in _spans(ax) if s[0] > DROP_END + 40]
-    plt.close(fig)
 
 
 def test_rejected_candidates_are_not_marked_as_scored(edf):
@@ -388,4 +371,3 @@ def test_rejected_candidates_are_not_marked_as_scored(edf):
     ax, fig = _panel_met_buren(edf, buren)
     _assert_event_span(ax)
     assert not [s for s in _spans(ax) if DROP_END + 3 < s[0] < DROP_END + 8]
-    plt.close(fig)
@@ -23,12 +23,14 @@ from app import Job, Site, User, app, db
 from flask_login import login_user
 from werkzeug.security import generate_password_hash
 
-# Alle 32 job-routes, met een concrete URL per route. Blijft bewust
+# Alle 33 job-routes, met een concrete URL per route. Blijft bewust
 # handmatig: de meta-test onderaan bewaakt dat er niets bijkomt.
 JOB_ROUTES = [
     ("GET", "/channel-select/{jid}"),
     ("GET", "/status/{jid}"),
     ("GET", "/api/status/{jid}"),
+    # Dezelfde status als Server-Sent Events (job_events.py).
+    ("GET", "/api/status/{jid}/stream"),
     ("GET", "/results/{jid}"),
     # Visuele eventcontrole. Staat hier omdat de route een <job_id> draagt;
     # daarnaast geldt requires_role("admin") — toegang tot de uitslag geeft
@@ -69,6 +71,8 @@ JOB_ROUTES = [
     ("GET", "/api/edf/{jid}/info"),
     ("GET", "/api/edf/{jid}/epoch/0"),
     ("GET", "/api/edf/{jid}/epochs/0/1"),
+    ("GET", "/api/edf/{jid}/range"),
+    ("GET", "/api/edf/{jid}/envelope"),
     ("GET", "/api/edf/{jid}/events/0"),
     ("GET", "/api/edf/{jid}/events/all"),
     ("POST", "/api/edf/{jid}/events/toggle"),
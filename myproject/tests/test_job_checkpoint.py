@@ -0,0 +1,117 @@
+"""Een onderbroken analyse gaat verder waar hij stopte, niet van nul.
+
+Drie dingen moeten kloppen: wat klaar was wordt teruggezet en niet opnieuw
+gedraaid (ook het laden niet, als niets het nog nodig heeft); een gewijzigde
+config maakt oude checkpoints ongeldig; en alleen een timeout of een
+gestopte work-horse zet de job opnieuw klaar, met meer tijd en hoogstens
+`JOB_RETRIES` keer.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from job_checkpoint import JobCheckpoints
+from stage_graph import Stage, run_stages
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _graph(calls, fail_pneumo):
+    def run(name, value):
+        def fn(**_):
+            calls.append(name)
+            if name == "pneumo" and fail_pneumo:
+                raise MemoryError("OOM")
+            return value
+        return fn
+    return [
+        Stage("load", run("load", "raws"), checkpoint=False),
+        Stage("staging", run("staging", ["N2"]), ("load",)),
+        Stage("spindles", run("spindles", 3), ("load", "staging")),
+        Stage("pneumo", run("pneumo", {"ahi": 7}), ("load", "staging")),
+        Stage("report", run("report", "ok"), ("staging", "spindles", "pneumo")),
+    ]
+
+
+def test_a_second_attempt_runs_only_what_is_missing(tmp_path):
+    ckpt = JobCheckpoints(str(tmp_path / "j_checkpoints"), "cfg-1")
+    calls: list = []
+    with pytest.raises(MemoryError):
+        run_stages(_graph(calls, fail_pneumo=True), max_workers=1, checkpoints=ckpt)
+    assert "staging" in ckpt.done() and "load" not in ckpt.done()
+
+    calls.clear()
+    out, timings = run_stages(_graph(calls, fail_pneumo=False), max_workers=1,
+                              checkpoints=JobCheckpoints(ckpt.directory, "cfg-1"))
+    assert out["report"] == "ok" and out["staging"] == ["N2"]
+    assert "staging" not in calls and "load" in calls      # pneumo heeft de raws nodig
+    assert timings["staging"] == {"restored": True}
+
+    calls.clear()
+    out, _ = run_stages(_graph(calls, fail_pneumo=False), max_workers=1,
+                        checkpoints=JobCheckpoints(ckpt.directory, "cfg-1"))
+    assert calls == [] and "load" not in out               # niets meer te laden
+
+
+def test_another_config_starts_clean(tmp_path):
+    ckpt = JobCheckpoints(str(tmp_path / "j_checkpoints"), "cfg-1")
+    ckpt.save("staging", ["N2"])
+    again = JobCheckpoints(ckpt.directory, "cfg-2")
+    assert again.done() == [] and again.restore("staging") == (False, None)
+
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import job_state  # noqa: E402
+
+
+@pytest.fixture
+def rq_job(monkeypatch):
+    import tasks
+    from rq import Queue
+
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(tasks, "_progress_redis", r)
+    monkeypatch.setattr(tasks, "JOB_RETRIES", 1)
+    return Queue("default", connection=r).enqueue(
+        "tasks.run_analysis_job", args=("j1",), job_timeout=900)
+
+
+def test_a_timeout_requeues_once_with_more_time(rq_job):
+    import tasks
+    from rq.job import Job
+    from rq.timeouts import JobTimeoutException
+
+    tasks.on_analysis_failure(rq_job, rq_job.connection, JobTimeoutException, None, None)
+    state = job_state.get(rq_job.connection, "j1")
+    assert state["status"] == "queued"
+    new_id = state["rq_id"]
+    retry = Job.fetch(new_id, connection=rq_job.connection)
+    assert retry.timeout == 1800 and retry.args == ("j1",)
+    assert retry.meta["attempt"] == 2 and retry.meta["retry_of"] == rq_job.id
+
+    assert tasks.requeue_interrupted_job(retry, "work-horse gestopt") is None
+
+
+def test_an_ordinary_error_is_not_retried(rq_job):
+    import tasks
+    tasks.on_analysis_failure(rq_job, rq_job.connection, FileNotFoundError, None, None)
+    assert "rq_id" not in job_state.get(rq_job.connection, "j1")
+
+
+def test_deleting_a_job_removes_its_directories_too(tmp_path, monkeypatch):
+    import app as app_module
+    from job_checkpoint import checkpoint_dir
+
+    monkeypatch.setattr(app_module, "redis_conn", fakeredis.FakeRedis())
+    monkeypatch.setitem(app_module.app.config, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setitem(app_module.app.config, "PROCESSED_FOLDER", str(tmp_path))
+    JobCheckpoints(checkpoint_dir(str(tmp_path), "j1"), "cfg-1").save("staging", ["N2"])
+    (tmp_path / "j1_study").mkdir()
+    (tmp_path / "j1_study" / "aasm_v3_rec.json").write_text("{}")
+    (tmp_path / "j1_results.json").write_text("{}")
+    (tmp_path / "j2_results.json").write_text("{}")
+
+    deleted, errors = app_module._delete_job_files("j1")
+    assert errors == [] and deleted == 3
+    assert [p.name for p in tmp_path.iterdir()] == ["j2_results.json"]
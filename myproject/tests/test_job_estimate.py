@@ -0,0 +1,85 @@
+"""Kost vooraf uit de header: ruwe priors zonder geschiedenis, een fit met.
+
+Een polygrafie moet goedkoper uitvallen dan een PSG van dezelfde nacht en
+naar de snelle baan gaan; met genoeg echte runs volgt de schatting die
+runs en niet meer de priors.
+"""
+import job_estimate
+
+
+def _summary(hours, n_ch=20, sfreq=256.0):
+    names = [f"ch{i}" for i in range(n_ch)]
+    return {"ch_names": names, "sfreq": sfreq, "duration_s": hours * 3600,
+            "native_sfreq": {n: sfreq for n in names}}
+
+
+def test_without_history_a_polygraphy_is_cheap_and_goes_fast(tmp_path, monkeypatch):
+    monkeypatch.delenv("YASAFLASKIFIED_FAST_LANE_MAX_S", raising=False)
+    pg = job_estimate.estimate(str(tmp_path), "analysis",
+                               job_estimate.features(_summary(8), "diagnostic_pg"))
+    psg = job_estimate.estimate(str(tmp_path), "analysis",
+                                job_estimate.features(_summary(8), "diagnostic_psg"))
+    assert pg["basis"] == psg["basis"] == "prior"
+    assert pg["runtime_s"] < psg["runtime_s"]
+    assert job_estimate.route(pg["runtime_s"]) == "fast"
+    assert job_estimate.route(psg["runtime_s"]) == "default"
+    assert job_estimate.route(None) == "default"
+
+
+def test_the_fit_follows_recorded_runs(tmp_path):
+    for i in range(12):
+        hours = 4 + i % 7
+        staging = i % 2 == 0
+        f = job_estimate.features(_summary(hours, n_ch=10 + i),
+                                  "diagnostic_psg" if staging else "diagnostic_pg")
+        runtime = 20 + 2 * f["msamples"] + 10 * hours + (30 * hours if staging else 0)
+        job_estimate.record(str(tmp_path), "analysis", f"j{i}", f, runtime,
+                            ram_mb=300 + 10 * f["msamples"])
+    job_estimate.record(str(tmp_path), "study", "s1", f, 999.0)
+
+    assert len(job_estimate.load_history(str(tmp_path), "analysis")) == 12
+    f = job_estimate.features(_summary(9, n_ch=15), "diagnostic_psg")
+    est = job_estimate.estimate(str(tmp_path), "analysis", f)
+    assert est["basis"] == "fit" and est["n"] == 12
+    assert abs(est["runtime_s"] - (20 + 2 * f["msamples"] + 40 * 9)) <= 1
+    assert abs(est["ram_mb"] - (300 + 10 * f["msamples"])) <= 1
+
+
+def test_the_timeout_follows_the_recording(tmp_path):
+    def timeout(hours, n_ch=20, profiles=0):
+        kind = "study" if profiles else "analysis"
+        f = job_estimate.features(_summary(hours, n_ch=n_ch), "diagnostic_psg", profiles)
+        return job_estimate.timeout_s(job_estimate.estimate(str(tmp_path), kind, f), 900)
+
+    assert timeout(0.5) == job_estimate.MIN_TIMEOUT_S
+    assert timeout(14, n_ch=40) > 900
+    assert timeout(8, profiles=3) < timeout(12, profiles=7) <= job_estimate.MAX_TIMEOUT_S
+    assert job_estimate.timeout_s(None, 900) == 900
+
+
+def test_a_parallel_comparison_is_fitted_by_rounds(tmp_path):
+    """Zes profielen over drie processen zijn twee rondes, geen zes."""
+    for i in range(12):
+        hours, workers = 4 + i % 7, 1 + i % 3
+        f = job_estimate.features(_summary(hours), None, 6, workers)
+        job_estimate.record(str(tmp_path), "study", f"s{i}", f,
+                            60 + 50 * hours * -(-6 // workers))
+    # Van vóór het kenmerk: onbekend hoeveel er tegelijk liepen.
+    old = job_estimate.features(_summary(8), None, 6)
+    del old["workers"]
+    job_estimate.record(str(tmp_path), "study", "old", old, 5.0)
+
+    seq = job_estimate.estimate(str(tmp_path), "study",
+                                job_estimate.features(_summary(8), None, 6))
+    par = job_estimate.estimate(str(tmp_path), "study",
+                                job_estimate.features(_summary(8), None, 6, workers=3))
+    assert seq["basis"] == "fit" and seq["n"] == 12
+    assert abs(seq["runtime_s"] - (60 + 50 * 8 * 6)) <= 1
+    assert abs(par["runtime_s"] - (60 + 50 * 8 * 2)) <= 1
+
+
+def test_the_prior_grows_with_the_samples(tmp_path):
+    small = job_estimate.features(_summary(8, n_ch=8), "diagnostic_pg")
+    large = job_estimate.features(_summary(8, n_ch=40, sfreq=512.0), "diagnostic_pg")
+    assert (job_estimate.estimate(str(tmp_path), "analysis", small)["runtime_s"]
+            < job_estimate.estimate(str(tmp_path), "analysis", large)["runtime_s"])
@@ -0,0 +1,69 @@
+"""Voortgang via pub/sub en de SSE-stream van de statuspagina."""
+import inspect
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import job_events  # noqa: E402
+import job_state  # noqa: E402
+
+
+def _events(chunks):
+    out = []
+    for chunk in chunks:
+        lines = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+        out.append((lines.get("event"), json.loads(lines["data"]) if "data" in lines else None))
+    return out
+
+
+def test_progress_is_stored_and_published_at_once():
+    r = fakeredis.FakeRedis()
+    sub = r.pubsub(ignore_subscribe_messages=True)
+    sub.subscribe(job_events.channel("j1"))
+    sub.get_message(timeout=1)                          # de inschrijving
+    job_events.publish_progress(r, "j1", 3, 10, "Staging...")
+    state = job_state.get(r, "j1")
+    assert (state["step"], state["total"], state["label"]) == ("3", "10", "Staging...")
+    assert 0 < r.ttl(job_state.key("j1")) <= job_state.ACTIVE_TTL_S
+    message = sub.get_message(timeout=1)
+    assert json.loads(message["data"]) == {"type": "progress", "step": 3,
+                                           "total": 10, "label": "Staging..."}
+
+
+def test_the_app_job_id_behind_an_rq_job():
+    from rq import Queue
+    q = Queue("default", connection=fakeredis.FakeRedis())
+    released = q.enqueue("tasks.run_analysis_job", args=("j1",),
+                         meta={"sched_key": "default:j1"})
+    assert job_events.app_job_id(released) == "j1"
+    assert job_events.app_job_id(q.enqueue("tasks.reuse_analysis_results",
+                                           args=("j2", "j0"))) == "j2"
+
+
+def test_the_stream_relays_progress_and_ends_when_done(monkeypatch):
+    import app as app_module
+
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(app_module, "redis_conn", r)
+    monkeypatch.setattr(app_module, "STATUS_STREAM_QUIET_S", 0.2)
+    state = {"status": "started", "done": False, "failed": False}
+    monkeypatch.setattr(app_module, "_job_status_payload",
+                        lambda job_id: (dict(state), 200))
+
+    view = inspect.unwrap(app_module.app.view_functions["api_job_status_stream"])
+    with app_module.app.test_request_context("/api/status/j1/stream"):
+        response = view("j1")
+        assert response.mimetype == "text/event-stream"
+        chunks = iter(response.response)
+        assert next(chunks).startswith("retry:")          # nu ingeschreven
+        job_events.publish_progress(r, "j1", 4, 10, "Pneumo...")
+        first, progress = _events([next(chunks), next(chunks)])
+        assert first == ("status", state)
+        assert progress == ("progress", {"step": 4, "total": 10, "label": "Pneumo..."})
+
+        state.update(status="finished", done=True)
+        job_events.publish_state(r, "j1")
+        assert _events([next(chunks)]) == [("status", state)]
+        assert next(chunks, None) is None
@@ -0,0 +1,124 @@
+"""De scheduler vóór RQ: prioriteit, eerlijk delen over sites, en een maximum per site.
+
+Eén worker-plaats per wachtrij (`YASAFLASKIFIED_SCHED_SLOTS`), zodat wat er
+vrijkomt en in welke volgorde de rest wacht precies te volgen is.
+"""
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import job_scheduler  # noqa: E402
+import job_state  # noqa: E402
+from rq import Queue  # noqa: E402
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.delenv("YASAFLASKIFIED_SCHEDULER", raising=False)
+    monkeypatch.delenv("YASAFLASKIFIED_SCHED_SITE_WEIGHTS", raising=False)
+    monkeypatch.delenv("YASAFLASKIFIED_SCHED_SITE_MAX_INFLIGHT", raising=False)
+    monkeypatch.setenv("YASAFLASKIFIED_SCHED_SLOTS", '{"default": 1, "study": 1}')
+    monkeypatch.setenv("YASAFLASKIFIED_SCHED_MAX_INFLIGHT", "10")
+    return fakeredis.FakeRedis()
+
+
+def _submit(conn, job_id, site, priority="routine"):
+    return job_scheduler.submit(conn, "default", job_id, "tasks.run_analysis_job",
+                                (job_id,), site=site, priority=priority,
+                                job_timeout=900, track_state=True)
+
+
+def test_a_late_site_is_not_stuck_behind_a_bulk_upload(conn):
+    assert _submit(conn, "a1", 1) is not None          # vrije plaats: meteen
+    for j in ("a2", "a3", "a4"):
+        assert _submit(conn, j, 1) is None
+    _submit(conn, "b1", 2)
+    _submit(conn, "b2", 2)
+    assert job_scheduler.queue_positions(conn) == ["b1", "a2", "b2", "a3", "a4"]
+    assert job_scheduler.pending_status(conn, "b1")["position"] == 1
+    assert job_state.get(conn, "a1")["status"] == "queued"
+    assert "rq_id" not in job_state.get(conn, "b1")
+
+
+def test_urgent_goes_first_whatever_the_site(conn):
+    for j in ("a1", "a2", "a3"):
+        _submit(conn, j, 1)
+    _submit(conn, "b1", 2, priority="research")
+    _submit(conn, "b2", 2, priority="urgent")
+    assert job_scheduler.queue_positions(conn)[:2] == ["b2", "a2"]
+    assert job_scheduler.queue_positions(conn)[-1] == "b1"
+
+
+def test_weights_set_the_share(conn, monkeypatch):
+    monkeypatch.setenv("YASAFLASKIFIED_SCHED_SITE_WEIGHTS", '{"1": 2}')
+    _submit(conn, "x", 3)                               # bezet de plaats
+    for i in range(4):
+        _submit(conn, f"a{i}", 1)
+        _submit(conn, f"b{i}", 2)
+    order = job_scheduler.queue_positions(conn)
+    assert [j[0] for j in order[:6]].count("a") == 4
+
+
+def test_a_site_at_its_limit_is_skipped_until_a_job_ends(conn, monkeypatch):
+    monkeypatch.setenv("YASAFLASKIFIED_SCHED_SLOTS", '{"default": 3}')
+    monkeypatch.setenv("YASAFLASKIFIED_SCHED_MAX_INFLIGHT", "1")
+    first = _submit(conn, "a1", 1)
+    assert first is not None
+    assert _submit(conn, "a2", 1) is None               # site 1 zit aan haar max
+    assert _submit(conn, "b1", 2) is not None           # site 2 niet
+
+    q = Queue("default", connection=conn)
+    done = q.fetch_job(first)
+    assert done.meta["sched_site"] == "1"
+    q.remove(done)
+    job_scheduler.on_job_success(done, conn, None)
+    assert job_state.get(conn, "a2")["rq_id"] is not None
+    assert job_scheduler.pending_status(conn, "a2") is None
+
+
+def test_off_goes_straight_to_rq(conn, monkeypatch):
+    monkeypatch.setenv("YASAFLASKIFIED_SCHEDULER", "off")
+    for j in ("a1", "a2"):
+        assert _submit(conn, j, 1) is not None
+    assert Queue("default", connection=conn).count == 2
+
+
+def test_the_wait_counts_the_estimates_ahead(conn):
+    def submit(job_id, estimate):
+        return job_scheduler.submit(conn, "default", job_id, "tasks.run_analysis_job",
+                                    (job_id,), site=1, estimate_s=estimate)
+    submit("a1", 600)                                   # draait
+    submit("a2", 600)
+    submit("a3", 120)
+    status = job_scheduler.pending_status(conn, "a3")
+    assert status["queue"] == "default" and status["position"] == 2
+    assert status["ahead_s"] == 600
+
+
+def test_a_worker_on_several_queues_is_one_free_slot(conn, monkeypatch):
+    from rq import Worker
+    monkeypatch.delenv("YASAFLASKIFIED_SCHED_SLOTS")
+    both = Worker([Queue("fast", connection=conn), Queue("default", connection=conn)],
+                  connection=conn, name="base")
+    clinical = Worker([Queue("default", connection=conn), Queue("study", connection=conn)],
+                      connection=conn, name="clinical")
+    for w in (both, clinical):
+        w.register_birth()
+        w.set_state("idle")
+
+    def submit(queue, job_id):
+        return job_scheduler.submit(conn, queue, job_id, "tasks.run_analysis_job",
+                                    (job_id,), site=1, job_timeout=900)
+    assert submit("fast", "f1") is not None
+    d1 = submit("default", "d1")
+    assert d1 is not None
+    assert submit("default", "d2") is None              # beide workers hebben werk
+    assert submit("study", "s1") is None
+
+    # d1 loopt op `clinical` en eindigt: die plaats komt vrij, niet meer.
+    Queue("default", connection=conn).remove(d1)
+    clinical.set_state("busy")
+    clinical.set_current_job_id(d1)
+    released = job_scheduler.dispatch(conn, ending=d1)
+    assert list(released) == ["default:d2"]
+    assert job_scheduler.pending_status(conn, "s1", ("study",))["position"] == 1
@@ -0,0 +1,58 @@
+"""Eén toestand per job in Redis, en de status-API die alleen daaruit antwoordt."""
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import job_state  # noqa: E402
+
+
+def test_one_hash_with_a_ttl_per_phase():
+    r = fakeredis.FakeRedis()
+    job_state.update(r, "j1", status="parsed", filepath="/data/a.edf", orig_file_id="f1")
+    assert 0 < r.ttl(job_state.key("j1")) <= job_state.PARSED_TTL_S
+
+    job_state.update(r, "j1", status="scheduled", estimate={"runtime_s": 240})
+    assert r.ttl(job_state.key("j1")) > job_state.PARSED_TTL_S
+    state = job_state.get(r, "j1")
+    assert state["filepath"] == "/data/a.edf" and state["estimate"] == {"runtime_s": 240}
+
+    job_state.update(r, "j1", estimate=None)
+    assert "estimate" not in job_state.get(r, "j1")
+    assert job_state.statuses(r, ["j1", "j2"]) == {"j1": "scheduled", "j2": None}
+
+
+def test_a_replaced_attempt_cannot_overwrite_its_successor():
+    r = fakeredis.FakeRedis()
+    job_state.update(r, "j1", status="queued", rq_id="rq-2")
+    assert not job_state.transition(r, "j1", "rq-1", "failed", error="timeout")
+    assert job_state.transition(r, "j1", "rq-2", "finished")
+    assert job_state.get(r, "j1")["status"] == "finished"
+    assert "error" not in job_state.get(r, "j1")
+
+
+def test_the_status_api_answers_from_the_state(monkeypatch, tmp_path):
+    import app as app_module
+
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(app_module, "redis_conn", r)
+    monkeypatch.setitem(app_module.app.config, "UPLOAD_FOLDER", str(tmp_path))
+    mirrored = []
+    monkeypatch.setattr(app_module, "_mirror_job_state",
+                        lambda job_id, status: mirrored.append((job_id, status)))
+
+    with app_module.app.test_request_context():
+        job_state.update(r, "j1", status="started", rq_id="rq-1", started_at=0.0,
+                         estimate={"runtime_s": 240}, step=3, total=10, label="Staging")
+        payload, code = app_module._job_status_payload("j1")
+        assert code == 200 and payload["status"] == "started"
+        assert payload["progress"] == {"step": "3", "total": "10", "label": "Staging"}
+        assert payload["eta_s"] == 0
+
+        (tmp_path / "j1_rapport.pdf").write_bytes(b"%PDF")
+        job_state.transition(r, "j1", "rq-1", "finished")
+        payload, _ = app_module._job_status_payload("j1")
+        assert payload["done"] and payload["has_pdf"] and not payload["has_excel"]
+        assert mirrored[-1] == ("j1", "finished")
+
+        payload, code = app_module._job_status_payload("unknown")
+        assert code == 404
@@ -0,0 +1,110 @@
+"""Eén lezing per job mag niets veranderen aan wat elke stap te zien krijgt.
+
+`run_analysis_job` las dezelfde EDF vroeger drie keer (staging, analyse,
+pneumo). Het laadplan decodeert de unie één keer en geeft elke stap een view.
+Dat is alleen een winst als het onzichtbaar is: per stap dezelfde kanalen,
+dezelfde samplefrequentie en sample voor sample dezelfde waarden als een
+aparte `_load_edf`. En het is alleen een winst als het echt views zijn —
+een stille kopie per stap zou het geheugen net verdubbelen.
+
+Synthetische mixed-rate EDF, zodat de hersampling van MNE meespeelt: EMG op
+512 Hz trekt de staging-groep omhoog, de ademkanalen zitten op 32 en 1 Hz.
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+edfio = pytest.importorskip("edfio")
+
+import load_plan  # noqa: E402
+import tasks  # noqa: E402
+
+DUR_S = 120
+
+
+@pytest.fixture(scope="module")
+def edf(tmp_path_factory):
+    def sig(name, sf, f):
+        t = np.arange(DUR_S * sf) / sf
+        return edfio.EdfSignal(f(t).astype(np.float64),
+                               sampling_frequency=sf, label=name)
+
+    p = tmp_path_factory.mktemp("edf") / "plan.edf"
+    edfio.Edf([
+        sig("EEG C4-M1", 256, lambda t: np.sin(2 * np.pi * 10 * t)),
+        sig("EEG F4-M1", 256, lambda t: np.sin(2 * np.pi * 7 * t)),
+        sig("EOG E1-M2", 256, lambda t: np.cos(2 * np.pi * 0.5 * t)),
+        sig("Flow",      256, lambda t: np.sin(2 * np.pi * 0.25 * t)),
+        sig("Thorax",    32,  lambda t: np.sin(2 * np.pi * 0.25 * t)),
+        sig("SpO2",      1,   lambda t: 96.0 + 0 * t),
+    ]).write(p)
+    return str(p)
+
+
+STAGES = {
+    "staging": ["EEG C4-M1", "EOG E1-M2"],
+    "analyse": ["EEG C4-M1", "EOG E1-M2", "EEG F4-M1"],
+    "pneumo":  ["Flow", "Thorax", "SpO2", "EEG C4-M1"],
+}
+
+
+def _planned(edf):
+    plan = load_plan.read_plan_header(edf)
+    for name, chans in STAGES.items():
+        load_plan.add_stage(plan, name, chans)
+    return plan, load_plan.execute(load_plan.finalize(plan))
+
+
+def test_each_stage_sees_exactly_what_a_separate_load_would_give(edf):
+    _, raws = _planned(edf)
+    for name, chans in STAGES.items():
+        ref = tasks._load_edf(edf, chans, label=name)
+        got = raws[name]
+        assert sorted(got.ch_names) == sorted(ref.ch_names)
+        assert got.info["sfreq"] == ref.info["sfreq"]
+        for ch in chans:
+            np.testing.assert_array_equal(got.get_data(picks=[ch]),
+                                          ref.get_data(picks=[ch]))
+
+
+def test_stages_with_the_same_rate_share_one_buffer(edf):
+    plan, raws = _planned(edf)
+    assert len(plan.groups) == 1
+    a, b, c = (raws[n]._data for n in ("staging", "analyse", "pneumo"))
+    assert np.shares_memory(a, b)
+    assert np.shares_memory(b, c)
+
+
+def test_a_stage_with_a_higher_rate_is_not_forced_on_the_others(edf, tmp_path):
+    """EMG op 512 Hz mag de pneumo-stap niet naar 512 Hz trekken."""
+    t = np.arange(DUR_S * 512) / 512
+    emg = edfio.EdfSignal(np.sin(t), sampling_frequency=512, label="EMG")
+    src = edfio.read_edf(edf)
+    src.append_signals(emg)
+    p = tmp_path / "emg.edf"
+    src.write(p)
+
+    plan = load_plan.read_plan_header(str(p))
+    load_plan.add_stage(plan, "staging", ["EEG C4-M1", "EMG"])
+    load_plan.add_stage(plan, "pneumo", ["Flow", "SpO2", "EEG C4-M1"])
+    raws = load_plan.execute(load_plan.finalize(plan))
+    assert raws["staging"].info["sfreq"] == 512
+    assert raws["pneumo"].info["sfreq"] == 256
+
+
+def test_views_keep_the_source_file_for_patient_fields(edf):
+    """psgscoring leest de patiëntvelden via `raw.filenames` uit het bestand."""
+    _, raws = _planned(edf)
+    for raw in raws.values():
+        assert raw.filenames and str(raw.filenames[0]) == edf
+
+
+def test_a_stage_without_available_channels_falls_back_to_the_whole_file(edf):
+    plan = load_plan.read_plan_header(edf)
+    load_plan.add_stage(plan, "staging", ["bestaat niet"])
+    raws = load_plan.execute(load_plan.finalize(plan))
+    assert len(raws["staging"].ch_names) == 6
@@ -0,0 +1,103 @@
+"""Geheugentoelating: reserveren tegen het budget van de node, uitstellen als het niet past."""
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import job_scheduler  # noqa: E402
+import memory_budget  # noqa: E402
+from rq import Queue  # noqa: E402
+from rq.registry import ScheduledJobRegistry  # noqa: E402
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setenv("YASAFLASKIFIED_RAM_BUDGET_MB", "1000")
+    monkeypatch.delenv("YASAFLASKIFIED_MEM_ADMISSION", raising=False)
+    monkeypatch.setenv("YASAFLASKIFIED_NODE_NAME", "node-a")
+    r = fakeredis.FakeRedis()
+    memory_budget.configure(r)
+    for name in ("w1", "w2"):
+        r.set(f"rq:worker:{name}", 1)
+    return r
+
+
+def test_a_job_waits_until_the_budget_has_room(conn):
+    assert memory_budget.reserve(conn, "a", 700, "w1")
+    assert not memory_budget.reserve(conn, "b", 400, "w2")
+    assert memory_budget.reserve(conn, "c", 300, "w2")
+    memory_budget.release(conn, "a")
+    assert memory_budget.reserve(conn, "b", 400, "w1")
+    assert set(memory_budget.reserved(conn)) == {"b", "c"}
+
+
+def test_a_job_larger_than_the_budget_runs_alone(conn):
+    assert memory_budget.reserve(conn, "huge", 5000, "w1")
+    assert not memory_budget.reserve(conn, "small", 100, "w2")
+
+
+def test_a_dead_worker_holds_nothing(conn):
+    assert memory_budget.reserve(conn, "a", 900, "gone")
+    assert memory_budget.reserve(conn, "b", 900, "w1")
+    assert list(memory_budget.reserved(conn)) == ["b"]
+    assert conn.hget(memory_budget.reserved_key(), "a") is None
+
+
+def test_each_node_has_its_own_budget(conn, monkeypatch):
+    assert memory_budget.reserve(conn, "a", 900, "w1")
+
+    # Een tweede host met de helft van het geheugen, zonder vast budget.
+    monkeypatch.setenv("YASAFLASKIFIED_NODE_NAME", "node-b")
+    monkeypatch.delenv("YASAFLASKIFIED_RAM_BUDGET_MB")
+    monkeypatch.setattr(memory_budget, "node_ram_mb", lambda: 500)
+    assert memory_budget.configure(conn) == 500 * memory_budget.BUDGET_FRACTION
+    assert memory_budget.reserve(conn, "b", 300, "w2")
+    assert not memory_budget.reserve(conn, "c", 300, "w2")
+
+    assert memory_budget.budget_mb(conn, "node-a") == 1000
+    assert set(memory_budget.reserved(conn, "node-a")) == {"a"}
+    memory_budget.release(conn, "b")
+    assert memory_budget.reserved(conn) == {}
+
+
+def test_the_worker_defers_with_backoff(conn, monkeypatch):
+    monkeypatch.setenv("YASAFLASKIFIED_WORKER_PREWARM", "0")
+    import worker
+
+    w = worker.PrewarmedWorker([Queue("default", connection=conn)], connection=conn)
+    w.register_birth()
+    memory_budget.reserve(conn, "running", 800, "w1")
+    q = Queue("default", connection=conn)
+    job = q.enqueue("tasks.run_analysis_job", args=("j1",), meta={"ram_mb": 500})
+    q.pop_job_id()
+
+    w.execute_job(job, q)
+    assert job.id in ScheduledJobRegistry(queue=q)
+    assert q.fetch_job(job.id).meta["mem_deferrals"] == 1
+    assert job.id not in memory_budget.reserved(conn)
+
+
+def test_the_estimate_travels_through_the_scheduler(conn, monkeypatch):
+    monkeypatch.setenv("YASAFLASKIFIED_SCHED_SLOTS", '{"default": 1}')
+    rq_id = job_scheduler.submit(conn, "default", "j1", "tasks.run_analysis_job",
+                                 ("j1",), site=1, ram_mb=2400, estimate_s=300)
+    meta = Queue("default", connection=conn).fetch_job(rq_id).meta
+    assert (meta["ram_mb"], meta["expected_s"]) == (2400, 300)
+    assert memory_budget.backoff_s(1) == memory_budget.BACKOFF_S[0]
+    assert memory_budget.backoff_s(99) == memory_budget.BACKOFF_S[-1]
+
+
+def test_profile_workers_are_reserved_next_to_their_job(conn, monkeypatch):
+    """De reservering van de job rekent op één proces; elke worker komt erbij."""
+    import rq
+    import tasks
+
+    job = type("Job", (), {"id": "cmp", "worker_name": "w1", "connection": conn})()
+    monkeypatch.setattr(rq, "get_current_job", lambda: job)
+    assert memory_budget.reserve(conn, "cmp", 400, "w1")
+    n, pool = tasks._reserve_pool(4, 250)
+    assert n == 2 and pool == (conn, memory_budget.pool_key("cmp"))
+    assert memory_budget.reserved(conn)[memory_budget.pool_key("cmp")]["mb"] == 500
+
+    memory_budget.release(conn, memory_budget.pool_key("cmp"))
+    assert memory_budget.reserve(conn, "other", 200, "w2")
+    assert tasks._reserve_pool(4, 250) == (1, None)
@@ -220,3 +220,24 @@ def test_a_partly_masked_recording_is_not_blocking():
     """27% artefact is normaal en mag niets blokkeren."""
     n_ep, art = 1284, list(range(348))
     assert len(set(art)) / n_ep < 1.0
+
+
+def test_the_arousal_classifier_choice_does_not_touch_the_environment(monkeypatch):
+    """Pneumo loopt naast andere stappen; de LGBM-keuze gaat via het profiel."""
+    pytest.importorskip("psgscoring")
+    import tasks
+    from psgscoring.constants import SCORING_PROFILES
+
+    monkeypatch.delenv("YASAFLASKIFIED_AROUSAL_LGBM", raising=False)
+    seen = {}
+
+    def fake(**kwargs):
+        seen["lgbm"] = SCORING_PROFILES[kwargs["scoring_profile"]]["AROUSAL_LGBM"]
+        seen["env"] = os.environ.get("YASAFLASKIFIED_AROUSAL_LGBM")
+        return {"meta": {"scoring_profile": kwargs["scoring_profile"]}}
+
+    monkeypatch.setattr(tasks, "run_pneumo_analysis", fake)
+    out = tasks._run_pneumo(arousal_lgbm=True, scoring_profile="aasm_v2_rec")
+    assert seen == {"lgbm": True, "env": None}
+    assert out["meta"]["scoring_profile"] == "aasm_v2_rec"
+    assert not SCORING_PROFILES["aasm_v2_rec"]["AROUSAL_LGBM"]
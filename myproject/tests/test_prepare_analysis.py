@@ -0,0 +1,107 @@
+"""Voorwerk tijdens de kanaalkeuze: wat het klaarzet, moet de analyse terugvinden.
+
+`prepare_analysis` stageert op de voorselectie van het kanaalkeuzescherm.
+Dat is alleen winst als /analyze met ongewijzigde kanalen op exact dezelfde
+cachesleutels uitkomt; een sleutel die net verschilt (extra EEG, volgorde)
+is stil werk voor niets.
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+edfio = pytest.importorskip("edfio")
+fakeredis = pytest.importorskip("fakeredis")
+
+import channel_map  # noqa: E402
+import job_state  # noqa: E402
+import load_plan  # noqa: E402
+import signal_quality  # noqa: E402
+import tasks  # noqa: E402
+from stage_cache import MISS  # noqa: E402
+
+CHANNELS = ["EEG C4-M1", "EEG F4-M1", "EOG E1-M2", "Chin EMG", "Leg EMG", "Flow"]
+
+
+@pytest.fixture
+def edf(tmp_path):
+    p = tmp_path / "night.edf"
+    t = np.arange(120 * 128) / 128
+    edfio.Edf([edfio.EdfSignal(np.sin(2 * np.pi * (i + 1) * t), sampling_frequency=128,
+                               label=name) for i, name in enumerate(CHANNELS)]).write(p)
+    return str(p)
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(tasks, "_get_progress_redis", lambda: r)
+    monkeypatch.setattr(tasks, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.delenv("YASAFLASKIFIED_STAGE_CACHE", raising=False)
+    calls = []
+    monkeypatch.setattr(tasks, "run_sleep_staging", lambda raw, *chs: calls.append(
+        ("staging", raw.ch_names)) or {"success": True, "hypnogram": ["N2"] * 4})
+    monkeypatch.setattr(signal_quality, "check_signal_quality", lambda raw: calls.append(
+        ("signal_quality", raw.ch_names)) or {"overall": "good", "issues": []})
+    return r, calls
+
+
+def _parsed(r, edf):
+    job_state.update(r, "j1", status="parsed", filepath=edf)
+    return {"job_id": "j1", "edf_path": edf, "content_hash": "abc",
+            **channel_map.preselect(CHANNELS, channel_map.preferred_eeg(CHANNELS))}
+
+
+def test_an_unchanged_submit_finds_the_prepared_stages(edf, worker):
+    r, calls = worker
+    cfg = _parsed(r, edf)
+    assert (cfg["eeg_ch"], cfg["eog_ch"], cfg["emg_ch"]) == ("EEG C4-M1", "EOG E1-M2",
+                                                             "Chin EMG")
+    out = tasks.prepare_analysis(cfg)
+    assert out["signal_cache"]
+    assert out["stage_cache"] == {"staging": "miss", "signal_quality": "miss"}
+    assert calls == [("staging", ["EEG C4-M1", "EOG E1-M2", "Chin EMG"]),
+                     ("signal_quality", ["EEG C4-M1", "EOG E1-M2", "Chin EMG", "EEG F4-M1"])]
+
+    # Zoals /analyze de config schrijft: `extra_eeg or [eeg]`.
+    form_extra = cfg["extra_eeg_ch"]
+    staging, analyse = tasks._stage_params(cfg["eeg_ch"], cfg["eog_ch"], cfg["emg_ch"],
+                                           form_extra or [cfg["eeg_ch"]])
+    cache = tasks._stage_cache(edf, "abc")
+    assert cache.load("staging", **staging) is not MISS
+    assert cache.load("signal_quality", **analyse) is not MISS
+
+
+def test_prepared_once_nothing_is_decoded_again(edf, worker, monkeypatch):
+    r, calls = worker
+    tasks.prepare_analysis(_parsed(r, edf))
+    monkeypatch.setattr(load_plan, "execute", lambda plan: pytest.fail("opnieuw gelezen"))
+    out = tasks.prepare_analysis(_parsed(r, edf))
+    assert out["stage_cache"] == {"staging": "hit", "signal_quality": "hit"}
+    assert len(calls) == 2
+
+
+def test_a_started_analysis_gets_no_prepare_work(edf, worker):
+    r, calls = worker
+    cfg = _parsed(r, edf)
+    job_state.update(r, "j1", status="scheduled")
+    assert tasks.prepare_analysis(cfg) == {"signal_cache": False, "stage_cache": {}}
+    assert calls == []
+
+
+def test_extra_eeg_is_settled_from_the_header_before_any_key(edf, worker):
+    """Een extra kanaal dat niet in de opname staat, of een lijst zonder het
+    hoofdkanaal: de sleutel is die van de lijst zoals de stappen hem zien."""
+    r, calls = worker
+    cfg = {**_parsed(r, edf), "extra_eeg_ch": ["EEG F4-M1", "EEG O2-M1"]}
+    tasks.prepare_analysis(cfg)
+    assert cfg["extra_eeg_ch"] == ["EEG F4-M1", "EEG O2-M1"]
+
+    extra = tasks._extra_eeg(CHANNELS, cfg["eeg_ch"], cfg["extra_eeg_ch"])
+    assert extra == ["EEG C4-M1", "EEG F4-M1"]
+    _, analyse = tasks._stage_params(cfg["eeg_ch"], cfg["eog_ch"], cfg["emg_ch"], extra)
+    assert analyse["extra_eeg"] is not extra
+    assert tasks._stage_cache(edf, "abc").load("signal_quality", **analyse) is not MISS
@@ -0,0 +1,35 @@
+"""Voorverwarmde workers: yasa leest zijn classifier één keer per pad.
+
+Het laden zelf (`preload`) is hier niet getest; dat meet `prewarm.py --measure`.
+"""
+import os
+
+import pytest
+
+yasa = pytest.importorskip("yasa")
+
+import prewarm  # noqa: E402
+
+
+def test_yasa_staging_reuses_a_loaded_classifier(tmp_path):
+    import joblib
+    import yasa.staging as staging
+
+    path = tmp_path / "clf_test.joblib"
+    joblib.dump({"w": [1, 2, 3]}, path)
+    prewarm.install_model_cache()
+    prewarm.install_model_cache()                       # idempotent
+    assert isinstance(staging.joblib, prewarm._CachedJoblib)
+    assert not isinstance(staging.joblib._joblib, prewarm._CachedJoblib)
+
+    first = staging.joblib.load(str(path))
+    assert first == {"w": [1, 2, 3]}
+    assert staging.joblib.load(str(path)) is first
+    assert staging.joblib.dump is joblib.dump           # de rest blijft joblib
+
+
+def test_only_the_newest_classifier_per_combination():
+    paths = prewarm.staging_classifiers()
+    combos = [os.path.basename(p).split("_lgb_")[0] for p in paths]
+    assert paths and len(combos) == len(set(combos))
+    assert "clf_eeg+eog+emg" in combos
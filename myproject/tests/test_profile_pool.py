@@ -0,0 +1,70 @@
+"""Profielen over processen: dezelfde raw, geen kopie, niet meer workers dan er passen.
+
+`profile_pool` is alleen een winst als een worker precies de raw ziet die de
+sequentiële lus zag (data, info, annotaties, bestandsnaam voor psgscoring),
+zonder hem te kunnen wijzigen — de andere profielen lezen dezelfde buffer —
+en als het aantal workers het geheugen niet overschrijdt.
+"""
+import numpy as np
+import pytest
+
+mne = pytest.importorskip("mne")
+
+import profile_pool  # noqa: E402
+
+
+@pytest.fixture
+def raw():
+    info = mne.create_info(["Flow", "SpO2"], 32.0, ["misc", "misc"])
+    r = mne.io.RawArray(np.random.default_rng(0).normal(size=(2, 32 * 60)), info,
+                        verbose=False)
+    r.set_annotations(mne.Annotations([10.0], [5.0], ["apnea"]))
+    r._filenames = ["/data/nacht.edf"]
+    return r
+
+
+def test_a_worker_sees_the_same_raw_read_only(raw):
+    handle, shm = profile_pool.share_raw(raw)
+    try:
+        seen, child_shm = profile_pool.attach_raw(handle)
+        assert np.array_equal(seen.get_data(), raw.get_data())
+        assert seen.ch_names == raw.ch_names and seen.info["sfreq"] == 32.0
+        assert list(seen.annotations.description) == ["apnea"]
+        assert seen.filenames[0].endswith("nacht.edf")
+        assert not seen._data.flags.writeable
+        # Geen kopie: wat in het segment verandert, ziet de worker.
+        np.ndarray(handle.shape, dtype=handle.dtype, buffer=shm.buf)[0, 0] = 42.0
+        assert seen._data[0, 0] == 42.0
+        del seen
+        child_shm.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_workers_are_bounded_by_profiles_and_memory(monkeypatch):
+    monkeypatch.delenv("YASAFLASKIFIED_PROFILE_WORKERS", raising=False)
+    monkeypatch.delenv("YASAFLASKIFIED_PROFILE_WORKER_MB", raising=False)
+    gib = 2**30
+    monkeypatch.setattr(profile_pool, "available_memory_bytes", lambda: 64 * gib)
+    assert profile_pool.profile_workers(3, gib, requested=16) == 3
+
+    # 0,6 GiB basis + 3 × 1 GiB per worker; van 16 GiB vrij telt 80 %: drie.
+    monkeypatch.setattr(profile_pool, "available_memory_bytes", lambda: 16 * gib)
+    assert profile_pool.profile_workers(7, gib, requested=16) == 3
+
+    monkeypatch.setattr(profile_pool, "available_memory_bytes", lambda: gib // 4)
+    assert profile_pool.profile_workers(7, gib, requested=16) == 1
+
+
+def test_a_container_limit_bounds_the_free_memory(monkeypatch, tmp_path):
+    """/proc/meminfo ziet de hele host; de cgroup van de container is de grens."""
+    gib = 2**30
+    (tmp_path / "max").write_text(str(4 * gib))
+    (tmp_path / "current").write_text(str(3 * gib))
+    monkeypatch.setattr(profile_pool, "_CGROUP_FILES",
+                        ((str(tmp_path / "max"), str(tmp_path / "current")),))
+    assert profile_pool.available_memory_bytes() <= gib
+
+    (tmp_path / "max").write_text("max")
+    assert profile_pool._cgroup_headroom_bytes() is None
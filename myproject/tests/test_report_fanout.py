@@ -0,0 +1,108 @@
+"""Rapporten na results.json, elk als eigen job — met een zichtbare toestand.
+
+De analysejob is klaar zodra results.json er staat; PDF, Excel, EDF+ en de
+mail volgen als afzonderlijke RQ-jobs. Dat mag alleen als (1) ze ook echt
+in de wachtrij komen, (2) hun toestand per artefact leesbaar is voor de
+status-API en het dashboard, en (3) een mislukt artefact dat zegt in plaats
+van stil "pending" te blijven. Ze gaan door de scheduler zoals analyses: een
+rapport springt niet voor de wachtende jobs van een andere site.
+"""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import app as app_module  # noqa: E402
+import job_events  # noqa: E402
+import job_scheduler  # noqa: E402
+import tasks  # noqa: E402
+from rq import Queue  # noqa: E402
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(tasks, "_progress_redis", r)
+    monkeypatch.setattr(tasks, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(app_module, "redis_conn", r)
+    monkeypatch.setitem(app_module.app.config, "UPLOAD_FOLDER", str(tmp_path))
+    (tmp_path / "j1_results.json").write_text(json.dumps(
+        {"job_id": "j1", "patient_info": {}, "edf_path": str(tmp_path / "weg.edf")}))
+    return r
+
+
+def test_every_artifact_is_queued_and_pending(job, monkeypatch):
+    monkeypatch.setenv("YASAFLASKIFIED_SCHEDULER", "off")
+    queued = tasks._fan_out_reports("j1")
+    assert queued == list(tasks.ARTIFACTS)
+    jobs = Queue("default", connection=job).jobs
+    assert sorted(j.args[1] for j in jobs) == sorted(tasks.ARTIFACTS)
+    assert {j.timeout for j in jobs} == {tasks.job_estimate.REPORT_TIMEOUT_S}
+    assert set(app_module._artifact_states(["j1"])["j1"].values()) == {"pending"}
+
+
+def test_reports_wait_their_turn_in_the_scheduler(job, monkeypatch):
+    monkeypatch.delenv("YASAFLASKIFIED_SCHEDULER", raising=False)
+    monkeypatch.setenv("YASAFLASKIFIED_SCHED_SLOTS", '{"default": 1, "fast": 1}')
+    monkeypatch.setattr(tasks, "_report_estimate",
+                        lambda edf_path: {"runtime_s": 600, "ram_mb": 700, "basis": "prior"})
+    tasks._fan_out_reports("j1", {"site_id": 3, "priority": "urgent"})
+
+    (released,) = Queue("default", connection=job).jobs
+    assert released.meta["sched_site"] == "3"
+    assert released.meta["sched_priority"] == "urgent"
+    assert released.meta["ram_mb"] == 700
+    assert released.timeout == tasks.job_estimate.timeout_s(
+        {"runtime_s": 600, "basis": "prior"}, 0)
+    assert job_events.app_job_id(released) == "j1"
+    waiting = job_scheduler.queue_positions(job, "default")
+    assert sorted(waiting) == sorted(f"j1:{k}" for k in tasks.ARTIFACTS
+                                     if k != released.args[1])
+
+
+def test_a_built_artifact_is_ready_and_a_failed_one_says_so(job, tmp_path, monkeypatch):
+    monkeypatch.setattr(tasks, "generate_excel_report",
+                        lambda results, path: Path(path).write_bytes(b"xlsx"))
+    tasks._fan_out_reports("j1")
+
+    assert tasks.generate_report_artifact("j1", "xlsx")["status"] == "done"
+    failed = tasks.generate_report_artifact("j1", "edfplus")   # EDF bestaat niet
+    assert failed["status"] == "failed"
+
+    states = app_module._artifact_states(["j1"])["j1"]
+    assert states["xlsx"] == "ready"
+    assert states["edfplus"] == "failed"
+    assert states["pdf"] == "pending"
+
+
+def test_a_mail_that_was_not_sent_is_not_ready(job, monkeypatch):
+    def smtp_down(job_id, results):
+        raise OSError("connection refused")
+
+    monkeypatch.setattr(tasks, "_send_email_notification", smtp_down)
+    assert tasks.generate_report_artifact("j1", "email")["status"] == "failed"
+    assert app_module._artifact_states(["j1"])["j1"]["email"] == "failed"
+
+    monkeypatch.setattr(tasks, "_send_email_notification", lambda job_id, results: False)
+    assert tasks.generate_report_artifact("j1", "email")["status"] == "skipped"
+    assert app_module._artifact_states(["j1"])["j1"]["email"] == "skipped"
+
+
+def test_a_report_job_that_dies_is_failed(job):
+    tasks._set_artifact("j1", "pdf", "running")
+    dead = type("Job", (), {"args": ("j1", "pdf")})()
+    tasks.on_report_failure(dead, job, TimeoutError, TimeoutError("900 s"), None)
+    assert app_module._artifact_states(["j1"])["j1"]["pdf"] == "failed"
+
+
+def test_without_redis_state_a_file_on_disk_still_counts(tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(app_module, "redis_conn", fakeredis.FakeRedis())
+    (tmp_path / "old_rapport.pdf").write_bytes(b"%PDF")
+    states = app_module._artifact_states(["old"])["old"]
+    assert states["pdf"] == "ready" and states["xlsx"] == "absent"
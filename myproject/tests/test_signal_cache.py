@@ -0,0 +1,103 @@
+"""De kolomcache moet dezelfde signalen leveren als de EDF, of zwijgen.
+
+`signal_cache.py` ontvlecht de EDF na het opladen naar één bestand per
+kanaal. Elke lezer die de cache verkiest boven MNE rekent erop dat de
+waarden dezelfde zijn — anders verschilt het rapport naargelang de cache er
+toevallig al stond. En een cache die niet meer bij het bestand hoort, moet
+genegeerd worden in plaats van stilzwijgend oude data te tonen.
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+edfio = pytest.importorskip("edfio")
+mne = pytest.importorskip("mne")
+
+import edf_api  # noqa: E402
+import load_plan  # noqa: E402
+import signal_cache  # noqa: E402
+
+DUR_S = 130
+
+
+@pytest.fixture
+def edf(tmp_path):
+    def sig(name, sf, f):
+        t = np.arange(DUR_S * sf) / sf
+        return edfio.EdfSignal(f(t), sampling_frequency=sf, label=name,
+                               physical_dimension="uV",
+                               physical_range=(-500.0, 500.0))
+
+    p = tmp_path / "cache.edf"
+    edfio.Edf([
+        sig("EEG C4-M1", 256, lambda t: 80 * np.sin(2 * np.pi * 10 * t)),
+        sig("EOG E1-M2", 256, lambda t: 60 * np.cos(2 * np.pi * 0.5 * t)),
+        sig("Flow",      32,  lambda t: 200 * np.sin(2 * np.pi * 0.25 * t)),
+    ]).write(p)
+    return str(p)
+
+
+def test_one_file_per_channel_and_a_manifest(edf):
+    d = signal_cache.build_signal_cache(edf)
+    with open(os.path.join(d, signal_cache.MANIFEST)) as f:
+        manifest = json.load(f)
+    sizes = {c["name"]: os.path.getsize(os.path.join(d, c["file"]))
+             for c in manifest["channels"]}
+    assert sizes == {"EEG C4-M1": 2 * 256 * DUR_S, "EOG E1-M2": 2 * 256 * DUR_S,
+                     "Flow": 2 * 32 * DUR_S}
+    assert {c["sfreq"] for c in manifest["channels"]} == {256.0, 32.0}
+
+
+def test_a_cached_raw_matches_mne(edf):
+    signal_cache.build_signal_cache(edf)
+    chans = ["EEG C4-M1", "EOG E1-M2"]
+    got = signal_cache.cached_raw(edf, chans)
+    ref = mne.io.read_raw_edf(edf, include=chans, preload=True, verbose=False)
+    assert got.ch_names == ref.ch_names
+    assert got.info["sfreq"] == ref.info["sfreq"]
+    np.testing.assert_allclose(got.get_data(), ref.get_data(), rtol=0, atol=1e-15)
+
+
+def test_mixed_rates_are_left_to_mne(edf):
+    """MNE hersamplet; de cache doet dat niet na en geeft dus niets terug."""
+    signal_cache.build_signal_cache(edf)
+    assert signal_cache.cached_raw(edf, ["EEG C4-M1", "Flow"]) is None
+
+
+def test_anonymising_keeps_the_cache_but_a_new_layout_does_not(edf):
+    signal_cache.build_signal_cache(edf)
+    with open(edf, "r+b") as f:
+        f.seek(8)
+        f.write(b"X X X X".ljust(80))
+    assert signal_cache.open_cache(edf) is not None
+
+    with open(edf, "r+b") as f:
+        f.seek(256)
+        f.write(b"EEG C3-M2".ljust(16))
+    assert signal_cache.open_cache(edf) is None
+
+
+def test_the_load_plan_and_the_viewer_read_from_the_cache(edf, tmp_path, monkeypatch):
+    signal_cache.build_signal_cache(edf)
+    plan = load_plan.read_plan_header(edf)
+    load_plan.add_stage(plan, "staging", ["EEG C4-M1", "EOG E1-M2"])
+
+    def no_mne(*a, **k):
+        raise AssertionError("MNE gelezen terwijl de cache volstond")
+
+    monkeypatch.setattr(mne.io, "read_raw_edf", no_mne)
+    raws = load_plan.execute(load_plan.finalize(plan))
+    assert raws["staging"].get_data().shape == (2, 256 * DUR_S)
+
+    (tmp_path / "j_config.json").write_text(json.dumps({"edf_path": edf}))
+    edf_api.clear_cache()
+    epoch = edf_api.edf_epoch("j", 2, str(tmp_path))
+    assert set(epoch["channels"]) == {"EEG C4-M1", "EOG E1-M2", "Flow"}
+    assert isinstance(edf_api._get_raw("j", str(tmp_path)),
+                      signal_cache.SignalCacheReader)
@@ -0,0 +1,95 @@
+"""Uitgezoomd mag een piek niet verdwijnen — en niet alles kosten.
+
+De viewer decimeerde met een vaste stap. Een EMG-burst van één sample of de
+bodem van een korte desaturatie viel dan tussen twee genomen samples en
+stond niet op het scherm. De min/max-envelope (`signal_pyramid.py`) moet
+zo'n uitschieter op elke zoomstap tonen, en moet dat doen uit de
+voorberekende niveaus in plaats van uit alle samples.
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+edfio = pytest.importorskip("edfio")
+
+import edf_api  # noqa: E402
+import signal_cache  # noqa: E402
+import signal_pyramid  # noqa: E402
+
+DUR_S = 3600
+SPIKE_T = 1234.567
+DESAT = (2000.0, 2004.0)
+
+
+@pytest.fixture
+def edf(tmp_path):
+    t = np.arange(DUR_S * 256) / 256
+    emg = 5 * np.sin(2 * np.pi * 30 * t)
+    emg[int(SPIKE_T * 256)] = 400.0
+    spo2 = np.full(DUR_S, 96.0)
+    spo2[int(DESAT[0]):int(DESAT[1])] = 81.0
+
+    p = tmp_path / "pyr.edf"
+    edfio.Edf([
+        edfio.EdfSignal(emg, sampling_frequency=256, label="EMG chin",
+                        physical_dimension="uV", physical_range=(-500.0, 500.0)),
+        edfio.EdfSignal(spo2, sampling_frequency=1, label="SpO2",
+                        physical_dimension="%", physical_range=(0.0, 100.0)),
+    ]).write(p)
+    return str(p)
+
+
+def test_levels_go_down_to_about_one_bin_per_epoch(edf):
+    signal_cache.build_signal_cache(edf)
+    cache = signal_cache.open_cache(edf)
+    levels = cache.pyramid["levels"]["EMG chin"]
+    assert [lv["bin"] for lv in levels] == [4 ** k for k in range(1, len(levels) + 1)]
+    assert levels[-1]["bin"] / 256 >= signal_pyramid.TOP_BIN_S
+    assert levels[-2]["bin"] / 256 < signal_pyramid.TOP_BIN_S
+
+
+@pytest.mark.parametrize("width", [300, 1200, 4000])
+def test_a_one_sample_spike_survives_every_zoom(edf, width):
+    signal_cache.build_signal_cache(edf)
+    cache = signal_cache.open_cache(edf)
+    lo, hi = signal_pyramid.envelope(cache, "EMG chin", 0, DUR_S, width)
+    assert len(hi) == width
+    assert hi.max() == pytest.approx(400e-6, rel=1e-3)
+    col = int(SPIKE_T / DUR_S * width)
+    assert abs(int(hi.argmax()) - col) <= 1
+
+    # Wat de oude vaste decimatie zou tonen: de piek valt ertussen.
+    stride = cache.physical("EMG chin")[:: (DUR_S * 256) // width]
+    assert stride.max() < 10e-6
+
+
+def test_a_short_desaturation_keeps_its_bottom(edf):
+    signal_cache.build_signal_cache(edf)
+    cache = signal_cache.open_cache(edf)
+    lo, _ = signal_pyramid.envelope(cache, "SpO2", 0, DUR_S, 200)
+    assert lo.min() == pytest.approx(81.0, abs=0.01)
+
+
+def test_without_a_pyramid_the_answer_is_the_same(edf):
+    """BDF of een oude cache: trager, maar dezelfde pieken."""
+    from edf_reader import EdfMemmapReader
+    lo, hi = signal_pyramid.envelope(EdfMemmapReader(edf), "EMG chin",
+                                     1200, 1300, 500)
+    assert hi.max() == pytest.approx(400e-6, rel=1e-3)
+
+
+def test_the_api_returns_width_columns_per_channel(edf, tmp_path):
+    signal_cache.build_signal_cache(edf)
+    (tmp_path / "j_config.json").write_text(json.dumps({"edf_path": edf}))
+    edf_api.clear_cache()
+    out = edf_api.edf_envelope("j", 0.0, None, 800, str(tmp_path))
+    assert out["width"] == 800
+    assert set(out["channels"]) == {"EMG chin", "SpO2"}
+    assert len(out["channels"]["EMG chin"]["max"]) == 800
+    with pytest.raises(IndexError):
+        edf_api.edf_envelope("j", DUR_S + 10, None, 800, str(tmp_path))
@@ -0,0 +1,106 @@
+"""De stapcache: dezelfde invoer geeft exact hetzelfde, andere invoer rekent opnieuw.
+
+Een treffer mag niet te onderscheiden zijn van herberekenen — ook niet in
+de types, want results.json en de stappen erna lezen die. Elke wijziging
+aan opname, parameters of bibliotheekversies moet een misser zijn, en een
+mislukte stap mag niet blijven hangen als "uitkomst".
+"""
+import numpy as np
+import pytest
+from stage_cache import MISS, StageCache
+
+VERSIONS = {"yasa": "0.7.0", "psgscoring": "0.25.0"}
+
+
+class Counting:
+    def __init__(self, value):
+        self.value, self.calls = value, 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_a_second_run_gets_the_same_value_without_computing(tmp_path):
+    value = {"hypnogram": ["W", "N2"], "n": np.int64(2), "span": (0, 30),
+             "confidence": {0: np.array([0.9, 0.1])}}
+    compute = Counting(value)
+    first = StageCache(str(tmp_path), "abc", VERSIONS)
+    first.run("staging", compute, channels=["C4-M1"])
+
+    again = StageCache(str(tmp_path), "abc", VERSIONS)
+    got = again.run("staging", compute, channels=["C4-M1"])
+    assert compute.calls == 1
+    assert again.outcome == {"staging": "hit"}
+    assert type(got["n"]) is np.int64 and got["span"] == (0, 30)
+    assert np.array_equal(got["confidence"][0], value["confidence"][0])
+
+
+@pytest.mark.parametrize("recording, params, versions", [
+    ("other", {"channels": ["C4-M1"]}, VERSIONS),
+    ("abc", {"channels": ["F4-M1"]}, VERSIONS),
+    ("abc", {"channels": ["C4-M1"]}, {**VERSIONS, "psgscoring": "0.26.0"}),
+])
+def test_anything_that_changes_the_outcome_is_a_miss(tmp_path, recording, params, versions):
+    StageCache(str(tmp_path), "abc", VERSIONS).store("pneumo", {"ahi": 5},
+                                                      channels=["C4-M1"])
+    assert StageCache(str(tmp_path), recording, versions).load("pneumo", **params) is MISS
+
+
+def test_a_failed_stage_is_not_kept(tmp_path):
+    cache = StageCache(str(tmp_path), "abc", VERSIONS)
+    cache.run("spindles", lambda: {"success": False, "error": "MemoryError"})
+    assert cache.load("spindles") is MISS
+    assert cache.outcome == {"spindles": "miss"}
+
+
+def test_switched_off_it_computes_and_remembers_nothing(tmp_path, monkeypatch):
+    import tasks
+    monkeypatch.setenv("YASAFLASKIFIED_STAGE_CACHE", "off")
+    cache = tasks._stage_cache(str(tmp_path / "missing.edf"), root=str(tmp_path))
+    assert not cache.enabled                 # en de EDF werd niet gelezen
+    compute = Counting(1)
+    cache.run("bandpower", compute)
+    cache.run("bandpower", compute)
+    assert compute.calls == 2 and cache.outcome == {}
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_a_corrupt_entry_is_recomputed(tmp_path):
+    cache = StageCache(str(tmp_path), "abc", VERSIONS)
+    cache.store("rem", {"n": 1})
+    (path,) = tmp_path.glob("*/*.pkl")
+    path.write_bytes(b"niet afgemaakt")
+    assert StageCache(str(tmp_path), "abc", VERSIONS).run("rem", lambda: {"n": 2}) == {"n": 2}
+
+
+def test_entries_unused_past_the_retention_are_pruned(tmp_path):
+    import os
+    import time
+
+    import stage_cache
+    cache = StageCache(str(tmp_path), "abc", VERSIONS)
+    cache.store("staging", {"hypnogram": ["W"]})
+    cache.store("rem", {"n": 1})
+    stale = cache._path(cache.key("rem", {}))
+    old = time.time() - 40 * 86400
+    os.utime(stale, (old, old))
+
+    assert stage_cache.prune(str(tmp_path), 30 * 86400) == 1
+    fresh = StageCache(str(tmp_path), "abc", VERSIONS)
+    assert fresh.load("rem") is MISS
+    assert fresh.load("staging") == {"hypnogram": ["W"]}
+
+    assert stage_cache.forget(str(tmp_path), "abc")
+    assert StageCache(str(tmp_path), "abc", VERSIONS).load("staging") is MISS
+    assert os.listdir(tmp_path) == []
+
+
+def test_a_cached_pneumo_result_holds_no_header_fields(tmp_path):
+    import tasks
+    pneumo = {"meta": {"patient_info": {"name": "Jan_Peeters"}, "n_epochs": 9}}
+    cache = StageCache(str(tmp_path), "abc", VERSIONS)
+    cache.run("pneumo", lambda: tasks._without_patient_info(pneumo))
+    stored = StageCache(str(tmp_path), "abc", VERSIONS).load("pneumo")
+    assert stored == {"meta": {"n_epochs": 9}}
+    assert pneumo["meta"]["patient_info"] == {"name": "Jan_Peeters"}
@@ -0,0 +1,85 @@
+"""De stappengraaf: volgorde uit `needs`, overlap waar het kan, stoppen bij een fout.
+
+`run_analysis_job` rekent op drie dingen van `stage_graph.run_stages`: een
+stap ziet alleen resultaten van stappen die al klaar zijn, onafhankelijke
+stappen lopen echt tegelijk, en een mislukte stap laat de job falen zoals
+de sequentiële pipeline dat deed — zonder nog nieuwe stappen te starten.
+"""
+import threading
+import time
+
+import pytest
+from stage_graph import Stage, StageGraphError, run_stages
+
+
+def test_each_stage_gets_what_it_needs():
+    out, timings = run_stages([
+        Stage("sum", lambda a, b: a + b, ("a", "b")),
+        Stage("a", lambda: 2),
+        Stage("b", lambda a: a * 10, ("a",)),
+    ], max_workers=2)
+    assert out == {"a": 2, "b": 20, "sum": 22}
+    assert timings["b"]["start_s"] >= timings["a"]["end_s"]
+    assert timings["sum"]["start_s"] >= timings["b"]["end_s"]
+
+
+def test_independent_stages_overlap():
+    both = threading.Barrier(2, timeout=5)
+
+    def detector():
+        both.wait()                 # hangt als de twee niet tegelijk lopen
+        return True
+
+    out, timings = run_stages([
+        Stage("staging", lambda: "hypno"),
+        Stage("spindles", lambda staging: detector(), ("staging",)),
+        Stage("pneumo", lambda staging: detector(), ("staging",)),
+    ], max_workers=3)
+    assert out["spindles"] and out["pneumo"]
+    assert timings["spindles"]["thread"] != timings["pneumo"]["thread"]
+
+
+def test_a_failure_stops_what_has_not_started():
+    started = []
+
+    def slow_ok():
+        time.sleep(0.2)
+        return 1
+
+    def fail():
+        raise RuntimeError("psgscoring kapot")
+
+    with pytest.raises(RuntimeError, match="kapot"):
+        run_stages([
+            Stage("pneumo", fail),
+            Stage("staging", slow_ok),
+            Stage("report", lambda staging: started.append(1), ("staging",)),
+        ], max_workers=2)
+    assert started == []
+
+
+def test_a_broken_graph_is_refused_before_anything_runs():
+    ran = []
+    with pytest.raises(StageGraphError):
+        run_stages([Stage("a", lambda b: ran.append("a"), ("b",)),
+                    Stage("b", lambda a: ran.append("b"), ("a",))])
+    with pytest.raises(StageGraphError):
+        run_stages([Stage("a", lambda x: None, ("x",))])
+    assert ran == []
+
+
+def test_a_timeout_in_the_job_does_not_wait_for_running_stages():
+    """RQ's harde timeout komt in de hoofdthread; lopende stappen houden hem niet op."""
+    release = threading.Event()
+
+    def interrupted(stage, n_done, n_total):
+        raise TimeoutError("job timeout")
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        run_stages([
+            Stage("fast", lambda: 1),
+            Stage("slow", lambda: release.wait(5)),
+        ], max_workers=2, on_done=interrupted)
+    assert time.monotonic() - started < 2
+    release.set()
@@ -0,0 +1,112 @@
+"""Een studievergelijking als één job per profiel plus een samenvoegjob.
+
+Het verdelen moet op `study` blijven en door de scheduler gaan met de site
+en prioriteit van de vergelijking, de samenvoegjob moet ook na een
+mislukt profiel draaien, en een vergelijking met een ontbrekend profiel mag
+er nooit komen — ook geen gedeeltelijke.
+"""
+import json
+import os
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import tasks  # noqa: E402
+
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    r = fakeredis.FakeRedis()
+    monkeypatch.setattr(tasks, "_progress_redis", r)
+    return r
+
+
+def _spec(conn, key):
+    import job_scheduler
+    raw = conn.hgetall(job_scheduler._job_key("study", key))
+    return {k.decode(): v.decode() for k, v in raw.items()}
+
+
+def test_fan_out_goes_through_the_scheduler_with_the_parents_site(tmp_path, redis_conn,
+                                                                   monkeypatch):
+    import rq
+    monkeypatch.delenv("YASAFLASKIFIED_SCHEDULER", raising=False)
+    parent = type("Job", (), {"meta": {"sched_site": "3", "sched_priority": "research",
+                                       "ram_mb": 900}})()
+    monkeypatch.setattr(rq, "get_current_job", lambda: parent)
+
+    out = tasks.run_study_comparison(
+        "j1", "/data/nacht.edf", str(tmp_path), ["aasm_v3", "aasm_v2", "eu"],
+        "aasm_v3", "C4-M1", "E1-M2", "Chin", {"flow": "Flow"}, ["W", "N2"],
+        fan_out=True)
+    assert out["status"] == "dispatched"
+    specs = [_spec(redis_conn, k) for k in out["profile_jobs"]]
+    assert [json.loads(s["args"])[3] for s in specs] == ["aasm_v3", "aasm_v2", "eu"]
+    assert {(s["site"], s["priority"], s["ram_mb"]) for s in specs} == {
+        ("3", "research", "900")}
+    assert specs[0]["on_failure"] == tasks.STUDY_PART_FAILURE_CALLBACK
+    assert not _spec(redis_conn, out["fan_in_job"])
+
+
+def test_the_last_part_submits_the_fan_in_even_after_a_failure(tmp_path, redis_conn,
+                                                                monkeypatch):
+    import rq
+    monkeypatch.delenv("YASAFLASKIFIED_SCHEDULER", raising=False)
+    monkeypatch.setattr(rq, "get_current_job", lambda: None)
+    tasks._dispatch_study_comparison("j1", "/data/nacht.edf", str(tmp_path),
+                                     ["aasm_v3", "eu"], "aasm_v3", {}, ["W"])
+    tasks._study_part_finished(redis_conn, "j1", "aasm_v3")
+    assert not _spec(redis_conn, "j1:merge")
+
+    failed = type("Job", (), {"args": ("j1", "/data/nacht.edf", str(tmp_path), "eu")})()
+    tasks.on_study_part_failure(failed, redis_conn, RuntimeError, RuntimeError("oom"), None)
+    assert _spec(redis_conn, "j1:eu")                       # nog één poging
+    assert not _spec(redis_conn, "j1:merge")
+
+    tasks.on_study_part_failure(failed, redis_conn, RuntimeError, RuntimeError("oom"), None)
+    merge = _spec(redis_conn, "j1:merge")
+    assert merge["func"] == "tasks.finish_study_comparison"
+    assert json.loads(merge["args"])[2] == ["aasm_v3", "eu"]
+
+
+def _part(results_dir, profile, ahi, wall):
+    d = os.path.join(tasks._study_parts_dir(results_dir, "j1"), profile)
+    os.makedirs(d)
+    with open(os.path.join(d, "profile_comparison.json"), "w") as f:
+        json.dump({profile: {"ahi_total": ahi},
+                   "_meta": {"wall_clock_s": {profile: wall},
+                             "flow_channels": {profile: {"flow": "Flow"}}}}, f)
+    with open(os.path.join(d, "profile_events.json"), "w") as f:
+        json.dump({profile: []}, f)
+
+
+def test_fan_in_refuses_a_partial_comparison(tmp_path):
+    _part(str(tmp_path), "aasm_v3", 12.0, 60.0)
+    out = tasks.finish_study_comparison("j1", str(tmp_path), ["aasm_v3", "eu"],
+                                        "aasm_v3", 0.0)
+    assert out["status"] == "error" and out["missing_profiles"] == ["eu"]
+    assert not (tmp_path / "profile_comparison.json").exists()
+    # Het geslaagde deel blijft staan voor een volgende poging.
+    assert os.path.isdir(tasks._study_parts_dir(str(tmp_path), "j1"))
+
+
+def test_fan_in_assembles_the_parts(tmp_path, monkeypatch):
+    seen = {}
+    monkeypatch.setattr(tasks, "_write_profile_report",
+                        lambda job_id, rd, comparison, profiles, elapsed:
+                        seen.update(comparison) or {"status": "done"})
+    _part(str(tmp_path), "aasm_v3", 12.0, 60.0)
+    _part(str(tmp_path), "eu", 31.0, 75.0)
+
+    out = tasks.finish_study_comparison("j1", str(tmp_path), ["aasm_v3", "eu"],
+                                        "aasm_v3", 0.0)
+    assert out["status"] == "done"
+    with open(tmp_path / "profile_comparison.json") as f:
+        written = json.load(f)
+    assert written["aasm_v3"]["severity"] == "Mild"
+    assert written["eu"]["severity"] == "Severe"
+    assert written["_meta"]["wall_clock_s"] == {"aasm_v3": 60.0, "eu": 75.0}
+    assert written["_meta"]["profile_jobs"] == 2
+    assert seen["eu"]["ahi_total"] == 31.0
+    assert not os.path.exists(tasks._study_parts_dir(str(tmp_path), "j1"))
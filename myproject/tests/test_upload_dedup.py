@@ -0,0 +1,219 @@
+"""Dezelfde opname opnieuw opgeladen: herkennen, niet opnieuw opslaan of rekenen.
+
+De inhoudshash (content_hash.py) moet dezelfde zijn langs elke weg waarop
+een EDF binnenkomt — chunks op hun plaats, de oude samenvoeging, of het
+bestand achteraf lezen — anders herkent de ene upload de andere niet.
+Hergebruik mag alleen binnen de site, alleen van een bestand dat nog
+ongewijzigd op schijf staat, en alleen van een resultaat met dezelfde
+kanaalkeuze.
+"""
+import io
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import app as app_module  # noqa: E402
+import content_hash  # noqa: E402
+from app import FileUploadHandler, Job, Site, User, app, db  # noqa: E402
+from flask_login import login_user  # noqa: E402
+
+# Iets meer dan twee chunks van 2 MiB, met een staart die niet op een blok valt.
+PAYLOAD = os.urandom(2 * (2 << 20) + 123_457)
+
+
+def _upload(tmp_path, chunk_size):
+    handler = FileUploadHandler(str(tmp_path / f"up{chunk_size}"), redis_connection=None)
+    n = -(-len(PAYLOAD) // chunk_size)
+    for i in reversed(range(n)):
+        piece = PAYLOAD[i * chunk_size:(i + 1) * chunk_size]
+        handler.save_chunk("dup01", i, FileStorage(io.BytesIO(piece), filename="a.edf"),
+                           total_chunks=n, chunk_size=chunk_size)
+    path = handler.assemble_file("dup01", n, "a.edf")
+    return handler.content_hash, path
+
+
+def test_every_way_in_gives_the_same_hash(tmp_path):
+    aligned, path = _upload(tmp_path, 2 << 20)
+    unaligned, _ = _upload(tmp_path, 1_000_003)
+
+    legacy = FileUploadHandler(str(tmp_path / "legacy"), redis_connection=None)
+    step = 700_001
+    n = -(-len(PAYLOAD) // step)
+    for i in range(n):
+        legacy.save_chunk("dup02", i, FileStorage(
+            io.BytesIO(PAYLOAD[i * step:(i + 1) * step]), filename="a.edf"))
+    legacy.assemble_file("dup02", n, "a.edf")
+
+    assert aligned == unaligned == legacy.content_hash == content_hash.file_hash(path)
+    assert [p for p in os.listdir(os.path.dirname(path)) if "partial" in p] == []
+
+
+@pytest.fixture()
+def env(tmp_path, monkeypatch):
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    monkeypatch.setattr(app_module, "redis_conn", fakeredis.FakeRedis())
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(upload_dir))
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        site_a, site_b = Site(name="A"), Site(name="B")
+        db.session.add_all([site_a, site_b])
+        db.session.commit()
+        users = {}
+        for name, site in (("alice", site_a), ("carol", site_a), ("bob", site_b)):
+            users[name] = User(username=name, password="x", role="user", site_id=site.id)
+            db.session.add(users[name])
+        db.session.commit()
+
+        edf = upload_dir / "night.edf"
+        edf.write_bytes(PAYLOAD)
+        digest = content_hash.file_hash(str(edf))
+        db.session.add(Job(job_id="first", owner_id=users["alice"].id,
+                           owner_username="alice", site_id=site_a.id,
+                           filename="night.edf", content_hash=digest))
+        db.session.commit()
+
+        cfg = {"eeg_ch": "C4-M1", "eog_ch": "E1", "emg_ch": None,
+               "extra_eeg_ch": ["C4-M1"], "recording_start": None,
+               "pneumo_channels": {"flow": "Flow"}, "scoring_profile": "standard",
+               "study_type": "diagnostic_psg", "arousal_lgbm": False,
+               "content_hash": digest}
+        (upload_dir / "first_config.json").write_text(json.dumps(cfg))
+        (upload_dir / "first_results.pipeline.json").write_text("{}")
+
+        yield {"edf": str(edf), "digest": digest, "users": users, "cfg": cfg}
+        db.session.remove()
+        db.drop_all()
+
+
+def _as(user):
+    ctx = app.test_request_context()
+    ctx.push()
+    login_user(user)
+    return ctx
+
+
+def test_the_same_site_finds_the_file_another_site_does_not(env):
+    ctx = _as(env["users"]["carol"])
+    try:
+        assert app_module._find_duplicate_edf(env["digest"], env["users"]["carol"]) == env["edf"]
+    finally:
+        ctx.pop()
+    ctx = _as(env["users"]["bob"])
+    try:
+        assert app_module._find_duplicate_edf(env["digest"], env["users"]["bob"]) is None
+    finally:
+        ctx.pop()
+
+
+def test_a_file_changed_since_upload_is_not_a_duplicate(env):
+    """Anonimisatie ter plekke herschrijft de header: dan geen hergebruik meer."""
+    with open(env["edf"], "r+b") as f:
+        f.seek(8)
+        f.write(b"X" * 80)
+    st = os.stat(env["edf"])
+    os.utime(env["edf"], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert app_module._find_duplicate_edf(env["digest"], env["users"]["alice"]) is None
+
+
+def test_results_are_reused_only_for_the_same_choices(env):
+    ctx = _as(env["users"]["carol"])
+    try:
+        assert app_module._reusable_analysis("second", dict(env["cfg"])) == "first"
+        assert app_module._reusable_analysis(
+            "second", {**env["cfg"], "eeg_ch": "F4-M1"}) is None
+        assert app_module._reusable_analysis(
+            "second", {**env["cfg"], "study_profile_set": {
+                "comparison_profiles": ["aasm_v3_rec"]}}) is None
+        os.remove(os.path.join(app.config["UPLOAD_FOLDER"], "first_results.pipeline.json"))
+        assert app_module._reusable_analysis("second", dict(env["cfg"])) is None
+    finally:
+        ctx.pop()
+
+
+def test_a_shared_recording_stays_with_each_job(env, tmp_path):
+    """Eén keer de data op schijf, maar verwijderen of anonimiseren raakt de andere job niet."""
+    again = os.path.join(app.config["UPLOAD_FOLDER"], "night_1.edf")
+    with open(again, "wb") as f:
+        f.write(PAYLOAD)
+    assert app_module._share_edf(env["edf"], again)
+    assert os.path.samefile(env["edf"], again)
+
+    app_module._unshare_edf(again)
+    with open(again, "r+b") as f:
+        f.write(b"X" * 8)
+    with open(env["edf"], "rb") as f:
+        assert f.read() == PAYLOAD
+
+    assert app_module._share_edf(env["edf"], again)
+    os.remove(env["edf"])
+    with open(again, "rb") as f:
+        assert f.read() == PAYLOAD
+
+
+def test_only_an_edited_result_keeps_a_pipeline_copy(tmp_path):
+    import pipeline_results
+
+    result = pipeline_results.results_path(str(tmp_path), "j1")
+    with open(result, "w") as f:
+        json.dump({"ahi": 12.0}, f)
+    assert pipeline_results.source(str(tmp_path), "j1") == result
+    assert not os.path.exists(pipeline_results.snapshot_path(str(tmp_path), "j1"))
+
+    for ahi in (9.0, 7.0):                             # twee bewerkingen
+        pipeline_results.before_edit(result)
+        with open(result, "w") as f:
+            json.dump({"ahi": ahi}, f)
+    with open(pipeline_results.source(str(tmp_path), "j1")) as f:
+        assert json.load(f) == {"ahi": 12.0}
+
+    pipeline_results.written(result)                   # heranalyse
+    assert pipeline_results.source(str(tmp_path), "j1") == result
+
+
+def test_anonymising_moves_the_job_off_the_original_recording(env):
+    """Na het herschrijven van de header hoort de job niet meer bij de bron."""
+    with open(env["edf"], "r+b") as f:
+        f.seek(8)
+        f.write(b"X" * 80)
+    st = os.stat(env["edf"])
+    os.utime(env["edf"], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    app_module._content_changed("first", env["edf"])
+    row = Job.query.filter_by(job_id="first").first()
+    assert row.content_hash == content_hash.file_hash(env["edf"]) != env["digest"]
+
+
+def test_a_reused_result_carries_this_recordings_header(tmp_path):
+    pytest.importorskip("psgscoring")
+    import tasks
+
+    edf = tmp_path / "anon.edf"
+    edf.write_bytes(b"0       " + b"STUDY-7 X X X".ljust(80) + b"Startdate X X X X".ljust(80)
+                    + b" " * 88)
+    source = {"meta": {"patient_info": {"name": "Jan_Peeters"}, "n_epochs": 9}}
+    pneumo = tasks._with_own_patient_info(source, str(edf))
+    assert pneumo["meta"]["n_epochs"] == 9
+    assert pneumo["meta"]["patient_info"]["patient_code"] == "STUDY-7"
+    assert pneumo["meta"]["patient_info"]["name"] != "Jan_Peeters"
+    assert source["meta"]["patient_info"] == {"name": "Jan_Peeters"}
+
+
+def test_deleting_a_job_removes_its_stage_cache_entries(env):
+    from stage_cache import MISS, StageCache
+    root = os.path.join(app.config["UPLOAD_FOLDER"], "stage_cache")
+    StageCache(root, env["digest"], {}).store("staging", {"hypnogram": ["W"]})
+    StageCache(root, "other", {}).store("staging", {"hypnogram": ["N2"]})
+
+    app_module._delete_job_files("first")
+    assert StageCache(root, env["digest"], {}).load("staging") is MISS
+    assert StageCache(root, "other", {}).load("staging") == {"hypnogram": ["N2"]}
@@ -0,0 +1,114 @@
+"""Chunks op hun eigen offset: volgorde, parallelisme en hervatten.
+
+Met `chunk_size` schrijft `FileUploadHandler` elke chunk rechtstreeks in
+`{file_id}_partial.edf` en is afronden een rename. Dat mag alleen als het
+resultaat byte voor byte hetzelfde is als de oude samenvoeging — ongeacht
+de volgorde waarin de chunks binnenkwamen of hoeveel tegelijk — en als
+een half verzonden bestand nooit als volledig wordt afgerond.
+"""
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from app import FileUploadHandler, UploadError
+from werkzeug.datastructures import FileStorage
+
+CHUNK = 1000
+PAYLOAD = bytes(range(256)) * 18 + b"tail"          # 4612 bytes, 5 chunks
+N = -(-len(PAYLOAD) // CHUNK)
+
+
+@pytest.fixture()
+def handler(tmp_path):
+    return FileUploadHandler(str(tmp_path / "uploads"), redis_connection=None)
+
+
+def _piece(i, spooled=False):
+    data = PAYLOAD[i * CHUNK:(i + 1) * CHUNK]
+    if spooled:
+        # Zoals werkzeug een grotere chunk aanlevert: een echt bestand,
+        # zodat copy_file_range gebruikt wordt.
+        f = tempfile.TemporaryFile()
+        f.write(data)
+        f.seek(0)
+        return FileStorage(f, filename="study.edf")
+    return FileStorage(io.BytesIO(data), filename="study.edf")
+
+
+def _send(handler, i, fid="inplace01", **kw):
+    return handler.save_chunk(fid, i, _piece(i, **kw),
+                              total_chunks=N, chunk_size=CHUNK)
+
+
+@pytest.mark.parametrize("spooled", [False, True])
+def test_out_of_order_chunks_give_the_same_file(handler, spooled):
+    for i in [3, 0, 4, 2, 1]:
+        _send(handler, i, spooled=spooled)
+    path = handler.assemble_file("inplace01", N, "study.edf")
+    with open(path, "rb") as f:
+        assert f.read() == PAYLOAD
+    leftovers = [n for n in os.listdir(handler.upload_dir) if "inplace01" in n]
+    assert leftovers == []
+
+
+def test_parallel_chunks_from_many_threads(handler):
+    with ThreadPoolExecutor(max_workers=N) as pool:
+        list(pool.map(lambda i: _send(handler, i), range(N)))
+    with open(handler.assemble_file("inplace01", N, "study.edf"), "rb") as f:
+        assert f.read() == PAYLOAD
+
+
+def test_the_status_says_what_to_resend(handler):
+    assert handler.chunk_status("inplace01") is None
+    for i in (0, 2, 4):
+        _send(handler, i)
+    st = handler.chunk_status("inplace01")
+    assert st["present"] == [0, 2, 4]
+    assert not st["complete"]
+    with pytest.raises(UploadError):
+        handler.assemble_file("inplace01", N, "study.edf")
+
+    for i in (1, 3):                      # hervat: alleen wat ontbrak
+        _send(handler, i)
+    assert handler.chunk_status("inplace01")["complete"]
+
+
+def test_a_short_chunk_in_the_middle_is_refused(handler):
+    short = FileStorage(io.BytesIO(b"x" * (CHUNK - 1)), filename="study.edf")
+    with pytest.raises(UploadError):
+        handler.save_chunk("inplace01", 1, short, total_chunks=N, chunk_size=CHUNK)
+    assert handler.chunk_status("inplace01")["present"] == []
+
+
+def test_changed_parameters_mid_upload_are_refused(handler):
+    _send(handler, 0)
+    with pytest.raises(UploadError):
+        handler.save_chunk("inplace01", 1, _piece(1),
+                           total_chunks=N, chunk_size=2 * CHUNK)
+
+
+def test_only_one_worker_finishes(handler):
+    for i in range(N):
+        _send(handler, i)
+    open(os.path.join(handler.upload_dir, "inplace01_partial.lock"), "w").close()
+    assert handler.assemble_file("inplace01", N, "study.edf") is None
+
+
+def test_a_request_that_comes_after_the_winner_is_not_an_error(handler):
+    """Twee laatste chunks zien allebei `complete`; de tweede is geen mislukte upload."""
+    for i in range(N):
+        _send(handler, i)
+    assert handler.finish_in_place("inplace01", "study.edf")
+    assert handler.finish_in_place("inplace01", "study.edf") is None
+
+
+@pytest.mark.parametrize("total, size", [
+    (1, 64 * 1024 * 1024),                       # boven MAX_CHUNK_SIZE
+    (10_000, 1024 * 1024),                       # samen boven MAX_CONTENT_LENGTH
+])
+def test_the_client_cannot_choose_the_allocation(handler, total, size):
+    with pytest.raises(UploadError):
+        handler.save_chunk("inplace02", 0, _piece(0), total_chunks=total, chunk_size=size)
+    assert not any("inplace02" in n for n in os.listdir(handler.upload_dir))
@@ -0,0 +1,120 @@
+"""De gedeelde viewercache: in bytes begrensd, over workers heen, en onschuldig.
+
+`window_cache.py` bewaart gedecimeerde vensters in Redis zodat een tweede
+worker niet opnieuw rekent wat de eerste al deed. Drie dingen moeten
+kloppen: het budget is een bytegrens (niet een aantal), de tellers zijn
+die van alle workers samen, en een hit geeft exact wat een miss zou geven.
+Redis kwijt mag de viewer niet breken.
+"""
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+fakeredis = pytest.importorskip("fakeredis")
+edfio = pytest.importorskip("edfio")
+
+import edf_api  # noqa: E402
+from redis.exceptions import ConnectionError as RedisConnectionError  # noqa: E402
+from window_cache import WindowCache  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def _worker(server, budget=10_000):
+    return WindowCache(fakeredis.FakeRedis(server=server), budget)
+
+
+def test_the_budget_is_bytes_and_the_oldest_goes_first(server):
+    cache = _worker(server, budget=10_000)
+    for i in range(3):
+        cache.put(f"k{i}", "job", b"x" * 3000)
+    cache.get("k0")                       # k0 weer vers; k1 is nu de oudste
+    cache.put("k3", "job", b"x" * 3000)
+    st = cache.stats()
+    assert st["bytes"] <= 10_000
+    assert cache.get("k1") is None
+    assert cache.get("k0") is not None
+    assert st["evictions"] == 1
+
+
+def test_a_second_worker_hits_what_the_first_stored(server):
+    a, b = _worker(server), _worker(server)
+    a.put("epoch", "job", b"signal")
+    assert b.get("epoch") == b"signal"
+    assert b.get("other") is None
+    st = a.stats()
+    assert (st["hits"], st["misses"], st["stores"]) == (1, 1, 1)
+
+
+def test_dropping_a_job_frees_its_bytes(server):
+    cache = _worker(server)
+    cache.put("a", "job-1", b"x" * 100)
+    cache.put("b", "job-2", b"x" * 50)
+    cache.drop_job("job-1")
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 50
+
+
+def test_without_redis_every_lookup_is_a_miss():
+    class Down:
+        def __getattr__(self, name):
+            def fail(*a, **k):
+                raise RedisConnectionError("weg")
+            return fail
+
+    cache = WindowCache(Down(), 10_000)
+    cache.put("k", "job", b"x")
+    assert cache.get("k") is None
+    assert cache.stats()["available"] is False
+
+
+def test_a_hit_serves_exactly_what_a_miss_computed(server, tmp_path, monkeypatch):
+    t = np.arange(95 * 256) / 256
+    p = tmp_path / "wc.edf"
+    edfio.Edf([
+        edfio.EdfSignal(80 * np.sin(2 * np.pi * 10 * t), sampling_frequency=256,
+                        label="EEG C4-M1", physical_dimension="uV",
+                        physical_range=(-500.0, 500.0)),
+    ]).write(p)
+    (tmp_path / "j_config.json").write_text(json.dumps({"edf_path": str(p)}))
+    edf_api.clear_cache()
+    monkeypatch.setattr(edf_api, "_window_cache", _worker(server, 10 * 2**20))
+
+    miss = edf_api.edf_epoch("j", 1, str(tmp_path))
+    edf_api._raw_cache.clear()            # een andere worker: niets geopend
+
+    def no_read(*a, **k):
+        raise AssertionError("venster opnieuw gelezen ondanks cache")
+
+    import edf_reader
+    monkeypatch.setattr(edf_reader.SignalSource, "window", no_read)
+    hit = edf_api.edf_epoch("j", 1, str(tmp_path))
+    assert hit == miss
+    assert edf_api._window_cache.stats()["hits"] == 1
+
+
+def test_the_process_cache_is_safe_under_request_threads():
+    """gthread: meerdere verzoeken in één proces openen en verdringen tegelijk."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = edf_api._LRUCache(maxsize=2)
+
+    def hammer(seed):
+        for i in range(2000):
+            key = f"job{(seed + i) % 5}"
+            if cache.get(key) is None:
+                cache.set(key, i)
+            if i % 7 == 0:
+                cache.pop(key)
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(hammer, range(8)))
+    assert len(cache._cache) <= 2
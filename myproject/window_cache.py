@@ -0,0 +1,174 @@
+"""Gedeelde venstercache voor de signaalviewer — één cache voor alle workers.
+
+Gunicorn draait vier workers, elk met een eigen `_LRUCache` in `edf_api`.
+Twee scorers op dezelfde opname komen bij verschillende workers terecht;
+wat de ene worker net las en decimeerde (of als prefetch klaarzette), moest
+de andere opnieuw doen. Vooral bij de MNE-fallback en bij een koude page
+cache gaf dat de grillige laadtijden.
+
+Deze cache staat daarom niet in het proces maar in Redis, dat de workers al
+delen voor RQ. Per venster (job, t0, t1, aantal samples, kanalen) wordt het
+gedecimeerde resultaat bewaard. De grens is een BYTEBUDGET
+(`EDF_VIEWER_CACHE_MB`), geen aantal: een epoch van 6 kanalen en een span
+van 30 kanalen zijn niet even zwaar. Wie het budget overschrijdt, ruimt de
+langst niet gebruikte vensters op.
+
+Tellers voor hits, misses en evictions staan ook in Redis, zodat ze over
+alle workers samen tellen (`/admin/viewer-cache`).
+
+De cache is een versnelling, geen bron: is Redis weg, dan gedraagt elke
+lookup zich als een miss en rekent de viewer zoals voorheen. Daarom een
+eigen verbinding zonder retries (`connect`) en na een fout een halve minuut
+niet meer proberen — redis-py wacht anders seconden per verzoek.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger("yasaflaskified.window_cache")
+
+PREFIX = "edfview:"
+DEFAULT_BUDGET_MB = 256
+RETRY_AFTER_S = 30.0
+
+
+def connect(host: str, port: int):
+    """Redis-verbinding die snel opgeeft; de RQ-verbinding mag wel wachten."""
+    from redis import Redis
+    from redis.backoff import NoBackoff
+    from redis.retry import Retry
+    return Redis(host=host, port=port, socket_connect_timeout=0.25,
+                 socket_timeout=0.5, retry=Retry(NoBackoff(), 0))
+
+
+class WindowCache:
+    """LRU-cache met bytebudget in Redis, gedeeld door alle workers."""
+
+    def __init__(self, conn, budget_bytes: int):
+        self.conn = conn
+        self.budget_bytes = int(budget_bytes)
+        self._lru = PREFIX + "lru"          # zset: sleutel → laatste gebruik
+        self._sizes = PREFIX + "sizes"      # hash: sleutel → bytes
+        self._bytes = PREFIX + "bytes"      # totaal in de cache
+        self._stats = PREFIX + "stats"      # hash: hits/misses/evictions/stores
+        self._down_until = 0.0
+
+    def _usable(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _failed(self, e: Exception) -> None:
+        logger.info("venstercache niet bereikbaar (%s) — %.0f s zonder",
+                    e, RETRY_AFTER_S)
+        self._down_until = time.monotonic() + RETRY_AFTER_S
+
+    def _entry(self, key: str) -> str:
+        return f"{PREFIX}w:{key}"
+
+    def _job_set(self, job_id: str) -> str:
+        return f"{PREFIX}job:{job_id}"
+
+    def get(self, key: str) -> bytes | None:
+        if not self._usable():
+            return None
+        try:
+            blob = self.conn.get(self._entry(key))
+            pipe = self.conn.pipeline(transaction=False)
+            if blob is None:
+                pipe.hincrby(self._stats, "misses", 1)
+            else:
+                pipe.zadd(self._lru, {key: time.time()}, xx=True)
+                pipe.hincrby(self._stats, "hits", 1)
+            pipe.execute()
+            return blob
+        except RedisError as e:
+            self._failed(e)
+            return None
+
+    def put(self, key: str, job_id: str, blob: bytes) -> None:
+        size = len(blob)
+        if size > self.budget_bytes or not self._usable():
+            return
+        try:
+            # NX: twee workers die hetzelfde venster tegelijk berekenen,
+            # tellen het maar één keer mee in het budget.
+            if not self.conn.set(self._entry(key), blob, nx=True):
+                return
+            pipe = self.conn.pipeline(transaction=False)
+            pipe.zadd(self._lru, {key: time.time()})
+            pipe.hset(self._sizes, key, size)
+            pipe.sadd(self._job_set(job_id), key)
+            pipe.incrby(self._bytes, size)
+            pipe.hincrby(self._stats, "stores", 1)
+            total = pipe.execute()[3]
+            if total > self.budget_bytes:
+                self._evict()
+        except RedisError as e:
+            self._failed(e)
+
+    def _evict(self) -> None:
+        """Oudste vensters weg tot het totaal weer binnen het budget valt.
+
+        ZPOPMIN is atomair: twee workers die tegelijk opruimen, halen nooit
+        dezelfde sleutel weg en trekken zijn grootte dus niet dubbel af.
+        """
+        while int(self.conn.get(self._bytes) or 0) > self.budget_bytes:
+            popped = self.conn.zpopmin(self._lru, 1)
+            if not popped:
+                break
+            key = popped[0][0]
+            key = key.decode() if isinstance(key, bytes) else key
+            size = int(self.conn.hget(self._sizes, key) or 0)
+            pipe = self.conn.pipeline(transaction=False)
+            pipe.delete(self._entry(key))
+            pipe.hdel(self._sizes, key)
+            pipe.decrby(self._bytes, size)
+            pipe.hincrby(self._stats, "evictions", 1)
+            pipe.execute()
+
+    def drop_job(self, job_id: str) -> None:
+        """Alle vensters van een job weg (job verwijderd of heranalyse)."""
+        if not self._usable():
+            return
+        try:
+            keys = [k.decode() if isinstance(k, bytes) else k
+                    for k in self.conn.smembers(self._job_set(job_id))]
+            if not keys:
+                return
+            sizes = self.conn.hmget(self._sizes, keys)
+            pipe = self.conn.pipeline(transaction=False)
+            pipe.delete(*[self._entry(k) for k in keys])
+            pipe.zrem(self._lru, *keys)
+            pipe.hdel(self._sizes, *keys)
+            pipe.decrby(self._bytes, sum(int(s or 0) for s in sizes))
+            pipe.delete(self._job_set(job_id))
+            pipe.execute()
+        except RedisError as e:
+            self._failed(e)
+
+    def stats(self) -> dict:
+        """Tellers over alle workers samen, plus bezetting."""
+        try:
+            raw = self.conn.hgetall(self._stats)
+            used = int(self.conn.get(self._bytes) or 0)
+            entries = int(self.conn.zcard(self._lru))
+        except RedisError as e:
+            return {"available": False, "error": str(e),
+                    "budget_bytes": self.budget_bytes}
+        counts = {(k.decode() if isinstance(k, bytes) else k): int(v)
+                  for k, v in raw.items()}
+        hits, misses = counts.get("hits", 0), counts.get("misses", 0)
+        return {
+            "available":    True,
+            "hits":         hits,
+            "misses":       misses,
+            "evictions":    counts.get("evictions", 0),
+            "stores":       counts.get("stores", 0),
+            "hit_rate":     round(hits / (hits + misses), 3) if hits + misses else None,
+            "entries":      entries,
+            "bytes":        used,
+            "budget_bytes": self.budget_bytes,
+        }
@@ -4,7 +4,9 @@ RQ Worker for YASAFlaskified
 Processes background jobs for sleep staging analysis
 """
 import os
+import signal
 import sys
+import time
 
 # Ensure psgscoring and other myproject modules are importable
 _myproject_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,8 +15,15 @@ if _myproject_dir not in sys.path:
 
 import json
 
+import job_events
+import job_state
+import memory_budget
 import redis
 from rq import Queue, Worker
+from rq.worker import WorkerStatus
+
+OVERRUN_FACTOR = 2.0
+"""Zoveel keer de geschatte duur (`expected_s`) en de worker meldt het."""
 
 
 def load_config():
@@ -26,6 +35,150 @@ def load_config():
             return json.load(f)
     return {}
 
+def _work_horse_killed(job, retpid, ret_val, rusage):
+    """Een work-horse die van buitenaf stopte (OOM-killer, harde timeout).
+
+    Dan loopt er geen failure-callback; de analysejob gaat hier opnieuw in
+    de wachtrij en hervat vanaf zijn checkpoints (tasks.requeue_interrupted_job).
+    Een andere job krijgt hier zijn eigen failure-callback, zodat een
+    rapport niet op "pending" blijft en een studievergelijking toch
+    samengevoegd wordt.
+    """
+    import job_scheduler
+    from tasks import requeue_interrupted_job
+    if (ret_val and os.WIFSIGNALED(ret_val)
+            and os.WTERMSIG(ret_val) == signal.SIGKILL and job.meta.get("ram_mb")):
+        # Waarschijnlijk de OOM-killer: de schatting was te laag, de nieuwe
+        # poging reserveert ruimer (memory_budget.py).
+        job.meta["ram_mb"] = round(job.meta["ram_mb"] * memory_budget.OOM_GROWTH)
+    reason = f"work-horse gestopt (status {ret_val})"
+    if requeue_interrupted_job(job, reason) is None:
+        job_scheduler.own_failure_callback(job, job.connection, RuntimeError,
+                                           RuntimeError(reason), None)
+    # Ook geen success-callback: de plaats van de site hier vrijgeven.
+    job_scheduler.job_ended(job.connection, job)
+    job_scheduler.dispatch(job.connection, ending=job.id)
+
+
+class PrewarmedWorker(Worker):
+    """Een RQ-worker die bibliotheken en modellen laadt vóór hij forkt.
+
+    Elke work-horse erft ze dan (prewarm.py). Ook bruikbaar vanuit de
+    RQ-CLI: `rq worker --worker-class worker.PrewarmedWorker ...`.
+    `YASAFLASKIFIED_WORKER_PREWARM=0` slaat het laden over.
+
+    Vóór het forken reserveert hij ook het geschatte geheugen van de job
+    tegen het budget van de node (memory_budget.py); past het niet, dan
+    wordt de job uitgesteld in plaats van gestart.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("work_horse_killed_handler", _work_horse_killed)
+        super().__init__(*args, **kwargs)
+        if os.environ.get("YASAFLASKIFIED_WORKER_PREWARM", "1").lower() not in (
+                "0", "off", "false", "no"):
+            import prewarm
+            prewarm.preload()
+        if memory_budget.enabled():
+            budget = memory_budget.configure(self.connection)
+            self.log.info("[MEM] RAM-budget van de node: %s MB", budget or "geen")
+
+    def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+        """Vrij: geef eerst vrij wat er in job_scheduler op een worker wacht."""
+        self.set_state(WorkerStatus.IDLE)
+        self._dispatch()
+        return super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+
+    def run_maintenance_tasks(self):
+        """Ook de klok van de scheduler, voor een ronde die niet doorging,
+        en het opruimen van de stapcache."""
+        super().run_maintenance_tasks()
+        self._dispatch()
+        try:
+            from tasks import prune_stage_cache
+            prune_stage_cache(self.connection)
+        except Exception as e:
+            self.log.warning("[CACHE] opruimen mislukt: %s", e)
+
+    def _dispatch(self):
+        import job_scheduler
+        job_scheduler.dispatch(self.connection)
+
+    def execute_job(self, job, queue):
+        mb = memory_budget.job_ram_mb(job) if memory_budget.enabled() else 0
+        app_job_id = job_events.app_job_id(job)
+        try:
+            if mb and not memory_budget.reserve(self.connection, job.id, mb, self.name):
+                self._defer_for_memory(job, queue)
+                return
+            if app_job_id:
+                job_state.transition(self.connection, app_job_id, job.id, "started",
+                                     started_at=time.time(), error=None)
+            started = time.monotonic()
+            try:
+                super().execute_job(job, queue)
+            finally:
+                if mb:
+                    memory_budget.release(self.connection, job.id)
+                if memory_budget.enabled():
+                    # Ook na een gestopte work-horse: de extra processen zijn weg.
+                    memory_budget.release(self.connection, memory_budget.pool_key(job.id))
+            self._compare_duration(job, time.monotonic() - started)
+            if app_job_id:
+                self._record_outcome(job, app_job_id)
+        finally:
+            # Klaar, mislukt, uitgesteld of opnieuw klaargezet: de statuspagina
+            # hoeft daar niet op te pollen.
+            job_events.publish_state(self.connection, app_job_id)
+
+    def _record_outcome(self, job, app_job_id):
+        """Eindtoestand in job_state; alleen als deze job daar nog de lopende is.
+
+        Rapporten en studievergelijkingen dragen dezelfde app-job_id maar zijn
+        niet de job die de statuspagina volgt: `transition` laat die liggen.
+        """
+        status = job.get_status(refresh=True)
+        status = getattr(status, "value", status)
+        if status not in job_state.FINAL:
+            return
+        error = None
+        if status == "failed":
+            result = job.latest_result()
+            lines = (result.exc_string or "").strip().splitlines() if result else []
+            error = lines[-1] if lines else "Onbekende fout"
+        job_state.transition(self.connection, app_job_id, job.id, status,
+                             ended_at=time.time(), error=error)
+
+    def _compare_duration(self, job, elapsed):
+        """Meld een job die veel langer liep dan geschat (`expected_s`).
+
+        De timeout ligt ruim boven de schatting (job_estimate.timeout_s); dit
+        maakt zichtbaar wat ertussen valt, vóór het een timeout wordt.
+        """
+        expected = job.meta.get("expected_s")
+        if expected and elapsed > OVERRUN_FACTOR * float(expected):
+            self.log.warning("[TIMING] %s liep %.0f s, geschat %.0f s (timeout %s s)",
+                             job.id, elapsed, float(expected), job.timeout)
+
+    def _defer_for_memory(self, job, queue):
+        """Terug naar RQ, als geplande job na een oplopende wachttijd.
+
+        Geplande jobs zet de RQ-scheduler terug in hun wachtrij; daarom
+        draaien de workers met `--with-scheduler`. De plaats in
+        job_scheduler blijft bij deze job: hij is niet af.
+        """
+        from datetime import datetime, timedelta, timezone
+
+        # Uit de tussenwachtrij, anders ruimt RQ hem later op als vastgelopen.
+        self.connection.lrem(queue.intermediate_queue_key, 1, job.id)
+        job.meta["mem_deferrals"] = int(job.meta.get("mem_deferrals", 0)) + 1
+        wait = memory_budget.backoff_s(job.meta["mem_deferrals"])
+        queue.schedule_job(job, datetime.now(timezone.utc) + timedelta(seconds=wait))
+        self.log.info("[MEM] %s uitgesteld met %d s (%d× uitgesteld)",
+                      job.id, wait, job.meta["mem_deferrals"])
+        self.set_state(WorkerStatus.IDLE)
+
+
 def main():
     """Main worker function"""
     # Load config
@@ -50,17 +203,18 @@ def main():
         print(f"   Port: {redis_port}")
         sys.exit(1)
 
-    # Create queue
-    queue = Queue('default', connection=conn)
+    # Create queues (in volgorde van voorrang), standaard alleen `default`
+    names = sys.argv[1:] or ['default']
+    queues = [Queue(name, connection=conn) for name in names]
 
     # Create worker
-    worker = Worker([queue], connection=conn)
+    worker = PrewarmedWorker(queues, connection=conn)
 
-    print("🎧 Worker listening on queue: default")
+    print(f"🎧 Worker listening on queues: {' '.join(names)}")
     print("🚀 Starting worker...")
 
-    # Start processing
-    worker.work()
+    # Start processing; de scheduler zet uitgestelde jobs terug (memory_budget.py)
+    worker.work(with_scheduler=True)
 
 if __name__ == '__main__':
     main()
@@ -658,6 +658,30 @@ def build_hypnogram_timeline(hypno: list, recording_start: str = None) -> dict:
 # MASTER FUNCTIE
 # ─────────────────────────────────────────────
 
+def resolve_eeg_channels(raw: mne.io.BaseRaw, eeg_ch: str,
+                         all_eeg_channels: list = None) -> list:
+    """De EEG-kanalen voor spindles/SW/bandpower die effectief in `raw` staan."""
+    if all_eeg_channels is None:
+        all_eeg_channels = [eeg_ch]
+    available = set(raw.ch_names)
+    return [ch for ch in all_eeg_channels if ch in available] or [eeg_ch]
+
+
+def analysis_meta(raw: mne.io.BaseRaw, eeg_ch: str, eog_ch: str, emg_ch: str,
+                  all_eeg_channels: list, recording_start: str = None) -> dict:
+    return {
+        "eeg_channel":      eeg_ch,
+        "eog_channel":      eog_ch,
+        "emg_channel":      emg_ch,
+        "all_eeg_channels": all_eeg_channels,
+        "sfreq":            raw.info["sfreq"],
+        "duration_min":     safe_round(raw.times[-1] / 60),
+        "recording_start":  recording_start,
+        "analysis_timestamp": datetime.utcnow().isoformat(),
+        "yasa_version":     yasa.__version__,
+    }
+
+
 def run_full_analysis(raw: mne.io.BaseRaw,
                       eeg_ch: str,
                       eog_ch: str = None,
@@ -680,27 +704,13 @@ def run_full_analysis(raw: mne.io.BaseRaw,
                        Gebruik dit wanneer staging al apart uitgevoerd werd
                        op een kleinere staging-raw (enkel EEG+EOG+EMG).
     """
-    if all_eeg_channels is None:
-        all_eeg_channels = [eeg_ch]
-
     # Filter kanalen die effectief aanwezig zijn
+    all_eeg_channels = resolve_eeg_channels(raw, eeg_ch, all_eeg_channels)
     available        = set(raw.ch_names)
-    all_eeg_channels = [ch for ch in all_eeg_channels if ch in available]
-    if not all_eeg_channels:
-        all_eeg_channels = [eeg_ch]
 
     output = {
-        "meta": {
-            "eeg_channel":      eeg_ch,
-            "eog_channel":      eog_ch,
-            "emg_channel":      emg_ch,
-            "all_eeg_channels": all_eeg_channels,
-            "sfreq":            raw.info["sfreq"],
-            "duration_min":     safe_round(raw.times[-1] / 60),
-            "recording_start":  recording_start,
-            "analysis_timestamp": datetime.utcnow().isoformat(),
-            "yasa_version":     yasa.__version__,
-        }
+        "meta": analysis_meta(raw, eeg_ch, eog_ch, emg_ch, all_eeg_channels,
+                              recording_start),
     }
 
     # ── 1. Slaapstaging ──────────────────────────────────────